@@ -1,11 +1,21 @@
-from llama_index.llms.openai import OpenAI
 from llama_index.core.agent.react.base import ReActAgent
 from llama_index.core.tools import FunctionTool
 import json
 import logging
+from shared.llm_gateway import complete, get_llm
+from shared.metrics import record_fallback
+from shared.prompts import (
+    CPA_SYSTEM, JSON_GENERATION, QUESTION_LIST, QUESTION_LIST_BACKUP, VALIDATION, VALIDATION_WRAP_UP,
+)
+from shared.scenario_index import get_scenario_index
+from shared.scenario_model import strip_code_fences
+from shared.tracing import traced
+# Changes with the question prompt version so near-duplicate scenarios stop reusing old lists
+QUESTION_LIST_VERSION = QUESTION_LIST.prompt_id
+
 class ScenarioClarificationAgent:
     def __init__(self, openai_api_key):
-        self.llm = OpenAI(api_key=openai_api_key, model="gpt-4o-mini")
+        self.llm = get_llm("gpt-4o-mini", api_key=openai_api_key)
         self.tools = [
             FunctionTool.from_defaults(
                 fn=self._tool_generate_question_list,
@@ -28,13 +38,7 @@ class ScenarioClarificationAgent:
         self.agent = ReActAgent.from_tools(
             tools=self.tools,
             llm=self.llm,
-            system_prompt=(
-                "You are a CPA assistant with three distinct roles working in a strict sequence:\n"
-                "ROLE 1: Question Generator - Creates a list of important questions needed for tax filing\n"
-                "ROLE 2: Response Validator - Reviews answers to the questions from Role 1 and determines if more information is needed\n"
-                "ROLE 3: JSON Generator - Creates structured JSON representation when all information is gathered\n\n"
-                "Always follow this exact sequence and maintain context between roles. Each role builds upon the work of the previous role."
-            ),
+            system_prompt=CPA_SYSTEM.render(),
             verbose=True
         )
         
@@ -51,6 +55,7 @@ class ScenarioClarificationAgent:
         # Add a flag to detect when we're in a recovery mode
         self.recovery_mode = False
 
+    @traced("question_generation")
     def _tool_generate_question_list(self, conversation: str):
         """Agent 1: Generates a list of questions needed to file a tax return.
         -- Args--
@@ -63,32 +68,25 @@ class ScenarioClarificationAgent:
         The questions cover all aspects of tax filing, including filing status, income sources, deductions, credits, dependents, and special situations.
         The output is a clear numbered list of questions that can be used to gather the necessary information for tax filing.
         """
-        prompt = (
-            "You are a professional tax preparer with extensive experience. Your task is to generate a comprehensive list of specific questions which you can ask your client. Include only the questions which a layman could answer. No tax knowledge should be required to answer these questions. "
-            "Questions should be about personal information relevant to tax filing but shouldn't ask questions about how to file."
-            "Based on these questions you should be able to accurately file a tax return based on the client's scenario. Think through all aspects of tax filing:\n\n"
-            "You can ask as many questions as required to extract the artifacts required as questioning is the only source to extract information from client. \n"
-            "Don't ask any questions which would require tax knowledge. All such information would be extracted from artifacts.\n"
-            "The questions would be asked by a tax consultant to his client. The questions asked should be relevant to tax filing artifacts only. Shouldn't confuse the client or require him to use his tax knowledge. \n"
-            "You can ask questions like all these and all the other necessary ones. The tax filing is being done in US, so do consider this."
-            # "- Filing status (single, married, head of household, etc.)\n"
-            "- Region to determine applicable tax laws (federal, state, local)\n"
-            # "- Country of residence for international tax considerations\n"
-            "- Annual Income amount. \n"
-            "- Income sources (W-2, 1099, self-employment, investments, rental properties, etc.)\n"
-            "- Deductions (medical expenses, mortgage interest, etc.)\n"
-            "- Credits (child tax credit, education credits, energy credits, etc.)\n"
-            "- Dependents and household information\n"
-            "- Tax payments already made (withholding, estimated payments, etc.)\n"
-            "- Special situations (foreign income, cryptocurrency, retirement distributions, etc.)\n\n"
-            "Format as a clear numbered list of questions that would be essential for tax filing. "
-            "Each question should be specific and directly related to tax filing requirements.\n"
-            "Do NOT provide answers or explanations - ONLY the numbered list of questions.\n\n"
-            f"Client Scenario:\n{conversation}\n\n"
-        )
+        prompt = QUESTION_LIST.render(conversation=conversation)
+        
+        # A near-identical scenario (same template, changed figures) gets the same questions
+        index = get_scenario_index()
+        if index is not None:
+            try:
+                match = index.find_similar_text("questions", conversation, version=QUESTION_LIST_VERSION)
+            except Exception as e:
+                logging.warning(f"Scenario index lookup failed: {str(e)}")
+                match = None
+            if match:
+                logging.info(f"Reusing question list of a similar scenario (similarity {match['similarity']:.2f})")
+                self.all_questions = match["payload"]
+                self.agent_memory["question_list"] = "\n".join(self.all_questions)
+                self.agent_memory["parsed_questions"] = self.all_questions
+                return "\n".join(self.all_questions)
         
         try:
-            response = self.llm.complete(prompt)
+            response = complete(self.llm, prompt, call_site="question_generation")
             logging.info(f"Generated questions raw response: {response.text}")
             questions = response.text.split('\n')
             cleaned_questions = []
@@ -109,14 +107,8 @@ class ScenarioClarificationAgent:
             # If we couldn't extract questions properly, enforce a structured format
             if len(cleaned_questions) < 5:
                 logging.warning("Failed to extract enough questions, using backup approach")
-                backup_prompt = (
-                    "Generate exactly 15 numbered tax filing questions based on this scenario. "
-                    "Format each question starting with a number followed by a period. For example:\n"
-                    "1. What is your filing status?\n"
-                    "2. What was your total income?\n"
-                    f"Scenario: {conversation}"
-                )
-                backup_response = self.llm.complete(backup_prompt)
+                backup_prompt = QUESTION_LIST_BACKUP.render(conversation=conversation)
+                backup_response = complete(self.llm, backup_prompt, call_site="question_generation_backup")
                 questions = backup_response.text.split('\n')
                 cleaned_questions = [q.strip() for q in questions if q.strip() and any(q.strip().startswith(f"{i}.") for i in range(1, 100))]
             
@@ -131,6 +123,12 @@ class ScenarioClarificationAgent:
             if not cleaned_questions:
                 return "I need to generate tax filing questions, but was unable to do so. Please provide more information about your tax situation."
             
+            if index is not None:
+                try:
+                    index.add_text("questions", conversation, cleaned_questions, version=QUESTION_LIST_VERSION)
+                except Exception as e:
+                    logging.warning(f"Could not index question list: {str(e)}")
+            
             # Return the formatted list
             return "\n".join(cleaned_questions)
             
@@ -151,11 +149,13 @@ class ScenarioClarificationAgent:
                 "11. Did you contribute to any retirement accounts?",
                 "12. Do you have any foreign income or foreign financial accounts?",
             ]
+            record_fallback("question_generation", "basic_questions")
             self.all_questions = basic_questions
             self.agent_memory["question_list"] = "\n".join(basic_questions)
             self.agent_memory["parsed_questions"] = basic_questions
             return "\n".join(basic_questions)
 
+    @traced("validation")
     def _tool_validate_responses(self, conversation: str):
         """Agent 2: Validates responses and determines if more information is needed."""
         # Increment conversation turn
@@ -177,34 +177,18 @@ class ScenarioClarificationAgent:
         # Count how many questions have been answered
         answered_questions = len(self.conversation_history) // 2 if len(self.conversation_history) > 1 else 0
     
-        prompt = (
-            "You are a tax expert. Your job is to determine if we have ENOUGH information to create a basic tax filing. "
-            "We don't need perfect or complete information - just the minimum essential details.\n\n"
-            f"{question_context}\n\n"
-            f"So far, {answered_questions} questions have been answered.\n\n"
-            "IMPORTANT: You should err on the side of completion rather than asking too many questions. "
-            "Only ask for additional information if absolutely critical tax details are missing. The most critical things that need to be asked are: 1) Country 2) Region 3) Annual Income 4) Filing Status \n\n"
-            "You must do ONE of the following:\n"
-            "1. If a CRITICAL piece of information is still missing (like filing status or basic income), "
-            "ask ONE specific follow-up question.\n\n"
-            "2. In MOST cases, you should respond with: 'COMPLETE: All necessary information gathered.'\n\n"
-            f"Original Scenario: {self.original_scenario}\n\n"
-            f"Conversation History:\n{conversation}\n\n"
-            "Your assessment (strongly prefer 'COMPLETE: All necessary information gathered.' unless critical information is missing):"
-        )
-        
         # If we've already asked multiple questions, be even more inclined to finish
         if self.conversation_turn > 3:
-            prompt = (
-                "You are a tax expert wrapping up a client consultation. You've already gathered several pieces of information. "
-                "At this point, you should have enough to proceed with a basic tax filing.\n\n"
-                f"Current information:\n{conversation}\n\n"
-                "Unless a fundamental piece of tax information is missing (like filing status or whether they had any income), "
-                "you should respond EXACTLY with: 'COMPLETE: All necessary information gathered.'\n\n"
-                "Your assessment:"
+            prompt = VALIDATION_WRAP_UP.render(conversation=conversation)
+        else:
+            prompt = VALIDATION.render(
+                question_context=question_context,
+                original_scenario=self.original_scenario,
+                conversation=conversation,
+                answered_questions=answered_questions,
             )
         
-        response = self.llm.complete(prompt)
+        response = complete(self.llm, prompt, call_site="validation")
         
         # Store this validation result in agent memory
         self.agent_memory["last_validation"] = response.text
@@ -225,6 +209,7 @@ class ScenarioClarificationAgent:
         
         return response_text
 
+    @traced("json_generation")
     def _tool_generate_structured_json(self, conversation: str):
         """Agent 3: Generates a structured JSON representation of the tax scenario."""
         # Reference both Agent 1's questions and Agent 2's validations
@@ -238,43 +223,13 @@ class ScenarioClarificationAgent:
             )
         
         # Enhanced prompt to ensure valid JSON generation even with minimal information
-        prompt = (
-            "You are a tax expert. Your job is to generate a well-structured JSON object that represents "
-            "the client's tax scenario based on the conversation history.\n\n"
-            "IMPORTANT: You MUST generate valid JSON even if information is incomplete. "
-            "The JSON must only contain the JSON object itself - no surrounding quotes, explanations, or markdown code blocks.\n"
-            "Use null values, empty arrays, or default values like 'unknown' for missing information.\n\n"
-            f"{context}"
-            f"Original Scenario: {self.original_scenario}\n\n"
-            f"Complete Conversation History:\n{conversation}\n\n"
-            "Example structure (follow this format):\n"
-            "{\n"
-            "  \"filing_status\": \"single\",\n"
-            "  \"income\": {\n"
-            "    \"primary\": \"salary\",\n"
-            "    \"amount\": 75000,\n"
-            "    \"sources\": []\n"
-            "  },\n"
-            "  \"deductions\": [],\n"
-            "  \"tax_dates\": {}\n"
-            "}\n\n"
-            "Structured JSON output (do not include any text before or after the JSON):"
+        prompt = JSON_GENERATION.render(
+            context=context, original_scenario=self.original_scenario, conversation=conversation
         )
         
-        response = self.llm.complete(prompt)
-        # Clean up potential formatting issues
-        json_text = response.text.strip()
-        
+        response = complete(self.llm, prompt, call_site="json_generation")
         # Remove any markdown code blocks if present
-        if json_text.startswith("```json"):
-            json_text = json_text.split("```json", 1)[1]
-        if json_text.startswith("```"):
-            json_text = json_text.split("```", 1)[1]
-        if "```" in json_text:
-            json_text = json_text.split("```")[0]
-            
-        # Strip any leading/trailing whitespace again after code block removal
-        json_text = json_text.strip()
+        json_text = strip_code_fences(response.text)
         
         # Check if JSON is wrapped in quotes and contains escaped characters
         if (json_text.startswith('"') and json_text.endswith('"')) or (json_text.startswith("'") and json_text.endswith("'")):
@@ -303,6 +258,7 @@ class ScenarioClarificationAgent:
             # If validation fails, return the original cleaned text
             return json_text
 
+    @traced("clarification")
     def clarify_and_structure(self, scenario: str, clarifications=None):
         if clarifications is None:
             clarifications = []
@@ -384,7 +340,7 @@ class ScenarioClarificationAgent:
                                     "}\n\n"
                                     f"Based on this information:\n{conversation}"
                                 )
-                                json_output = self.llm.complete(backup_prompt).text.strip()
+                                json_output = complete(self.llm, backup_prompt, call_site="json_generation_retry").text.strip()
                             else:
                                 # Last attempt failed, create a minimal valid JSON as fallback
                                 minimal_json = {
@@ -397,6 +353,7 @@ class ScenarioClarificationAgent:
                                     "tax_dates": {},
                                     "raw_conversation": conversation
                                 }
+                                record_fallback("json_generation", "minimal_json")
                                 return {"response": json.dumps(minimal_json), "status": "complete"}
                     
                     # This code should not be reached due to the fallback above
@@ -433,7 +390,7 @@ class ScenarioClarificationAgent:
                         f"Conversation: {conversation}"
                     )
                     
-                    backup_response = self.llm.complete(backup_prompt)
+                    backup_response = complete(self.llm, backup_prompt, call_site="json_generation_retry")
                     backup_output = backup_response.text.strip()
                     
                     try:
@@ -455,7 +412,7 @@ class ScenarioClarificationAgent:
                             "note": "Limited information was provided. This is a basic structure that should be reviewed.",
                             "conversation_summary": conversation[:500] + "..." if len(conversation) > 500 else conversation
                         }
-                        
+                        record_fallback("json_generation", "minimal_json")
                         return {
                             "response": json.dumps(minimal_json, indent=2),
                             "status": "complete"
@@ -471,6 +428,22 @@ class ScenarioClarificationAgent:
                 "status": "error"
             }
     
+    # Conversation state carried between calls; see export_state/restore_state
+    STATE_FIELDS = (
+        "current_stage", "question_list_generated", "all_questions", "original_scenario",
+        "conversation_history", "agent_memory", "conversation_turn", "recovery_mode",
+    )
+
+    def export_state(self):
+        """Return the conversation state as a JSON-serialisable dict."""
+        return {field: getattr(self, field) for field in self.STATE_FIELDS}
+
+    def restore_state(self, state):
+        """Continue a conversation from a dict returned by export_state."""
+        for field in self.STATE_FIELDS:
+            if field in state:
+                setattr(self, field, state[field])
+
     def reset(self):
         """Reset the agent to its initial state."""
         self.current_stage = "question_generation"
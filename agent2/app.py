@@ -1,7 +1,10 @@
 import streamlit as st
 import datetime
+import os
 from agent2.utils.tax_file_reader import read_tax_calculation_file
-from agent2.utils.pdf_helper import display_pdf
+from agent2.utils.pdf_helper import display_pdf, report_download_button, serve_report
+from agent2.utils.report_server import report_url
+from shared.storage import BASELINE_FILE_NAME, SHARED_NAMESPACE, STORAGE_MAX_AGE_SECONDS
 import logging
 from dotenv import load_dotenv
 
@@ -14,11 +17,20 @@ load_dotenv()
 
 # Move this function outside the module scope and rename it to avoid showing the function name
 @st.cache_resource(show_spinner=False)  # Hide the "Running..." message
-def _get_cached_tax_calculation():
-    return read_tax_calculation_file("base_tax_calculation.txt")
+def _get_cached_tax_calculation(file_path, modified_time):
+    # modified_time is part of the cache key so a rewritten baseline is reloaded
+    return read_tax_calculation_file(file_path)
 
-def main(default_scenario_from_agent1=None, set_page_config=True):
-    """Main function that can be called from other modules or run directly"""
+def main(default_scenario_from_agent1=None, set_page_config=True, baseline_path=None, namespace=SHARED_NAMESPACE):
+    """Main function that can be called from other modules or run directly
+
+    Args:
+        default_scenario_from_agent1: Unused, kept for compatibility
+        set_page_config (bool): Whether to call st.set_page_config (standalone mode)
+        baseline_path (str, optional): This session's baseline calculation; None
+            (standalone mode) uses the shared base_tax_calculation.txt
+        namespace (str, optional): Storage namespace for generated reports
+    """
     # Set Streamlit page config only if requested (for standalone mode)
     if set_page_config:
         st.set_page_config(page_title="Agent 2", layout="wide")
@@ -26,11 +38,24 @@ def main(default_scenario_from_agent1=None, set_page_config=True):
     # Display header
     st.header("Tax Calculation Analysis")
 
+    if baseline_path is None:
+        baseline_path = BASELINE_FILE_NAME
+    elif not os.path.exists(baseline_path):
+        # Never fall back to the shared file here: it may hold another client's calculation
+        logger.warning(f"Session baseline {baseline_path} is missing")
+        st.error("This session's baseline tax calculation is no longer available (stored files expire after "
+                 f"{STORAGE_MAX_AGE_SECONDS // 3600} hours). Go back to Agent 1 and run the tax analysis again.")
+        return
+
     # Hide the cache access by using session state differently
+    if st.session_state.get("baseline_tax_calculation_path") != baseline_path:
+        st.session_state.pop("baseline_tax_calculation", None)
     if "baseline_tax_calculation" not in st.session_state:
         # Use an empty spinner to hide the "Running..." message
         with st.spinner("💰 Loading tax calculation..."):
-            st.session_state["baseline_tax_calculation"] = _get_cached_tax_calculation()
+            modified_time = os.path.getmtime(baseline_path) if os.path.exists(baseline_path) else 0
+            st.session_state["baseline_tax_calculation"] = _get_cached_tax_calculation(baseline_path, modified_time)
+            st.session_state["baseline_tax_calculation_path"] = baseline_path
         # Show our own loading message after the cache access
         st.success("✅ Tax calculation loaded successfully")
     
@@ -153,45 +178,59 @@ def main(default_scenario_from_agent1=None, set_page_config=True):
         # Document comparison functionality
         st.markdown("---")
         st.subheader("📊 Compare with Another Document")
-        st.write("Upload any tax document to compare with the baseline calculation.")
-        previous_tax_return = st.file_uploader("Upload document for comparison", 
+        st.write("Upload any tax document to compare with the baseline calculation. "
+                 "Upload several prior years at once for a multi-year comparison.")
+        uploaded_documents = st.file_uploader("Upload document(s) for comparison", 
                                         type=["pdf", "json", "docx", "txt"], 
+                                        accept_multiple_files=True,
                                         key="previous_tax_return")
 
-        # If document uploaded, generate comparison
-        if previous_tax_return is not None:
-            # Process the uploaded document - not wrapped in spinner since this is usually quick
-            from agent2.utils.tax_comparison import parse_previous_tax_return, generate_tax_comparison
-            uploaded_document_data = parse_previous_tax_return(previous_tax_return)
+        # If documents uploaded, generate comparison
+        if uploaded_documents:
+            # Process the uploaded documents - not wrapped in spinner since this is usually quick.
+            # Extraction and comparison results are cached by file content, so reruns
+            # and re-uploads of the same files don't redo the work.
+            from agent2.utils.comparison_cache import cached_parse_previous_tax_returns, cached_tax_comparison
+            parsed_documents = cached_parse_previous_tax_returns(uploaded_documents)
+            valid_documents = []
+            for uploaded_document, document in zip(uploaded_documents, parsed_documents):
+                if "error" in document:
+                    st.error(f"Error processing uploaded document: {document['error']}")
+                else:
+                    valid_documents.append(uploaded_document)
 
-            if "error" not in uploaded_document_data:
+            if valid_documents:
                 client_data = {"name": "Tax Client", "tax_year": datetime.datetime.now().year}
+                if len(valid_documents) == 1:
+                    spinner_text = "🤖 Comparing tax document with the baseline..."
+                    report_name = "Tax_Document_Comparison"
+                else:
+                    spinner_text = f"🤖 Comparing {len(valid_documents)} tax documents with the baseline..."
+                    report_name = "Multi_Year_Tax_Comparison"
                 
-                # Add spinner specifically for the OpenAI document comparison call
-                with st.spinner("🤖 Calling OpenAI for detailed tax document comparison..."):
-                    comparison_result = generate_tax_comparison(
-                        previous_year_data=uploaded_document_data,
+                # Add spinner specifically for the document comparison
+                with st.spinner(spinner_text):
+                    comparison_result = cached_tax_comparison(
+                        valid_documents,
                         current_year_data=tax_calculation,
-                        client_data=client_data
+                        client_data=client_data,
+                        namespace=namespace
                     )
 
                 if "error" not in comparison_result:
                     st.success("✅ Document comparison completed!")
-                    with open(comparison_result["report_path"], "rb") as file:
-                        st.download_button(
-                            label="📥 Download Comparison Report (PDF)",
-                            data=file,
-                            file_name=f"Tax_Document_Comparison_{datetime.datetime.now().strftime('%Y%m%d')}.pdf",
-                            mime="application/pdf"
-                        )
+                    download_name = f"{report_name}_{datetime.datetime.now().strftime('%Y%m%d')}.pdf"
+                    report_id = serve_report(comparison_result["report_path"], download_name=download_name)
+                    if report_id is not None:
+                        st.link_button("📥 Download Comparison Report (PDF)", report_url(report_id, download=True))
+                    else:
+                        report_download_button("📥 Download Comparison Report (PDF)", comparison_result["report_path"], download_name)
                     try:
-                        display_pdf(comparison_result["report_path"])
+                        display_pdf(comparison_result["report_path"], report_id=report_id)
                     except Exception as e:
                         st.warning(f"Unable to display PDF in browser: {str(e)}. Please download using the button above.")
                 else:
                     st.error(f"Error generating comparison: {comparison_result['error']}")
-            else:
-                st.error(f"Error processing uploaded document: {uploaded_document_data['error']}")
     else:
         st.error(f"Error loading tax calculation: {tax_calculation.get('error')}")
 
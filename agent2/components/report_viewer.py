@@ -1,10 +1,9 @@
 import streamlit as st
-import json
-import base64
+from agent2.utils.pdf_helper import display_pdf, display_pdf_thumbnail, report_download_button, serve_report
 
 def display_report(structured_output, output_paths):
     st.header("📊 Tax Comparison Report")
-    
+
     # Display reasoning if available
     if isinstance(structured_output, dict) and "reasoning" in structured_output:
         st.subheader("🧠 AI Reasoning")
@@ -15,40 +14,24 @@ def display_report(structured_output, output_paths):
     else:
         # Legacy format or sample data
         data_for_display = structured_output
-    
-    # Display PDF embedded in the UI
+
+    # Display PDF embedded in the UI, streamed from the report server
     st.subheader("📄 PDF Report")
-    display_pdf(output_paths['pdf'])
-    
-    # Download section
+    report_id = serve_report(output_paths['pdf'], download_name="Tax_Comparison_Report.pdf")
+    if report_id is not None:
+        display_pdf_thumbnail(report_id)
+    display_pdf(output_paths['pdf'], report_id=report_id)
+
+    # Download section - served by URL, so no file handles are left open
     st.subheader("📥 Download Files")
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.download_button("⬇️ Download PDF", open(output_paths['pdf'], "rb"), file_name="Tax_Comparison_Report.pdf")
+        report_download_button("⬇️ Download PDF", output_paths['pdf'], "Tax_Comparison_Report.pdf", key="download_report_pdf")
     with col2:
-        st.download_button("⬇️ Download Excel", open(output_paths['excel'], "rb"), file_name="Tax_Comparison.xlsx")
+        report_download_button("⬇️ Download Excel", output_paths['excel'], "Tax_Comparison.xlsx", key="download_report_excel")
     with col3:
-        st.download_button("⬇️ Download JSON", open(output_paths['json'], "rb"), file_name="Tax_Comparison.json")
-    
+        report_download_button("⬇️ Download JSON", output_paths['json'], "Tax_Comparison.json", key="download_report_json")
+
     # Make JSON output collapsible
     with st.expander("View Raw JSON Data"):
         st.json(data_for_display)
-
-def display_pdf(pdf_file):
-    """Display a PDF file directly in the Streamlit app with a fallback download link"""
-    with open(pdf_file, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-    
-    # Embed PDF viewer using an iframe
-    pdf_display = f"""
-        <iframe
-            src="data:application/pdf;base64,{base64_pdf}"
-            width="100%"
-            height="600"
-            type="application/pdf"
-        ></iframe>
-    """
-    st.markdown(pdf_display, unsafe_allow_html=True)
-    
-    # Provide a fallback message with a download link
-    st.caption("If the PDF doesn't display correctly, you can download it using the button below.")
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from shared.metrics import record_cache_lookup
+from shared.storage import SHARED_NAMESPACE
+from shared.tracing import current_span, propagate, traced
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever extraction, comparison or report generation changes output so
+# stale cache entries stop matching.
+PIPELINE_VERSION = "1"
+
+CACHE_DIR = Path(os.getenv("COMPARISON_CACHE_DIR", "cache/comparisons"))
+MAX_CACHE_BYTES = int(os.getenv("COMPARISON_CACHE_MAX_MB", "200")) * 1024 * 1024
+MAX_CACHE_AGE_SECONDS = int(os.getenv("COMPARISON_CACHE_MAX_AGE_DAYS", "7")) * 24 * 3600
+
+_cache_lock = threading.Lock()
+
+
+def hash_bytes(data):
+    """Return the SHA-256 hex digest of raw bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_uploaded_file(file_obj):
+    """
+    Hash the content of an uploaded file without disturbing its read position.
+
+    Args:
+        file_obj: Streamlit UploadedFile or any seekable binary file object
+
+    Returns:
+        str: SHA-256 hex digest of the file content
+    """
+    if hasattr(file_obj, "getvalue"):
+        return hash_bytes(file_obj.getvalue())
+    position = file_obj.tell()
+    file_obj.seek(0)
+    digest = hash_bytes(file_obj.read())
+    file_obj.seek(position)
+    return digest
+
+
+def _cache_key(*parts):
+    """Combine key parts with the pipeline version into one digest."""
+    return hash_bytes("\x1f".join([PIPELINE_VERSION, *parts]).encode("utf-8"))
+
+
+def _entry_dir(kind, key):
+    return CACHE_DIR / f"{kind}-{key}"
+
+
+def _write_json_atomic(path, data):
+    """Write JSON next to its destination and rename it into place."""
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _load_entry(kind, key):
+    """Return the cached payload for an entry, refreshing its access time, or None."""
+    entry_dir = _entry_dir(kind, key)
+    payload_path = entry_dir / "payload.json"
+    if not payload_path.exists():
+        return None
+    try:
+        with open(payload_path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Discarding unreadable cache entry {entry_dir}: {e}")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+    if time.time() - payload.get("created_at", 0) > MAX_CACHE_AGE_SECONDS:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+    # The access time drives LRU eviction
+    os.utime(payload_path)
+    return payload
+
+
+def _store_entry(kind, key, payload, report_path=None):
+    """
+    Store a payload (and optionally the generated report's path) under a cache key.
+
+    Returns:
+        dict: The stored payload
+    """
+    entry_dir = _entry_dir(kind, key)
+    entry_dir.mkdir(parents=True, exist_ok=True)
+
+    payload = dict(payload)
+    payload["created_at"] = time.time()
+    payload["pipeline_version"] = PIPELINE_VERSION
+
+    if report_path:
+        # The report itself stays in managed storage (shared.storage), which
+        # owns its retention; a hit is only served while the file still exists
+        payload["report_path"] = str(report_path)
+
+    _write_json_atomic(entry_dir / "payload.json", payload)
+    evict_cache()
+    return payload
+
+
+def evict_cache(max_bytes=None, max_age_seconds=None):
+    """
+    Remove expired entries, then least recently used ones until the cache fits.
+
+    Args:
+        max_bytes (int, optional): Size budget, defaults to COMPARISON_CACHE_MAX_MB
+        max_age_seconds (int, optional): Age limit, defaults to COMPARISON_CACHE_MAX_AGE_DAYS
+
+    Returns:
+        int: Number of entries removed
+    """
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    max_age_seconds = MAX_CACHE_AGE_SECONDS if max_age_seconds is None else max_age_seconds
+    if not CACHE_DIR.exists():
+        return 0
+
+    with _cache_lock:
+        now = time.time()
+        entries = []
+        removed = 0
+        for entry_dir in CACHE_DIR.iterdir():
+            if not entry_dir.is_dir():
+                continue
+            try:
+                files = [path for path in entry_dir.iterdir() if path.is_file()]
+                size = sum(path.stat().st_size for path in files)
+                last_access = max((path.stat().st_mtime for path in files), default=0)
+            except OSError:
+                continue
+            if now - last_access > max_age_seconds:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                removed += 1
+            else:
+                entries.append((last_access, size, entry_dir))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            removed += 1
+
+    if removed:
+        logger.info(f"Evicted {removed} comparison cache entries")
+    return removed
+
+
+@traced("cached_document_extraction")
+def cached_parse_previous_tax_return(file_obj):
+    """
+    Parse an uploaded tax document, reusing the extracted data for identical content.
+
+    Args:
+        file_obj: The uploaded file object
+
+    Returns:
+        dict: Extracted tax data or error message (errors are not cached)
+    """
+    from agent2.utils.tax_comparison import parse_previous_tax_return
+
+    key = _cache_key("parse", hash_uploaded_file(file_obj), file_obj.name.lower().rsplit(".", 1)[-1])
+    cached = _load_entry("parse", key)
+    current_span().set_attribute("cache.hit", cached is not None)
+    record_cache_lookup("document_extraction", cached is not None)
+    if cached is not None:
+        logger.info(f"Comparison cache hit for extracted document {file_obj.name}")
+        document_data = cached["document_data"]
+        # The same content may be uploaded under another name
+        document_data["file_name"] = file_obj.name
+        return document_data
+
+    document_data = parse_previous_tax_return(file_obj)
+    if "error" not in document_data:
+        try:
+            _store_entry("parse", key, {"document_data": document_data})
+        except Exception as e:
+            # Caching is an optimization; never fail the extraction because of it
+            logger.warning(f"Could not cache extracted document {file_obj.name}: {str(e)}")
+    return document_data
+
+
+def cached_parse_previous_tax_returns(file_objs):
+    """
+    Parse several uploaded documents concurrently through the extraction cache.
+
+    Args:
+        file_objs (list): The uploaded file objects
+
+    Returns:
+        list: Extracted tax data (or error dict) per file, in upload order
+    """
+    from agent2.utils.tax_comparison import MAX_PARALLEL_DOCUMENTS
+
+    if not file_objs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_DOCUMENTS, len(file_objs))) as executor:
+        return list(executor.map(propagate(cached_parse_previous_tax_return), file_objs))
+
+
+@traced("cached_comparison")
+def cached_tax_comparison(file_objs, current_year_data, client_data=None, namespace=SHARED_NAMESPACE):
+    """
+    Run the comparison pipeline (extraction, comparison, PDF report) for one or
+    more uploaded documents, memoized on the uploaded file hashes, the baseline
+    hash and the pipeline version.
+
+    Args:
+        file_objs (list): Uploaded file objects; several trigger a multi-year comparison
+        current_year_data (dict): Baseline tax calculation data
+        client_data (dict, optional): Client information
+        namespace (str, optional): Storage namespace for newly generated reports
+
+    Returns:
+        dict: Result with report_path and comparison_data, or error message.
+        Cached results carry "cache_hit": True.
+    """
+    from agent2.utils.tax_comparison import generate_tax_comparison, generate_multi_year_comparison
+
+    file_hashes = [hash_uploaded_file(file_obj) for file_obj in file_objs]
+    baseline_hash = hash_bytes(current_year_data.get("full_text", "").encode("utf-8"))
+    client_key = json.dumps(client_data or {}, sort_keys=True, default=str)
+    key = _cache_key("compare", *file_hashes, baseline_hash, client_key)
+
+    cached = _load_entry("compare", key)
+    cache_hit = cached is not None and os.path.exists(cached.get("report_path", ""))
+    current_span().set_attribute("cache.hit", cache_hit)
+    record_cache_lookup("comparison", cache_hit)
+    if cache_hit:
+        logger.info("Comparison cache hit")
+        return {
+            "report_path": cached["report_path"],
+            "comparison_data": cached["comparison_data"],
+            "cache_hit": True,
+        }
+
+    documents_data = cached_parse_previous_tax_returns(file_objs)
+    errors = [document["error"] for document in documents_data if "error" in document]
+    if errors:
+        return {"error": "; ".join(errors)}
+
+    if len(documents_data) == 1:
+        result = generate_tax_comparison(documents_data[0], current_year_data, client_data, namespace=namespace)
+    else:
+        result = generate_multi_year_comparison(documents_data, current_year_data, client_data, namespace=namespace)
+
+    if "error" in result:
+        return result
+
+    try:
+        _store_entry(
+            "compare",
+            key,
+            {"comparison_data": result["comparison_data"]},
+            report_path=result["report_path"],
+        )
+    except Exception as e:
+        # Caching is an optimization; never fail the comparison because of it
+        logger.warning(f"Could not cache comparison result: {str(e)}")
+
+    result["cache_hit"] = False
+    return result
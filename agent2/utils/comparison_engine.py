@@ -0,0 +1,389 @@
+import re
+import json
+import logging
+
+from shared.money import (
+    AMOUNT_PATTERN, money_difference, parse_amount, parse_amounts, percent_change, to_decimal, units_to_floats,
+)
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of metrics both documents must share before the local
+# comparison is trusted; below this the caller falls back to the LLM.
+MIN_SHARED_METRICS = 3
+
+# Decimal places kept when parsing extracted amounts; rates need more than cents
+RATE_PLACES = 4
+
+# Canonical tax metrics, in report order. Each entry maps a stable key to the
+# label shown in the report, the aliases used to find it in JSON keys and free
+# text, and whether the value is a dollar amount or a rate.
+CANONICAL_METRICS = [
+    {
+        "key": "total_income",
+        "label": "Total Income",
+        "kind": "money",
+        "aliases": ["total income", "gross income", "total gross income", "income amount", "annual income", "total annual income"],
+    },
+    {
+        "key": "business_expenses",
+        "label": "Total Business Expenses",
+        "kind": "money",
+        "aliases": ["total business expenses", "business expenses"],
+    },
+    {
+        "key": "deductions",
+        "label": "Total Deductions",
+        "kind": "money",
+        "aliases": ["total deductions", "deductions total", "standard deduction", "itemized deductions"],
+    },
+    {
+        "key": "adjusted_gross_income",
+        "label": "Adjusted Gross Income (AGI)",
+        "kind": "money",
+        "aliases": ["adjusted gross income agi", "adjusted gross income", "agi"],
+    },
+    {
+        "key": "taxable_income",
+        "label": "Taxable Income",
+        "kind": "money",
+        "aliases": ["taxable income", "total taxable income"],
+    },
+    {
+        "key": "federal_tax",
+        "label": "Federal Income Tax",
+        "kind": "money",
+        "aliases": ["total federal tax", "federal income tax", "federal tax", "federal taxes owed"],
+    },
+    {
+        "key": "state_tax",
+        "label": "State Tax",
+        "kind": "money",
+        "aliases": ["total state tax", "state income tax", "state tax", "region taxes owed"],
+    },
+    {
+        "key": "fica_tax",
+        "label": "FICA Taxes",
+        "kind": "money",
+        "aliases": ["total fica taxes", "total fica tax", "fica taxes", "fica tax", "fica total"],
+    },
+    {
+        "key": "total_tax",
+        "label": "Total Tax Liability",
+        "kind": "money",
+        "aliases": ["total tax liability", "total tax", "total taxes owed", "total taxes"],
+    },
+    {
+        "key": "effective_rate",
+        "label": "Effective Tax Rate",
+        "kind": "rate",
+        "aliases": ["effective tax rate", "total effective tax rate", "effective rate"],
+    },
+]
+
+_NUMBER_PATTERN = r"(" + AMOUNT_PATTERN + r")\s*(%)?"
+
+
+def _normalize_label(text):
+    """Lower-case a label and collapse anything that isn't a letter or digit to single spaces."""
+    return re.sub(r"[^a-z0-9]+", " ", str(text).lower()).strip()
+
+
+# Alias lookup for JSON keys, built once at import time
+_ALIAS_TO_KEY = {}
+for _metric in CANONICAL_METRICS:
+    for _alias in _metric["aliases"]:
+        _ALIAS_TO_KEY.setdefault(_normalize_label(_alias), _metric["key"])
+
+_METRICS_BY_KEY = {metric["key"]: metric for metric in CANONICAL_METRICS}
+
+# One compiled pattern per metric for free-text extraction. Labels must open a
+# line or table cell (after any bullet/numbering) so "Adjusted Gross Income"
+# isn't read as "Gross Income". Longer aliases are tried first.
+_TEXT_PATTERNS = {
+    metric["key"]: re.compile(
+        r"(?:^|\|)[ \t>#*\-\d.)]*(?:"
+        + "|".join(re.escape(alias).replace(r"\ ", r"\s+") for alias in sorted(metric["aliases"], key=len, reverse=True))
+        + r")(?:\s*\([^)\n]*\))?\s*[:=\-|]\s*"
+        + _NUMBER_PATTERN,
+        re.IGNORECASE | re.MULTILINE,
+    )
+    for metric in CANONICAL_METRICS
+}
+
+
+def _to_number(value):
+    """
+    Convert a JSON value or extracted string to a float.
+
+    Args:
+        value: int, float or string such as "$1,234.56", "(1,234)" or "$1.2k"
+
+    Returns:
+        float or None: The numeric value, or None if it can't be parsed
+    """
+    parsed = parse_amount(value)
+    if parsed is None:
+        return None
+    return float(parsed[0])
+
+
+def _normalize_rate(value, has_percent_sign=False):
+    """Express a rate as a percentage (23.75) whether it arrived as 23.75% or 0.2375."""
+    if not has_percent_sign and abs(value) <= 1:
+        return float(to_decimal(value) * 100)
+    return value
+
+
+def extract_metrics_from_json(json_data):
+    """
+    Extract canonical tax metrics from arbitrarily nested JSON data.
+
+    Keys are matched by their normalized name and, for nested objects, by the
+    parent and child key together (e.g. {"income": {"amount": ...}}).
+
+    Args:
+        json_data (dict): The parsed JSON document
+
+    Returns:
+        dict: Canonical metric key -> float value
+    """
+    metrics = {}
+
+    def visit(node, parent_key, depth):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                visit(value, key, depth + 1)
+                if not isinstance(value, (dict, list)):
+                    candidates = [_normalize_label(key)]
+                    if parent_key:
+                        candidates.insert(0, _normalize_label(f"{parent_key} {key}"))
+                    for candidate in candidates:
+                        metric_key = _ALIAS_TO_KEY.get(candidate)
+                        if metric_key is None:
+                            continue
+                        number = _to_number(value)
+                        if number is None:
+                            continue
+                        # Prefer the shallowest occurrence of a metric
+                        if metric_key not in metrics or depth < metrics[metric_key][1]:
+                            if _METRICS_BY_KEY[metric_key]["kind"] == "rate":
+                                number = _normalize_rate(number, isinstance(value, str) and "%" in value)
+                            metrics[metric_key] = (number, depth)
+                        break
+        elif isinstance(node, list):
+            for item in node:
+                visit(item, parent_key, depth + 1)
+
+    visit(json_data, "", 0)
+    return {key: value for key, (value, _) in metrics.items()}
+
+
+def extract_metrics_from_text(text):
+    """
+    Extract canonical tax metrics from free text such as our baseline calculation.
+
+    Only "Label: value" style lines are used; formulas and prose are ignored.
+    When a label appears several times the last occurrence wins, since summaries
+    sit at the end of our documents.
+
+    Args:
+        text (str): Document text
+
+    Returns:
+        dict: Canonical metric key -> float value
+    """
+    metrics = {}
+    if not text:
+        return metrics
+
+    # Markdown emphasis splits labels from their values ("**AGI:** $1")
+    cleaned = text.replace("**", "").replace("__", "")
+
+    found = [
+        (metric_key, match.group(1), bool(match.group(2)))
+        for metric_key, pattern in _TEXT_PATTERNS.items()
+        for match in pattern.finditer(cleaned)
+    ]
+    if not found:
+        return metrics
+
+    # Parse every matched amount in one batch, to 4 places so rates keep their precision
+    units, valid, _ = parse_amounts([amount for _, amount, _ in found], places=RATE_PLACES)
+    for (metric_key, _, has_percent_sign), number in zip(found, units_to_floats(units, valid, RATE_PLACES)):
+        if number is None:
+            continue
+        if _METRICS_BY_KEY[metric_key]["kind"] == "rate":
+            number = _normalize_rate(number, has_percent_sign)
+        metrics[metric_key] = number
+
+    return metrics
+
+
+def extract_metrics(document_data):
+    """
+    Extract canonical tax metrics from a parsed document.
+
+    Args:
+        document_data (dict): Output of parse_previous_tax_return or read_tax_calculation_file
+
+    Returns:
+        dict: Canonical metric key -> float value
+    """
+    if document_data.get("source_type") == "json":
+        return extract_metrics_from_json(document_data.get("raw_data", {}))
+
+    text = document_data.get("text_content") or document_data.get("full_text", "")
+    return extract_metrics_from_text(text)
+
+
+def compare_metrics(metrics1, metrics2, year_labels=None):
+    """
+    Align two metric sets by canonical label and compute differences.
+
+    Args:
+        metrics1 (dict): Metrics of the first (previous) document
+        metrics2 (dict): Metrics of the second (current) document
+        year_labels (list, optional): Column labels for the two documents
+
+    Returns:
+        dict: Comparison data in the structure create_comparison_report consumes
+    """
+    key_metrics = []
+    for metric in CANONICAL_METRICS:
+        value1 = metrics1.get(metric["key"])
+        value2 = metrics2.get(metric["key"])
+        if value1 is None and value2 is None:
+            continue
+
+        entry = {
+            "label": metric["label"],
+            "document1": value1 if value1 is not None else "N/A",
+            "document2": value2 if value2 is not None else "N/A",
+            "difference": "N/A",
+            "percent_change": "N/A",
+        }
+        if value1 is not None and value2 is not None:
+            entry["difference"] = money_difference(value1, value2)
+            if value1 != 0:
+                entry["percent_change"] = percent_change(value1, value2)
+        key_metrics.append(entry)
+
+    return {
+        "year_labels": year_labels or ["Previous Year", "Current Year"],
+        "key_metrics": key_metrics,
+    }
+
+
+def build_local_comparison(previous_year_data, current_year_data):
+    """
+    Compare two documents without calling the LLM.
+
+    Args:
+        previous_year_data (dict): Uploaded document data
+        current_year_data (dict): Baseline tax calculation data
+
+    Returns:
+        dict or None: Comparison data, or None if the documents don't share
+        enough recognizable metrics to be compared deterministically
+    """
+    metrics1 = extract_metrics(previous_year_data)
+    metrics2 = extract_metrics(current_year_data)
+    shared = set(metrics1) & set(metrics2)
+
+    if len(shared) < MIN_SHARED_METRICS:
+        logger.info(f"Local comparison found only {len(shared)} shared metrics, deferring to AI")
+        return None
+
+    comparison_data = compare_metrics(metrics1, metrics2)
+    summary_lines = [
+        f"{metric['label']}: {metric['document1']} -> {metric['document2']} ({metric['difference']})"
+        for metric in comparison_data["key_metrics"]
+    ]
+    comparison_data["analysis"] = {"detailed_comparison": "\n".join(summary_lines)}
+    comparison_data["full_analysis_text"] = json.dumps(comparison_data["key_metrics"], indent=2)
+    comparison_data["comparison_method"] = "local"
+
+    logger.info(f"Compared {len(shared)} shared metrics locally")
+    return comparison_data
+
+
+def metrics_from_key_metrics(key_metrics, column="document1"):
+    """
+    Map an AI-produced key_metrics list back onto canonical metric keys.
+
+    Args:
+        key_metrics (list): Entries with a "label" and per-document values
+        column (str): Which document's value to take
+
+    Returns:
+        dict: Canonical metric key -> float value for the labels we recognize
+    """
+    metrics = {}
+    for entry in key_metrics:
+        metric_key = _ALIAS_TO_KEY.get(_normalize_label(entry.get("label", "")))
+        if metric_key is None or metric_key in metrics:
+            continue
+        number = _to_number(entry.get(column))
+        if number is not None:
+            metrics[metric_key] = number
+    return metrics
+
+
+def _trend(values):
+    """Describe the direction of a series of values, ignoring gaps."""
+    present = [value for value in values if value is not None]
+    if len(present) < 2:
+        return "N/A"
+    if present[-1] > present[0]:
+        return "Up"
+    if present[-1] < present[0]:
+        return "Down"
+    return "Flat"
+
+
+def build_metric_matrix(metric_sets, year_labels):
+    """
+    Align several documents into a year x metric matrix with trend columns.
+
+    Args:
+        metric_sets (list): One canonical metrics dict per document, oldest first
+        year_labels (list): Column label for each document
+
+    Returns:
+        dict: {"year_labels": [...], "key_metrics": [{"label", "values", "changes",
+        "difference", "percent_change", "trend"}, ...]}
+    """
+    key_metrics = []
+    for metric in CANONICAL_METRICS:
+        values = [metrics.get(metric["key"]) for metrics in metric_sets]
+        present = [value for value in values if value is not None]
+        if not present:
+            continue
+
+        # Year-over-year change against the previous column that has a value
+        changes = ["N/A"]
+        last_value = values[0]
+        for value in values[1:]:
+            if value is not None and last_value is not None:
+                changes.append(money_difference(last_value, value))
+            else:
+                changes.append("N/A")
+            if value is not None:
+                last_value = value
+
+        entry = {
+            "label": metric["label"],
+            "values": [value if value is not None else "N/A" for value in values],
+            "changes": changes,
+            "difference": "N/A",
+            "percent_change": "N/A",
+            "trend": _trend(values),
+        }
+        if len(present) >= 2:
+            entry["difference"] = money_difference(present[0], present[-1])
+            if present[0] != 0:
+                entry["percent_change"] = percent_change(present[0], present[-1])
+        key_metrics.append(entry)
+
+    return {"year_labels": list(year_labels), "key_metrics": key_metrics}
@@ -0,0 +1,332 @@
+"""
+CPU-bound document work: text extraction from uploads and PDF rendering.
+
+These functions take and return plain data (bytes, dicts, strings) so
+shared.worker_pool can run them in worker processes. The module imports no
+storage, LLM or metrics code, which keeps worker start-up light.
+"""
+import json
+import logging
+import datetime
+from io import BytesIO
+from fpdf import FPDF
+from PyPDF2 import PdfReader
+
+from shared.money import format_money, format_percent, money_difference
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".json", ".pdf", ".docx")
+
+def extract_document(file_name, data):
+    """
+    Extract tax data from an uploaded document's bytes.
+
+    Args:
+        file_name (str): Original file name; its extension selects the parser
+        data (bytes): File contents
+
+    Returns:
+        dict: Extracted tax data or error message
+    """
+    filename = file_name.lower()
+    if filename.endswith(".json"):
+        return extract_tax_data_from_json(json.loads(data.decode("utf-8")))
+    if filename.endswith(".pdf"):
+        return extract_tax_data_from_pdf(BytesIO(data))
+    if filename.endswith(".docx"):
+        return extract_tax_data_from_docx(BytesIO(data))
+    return {"error": "Unsupported file format. Please upload a PDF, JSON, or DOCX file."}
+
+def extract_tax_data_from_json(json_data):
+    """
+    Extract relevant tax information from JSON data.
+    
+    Args:
+        json_data (dict): The parsed JSON data
+        
+    Returns:
+        dict: Extracted tax data
+    """
+    try:
+        # For now, just return the data as is - we'll use AI to parse it later
+        return {
+            "source_type": "json",
+            "raw_data": json_data
+        }
+    except Exception as e:
+        logger.error(f"Error extracting data from JSON: {str(e)}")
+        return {"error": f"Failed to extract data from JSON: {str(e)}"}
+
+def extract_tax_data_from_pdf(file_obj):
+    """
+    Extract text content from a PDF file.
+    
+    Args:
+        file_obj: The uploaded PDF file object
+        
+    Returns:
+        dict: Extracted text content
+    """
+    try:
+        # Read the upload in memory; no temporary copy is written to disk
+        text_content = ""
+        pdf = PdfReader(BytesIO(file_obj.read()))
+        
+        for page in pdf.pages:
+            text_content += page.extract_text() + "\n"
+        
+        return {
+            "source_type": "pdf",
+            "text_content": text_content,
+            "page_count": len(pdf.pages)
+        }
+    except Exception as e:
+        logger.error(f"Error extracting data from PDF: {str(e)}")
+        return {"error": f"Failed to extract data from PDF: {str(e)}"}
+
+def extract_tax_data_from_docx(file_obj):
+    """
+    Extract text content from a DOCX file.
+    
+    Args:
+        file_obj: The uploaded DOCX file object
+        
+    Returns:
+        dict: Extracted text content
+    """
+    try:
+        # Read the upload in memory; no temporary copy is written to disk
+        from docx import Document
+        doc = Document(BytesIO(file_obj.read()))
+        text_content = ""
+        
+        # Extract text from paragraphs
+        for para in doc.paragraphs:
+            text_content += para.text + "\n"
+        
+        # Extract text from tables
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    text_content += cell.text + " | "
+                text_content += "\n"
+        
+        return {
+            "source_type": "docx",
+            "text_content": text_content,
+            "page_count": len(doc.paragraphs)  # Approximate measure
+        }
+    except Exception as e:
+        logger.error(f"Error extracting data from DOCX: {str(e)}")
+        return {"error": f"Failed to extract data from DOCX: {str(e)}"}
+
+def _format_metric_value(value, label):
+    """Format a metric value for the PDF table: dollars, or a percentage for rates."""
+    if isinstance(value, (int, float)) and "rate" not in label.lower():
+        return format_money(value)
+    elif isinstance(value, (int, float)):
+        return format_percent(value)
+    return str(value)
+
+def _format_difference(diff, label):
+    """Format a signed difference for the PDF table."""
+    if not isinstance(diff, (int, float)):
+        return "N/A"
+    if "rate" in label.lower():
+        return format_percent(diff, signed=True)
+    return format_money(diff, signed=True)
+
+def render_comparison_report(comparison_data, client_data):
+    """
+    Render the two-document comparison PDF.
+
+    Args:
+        comparison_data (dict): The comparison data from the local or AI comparison
+        client_data (dict): Client information
+
+    Returns:
+        tuple: (PDF bytes, file-name-safe client name)
+    """
+    # Generate a PDF report with FPDF
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    
+    # Add title page
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(0, 10, "Tax Document Comparison Report", 0, 1, "C")
+    
+    # Add client name if available
+    client_name = client_data.get("name", "")
+    if not client_name and "ClientDetails" in client_data:
+        client_name = client_data["ClientDetails"].get("name", "")
+    
+    if client_name:
+        pdf.set_font("Arial", "B", 14)
+        pdf.cell(0, 10, f"For: {client_name}", 0, 1, "C")
+    
+    # Add date
+    pdf.set_font("Arial", "", 12)
+    pdf.cell(0, 10, f"Generated on: {datetime.datetime.now().strftime('%B %d, %Y')}", 0, 1, "C")
+    
+    # Add some spacing between title and comparison data
+    pdf.ln(5)
+    
+    # Add comparison data on the same page - removed the pdf.add_page() call that was here before
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, "Tax Metrics Comparison", 0, 1, "C")
+    
+    # Create table headers
+    pdf.set_fill_color(220, 220, 220)
+    pdf.set_font("Arial", "B", 10)
+    
+    # Get document labels
+    doc_labels = comparison_data.get("year_labels", ["Previous Year", "Current Year"])
+    
+    # Set column widths for better readability - adjusted for three columns
+    metric_width = 70
+    doc1_width = 45
+    doc2_width = 45
+    diff_width = 30
+    
+    # Draw table header for three columns
+    pdf.cell(metric_width, 10, "Tax Metric", 1, 0, "L", True)
+    pdf.cell(doc1_width, 10, doc_labels[0], 1, 0, "C", True)
+    pdf.cell(doc2_width, 10, doc_labels[1], 1, 0, "C", True)
+    pdf.cell(diff_width, 10, "Difference", 1, 1, "C", True)  # End the row (1,1)
+    
+    # Add data rows
+    pdf.set_font("Arial", "", 10)
+    
+    # Keep track of alternating row colors for readability
+    row_count = 0
+    
+    # Process each metric identified by OpenAI
+    for metric in comparison_data.get("key_metrics", []):
+        # Alternate row colors
+        if row_count % 2 == 0:
+            pdf.set_fill_color(245, 245, 245)
+            has_fill = True
+        else:
+            has_fill = False
+        row_count += 1
+        
+        # Extract values - handle different key names
+        label = metric.get("label", "")
+        
+        # Handle potential different keys in the metrics
+        doc1_value = metric.get("document1", metric.get("previous_year", metric.get("doc1", 0)))
+        doc2_value = metric.get("document2", metric.get("current_year", metric.get("doc2", 0)))
+        
+        # Calculate difference if not provided
+        if "difference" in metric:
+            diff = metric["difference"]
+        else:
+            diff = money_difference(doc1_value, doc2_value) if isinstance(doc2_value, (int, float)) and isinstance(doc1_value, (int, float)) else 0
+        
+        # Render label cell
+        pdf.cell(metric_width, 8, label, 1, 0, "L", has_fill)
+        
+        # Format and render both document values
+        pdf.cell(doc1_width, 8, _format_metric_value(doc1_value, label), 1, 0, "R", has_fill)
+        pdf.cell(doc2_width, 8, _format_metric_value(doc2_value, label), 1, 0, "R", has_fill)
+        
+        # Format difference - this is now the last column
+        pdf.cell(diff_width, 8, _format_difference(diff, label), 1, 1, "R", has_fill)  # End the row (1,1)
+
+    safe_client_name = "".join(c if c.isalnum() else "_" for c in client_name) if client_name else "tax_client"
+    return pdf.output(dest="S").encode("latin-1"), safe_client_name
+
+def render_multi_year_report(comparison_data, client_data):
+    """
+    Render the multi-year comparison PDF.
+
+    Args:
+        comparison_data (dict): Matrix from build_metric_matrix
+        client_data (dict): Client information
+
+    Returns:
+        tuple: (PDF bytes, file-name-safe client name)
+    """
+    year_labels = comparison_data.get("year_labels", [])
+    
+    # Landscape gives room for up to ~6 value columns plus trend columns
+    pdf = FPDF(orientation="L")
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(0, 10, "Multi-Year Tax Comparison Report", 0, 1, "C")
+    
+    client_name = client_data.get("name", "")
+    if not client_name and "ClientDetails" in client_data:
+        client_name = client_data["ClientDetails"].get("name", "")
+    
+    if client_name:
+        pdf.set_font("Arial", "B", 14)
+        pdf.cell(0, 10, f"For: {client_name}", 0, 1, "C")
+    
+    pdf.set_font("Arial", "", 12)
+    pdf.cell(0, 10, f"Generated on: {datetime.datetime.now().strftime('%B %d, %Y')}", 0, 1, "C")
+    pdf.ln(5)
+    
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, "Tax Metrics by Year", 0, 1, "C")
+    
+    # Split the usable page width between the metric, value and trend columns
+    usable_width = pdf.w - pdf.l_margin - pdf.r_margin
+    metric_width = 60
+    change_width = 30
+    percent_width = 22
+    trend_width = 16
+    value_width = (usable_width - metric_width - change_width - percent_width - trend_width) / max(len(year_labels), 1)
+    font_size = 9 if len(year_labels) <= 5 else 7
+    
+    pdf.set_fill_color(220, 220, 220)
+    pdf.set_font("Arial", "B", font_size)
+    pdf.cell(metric_width, 10, "Tax Metric", 1, 0, "L", True)
+    for year_label in year_labels:
+        pdf.cell(value_width, 10, str(year_label), 1, 0, "C", True)
+    pdf.cell(change_width, 10, "Change", 1, 0, "C", True)
+    pdf.cell(percent_width, 10, "% Change", 1, 0, "C", True)
+    pdf.cell(trend_width, 10, "Trend", 1, 1, "C", True)
+    
+    pdf.set_font("Arial", "", font_size)
+    for row_count, metric in enumerate(comparison_data.get("key_metrics", [])):
+        has_fill = row_count % 2 == 0
+        if has_fill:
+            pdf.set_fill_color(245, 245, 245)
+        
+        label = metric.get("label", "")
+        pdf.cell(metric_width, 8, label, 1, 0, "L", has_fill)
+        for value in metric.get("values", []):
+            pdf.cell(value_width, 8, _format_metric_value(value, label), 1, 0, "R", has_fill)
+        pdf.cell(change_width, 8, _format_difference(metric.get("difference"), label), 1, 0, "R", has_fill)
+        
+        percent_change = metric.get("percent_change")
+        if isinstance(percent_change, (int, float)):
+            percent_str = f"{'+' if percent_change > 0 else ''}{percent_change:.1f}%"
+        else:
+            percent_str = "N/A"
+        pdf.cell(percent_width, 8, percent_str, 1, 0, "R", has_fill)
+        pdf.cell(trend_width, 8, metric.get("trend", "N/A"), 1, 1, "C", has_fill)
+        
+        # Year-over-year changes, under the column of the later year
+        changes = metric.get("changes", [])
+        if any(isinstance(change, (int, float)) for change in changes):
+            pdf.set_font("Arial", "I", font_size - 1)
+            pdf.cell(metric_width, 6, "    vs. previous year", 1, 0, "L", has_fill)
+            for change in changes:
+                text = _format_difference(change, label) if isinstance(change, (int, float)) else ""
+                pdf.cell(value_width, 6, text, 1, 0, "R", has_fill)
+            pdf.cell(change_width + percent_width + trend_width, 6, "", 1, 1, "C", has_fill)
+            pdf.set_font("Arial", "", font_size)
+    
+    pdf.ln(4)
+    pdf.set_font("Arial", "I", 9)
+    pdf.multi_cell(0, 5, "Change and % Change compare the earliest and the latest year in which each metric was found. "
+                         "The \"vs. previous year\" rows show each year's change from the previous column with a value.")
+
+    safe_client_name = "".join(c if c.isalnum() else "_" for c in client_name) if client_name else "tax_client"
+    return pdf.output(dest="S").encode("latin-1"), safe_client_name
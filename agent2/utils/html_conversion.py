@@ -1,11 +1,15 @@
 import os
 import logging
-from openai import OpenAI
+from shared.llm_gateway import chat_completion
+from shared.metrics import record_fallback
+from shared.prompts import HTML_CONVERSION
+from shared.tracing import traced
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+@traced("html_conversion")
 def convert_tax_calculation_to_html(tax_calculation_text):
     """
     Convert the tax calculation text to HTML format using OpenAI.
@@ -21,45 +25,17 @@ def convert_tax_calculation_to_html(tax_calculation_text):
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             logger.error("OpenAI API key not found")
+            record_fallback("html_conversion", "pre_html")
             return f"<pre>{tax_calculation_text}</pre>"  # Fallback to simple pre-formatted HTML
         
-        # Initialize OpenAI client
-        client = OpenAI(api_key=api_key)
         logger.info("Calling OpenAI to convert tax calculation to HTML...")
         
-        # Create prompt for OpenAI with improved HTML structure guidance
-        prompt = f"""
-        Convert the following tax calculation text to a well-formatted HTML representation.
-        Do not change ANY of the content - keep all numbers, calculations, and text exactly the same.
-        
-        Improve the presentation using these HTML elements and CSS classes:
-        - Use <section> tags to group related content
-        - Use <h1>, <h2>, <h3> for section titles 
-        - Use <p> for text blocks
-        - Wrap tables in <div class="table-responsive">
-        - Use <table>, <tr>, <th>, <td> for tabular data
-        - Use <span class="number"> for important numeric values
-        - Wrap calculation blocks in <div class="calculation">...</div>
-        - Place summary information in <div class="summary">...</div>
-        
-        Apply modern formatting while maintaining the exact mathematical values and explanations.
-        
-        Here's the tax calculation text:
-        
-        ```
-        {tax_calculation_text}
-        ```
-        
-        Return ONLY valid HTML that can be directly embedded in a web page. Don't include any explanations before or after.
-        """
-        
-        # Call OpenAI API
-        response = client.chat.completions.create(
+        # Call OpenAI API; the style rules form a static prefix the provider can cache
+        response = chat_completion(
             model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an HTML conversion expert who preserves the exact content of tax documents while improving their presentation with HTML."},
-                {"role": "user", "content": prompt}
-            ],
+            call_site="html_conversion",
+            api_key=api_key,
+            messages=HTML_CONVERSION.messages(text=tax_calculation_text),
             temperature=0.1  # Lower temperature for more consistent output
         )
         
@@ -99,6 +75,7 @@ def convert_tax_calculation_to_html(tax_calculation_text):
     except Exception as e:
         logger.error(f"Error converting tax calculation to HTML: {str(e)}")
         # Fallback to simple pre-formatted HTML
+        record_fallback("html_conversion", "pre_html")
         return f"<pre>{tax_calculation_text}</pre>"
 
 def get_clean_html_for_streamlit(html_content):
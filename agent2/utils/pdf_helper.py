@@ -1,43 +1,102 @@
-import base64
 import streamlit as st
 import logging
 import os
+from agent2.utils.report_server import ensure_report_server, register_report, report_url, thumbnail_url
 
 logger = logging.getLogger(__name__)
 
-def display_pdf(pdf_file):
+def serve_report(pdf_file, download_name=None):
+    """Register a report with the report server, starting it if needed
+
+    Args:
+        pdf_file (str): Path to the report file
+        download_name (str, optional): File name offered when downloading
+
+    Returns:
+        str or None: Report ID, or None if the report server isn't available
+    """
+    if not ensure_report_server():
+        return None
+    return register_report(pdf_file, download_name=download_name)
+
+def display_pdf(pdf_file, report_id=None, height=600):
     """Display a PDF file in the Streamlit app with a fallback download link
-    
+
+    The PDF is streamed to the browser from the report server instead of being
+    base64-encoded into the page, so the websocket only carries a URL.
+
     Args:
         pdf_file (str): Path to the PDF file
-        
+        report_id (str, optional): ID from serve_report, if already registered
+        height (int): Height of the embedded viewer in pixels
+
     Returns:
-        None
+        str or None: The report ID used, or None if the PDF couldn't be served
     """
     # Make sure the file exists
     if not os.path.exists(pdf_file):
         st.warning(f"PDF file not found: {pdf_file}")
-        return
-    
+        return None
+
     try:
-        with open(pdf_file, "rb") as f:
-            base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-        
-        # Embed PDF viewer using an iframe
+        if report_id is None:
+            report_id = serve_report(pdf_file)
+        if report_id is None:
+            st.info("The PDF viewer is unavailable right now. Please use the download button to view the report.")
+            return None
+
+        # Embed PDF viewer using an iframe pointing at the report endpoint
         pdf_display = f"""
             <iframe
-                src="data:application/pdf;base64,{base64_pdf}"
+                src="{report_url(report_id)}"
                 width="100%"
-                height="600"
+                height="{height}"
                 type="application/pdf"
             ></iframe>
         """
         st.markdown(pdf_display, unsafe_allow_html=True)
-        
+
         # Provide a fallback message
-        st.caption("If the PDF doesn't display correctly in your browser, you can download it using the button below.")
-        
+        st.caption(f"If the PDF doesn't display correctly in your browser, [open it in a new tab]({report_url(report_id)}) "
+                   "or download it using the button.")
+        return report_id
+
     except Exception as e:
         logger.error(f"Error displaying PDF: {str(e)}")
         st.error(f"Error displaying PDF: {str(e)}")
         st.info("Please use the download button below to view the PDF.")
+        return None
+
+def display_pdf_thumbnail(report_id, width=240):
+    """Show a lazily loaded first-page thumbnail that links to the full report
+
+    Args:
+        report_id (str): ID from serve_report
+        width (int): Displayed width in pixels
+    """
+    st.markdown(
+        f'<a href="{report_url(report_id)}" target="_blank">'
+        f'<img src="{thumbnail_url(report_id)}" width="{width}" loading="lazy" '
+        f'alt="Report preview" onerror="this.style.display=\'none\'"></a>',
+        unsafe_allow_html=True
+    )
+
+def report_download_button(label, report_file, download_name, key=None):
+    """Offer a report for download straight from the report server
+
+    Falls back to st.download_button (reading the file with a closed handle)
+    when the report server isn't available.
+
+    Args:
+        label (str): Button label
+        report_file (str): Path to the file
+        download_name (str): File name offered to the browser
+        key (str, optional): Streamlit widget key
+    """
+    report_id = serve_report(report_file, download_name=download_name)
+    if report_id is not None:
+        st.link_button(label, report_url(report_id, download=True))
+        return
+    with open(report_file, "rb") as f:
+        data = f.read()
+    st.download_button(label, data=data, file_name=download_name, key=key)
@@ -0,0 +1,302 @@
+import os
+import re
+import time
+import logging
+import secrets
+import mimetypes
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# The static endpoint runs next to Streamlit; the public URL is what the
+# browser uses to reach it (set it when running behind a proxy). The default
+# port is outside 8501-8600, where Streamlit looks for a free port. With
+# REPORT_SERVER_ENABLED=0, reports go through st.download_button instead, for
+# deployments where the browser can't reach the port.
+REPORT_SERVER_ENABLED = os.getenv("REPORT_SERVER_ENABLED", "1").lower() not in ("0", "false", "no")
+REPORT_SERVER_HOST = os.getenv("REPORT_SERVER_HOST", "127.0.0.1")
+REPORT_SERVER_PORT = int(os.getenv("REPORT_SERVER_PORT", "8790"))
+
+
+def _default_public_url():
+    # GitHub Codespaces forwards ports to https://<codespace>-<port>.<domain>
+    codespace = os.getenv("CODESPACE_NAME")
+    domain = os.getenv("GITHUB_CODESPACES_PORT_FORWARDING_DOMAIN")
+    if codespace and domain:
+        return f"https://{codespace}-{REPORT_SERVER_PORT}.{domain}"
+    return f"http://localhost:{REPORT_SERVER_PORT}"
+
+
+REPORT_SERVER_PUBLIC_URL = (os.getenv("REPORT_SERVER_PUBLIC_URL") or _default_public_url()).rstrip("/")
+
+# Registered reports are forgotten after this long
+REPORT_TTL_SECONDS = int(os.getenv("REPORT_SERVER_TTL_HOURS", "24")) * 3600
+
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_WIDTH = 240
+
+_registry = {}
+# (path, download name) -> report ID, so reruns keep the same URL
+_ids_by_path = {}
+_registry_lock = threading.Lock()
+_server = None
+# Set after a failed bind, so reruns don't retry (and log) it every time
+_server_failed = False
+_server_lock = threading.Lock()
+
+
+def register_report(path, download_name=None):
+    """
+    Register a generated file so it can be served by ID.
+
+    Registering the same unchanged file again returns its existing ID, so the
+    URL stays stable across Streamlit reruns and the browser can reuse its
+    cached copy. A file rewritten since it was registered gets a new ID.
+
+    Args:
+        path (str): Path to the report on disk
+        download_name (str, optional): File name offered to the browser
+
+    Returns:
+        str: Unguessable report ID
+    """
+    path = os.path.abspath(path)
+    download_name = download_name or os.path.basename(path)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        modified = None
+    key = (path, download_name)
+    with _registry_lock:
+        _prune_registry()
+        report_id = _ids_by_path.get(key)
+        entry = _registry.get(report_id)
+        if entry is not None and entry["modified"] == modified:
+            entry["registered_at"] = time.time()
+            return report_id
+        if entry is not None:
+            del _registry[report_id]
+        report_id = secrets.token_urlsafe(16)
+        _registry[report_id] = {
+            "path": path,
+            "download_name": download_name,
+            "modified": modified,
+            "registered_at": time.time(),
+        }
+        _ids_by_path[key] = report_id
+    return report_id
+
+
+def unregister_report(report_id):
+    """Stop serving a report. Returns True if it was registered."""
+    with _registry_lock:
+        entry = _registry.pop(report_id, None)
+        if entry is None:
+            return False
+        _ids_by_path.pop((entry["path"], entry["download_name"]), None)
+        return True
+
+
+def get_report(report_id):
+    """Return the registry entry for a report ID, or None."""
+    with _registry_lock:
+        return _registry.get(report_id)
+
+
+def _prune_registry():
+    """Drop expired entries and entries whose file has been removed. Caller holds the lock."""
+    now = time.time()
+    for report_id, entry in list(_registry.items()):
+        if now - entry["registered_at"] > REPORT_TTL_SECONDS or not os.path.exists(entry["path"]):
+            del _registry[report_id]
+            _ids_by_path.pop((entry["path"], entry["download_name"]), None)
+
+
+def report_url(report_id, download=False):
+    """Public URL of a registered report."""
+    url = f"{REPORT_SERVER_PUBLIC_URL}/reports/{report_id}"
+    return f"{url}?download=1" if download else url
+
+
+def thumbnail_url(report_id):
+    """Public URL of the first-page thumbnail of a registered PDF."""
+    return f"{REPORT_SERVER_PUBLIC_URL}/reports/{report_id}/thumbnail.png"
+
+
+def render_thumbnail(pdf_path):
+    """
+    Render (once) a PNG thumbnail of a PDF's first page next to the PDF.
+
+    Thumbnails need PyMuPDF; without it this returns None and the endpoint 404s.
+
+    Args:
+        pdf_path (str): Path to the PDF
+
+    Returns:
+        str or None: Path to the thumbnail image
+    """
+    thumbnail_path = f"{pdf_path}.thumb.png"
+    if os.path.exists(thumbnail_path) and os.path.getmtime(thumbnail_path) >= os.path.getmtime(pdf_path):
+        return thumbnail_path
+
+    try:
+        import fitz  # PyMuPDF
+    except ImportError:
+        logger.info("PyMuPDF not installed; report thumbnails are disabled")
+        return None
+
+    try:
+        with fitz.open(pdf_path) as document:
+            page = document.load_page(0)
+            zoom = THUMBNAIL_WIDTH / page.rect.width
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            temp_path = f"{thumbnail_path}.{threading.get_ident()}.tmp"
+            pixmap.save(temp_path, output="png")
+            os.replace(temp_path, thumbnail_path)
+        return thumbnail_path
+    except Exception as e:
+        logger.error(f"Error rendering thumbnail for {pdf_path}: {str(e)}")
+        return None
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """Serves registered reports with single-range support and lazy thumbnails."""
+
+    server_version = "ReportServer/1.0"
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Report server: {format % args}")
+
+    def _serve(self, send_body):
+        parsed = urlparse(self.path)
+        match = re.fullmatch(r"/reports/([A-Za-z0-9_\-]+)(/thumbnail\.png)?", parsed.path)
+        if not match:
+            self.send_error(404)
+            return
+
+        entry = get_report(match.group(1))
+        if entry is None or not os.path.exists(entry["path"]):
+            self.send_error(404, "Report not found or expired")
+            return
+
+        if match.group(2):
+            path = render_thumbnail(entry["path"])
+            if path is None:
+                self.send_error(404, "Thumbnail unavailable")
+                return
+            content_type = "image/png"
+            disposition = "inline"
+        else:
+            path = entry["path"]
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            download = parse_qs(parsed.query).get("download") == ["1"]
+            disposition = f'{"attachment" if download else "inline"}; filename="{entry["download_name"]}"'
+
+        self._send_file(path, content_type, disposition, send_body)
+
+    def _send_file(self, path, content_type, disposition, send_body):
+        file_size = os.path.getsize(path)
+        start, end = 0, file_size - 1
+        status = 200
+
+        range_header = self.headers.get("Range")
+        if range_header:
+            range_match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+            if not range_match or (not range_match.group(1) and not range_match.group(2)):
+                self._send_unsatisfiable(file_size)
+                return
+            if range_match.group(1):
+                start = int(range_match.group(1))
+                if range_match.group(2):
+                    end = min(int(range_match.group(2)), file_size - 1)
+            else:
+                # Suffix range: the last N bytes
+                start = max(file_size - int(range_match.group(2)), 0)
+            if start > end or start >= file_size:
+                self._send_unsatisfiable(file_size)
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Content-Disposition", disposition)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Cache-Control", "private, max-age=3600")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
+        self.end_headers()
+
+        if not send_body:
+            return
+
+        remaining = end - start + 1
+        with open(path, "rb") as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The browser cancelled the request (e.g. after a range probe)
+                    return
+                remaining -= len(chunk)
+
+    def _send_unsatisfiable(self, file_size):
+        self.send_response(416)
+        self.send_header("Content-Range", f"bytes */{file_size}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def ensure_report_server():
+    """
+    Start the report endpoint in a daemon thread if it isn't running yet.
+
+    A failed bind is remembered, and callers fall back to sending the file
+    through Streamlit for the rest of the process's life.
+
+    Returns:
+        bool: True if the server is available
+    """
+    global _server, _server_failed
+    if not REPORT_SERVER_ENABLED:
+        return False
+    with _server_lock:
+        if _server is not None:
+            return True
+        if _server_failed:
+            return False
+        try:
+            _server = ThreadingHTTPServer((REPORT_SERVER_HOST, REPORT_SERVER_PORT), ReportRequestHandler)
+        except OSError as e:
+            _server_failed = True
+            logger.error(f"Could not start report server on {REPORT_SERVER_HOST}:{REPORT_SERVER_PORT}, "
+                         f"serving reports through Streamlit instead: {str(e)}")
+            return False
+        _server.daemon_threads = True
+        thread = threading.Thread(target=_server.serve_forever, name="report-server", daemon=True)
+        thread.start()
+        logger.info(f"Report server listening on {REPORT_SERVER_HOST}:{REPORT_SERVER_PORT}")
+        return True
+
+
+def shutdown_report_server():
+    """Stop the report endpoint (mainly for tests and benchmarks)."""
+    global _server, _server_failed
+    with _server_lock:
+        _server_failed = False
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
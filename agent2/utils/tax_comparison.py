@@ -2,21 +2,48 @@ import os
 import json
 import logging
 import datetime
-from pathlib import Path
-from fpdf import FPDF
-from PyPDF2 import PdfReader
 import re
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from shared.llm_gateway import chat_completion
+from shared.metrics import DOCUMENT_EXTRACTION_SECONDS, REPORT_GENERATION_SECONDS, timed
+from shared.prompts import COMPARISON
+from shared.storage import SHARED_NAMESPACE, get_storage
+from shared.tracing import propagate, traced
+from shared.worker_pool import run_cpu_bound
 from agent2.utils.tax_file_reader import read_tax_calculation_file
+from agent2.utils.document_processing import (
+    SUPPORTED_EXTENSIONS,
+    extract_document,
+    extract_tax_data_from_docx,
+    extract_tax_data_from_json,
+    extract_tax_data_from_pdf,
+    render_comparison_report,
+    render_multi_year_report,
+)
+from agent2.utils.comparison_engine import (
+    MIN_SHARED_METRICS,
+    build_local_comparison,
+    build_metric_matrix,
+    extract_metrics,
+    metrics_from_key_metrics,
+)
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
-# Create output directory for reports
-REPORTS_DIR = Path("reports")
-REPORTS_DIR.mkdir(exist_ok=True)
+# Reports are written through the shared storage manager, which namespaces
+# them per session/client and enforces retention quotas
+REPORTS_DIR = get_storage().root
 
+# Upper bound on documents extracted/compared at the same time in multi-year mode
+MAX_PARALLEL_DOCUMENTS = 5
+
+def _document_format(file_obj):
+    return file_obj.name.lower().rsplit(".", 1)[-1]
+
+@traced("document_extraction")
+@timed(DOCUMENT_EXTRACTION_SECONDS, format=_document_format)
 def parse_previous_tax_return(file_obj):
     """
     Parse a previous year's tax return file (PDF, JSON, or DOCX).
@@ -29,174 +56,188 @@ def parse_previous_tax_return(file_obj):
     """
     try:
         # Check file extension
-        filename = file_obj.name.lower()
-        
-        if filename.endswith(".json"):
-            # Process JSON file
-            file_obj.seek(0)  # Reset file pointer
-            data = json.loads(file_obj.read().decode('utf-8'))
-            return extract_tax_data_from_json(data)
-        
-        elif filename.endswith(".pdf"):
-            # Process PDF file
-            file_obj.seek(0)  # Reset file pointer
-            return extract_tax_data_from_pdf(file_obj)
+        if not file_obj.name.lower().endswith(SUPPORTED_EXTENSIONS):
+            return {"error": "Unsupported file format. Please upload a PDF, JSON, or DOCX file."}
         
-        elif filename.endswith(".docx"):
-            # Process DOCX file
-            file_obj.seek(0)  # Reset file pointer
-            return extract_tax_data_from_docx(file_obj)
+        # Extraction is CPU-bound; it runs on the worker pool when one is enabled
+        file_obj.seek(0)  # Reset file pointer
+        result = run_cpu_bound(extract_document, file_obj.name, file_obj.read())
         
-        else:
-            return {"error": "Unsupported file format. Please upload a PDF, JSON, or DOCX file."}
+        # Keep the original name so multi-year comparisons can label columns
+        if "error" not in result:
+            result["file_name"] = file_obj.name
+        return result
     
     except Exception as e:
         logger.error(f"Error parsing previous tax return: {str(e)}")
         return {"error": f"Failed to parse tax return: {str(e)}"}
 
-def extract_tax_data_from_json(json_data):
+def parse_previous_tax_returns(file_objs, max_workers=MAX_PARALLEL_DOCUMENTS):
     """
-    Extract relevant tax information from JSON data.
+    Parse several uploaded tax documents concurrently.
     
     Args:
-        json_data (dict): The parsed JSON data
+        file_objs (list): The uploaded file objects
+        max_workers (int): Maximum number of documents parsed at once
         
     Returns:
-        dict: Extracted tax data
+        list: Extracted tax data (or error dict) per file, in upload order
     """
-    try:
-        # For now, just return the data as is - we'll use AI to parse it later
-        return {
-            "source_type": "json",
-            "raw_data": json_data
-        }
-    except Exception as e:
-        logger.error(f"Error extracting data from JSON: {str(e)}")
-        return {"error": f"Failed to extract data from JSON: {str(e)}"}
+    if not file_objs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(file_objs))) as executor:
+        return list(executor.map(propagate(parse_previous_tax_return), file_objs))
 
-def extract_tax_data_from_pdf(file_obj):
+@traced("comparison")
+def generate_tax_comparison(previous_year_data, current_year_data=None, client_data=None, namespace=SHARED_NAMESPACE):
     """
-    Extract text content from a PDF file.
+    Compare two tax documents and generate a PDF report.
+    
+    Metrics are aligned locally by canonical label when both documents expose
+    them (JSON uploads, our baseline, well-labelled text); the AI comparison is
+    only used as a fallback for unstructured documents.
     
     Args:
-        file_obj: The uploaded PDF file object
+        previous_year_data (dict): Uploaded document data
+        current_year_data (dict, optional): Baseline tax calculation. If None, will use base_tax_calculation.txt
+        client_data (dict, optional): Client information
+        namespace (str, optional): Storage namespace for the report (see shared.storage.make_namespace)
         
     Returns:
-        dict: Extracted text content
+        dict: Result with PDF report path or error message
     """
     try:
-        # Save PDF to temporary file
-        temp_path = REPORTS_DIR / f"temp_tax_return_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-        with open(temp_path, "wb") as f:
-            f.write(file_obj.read())
-            
-        # Extract text from PDF
-        text_content = ""
-        pdf = PdfReader(temp_path)
+        # If current_year_data not provided, use base_tax_calculation.txt
+        if current_year_data is None:
+            current_year_data = read_tax_calculation_file("base_tax_calculation.txt")
+            if "error" in current_year_data:
+                return current_year_data
+            # Add source_type for consistency with previous_year_data
+            current_year_data["source_type"] = "text"
+            current_year_data["text_content"] = current_year_data.get("full_text", "")
         
-        for page in pdf.pages:
-            text_content += page.extract_text() + "\n"
+        # If client_data is None, provide a minimal structure
+        if client_data is None:
+            client_data = {"name": "Tax Client", "tax_year": datetime.datetime.now().year}
         
-        # Remove temp file
-        os.remove(temp_path)
+        # Compare machine-readable values locally; only free text we can't
+        # parse is sent to OpenAI
+        comparison_data = run_cpu_bound(build_local_comparison, previous_year_data, current_year_data)
+        if comparison_data is None:
+            comparison_data = analyze_tax_returns_with_ai(
+                previous_year_data, 
+                current_year_data, 
+                client_data
+            )
         
-        return {
-            "source_type": "pdf",
-            "text_content": text_content,
-            "page_count": len(pdf.pages)
-        }
+        if "error" in comparison_data:
+            return comparison_data
+        
+        # Generate PDF report
+        pdf_path = create_comparison_report(comparison_data, client_data, namespace=namespace)
+        
+        return {"report_path": pdf_path, "comparison_data": comparison_data}
+    
     except Exception as e:
-        logger.error(f"Error extracting data from PDF: {str(e)}")
-        return {"error": f"Failed to extract data from PDF: {str(e)}"}
+        logger.error(f"Error generating document comparison: {str(e)}")
+        return {"error": f"Failed to generate document comparison: {str(e)}"}
 
-def extract_tax_data_from_docx(file_obj):
+def _document_year_label(document_data, index):
+    """
+    Pick a column label for an uploaded document: its tax year if we can find
+    one in the JSON data or file name, otherwise its file name or position.
     """
-    Extract text content from a DOCX file.
+    raw_data = document_data.get("raw_data")
+    if isinstance(raw_data, dict):
+        for key in ("tax_year", "year", "TaxYear"):
+            if raw_data.get(key):
+                return str(raw_data[key])
     
-    Args:
-        file_obj: The uploaded DOCX file object
-        
-    Returns:
-        dict: Extracted text content
+    file_name = document_data.get("file_name", "")
+    year_match = re.search(r"(?<!\d)(19|20)\d{2}(?!\d)", file_name)
+    if year_match:
+        return year_match.group(0)
+    if file_name:
+        return os.path.splitext(file_name)[0]
+    return f"Document {index + 1}"
+
+def _extract_document_metrics(document_data, current_year_data, baseline_metrics, client_data):
     """
-    try:
-        # Save DOCX to temporary file
-        temp_path = REPORTS_DIR / f"temp_tax_return_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.docx"
-        with open(temp_path, "wb") as f:
-            f.write(file_obj.read())
-            
-        # Extract text from DOCX
-        from docx import Document
-        doc = Document(temp_path)
-        text_content = ""
-        
-        # Extract text from paragraphs
-        for para in doc.paragraphs:
-            text_content += para.text + "\n"
-        
-        # Extract text from tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text_content += cell.text + " | "
-                text_content += "\n"
-        
-        # Remove temp file
-        os.remove(temp_path)
-        
-        return {
-            "source_type": "docx",
-            "text_content": text_content,
-            "page_count": len(doc.paragraphs)  # Approximate measure
-        }
-    except Exception as e:
-        logger.error(f"Error extracting data from DOCX: {str(e)}")
-        return {"error": f"Failed to extract data from DOCX: {str(e)}"}
+    Extract canonical metrics from one uploaded document, asking OpenAI only
+    when the local parser doesn't find enough metrics shared with the baseline.
+    """
+    metrics = run_cpu_bound(extract_metrics, document_data)
+    if len(set(metrics) & set(baseline_metrics)) >= MIN_SHARED_METRICS:
+        return metrics
+    
+    ai_result = analyze_tax_returns_with_ai(document_data, current_year_data, client_data)
+    if "error" in ai_result:
+        logger.warning(f"AI extraction failed for {document_data.get('file_name', 'document')}: {ai_result['error']}")
+        return metrics
+    ai_metrics = metrics_from_key_metrics(ai_result.get("key_metrics", []), column="document1")
+    # Locally parsed values are exact; only fill the gaps from the AI output
+    ai_metrics.update(metrics)
+    return ai_metrics
 
-def generate_tax_comparison(previous_year_data, current_year_data=None, client_data=None):
+@traced("multi_year_comparison")
+def generate_multi_year_comparison(documents_data, current_year_data=None, client_data=None, namespace=SHARED_NAMESPACE):
     """
-    Compare two tax documents and generate a PDF report.
+    Compare several prior-year documents against the baseline in one run.
+    
+    Documents are extracted concurrently, aligned into a year x metric matrix
+    (oldest year first, baseline last) and rendered into a single PDF report
+    with change and trend columns.
     
     Args:
-        previous_year_data (dict): Uploaded document data
+        documents_data (list): Uploaded document data, as returned by parse_previous_tax_return
         current_year_data (dict, optional): Baseline tax calculation. If None, will use base_tax_calculation.txt
         client_data (dict, optional): Client information
+        namespace (str, optional): Storage namespace for the report (see shared.storage.make_namespace)
         
     Returns:
-        dict: Result with PDF report path or error message
+        dict: Result with PDF report path and the comparison matrix, or error message
     """
     try:
-        # If current_year_data not provided, use base_tax_calculation.txt
+        if not documents_data:
+            return {"error": "No documents provided for comparison."}
+        
         if current_year_data is None:
             current_year_data = read_tax_calculation_file("base_tax_calculation.txt")
             if "error" in current_year_data:
                 return current_year_data
-            # Add source_type for consistency with previous_year_data
-            current_year_data["source_type"] = "text"
-            current_year_data["text_content"] = current_year_data.get("full_text", "")
         
-        # If client_data is None, provide a minimal structure
         if client_data is None:
             client_data = {"name": "Tax Client", "tax_year": datetime.datetime.now().year}
         
-        # Use OpenAI to analyze and compare the documents
-        comparison_data = analyze_tax_returns_with_ai(
-            previous_year_data, 
-            current_year_data, 
-            client_data
-        )
+        baseline_metrics = run_cpu_bound(extract_metrics, current_year_data)
         
-        if "error" in comparison_data:
-            return comparison_data
+        with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_DOCUMENTS, len(documents_data))) as executor:
+            document_metrics = list(executor.map(
+                propagate(lambda document: _extract_document_metrics(document, current_year_data, baseline_metrics, client_data)),
+                documents_data
+            ))
         
-        # Generate PDF report
-        pdf_path = create_comparison_report(comparison_data, client_data)
+        # Year columns first in chronological order; labels that aren't years follow in upload order
+        labelled = [
+            (_document_year_label(document, index), metrics)
+            for index, (document, metrics) in enumerate(zip(documents_data, document_metrics))
+        ]
+        labelled.sort(key=lambda item: (not item[0].isdigit(), item[0] if item[0].isdigit() else ""))
+        
+        year_labels = [label for label, _ in labelled] + ["Baseline"]
+        metric_sets = [metrics for _, metrics in labelled] + [baseline_metrics]
+        comparison_data = build_metric_matrix(metric_sets, year_labels)
+        
+        if not comparison_data["key_metrics"]:
+            return {"error": "No comparable tax metrics were found in the uploaded documents."}
+        
+        pdf_path = create_multi_year_report(comparison_data, client_data, namespace=namespace)
         
         return {"report_path": pdf_path, "comparison_data": comparison_data}
     
     except Exception as e:
-        logger.error(f"Error generating document comparison: {str(e)}")
-        return {"error": f"Failed to generate document comparison: {str(e)}"}
+        logger.error(f"Error generating multi-year comparison: {str(e)}")
+        return {"error": f"Failed to generate multi-year comparison: {str(e)}"}
 
 def analyze_tax_returns_with_ai(previous_year_data, current_year_data, client_data):
     """
@@ -237,57 +278,14 @@ def analyze_tax_returns_with_ai(previous_year_data, current_year_data, client_da
         # Format baseline calculation data
         document2_str = current_year_data.get("full_text", "")
         
-        # Initialize OpenAI client
-        client = OpenAI(api_key=api_key)
-        
-        # Create a simplified prompt for OpenAI to focus only on numeric value comparison
-        prompt = f"""
-        You are a tax expert analyzing two tax documents. Your task is to identify and compare ONLY numeric values 
-        between these documents. Focus exclusively on extracting numeric tax metrics, amounts, and rates.
-
-        # DOCUMENT 1 (Previous Year):
-        ```
-        {document1_str}
-        ```
-
-        # DOCUMENT 2 (Current Year):
-        ```
-        {document2_str}
-        ```
-
-        Please provide ONLY a detailed comparison of the numeric values found in both documents:
-        
-        1. DETAILED COMPARISON: Identify and compare ANY relevant tax metrics found in the documents. 
-           - Extract numerical values from both documents where possible
-           - Calculate differences
-           - Do not include any analysis or recommendations
-           - Strictly focus on numeric tax-related values only
-        
-        Generate structured JSON data for the comparison with this format:
-        {{
-          "year_labels": ["Previous Year", "Current Year"],
-          "key_metrics": [
-            {{
-              "label": "[Tax Metric Name]",
-              "document1": [numeric value],
-              "document2": [numeric value],
-              "difference": [numeric difference]
-            }}
-            // Include all relevant numeric metrics you can identify from the documents
-          ]
-        }}
-        
-        Include the JSON between markers [JSON_START] and [JSON_END] to make extraction easier.
-        """
-        
-        # Call OpenAI API
+        # Call OpenAI API; the instructions and output format come before the documents
+        # so they form a prefix the provider can cache
         logger.info("Calling OpenAI for detailed tax document comparison...")
-        response = client.chat.completions.create(
+        response = chat_completion(
             model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a tax expert who analyzes and compares tax documents, extracting and comparing only numeric metrics based on the actual content of the documents."},
-                {"role": "user", "content": prompt}
-            ],
+            call_site="comparison",
+            api_key=api_key,
+            messages=COMPARISON.messages(document1=document1_str, document2=document2_str),
             temperature=0.1  # Lower temperature for more consistent structured output
         )
         
@@ -353,7 +351,8 @@ def analyze_tax_returns_with_ai(previous_year_data, current_year_data, client_da
             "year_labels": comparison_data.get("year_labels", ["Document 1", "Document 2"]),
             "key_metrics": comparison_data.get("key_metrics", []),
             "analysis": analysis_sections,
-            "full_analysis_text": content
+            "full_analysis_text": content,
+            "comparison_method": "ai"
         }
         
         return result
@@ -362,132 +361,29 @@ def analyze_tax_returns_with_ai(previous_year_data, current_year_data, client_da
         logger.error(f"Error analyzing tax returns with AI: {str(e)}")
         return {"error": f"Failed to analyze tax returns: {str(e)}"}
 
-def create_comparison_report(comparison_data, client_data):
+@traced("pdf_build")
+@timed(REPORT_GENERATION_SECONDS, kind="comparison")
+def create_comparison_report(comparison_data, client_data, namespace=SHARED_NAMESPACE):
     """
     Create a comprehensive PDF report of the tax document comparison.
     
     Args:
         comparison_data (dict): The comparison data from AI analysis
         client_data (dict): Client information
+        namespace (str, optional): Storage namespace for the report
         
     Returns:
         str: Path to the generated PDF report
     """
     try:
-        # Generate a PDF report with FPDF
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        
-        # Add title page
-        pdf.add_page()
-        pdf.set_font("Arial", "B", 16)
-        pdf.cell(0, 10, "Tax Document Comparison Report", 0, 1, "C")
-        
-        # Add client name if available
-        client_name = client_data.get("name", "")
-        if not client_name and "ClientDetails" in client_data:
-            client_name = client_data["ClientDetails"].get("name", "")
-        
-        if client_name:
-            pdf.set_font("Arial", "B", 14)
-            pdf.cell(0, 10, f"For: {client_name}", 0, 1, "C")
-        
-        # Add date
-        pdf.set_font("Arial", "", 12)
-        pdf.cell(0, 10, f"Generated on: {datetime.datetime.now().strftime('%B %d, %Y')}", 0, 1, "C")
-        
-        # Add some spacing between title and comparison data
-        pdf.ln(5)
-        
-        # Add comparison data on the same page - removed the pdf.add_page() call that was here before
-        pdf.set_font("Arial", "B", 14)
-        pdf.cell(0, 10, "Tax Metrics Comparison", 0, 1, "C")
-        
-        # Create table headers
-        pdf.set_fill_color(220, 220, 220)
-        pdf.set_font("Arial", "B", 10)
-        
-        # Get document labels
-        doc_labels = comparison_data.get("year_labels", ["Previous Year", "Current Year"])
-        
-        # Set column widths for better readability - adjusted for three columns
-        metric_width = 70
-        doc1_width = 45
-        doc2_width = 45
-        diff_width = 30
-        
-        # Draw table header for three columns
-        pdf.cell(metric_width, 10, "Tax Metric", 1, 0, "L", True)
-        pdf.cell(doc1_width, 10, doc_labels[0], 1, 0, "C", True)
-        pdf.cell(doc2_width, 10, doc_labels[1], 1, 0, "C", True)
-        pdf.cell(diff_width, 10, "Difference", 1, 1, "C", True)  # End the row (1,1)
-        
-        # Add data rows
-        pdf.set_font("Arial", "", 10)
-        
-        # Keep track of alternating row colors for readability
-        row_count = 0
-        
-        # Process each metric identified by OpenAI
-        for metric in comparison_data.get("key_metrics", []):
-            # Alternate row colors
-            if row_count % 2 == 0:
-                pdf.set_fill_color(245, 245, 245)
-                has_fill = True
-            else:
-                has_fill = False
-            row_count += 1
-            
-            # Extract values - handle different key names
-            label = metric.get("label", "")
-            
-            # Handle potential different keys in the metrics
-            doc1_value = metric.get("document1", metric.get("previous_year", metric.get("doc1", 0)))
-            doc2_value = metric.get("document2", metric.get("current_year", metric.get("doc2", 0)))
-            
-            # Calculate difference if not provided
-            if "difference" in metric:
-                diff = metric["difference"]
-            else:
-                diff = doc2_value - doc1_value if isinstance(doc2_value, (int, float)) and isinstance(doc1_value, (int, float)) else 0
-            
-            # Render label cell
-            pdf.cell(metric_width, 8, label, 1, 0, "L", has_fill)
-            
-            # Format and render document 1 value
-            if isinstance(doc1_value, (int, float)) and "rate" not in label.lower():
-                pdf.cell(doc1_width, 8, f"${doc1_value:,.2f}", 1, 0, "R", has_fill)
-            elif isinstance(doc1_value, (int, float)) and "rate" in label.lower():
-                pdf.cell(doc1_width, 8, f"{doc1_value:.2f}%", 1, 0, "R", has_fill)
-            else:
-                pdf.cell(doc1_width, 8, str(doc1_value), 1, 0, "R", has_fill)
-            
-            # Format and render document 2 value
-            if isinstance(doc2_value, (int, float)) and "rate" not in label.lower():
-                pdf.cell(doc2_width, 8, f"${doc2_value:,.2f}", 1, 0, "R", has_fill)
-            elif isinstance(doc2_value, (int, float)) and "rate" in label.lower():
-                pdf.cell(doc2_width, 8, f"{doc2_value:.2f}%", 1, 0, "R", has_fill)
-            else:
-                pdf.cell(doc2_width, 8, str(doc2_value), 1, 0, "R", has_fill)
-            
-            # Format difference - this is now the last column
-            if isinstance(diff, (int, float)):
-                sign = "+" if diff > 0 else ""
-                if "rate" in label.lower():
-                    diff_str = f"{sign}{diff:.2f}%"
-                else:
-                    diff_str = f"{sign}${diff:,.2f}"
-                    
-                pdf.cell(diff_width, 8, diff_str, 1, 1, "R", has_fill)  # End the row (1,1)
-            else:
-                pdf.cell(diff_width, 8, "N/A", 1, 1, "R", has_fill)  # End the row (1,1)
-        
-        # Save the PDF
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_client_name = "".join(c if c.isalnum() else "_" for c in client_name) if client_name else "tax_client"
-        pdf_path = str(REPORTS_DIR / f"{safe_client_name}_Tax_Comparison_{timestamp}.pdf")
-        
-        pdf.output(pdf_path)
+        # FPDF rendering is CPU-bound; it runs on the worker pool when one is enabled
+        pdf_bytes, safe_client_name = run_cpu_bound(render_comparison_report, comparison_data, client_data)
+        
+        # Save the PDF atomically so readers never see a partial file
+        storage = get_storage()
+        pdf_path = storage.artifact_path(namespace, f"{safe_client_name}_Tax_Comparison", ".pdf")
+        storage.write_bytes(pdf_path, pdf_bytes, namespace=namespace, kind="comparison_report")
+        pdf_path = str(pdf_path)
         logger.info(f"Generated numeric tax comparison report: {pdf_path}")
         
         return pdf_path
@@ -495,3 +391,32 @@ def create_comparison_report(comparison_data, client_data):
     except Exception as e:
         logger.error(f"Error creating comparison report: {str(e)}")
         raise Exception(f"Failed to create comparison report: {str(e)}")
+
+@traced("pdf_build")
+@timed(REPORT_GENERATION_SECONDS, kind="multi_year")
+def create_multi_year_report(comparison_data, client_data, namespace=SHARED_NAMESPACE):
+    """
+    Create a PDF report comparing several years of tax metrics side by side.
+    
+    Args:
+        comparison_data (dict): Matrix from build_metric_matrix
+        client_data (dict): Client information
+        namespace (str, optional): Storage namespace for the report
+        
+    Returns:
+        str: Path to the generated PDF report
+    """
+    try:
+        pdf_bytes, safe_client_name = run_cpu_bound(render_multi_year_report, comparison_data, client_data)
+        
+        storage = get_storage()
+        pdf_path = storage.artifact_path(namespace, f"{safe_client_name}_Multi_Year_Comparison", ".pdf")
+        storage.write_bytes(pdf_path, pdf_bytes, namespace=namespace, kind="comparison_report")
+        pdf_path = str(pdf_path)
+        logger.info(f"Generated multi-year tax comparison report: {pdf_path}")
+        
+        return pdf_path
+        
+    except Exception as e:
+        logger.error(f"Error creating multi-year report: {str(e)}")
+        raise Exception(f"Failed to create multi-year report: {str(e)}")
@@ -4,9 +4,26 @@ import logging
 import datetime
 from pathlib import Path
 from agent2.utils.html_conversion import convert_tax_calculation_to_html, get_clean_html_for_streamlit
+from shared.money import AMOUNT_PATTERN, parse_money, parse_percent
 
 logger = logging.getLogger(__name__)
 
+def _amount_after(label):
+    return re.compile(label + r":?\s*(" + AMOUNT_PATTERN + ")")
+
+# Result key -> label patterns tried in order; the first one found is used
+_BASELINE_AMOUNT_PATTERNS = [
+    ("income", [_amount_after(r"Total Income")]),
+    ("adjusted_gross_income", [_amount_after(r"Adjusted Gross Income \(AGI\)")]),
+    ("taxable_income", [_amount_after(r"Taxable Income")]),
+    ("deductions", [_amount_after(r"Total Business Expenses"), _amount_after(r"Total Deductions")]),
+    ("federal_taxes_owed", [_amount_after(r"Federal Tax"), _amount_after(r"Total Federal Tax")]),
+    ("region_taxes_owed", [_amount_after(r"State Tax"), _amount_after(r"Total State Tax")]),
+    ("fica_total", [_amount_after(r"FICA Taxes"), _amount_after(r"Total FICA Taxes")]),
+    ("total_taxes_owed", [_amount_after(r"Total Tax Liability")]),
+]
+_EFFECTIVE_RATE_PATTERN = re.compile(r"Effective Tax Rate:?\s*([\d\.]+)%")
+
 def read_tax_calculation_file(file_path="base_tax_calculation.txt"):
     """
     Read the tax calculation from a text file.
@@ -80,63 +97,32 @@ def extract_tax_info_from_file(file_content):
     }
     
     # Look for key metrics in the file content
+    amounts = {}
     try:
-        # Extract total income
-        total_income_match = re.search(r"Total Income:?\s*\$?([\d,\.]+)", file_content)
-        if total_income_match:
-            result["income"] = float(total_income_match.group(1).replace(",", ""))
-        
-        # Extract AGI
-        agi_match = re.search(r"Adjusted Gross Income \(AGI\):?\s*\$?([\d,\.]+)", file_content)
-        if agi_match:
-            result["adjusted_gross_income"] = float(agi_match.group(1).replace(",", ""))
-        
-        # Extract taxable income
-        taxable_income_match = re.search(r"Taxable Income:?\s*\$?([\d,\.]+)", file_content)
-        if taxable_income_match:
-            result["taxable_income"] = float(taxable_income_match.group(1).replace(",", ""))
-        
-        # Extract total business expenses/deductions
-        deductions_match = re.search(r"Total Business Expenses:?\s*\$?([\d,\.]+)", file_content) or \
-                           re.search(r"Total Deductions:?\s*\$?([\d,\.]+)", file_content)
-        if deductions_match:
-            result["deductions"] = float(deductions_match.group(1).replace(",", ""))
-        
-        # Extract federal tax
-        federal_tax_match = re.search(r"Federal Tax:?\s*\$?([\d,\.]+)", file_content) or \
-                            re.search(r"Total Federal Tax:?\s*\$?([\d,\.]+)", file_content)
-        if federal_tax_match:
-            result["federal_taxes_owed"] = float(federal_tax_match.group(1).replace(",", ""))
-        
-        # Extract state tax
-        state_tax_match = re.search(r"State Tax:?\s*\$?([\d,\.]+)", file_content) or \
-                          re.search(r"Total State Tax:?\s*\$?([\d,\.]+)", file_content)
-        if state_tax_match:
-            result["region_taxes_owed"] = float(state_tax_match.group(1).replace(",", ""))
-        
-        # Extract FICA taxes
-        fica_tax_match = re.search(r"FICA Taxes:?\s*\$?([\d,\.]+)", file_content) or \
-                         re.search(r"Total FICA Taxes:?\s*\$?([\d,\.]+)", file_content)
-        if fica_tax_match:
-            result["fica_total"] = float(fica_tax_match.group(1).replace(",", ""))
-        
-        # Extract total tax liability
-        total_tax_match = re.search(r"Total Tax Liability:?\s*\$?([\d,\.]+)", file_content)
-        if total_tax_match:
-            result["total_taxes_owed"] = float(total_tax_match.group(1).replace(",", ""))
+        for key, patterns in _BASELINE_AMOUNT_PATTERNS:
+            match = next((m for m in (pattern.search(file_content) for pattern in patterns) if m), None)
+            amount = parse_money(match.group(1)) if match else None
+            if amount is not None:
+                amounts[key] = amount
+                result[key] = float(amount)
         
         # Extract effective tax rate
-        effective_rate_match = re.search(r"Effective Tax Rate:?\s*([\d\.]+)%", file_content)
+        effective_rate_match = _EFFECTIVE_RATE_PATTERN.search(file_content)
         if effective_rate_match:
-            result["total_effective_tax_rate"] = float(effective_rate_match.group(1)) / 100  # Convert percentage to decimal
+            result["total_effective_tax_rate"] = float(parse_percent(effective_rate_match.group(1)) / 100)  # Convert percentage to decimal
+        
+        # Derived figures are computed on the exact amounts, not the floats
+        income = amounts.get("income", 0)
+        total_taxes = amounts.get("total_taxes_owed", 0)
+        federal_taxes = amounts.get("federal_taxes_owed", 0)
         
         # Calculate income after tax (if we have both income and total tax)
-        if result["income"] > 0 and result["total_taxes_owed"] > 0:
-            result["income_after_tax"] = result["income"] - result["total_taxes_owed"]
+        if income > 0 and total_taxes > 0:
+            result["income_after_tax"] = float(income - total_taxes)
         
         # Calculate federal effective rate if we have federal taxes and income
-        if result["federal_taxes_owed"] > 0 and result["income"] > 0:
-            result["federal_effective_rate"] = result["federal_taxes_owed"] / result["income"]
+        if federal_taxes > 0 and income > 0:
+            result["federal_effective_rate"] = float(federal_taxes / income)
             
     except Exception as e:
         logger.warning(f"Error extracting tax info from file: {e}")
@@ -1,16 +1,40 @@
-from llama_index.llms.openai import OpenAI
 from llama_index.core.agent.react.base import ReActAgent
 from llama_index.core.tools import FunctionTool
 import json
+import hashlib
 import logging
 import os 
+import sys
 from dotenv import load_dotenv
 load_dotenv()
-import re
+
+if __package__ in (None, ""):
+    # Allow running this file directly (python main.py) as well as via app.py
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.cost_ledger import BudgetExceeded
+from shared.llm_gateway import complete, finish_reason, get_llm, is_retryable
+from shared.prompts import BASELINE, STRATEGY_ANALYSIS, STRATEGY_SCORING, STRATEGY_SCORING_BATCH
+from shared.rate_limiter import estimate_tokens
+from shared.scenario_index import get_scenario_index
+from shared.scenario_model import ClientScenario, InvalidScenario
+from shared.strategy_selection import (
+    StrategyCatalog, client_label, pack_batches, parse_batch_scores, parse_scores, select_top,
+)
+from shared.storage import BASELINE_FILE_NAME, get_storage, make_namespace
+from shared.tracing import get_tracer, traced
+
+tracer = get_tracer(__name__)
+
+# What the analysis prompt needs of each strategy; IDs and score provenance stay out of it
+ANALYSIS_STRATEGY_FIELDS = ("title", "relevance_score", "details", "pitfalls")
+
+# Changes with the scoring prompt version so near-duplicate scenarios stop reusing old shortlists
+STRATEGY_SCORING_VERSION = STRATEGY_SCORING.prompt_id
 
 class Tax_Stratigies_Agent:
     def __init__(self, openai_api_key):
-        self.llm = OpenAI(api_key=openai_api_key, model="gpt-4o-mini")
+        self.llm = get_llm("gpt-4o-mini", api_key=openai_api_key)
         self.tools = [
             FunctionTool.from_defaults(
                 fn=self.get_tax_strategies,
@@ -53,178 +77,268 @@ class Tax_Stratigies_Agent:
             logging.warning(f"Tax strategies file not found, will try to use: {self.strategies_file_path}")
         
         self._tax_strategies_content = None
+        self._tax_strategies_mtime = None
+        self._catalog = None
+        self._catalog_built_version = None
+        # Changes whenever tax_strategies.md does, so indexed shortlists of an old catalog aren't reused
+        self._catalog_version = "none"
 
     def _load_tax_strategies(self):
-        """Load tax strategies from the markdown file."""
-        if self._tax_strategies_content is None:
+        """Load tax strategies from the markdown file, re-reading it when its modification time changes."""
+        try:
+            mtime = os.path.getmtime(self.strategies_file_path)
+        except OSError:
+            mtime = None
+        if self._tax_strategies_content is None or mtime != self._tax_strategies_mtime:
+            self._tax_strategies_mtime = mtime
             try:
                 with open(self.strategies_file_path, "r", encoding="utf-8") as f:
                     self._tax_strategies_content = f.read()
                     logging.info(f"Successfully loaded tax strategies from {self.strategies_file_path}")
+                self._catalog_version = hashlib.sha256(self._tax_strategies_content.encode("utf-8")).hexdigest()[:16]
             except FileNotFoundError:
                 logging.error(f"Tax strategies file not found at {self.strategies_file_path}")
                 self._tax_strategies_content = "No tax strategies available."
+                self._catalog_version = "none"
                     
         return self._tax_strategies_content
 
-    def _parse_tax_strategies(self, content):
-        """Parse the markdown content to extract individual strategies with their pitfalls."""
-        strategies = {}
-        # Updated pattern to capture strategies and their pitfalls
-        strategy_pattern = r"### (Strategy \d+: .+?)\n(.*?)(?=### |$)"
-        matches = re.findall(strategy_pattern, content, re.DOTALL)
-        
-        for title, full_content in matches:
-            # Split content into main details and pitfalls
-            if "#### Common Pitfalls" in full_content:
-                parts = full_content.split("#### Common Pitfalls", 1)
-                main_details = parts[0].strip()
-                pitfalls = "#### Common Pitfalls" + parts[1].strip()
-            else:
-                main_details = full_content.strip()
-                pitfalls = ""
-            
-            strategies[title] = {
-                "details": main_details,
-                "pitfalls": pitfalls
-            }
-            
-        return strategies
-
-    def _clean_json_response(self, response_text):
-        """Clean a potential JSON string from markdown code blocks and other formatting."""
-        cleaned_text = response_text.strip()
-        
-        if cleaned_text.startswith("```json"):
-            cleaned_text = cleaned_text.split("```json", 1)[1]
-        elif cleaned_text.startswith("```"):
-            cleaned_text = cleaned_text.split("```", 1)[1]
-        
-        if "```" in cleaned_text:
-            cleaned_text = cleaned_text.split("```")[0]
-        
-        return cleaned_text.strip()
+    def _load_catalog(self):
+        """The parsed strategy catalog, rebuilt when the file's content hash changes."""
+        content = self._load_tax_strategies()
+        if self._catalog is None or self._catalog_built_version != self._catalog_version:
+            self._catalog = StrategyCatalog.from_markdown(content)
+            self._catalog_built_version = self._catalog_version
+        return self._catalog
 
+    @traced("strategy_scoring")
     def get_tax_strategies(self, json_input):
         """
         Tool 1: Identify top 3 applicable tax strategies based on client data.
         
         Args:
-            json_input (str): JSON string containing client tax information
+            json_input (ClientScenario, dict or str): Client tax information
             
         Returns:
             list: List of top 3 applicable tax strategies with details and pitfalls
         """
-        tax_strategies_content = self._load_tax_strategies()
-        parsed_strategies = self._parse_tax_strategies(tax_strategies_content)
+        catalog = self._load_catalog()
         
         try:
-            if isinstance(json_input, str):
-                client_data = json.loads(json_input)
-            else:
-                client_data = json_input
-        except json.JSONDecodeError:
+            scenario = ClientScenario.parse(json_input)
+        except InvalidScenario:
             return []
         
-        if not parsed_strategies:
+        if not catalog:
             logging.warning("No tax strategies loaded from file")
             return []
         
-        prompt = f"""
-        You are a tax strategy expert. Based on the client's tax information, identify the most relevant tax strategies.
+        return [strategy.to_dict() for strategy in self.select_strategies(scenario, catalog)]
+
+    def select_strategies(self, scenario, catalog):
+        """
+        Score the catalog for a client and keep the most relevant strategies.
         
-        Client Tax Information:
-        {json.dumps(client_data, indent=2)}
+        Args:
+            scenario (ClientScenario): Client tax information
+            catalog (StrategyCatalog): Strategies to choose from
+            
+        Returns:
+            list: ScoredStrategy records, best first
+        """
+        # Relevance depends on the client's situation, not the exact figures, so a
+        # near-duplicate whose only differences are small amount changes reuses the
+        # earlier shortlist; apply_tax_strategies still recalculates with this client's numbers
+        index = get_scenario_index()
+        version = f"{STRATEGY_SCORING_VERSION}-{self._catalog_version}"
+        if index is not None:
+            reused = self._reused_shortlist(index, scenario, catalog, version)
+            if reused is not None:
+                return reused
+        
+        strategies = self._score_strategies(scenario, catalog)
+        if index is not None and strategies:
+            self._index_shortlist(index, scenario, strategies, version)
+        return strategies
+
+    @traced("strategy_scoring")
+    def get_tax_strategies_batch(self, json_inputs):
+        """
+        Identify the top 3 strategies for many clients, scoring them in batched requests.
         
-        Available Tax Strategies (titles only):
-        {json.dumps(list(parsed_strategies.keys()), indent=2)}
+        Args:
+            json_inputs (list): Client tax information per client (ClientScenario, dict or str)
+            
+        Returns:
+            list: One list of strategy dicts per input, as get_tax_strategies returns;
+            empty for inputs that are not valid client JSON
+        """
+        catalog = self._load_catalog()
+        scenarios = []
+        for json_input in json_inputs:
+            try:
+                scenarios.append(ClientScenario.parse(json_input))
+            except InvalidScenario:
+                scenarios.append(None)
         
-        For each strategy, evaluate its relevance to this client's situation on a scale of 1-10.
-        Return your answer as a JSON object with strategy titles as keys and relevance scores as values.
-        Example:
-        {{
-            "Strategy 1: New Side Business and Potential Deductions": 8,
-            "Strategy 2: Converting a Primary Residence to a Rental Property": 3
-        }}
+        if not catalog:
+            logging.warning("No tax strategies loaded from file")
+            return [[] for _ in scenarios]
         
-        Include only strategies with a relevance score of 5 or higher.
+        selected = iter(self.select_strategies_batch([scenario for scenario in scenarios if scenario is not None], catalog))
+        return [
+            [strategy.to_dict() for strategy in next(selected)] if scenario is not None else []
+            for scenario in scenarios
+        ]
+
+    def select_strategies_batch(self, scenarios, catalog):
         """
+        Score the catalog for many clients, several clients per LLM request.
         
-        response = self.llm.complete(prompt)
-        cleaned_response = self._clean_json_response(response.text)
+        The catalog is sent once per request, followed by a compact summary of
+        each client. Duplicate scenarios are scored once and near-duplicates
+        reuse indexed shortlists, as in select_strategies.
         
-        try:
-            scored_strategies = json.loads(cleaned_response)
-            sorted_strategies = {k: v for k, v in sorted(scored_strategies.items(), key=lambda item: item[1], reverse=True)}
-            top_strategies = {k: v for k, v in sorted_strategies.items() if v >= 5}
-            
-            # Limit to top 3 strategies and include pitfalls
-            strategies_with_details = []
-            count = 0
-            for strategy_title in top_strategies.keys():
-                if count >= 3:
-                    break
-                if strategy_title in parsed_strategies:
-                    strategy_data = parsed_strategies[strategy_title]
-                    strategies_with_details.append({
-                        "title": strategy_title,
-                        "relevance_score": top_strategies[strategy_title],
-                        "details": strategy_data["details"],
-                        "pitfalls": strategy_data["pitfalls"]
-                    })
-                    count += 1
-            
-            return strategies_with_details
+        Args:
+            scenarios (list): ClientScenario per client
+            catalog (StrategyCatalog): Strategies to choose from
             
-        except json.JSONDecodeError:
-            logging.error(f"Failed to parse JSON from response: {response.text}")            
-            # Try extracting JSON pattern
+        Returns:
+            list: ScoredStrategy records per client, best first, in input order
+        """
+        index = get_scenario_index()
+        version = f"{STRATEGY_SCORING_VERSION}-{self._catalog_version}"
+        shortlists, pending = {}, {}
+        for scenario in scenarios:
+            if scenario.digest in shortlists or scenario.digest in pending:
+                continue
+            reused = self._reused_shortlist(index, scenario, catalog, version) if index is not None else None
+            if reused is not None:
+                shortlists[scenario.digest] = reused
+            else:
+                pending[scenario.digest] = scenario
+        
+        if pending:
+            scored = {}
+            batch_scenarios = list(pending.values())
+            summaries = [scenario.summary() for scenario in batch_scenarios]
+            prefix_tokens = estimate_tokens(STRATEGY_SCORING_BATCH.prefix(catalog=catalog.listing()))
+            for batch in pack_batches(summaries, catalog, prefix_tokens):
+                self._score_batch([batch_scenarios[position] for position in batch],
+                                  [summaries[position] for position in batch], catalog, scored)
+            for digest, strategies in scored.items():
+                shortlists[digest] = strategies
+                if index is not None and strategies:
+                    self._index_shortlist(index, pending[digest], strategies, version)
+        
+        return [shortlists.get(scenario.digest, []) for scenario in scenarios]
+
+    def _score_batch(self, scenarios, summaries, catalog, results):
+        """
+        Score one batch of clients into results ({digest: strategies}).
+        
+        Clients missing from the answer (output cut off at the token limit, or
+        skipped by the model) are split in two and retried; a single client
+        falls back to the single-client prompt.
+        """
+        if len(scenarios) == 1:
+            results[scenarios[0].digest] = self._score_strategies(scenarios[0], catalog)
+            return
+        
+        client_ids = [client_label(position) for position in range(len(scenarios))]
+        prompt = STRATEGY_SCORING_BATCH.render(
+            catalog=catalog.listing(),
+            clients="\n".join(f"{client_id}: {summary}" for client_id, summary in zip(client_ids, summaries)),
+        )
+        with tracer.start_as_current_span("strategy_scoring_batch", {"batch.clients": len(scenarios)}) as span:
             try:
-                json_pattern = r'\{[\s\S]*\}'
-                match = re.search(json_pattern, response.text)
-                if match:
-                    json_text = match.group(0)
-                    scored_strategies = json.loads(json_text)
-                    sorted_strategies = {k: v for k, v in sorted(scored_strategies.items(), key=lambda item: item[1], reverse=True)}
-                    top_strategies = {k: v for k, v in sorted_strategies.items() if v >= 5}
-                    
-                    strategies_with_details = []
-                    count = 0
-                    for strategy_title in top_strategies.keys():
-                        if count >= 3:
-                            break
-                        if strategy_title in parsed_strategies:
-                            strategies_with_details.append({
-                                "title": strategy_title,
-                                "relevance_score": top_strategies[strategy_title],
-                                "details": parsed_strategies[strategy_title]
-                            })
-                            count += 1
-                    
-                    return strategies_with_details
-            except:
-                pass
-            
-            logging.error("Could not parse strategies, returning empty list")
+                response = complete(self.llm, prompt, call_site="strategy_scoring_batch")
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                if is_retryable(e):
+                    raise
+                # Usually a request over the context length; smaller batches may fit
+                logging.warning(f"Batched scoring of {len(scenarios)} clients failed ({type(e).__name__}: {str(e)})")
+                scores, truncated = {}, False
+            else:
+                scores = parse_batch_scores(response.text, catalog, client_ids)
+                truncated = finish_reason(response) == "length"
+            span.set_attributes({"batch.scored": len(scores), "batch.truncated": truncated})
+        
+        missing = []
+        for client_id, scenario, summary in zip(client_ids, scenarios, summaries):
+            if client_id in scores:
+                results[scenario.digest] = select_top(scores[client_id], catalog)
+            else:
+                missing.append((scenario, summary))
+        if not missing:
+            return
+        
+        logging.warning(
+            f"{len(missing)} of {len(scenarios)} clients missing from batched scores"
+            f"{' (output truncated)' if truncated else ''}; retrying them in smaller batches"
+        )
+        half = (len(missing) + 1) // 2
+        for part in (missing[:half], missing[half:]):
+            if part:
+                self._score_batch([scenario for scenario, _ in part], [summary for _, summary in part], catalog, results)
+
+    def _reused_shortlist(self, index, scenario, catalog, version):
+        """Shortlist of an indexed near-duplicate whose only differences are small amount changes, or None."""
+        try:
+            match = index.find_similar_scenario("strategies", scenario.data, version=version)
+        except Exception as e:
+            logging.warning(f"Scenario index lookup failed: {str(e)}")
+            return None
+        if not match or not match["tweaks_only"]:
+            return None
+        logging.info(
+            f"Reusing strategy shortlist of a similar scenario (similarity {match['similarity']:.2f}, "
+            f"changed fields: {', '.join(match['changed_fields']) or 'none'})"
+        )
+        scores = {entry["id"]: entry["relevance_score"] for entry in match["payload"]}
+        return select_top(scores, catalog, source="index", similarity=round(match["similarity"], 3))
+
+    def _index_shortlist(self, index, scenario, strategies, version):
+        try:
+            index.add_scenario(
+                "strategies", scenario.data,
+                [{"id": strategy.strategy_id, "relevance_score": strategy.relevance_score} for strategy in strategies],
+                version=version,
+            )
+        except Exception as e:
+            logging.warning(f"Could not index strategy shortlist: {str(e)}")
+
+    def _score_strategies(self, scenario, catalog):
+        """Ask the LLM to score the catalog for this client and keep the top 3."""
+        # The catalog goes in the static prefix, so only the client data differs between calls
+        prompt = STRATEGY_SCORING.render(catalog=catalog.listing(), client_json=scenario.to_json(indent=2))
+        response = complete(self.llm, prompt, call_site="strategy_scoring")
+        
+        try:
+            scores = parse_scores(response.text, catalog)
+        except ValueError:
+            logging.error(f"Could not parse strategy scores, returning empty list. Response: {response.text}")
             return []
+        return select_top(scores, catalog)
 
-    def apply_tax_strategies(self, json_input, strategies_list):
+    def apply_tax_strategies(self, json_input, strategies_list, session_id=None):
         """
         Tool 2: Apply selected tax strategies and calculate estimated taxes using AI.
         
         Args:
-            json_input (str): JSON string containing client tax information
+            json_input (ClientScenario, dict or str): Client tax information
             strategies_list (list): List of applicable tax strategies (max 3)
+            session_id (str, optional): Session whose baseline file is written. Without
+                one the shared base_tax_calculation.txt in the project root is used.
             
         Returns:
             str: Human-readable tax strategy analysis with tax calculations
         """
         try:
-            if isinstance(json_input, str):
-                client_data = json.loads(json_input)
-            else:
-                client_data = json_input
-        except json.JSONDecodeError:
+            scenario = ClientScenario.parse(json_input)
+        except InvalidScenario:
             return "Error: Invalid JSON input."
         
         if not isinstance(strategies_list, list):
@@ -238,38 +352,24 @@ class Tax_Stratigies_Agent:
             strategies_list = strategies_list[:3]
 
         # First, calculate and store the baseline tax calculation
-        baseline_prompt = f"""
-        You are a professional tax advisor. Calculate the detailed baseline tax calculation for this client.
-        
-        Client Tax Information:
-        {json.dumps(client_data, indent=2)}
-        
-        Provide a comprehensive breakdown including:
-        1. Total income calculation from all sources
-        2. Business expenses and deductions
-        3. Adjusted Gross Income (AGI)
-        4. Federal income tax calculation with tax brackets
-        5. State tax calculation (if applicable)
-        6. FICA taxes (Social Security and Medicare)
-        7. Total tax liability
-        8. Effective tax rate
-        
-        Show all calculations step by step with formulas and specific dollar amounts.
-        Format this as a detailed calculation showing all steps and formulas used.
-        """
+        baseline_prompt = BASELINE.render(client_json=scenario.to_json(indent=2))
         
-        baseline_response = self.llm.complete(baseline_prompt)
+        with tracer.start_as_current_span("baseline"):
+            baseline_response = complete(self.llm, baseline_prompt, call_site="baseline")
         baseline_calculation = baseline_response.text
         
-        # Store baseline calculation in file
+        # Store baseline calculation in file - atomically, and per session when we
+        # know the session so concurrent users don't overwrite each other
         try:
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            base_tax_file_path = os.path.join(os.path.dirname(base_dir), "base_tax_calculation.txt")
-            
-            with open(base_tax_file_path, "w", encoding="utf-8") as f:
-                f.write("BASELINE TAX CALCULATION\n")
-                f.write("=" * 50 + "\n\n")
-                f.write(baseline_calculation)
+            base_tax_file_path = self.baseline_path(session_id)
+            baseline_text = "BASELINE TAX CALCULATION\n" + "=" * 50 + "\n\n" + baseline_calculation
+            storage = get_storage()
+            if session_id:
+                storage.write_text(base_tax_file_path, baseline_text, namespace=make_namespace(session_id), kind="baseline")
+            else:
+                with storage.atomic_path(base_tax_file_path) as temp_path:
+                    with open(temp_path, "w", encoding="utf-8") as f:
+                        f.write(baseline_text)
             
             logging.info(f"Baseline tax calculation saved to {base_tax_file_path}")
             
@@ -277,127 +377,69 @@ class Tax_Stratigies_Agent:
             logging.error(f"Error saving baseline tax calculation: {str(e)}")
             
         # Now create the main tax strategy analysis prompt (without baseline section)
-        prompt = f"""
-        You are a professional tax advisor with extensive knowledge of tax calculations and optimization strategies. 
-        Based on the client's financial information and the selected tax strategies, provide a tax strategy analysis.
-        
-        Client Tax Information:
-        {json.dumps(client_data, indent=2)}
-        Base line tax calculation (For Reference Only):
-        {baseline_calculation}
-        Selected Tax Strategies (Top {len(strategies_list)} most relevant):
-        {json.dumps(strategies_list, indent=2)}
-        
-        Your task is to:
-        1. For each strategy, calculate the tax impact and savings compared to baseline
-        2. Provide detailed implementation steps
-        3. Include common pitfalls to avoid for each strategy
-        4. Make realistic assumptions about tax brackets, deductions, and credits
-        
-        Use these guidelines for calculations:
-        - For US taxes, consider federal income tax, state tax (if applicable), and FICA taxes
-        - Apply appropriate tax brackets based on filing status and income level
-        - Consider standard vs itemized deductions
-        - Factor in applicable tax credits
-        - For business income, consider self-employment tax implications
-        
-        IMPORTANT: Format your response as human-readable text that could be directly shared with a client.
-        Include clear headings, specific dollar amounts, and step-by-step explanations for each strategy.
-        DO NOT respond with JSON - respond with well-formatted text only.
-        DO NOT include the baseline tax calculation section in your response.
-        
-        Structure your response like this:
-        
-        TAX STRATEGY ANALYSIS
-        
-        ## Client Overview
-        - Filing Status: [Extract from client data]
-        - Total Annual Income: $[Calculate total income]
-        - Primary Income Sources: [List main sources]
-        - Dependents: [Number and ages if applicable]
-        
-        ### Strategy 1: [Strategy Title]
-        - **Relevance Score**: [Score]/10
-        - **How it applies**: [Detailed explanation based on client situation]
-        - **Tax Calculation with Strategy**:
-          - Federal Income Tax: $[Adjusted amount]
-          - State Tax: $[Adjusted amount] 
-          - FICA Taxes: $[Adjusted amount]
-          - Total Tax with Strategy: $[New total]
-        - **Estimated Tax Savings**: $[Baseline - Strategy total]
-        - **Implementation Steps**:
-          1. [Specific actionable step]
-          2. [Specific actionable step]
-          3. [Additional steps as needed]
-        - **Required Documentation**: [List any forms or documents needed]
-        - **Timing Considerations**: [When to implement]
-        - **Common Pitfalls to Avoid**:
-          [Include the specific pitfalls from the strategy data provided above]
-        
-        ### Strategy 2: [Strategy Title]
-        [Same format as Strategy 1, including the Common Pitfalls section]
-        
-        ### Strategy 3: [Strategy Title]
-        [Same format as Strategy 1, including the Common Pitfalls section]
-        
-        ## Summary and Recommendations
-        
-        ### Strategy Comparison
-        | Strategy | Tax Savings | Implementation Difficulty | Timeline |
-        |----------|-------------|---------------------------|----------|
-        | [Strategy 1] | $[Amount] | [Easy/Medium/Hard] | [Timeline] |
-        | [Strategy 2] | $[Amount] | [Easy/Medium/Hard] | [Timeline] |
-        | [Strategy 3] | $[Amount] | [Easy/Medium/Hard] | [Timeline] |
-        
-        ### Best Strategy Recommendation
-        - **Recommended Strategy**: [Name of strategy with best savings/effort ratio]
-        - **Expected Annual Savings**: $[Amount]
-        - **Why this strategy**: [Explanation of why it's best for this client]
-        
-        ### Combined Strategy Potential
-        - **If multiple strategies can be combined**: $[Total potential savings]
-        - **Overall Recommendation**: [Strategic advice for the client]
-        
-        ### Next Steps
-        1. [Immediate action item]
-        2. [Follow-up action item]
-        3. [Long-term planning item]
-        
-        **Note**: These calculations are estimates based on current tax laws and the information provided.
-        """
+        prompt = STRATEGY_ANALYSIS.render(
+            client_json=scenario.to_json(indent=2),
+            baseline=baseline_calculation,
+            strategy_count=len(strategies_list),
+            strategies_json=json.dumps(
+                [
+                    {key: strategy[key] for key in ANALYSIS_STRATEGY_FIELDS if key in strategy}
+                    if isinstance(strategy, dict) else strategy
+                    for strategy in strategies_list
+                ],
+                indent=2,
+            ),
+        )
         
-        response = self.llm.complete(prompt)
+        with tracer.start_as_current_span("analysis"):
+            response = complete(self.llm, prompt, call_site="analysis")
         return response.text
 
-    def process_tax_scenario(self, client_json):
+    def baseline_path(self, session_id=None):
+        """
+        Path of the baseline tax calculation written by apply_tax_strategies.
+        
+        Args:
+            session_id (str, optional): Session ID; None means the shared project-root file
+            
+        Returns:
+            str: Path to the baseline file
+        """
+        if session_id:
+            return str(get_storage().baseline_path(make_namespace(session_id)))
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(os.path.dirname(base_dir), BASELINE_FILE_NAME)
+
+    @traced("strategies")
+    def process_tax_scenario(self, client_json, session_id=None):
         """
         Process a client's tax scenario to identify and apply appropriate tax strategies.
         
         Args:
-            client_json (str or dict): Client's tax information as JSON string or dictionary
+            client_json (ClientScenario, dict or str): Client's tax information
+            session_id (str, optional): Session ID used to namespace the baseline file
             
         Returns:
-            dict: Tax strategy analysis with applicable strategies and human-readable analysis
+            dict: Tax strategy analysis with applicable strategies, human-readable analysis
+            and the path of the baseline calculation
         """
         try:
-            if isinstance(client_json, dict):
-                client_json_str = json.dumps(client_json)
-            else:
-                client_json_str = client_json
-                json.loads(client_json_str)  # Validate JSON
+            # Parsed once here; both tools receive the same scenario object
+            scenario = ClientScenario.parse(client_json)
                 
             # Step 1: Identify applicable tax strategies
-            strategies_result = self.get_tax_strategies(client_json_str)
+            strategies_result = self.get_tax_strategies(scenario)
             
             if not isinstance(strategies_result, list):
                 return f"Error: Expected list of strategies but got {type(strategies_result)}"
             
             # Step 2: Apply strategies and calculate tax estimates
-            human_readable_analysis = self.apply_tax_strategies(client_json_str, strategies_result)
+            human_readable_analysis = self.apply_tax_strategies(scenario, strategies_result, session_id=session_id)
             
             return {
                 "applicable_strategies": strategies_result,
-                "tax_analysis": human_readable_analysis
+                "tax_analysis": human_readable_analysis,
+                "baseline_path": self.baseline_path(session_id)
             }
             
         except Exception as e:
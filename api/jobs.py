@@ -0,0 +1,137 @@
+"""
+Background jobs for the API.
+
+Long-running pipeline stages (question generation, validation, strategies,
+comparison) run on a worker pool; handlers return a job ID at once and
+clients poll GET /v1/jobs/<id> or stream GET /v1/jobs/<id>/events.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+API_JOB_WORKERS = int(os.getenv("API_JOB_WORKERS", "16"))
+# Finished jobs are kept this long for polling
+API_JOB_TTL_SECONDS = int(os.getenv("API_JOB_TTL_SECONDS", "3600"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class Job:
+    """A unit of background work and its outcome."""
+
+    def __init__(self, kind, session_id):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.session_id = session_id
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Bumped on every state change so SSE streams can detect updates
+        self.version = 0
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "session_id": self.session_id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Runs jobs on a thread pool and keeps their state in memory."""
+
+    def __init__(self, workers=API_JOB_WORKERS, ttl_seconds=API_JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, session_id, fn):
+        """
+        Queue fn() as a background job.
+
+        Args:
+            kind (str): Job type, e.g. "strategies"
+            session_id (str): Session the job belongs to
+            fn (callable): Work to run; its return value becomes the job result.
+                A dict with an "error" key marks the job as failed.
+
+        Returns:
+            Job: The queued job
+        """
+        job = Job(kind, session_id)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _update(self, job, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.version += 1
+
+    def _run(self, job, fn):
+        self._update(job, status=JOB_RUNNING, started_at=time.time())
+        try:
+            result = fn()
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+            self._update(job, status=JOB_FAILED, error=str(e), finished_at=time.time())
+            return
+        if isinstance(result, dict) and "error" in result:
+            self._update(job, status=JOB_FAILED, error=str(result["error"]), result=result, finished_at=time.time())
+        else:
+            self._update(job, status=JOB_SUCCEEDED, result=result, finished_at=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def snapshot(self, job_id):
+        """
+        Consistent copy of a job's state.
+
+        Returns:
+            tuple: (version, job dict), or (None, None) for unknown jobs
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None, None
+            return job.version, job.to_dict()
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == JOB_QUEUED)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        for job_id in [key for key, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,332 @@
+"""
+Headless HTTP API for the tax pipeline.
+
+    python -m api.server --port 8700
+
+Endpoints (JSON in and out; long stages return 202 with a job):
+
+    POST   /v1/sessions                          {"client_id"?, "priority"?: "interactive"|"batch"}
+    GET    /v1/sessions/<id>
+    DELETE /v1/sessions/<id>
+    POST   /v1/sessions/<id>/scenario            {"scenario"}                    -> job
+    POST   /v1/sessions/<id>/answers             {"answers": [...]} | {"answer"} -> job
+    GET    /v1/sessions/<id>/json                structured client JSON
+    POST   /v1/sessions/<id>/strategies                                           -> job
+    POST   /v1/sessions/<id>/comparison          multipart files, or {"documents": [{"name", "content_base64"}]} -> job
+    GET    /v1/sessions/<id>/comparison/report   PDF
+    GET    /v1/jobs/<id>                         poll
+    GET    /v1/jobs/<id>/events                  Server-Sent Events until the job finishes
+    GET    /healthz, /metrics
+
+Set API_TOKEN to require "Authorization: Bearer <token>".
+"""
+import os
+import sys
+import hmac
+import json
+import base64
+import asyncio
+import logging
+import argparse
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tornado.web
+import tornado.httpserver
+from tornado.iostream import StreamClosedError
+from dotenv import load_dotenv
+
+from api.jobs import JobManager
+from api.sessions import SessionManager
+from shared.metrics import Gauge, REGISTRY, render_metrics
+
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8700"))
+API_TOKEN = os.getenv("API_TOKEN")
+API_MAX_UPLOAD_BYTES = int(os.getenv("API_MAX_UPLOAD_MB", "25")) * 1024 * 1024
+# How often an SSE stream checks its job, and how often it sends a keep-alive comment
+SSE_POLL_SECONDS = 0.25
+SSE_HEARTBEAT_SECONDS = 15
+
+_job_managers = []
+REGISTRY.register(Gauge(
+    "api_job_queue_depth", "API jobs waiting for a worker",
+    callback=lambda: [({}, sum(jobs.queue_depth() for jobs in _job_managers))],
+))
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    @property
+    def sessions(self):
+        return self.application.settings["sessions"]
+
+    @property
+    def jobs(self):
+        return self.application.settings["jobs"]
+
+    def prepare(self):
+        if API_TOKEN and self.request.path not in ("/healthz",):
+            # Constant-time comparison, so response timing doesn't leak the token
+            if not hmac.compare_digest(self.request.headers.get("Authorization", "").encode("utf-8"),
+                                       f"Bearer {API_TOKEN}".encode("utf-8")):
+                raise tornado.web.HTTPError(401, reason="Missing or invalid API token")
+
+    def write_json(self, data, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps(data, default=str))
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps({"error": self._reason}))
+
+    def json_body(self):
+        if not self.request.body:
+            return {}
+        try:
+            body = json.loads(self.request.body)
+        except (ValueError, UnicodeDecodeError):
+            raise tornado.web.HTTPError(400, reason="Request body must be JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Request body must be a JSON object")
+        return body
+
+    def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise tornado.web.HTTPError(404, reason=f"Unknown session {session_id}")
+        return session
+
+    def submit_job(self, session, kind, fn):
+        job = self.jobs.submit(kind, session.id, lambda: session.run(fn))
+        self.set_header("Location", f"/v1/jobs/{job.id}")
+        self.write_json({"job_id": job.id, "status": job.status, "events": f"/v1/jobs/{job.id}/events"}, status=202)
+
+
+class SessionsHandler(BaseHandler):
+    def post(self):
+        body = self.json_body()
+        priority = body.get("priority", "interactive")
+        if priority not in ("interactive", "batch"):
+            raise tornado.web.HTTPError(400, reason="priority must be interactive or batch")
+        session = self.sessions.create(client_id=body.get("client_id"), priority=priority)
+        self.write_json(session.to_dict(), status=201)
+
+
+class SessionHandler(BaseHandler):
+    def get(self, session_id):
+        self.write_json(self.get_session(session_id).to_dict())
+
+    def delete(self, session_id):
+        if not self.sessions.delete(session_id):
+            raise tornado.web.HTTPError(404, reason=f"Unknown session {session_id}")
+        self.set_status(204)
+        self.finish()
+
+
+class ScenarioHandler(BaseHandler):
+    def post(self, session_id):
+        session = self.get_session(session_id)
+        scenario = self.json_body().get("scenario")
+        if not isinstance(scenario, str) or not scenario.strip():
+            raise tornado.web.HTTPError(400, reason="scenario is required")
+        self.submit_job(session, "scenario", lambda: session.submit_scenario(scenario.strip()))
+
+
+class AnswersHandler(BaseHandler):
+    def post(self, session_id):
+        session = self.get_session(session_id)
+        body = self.json_body()
+        answers, answer = body.get("answers"), body.get("answer")
+        if answers is not None and not (isinstance(answers, list) and all(isinstance(a, str) for a in answers)):
+            raise tornado.web.HTTPError(400, reason="answers must be a list of strings")
+        if answers is None and not isinstance(answer, str):
+            raise tornado.web.HTTPError(400, reason="answers or answer is required")
+        if session.scenario is None:
+            raise tornado.web.HTTPError(409, reason="Submit a scenario first")
+        self.submit_job(session, "answers", lambda: session.submit_answers(answers=answers, answer=answer))
+
+
+class ClientJsonHandler(BaseHandler):
+    def get(self, session_id):
+        session = self.get_session(session_id)
+        if session.client_json is None:
+            raise tornado.web.HTTPError(409, reason="Structured JSON is not available yet")
+        self.write_json(session.client_json)
+
+
+class StrategiesHandler(BaseHandler):
+    def post(self, session_id):
+        session = self.get_session(session_id)
+        if session.client_json is None:
+            raise tornado.web.HTTPError(409, reason="Structured JSON is not available yet")
+        strategies_agent = self.sessions.strategies_agent
+        self.submit_job(session, "strategies", lambda: session.run_strategies(strategies_agent))
+
+
+class ComparisonHandler(BaseHandler):
+    def _documents(self):
+        files = [f for field in self.request.files.values() for f in field]
+        if files:
+            return [(f["filename"], f["body"]) for f in files], None
+        body = self.json_body()
+        documents = []
+        for document in body.get("documents") or []:
+            try:
+                documents.append((document["name"], base64.b64decode(document["content_base64"])))
+            except (KeyError, TypeError, ValueError):
+                raise tornado.web.HTTPError(400, reason="documents need name and base64 content_base64")
+        return documents, body.get("client")
+
+    def post(self, session_id):
+        session = self.get_session(session_id)
+        if session.strategies is None:
+            raise tornado.web.HTTPError(409, reason="Run strategies first")
+        documents, client_data = self._documents()
+        if not documents:
+            raise tornado.web.HTTPError(400, reason="At least one document is required")
+        if client_data is None and self.get_argument("client", None):
+            try:
+                client_data = json.loads(self.get_argument("client"))
+            except ValueError:
+                raise tornado.web.HTTPError(400, reason="client must be JSON")
+            if not isinstance(client_data, dict):
+                raise tornado.web.HTTPError(400, reason="client must be a JSON object")
+        self.submit_job(session, "comparison", lambda: session.run_comparison(documents, client_data))
+
+
+class ComparisonReportHandler(BaseHandler):
+    def get(self, session_id):
+        session = self.get_session(session_id)
+        report_path = (session.comparison or {}).get("report_path")
+        if not report_path or not os.path.exists(report_path):
+            raise tornado.web.HTTPError(404, reason="No comparison report for this session")
+        self.set_header("Content-Type", "application/pdf")
+        self.set_header("Content-Disposition", f'attachment; filename="{os.path.basename(report_path)}"')
+        with open(report_path, "rb") as f:
+            self.finish(f.read())
+
+
+class JobHandler(BaseHandler):
+    def get(self, job_id):
+        _, job = self.jobs.snapshot(job_id)
+        if job is None:
+            raise tornado.web.HTTPError(404, reason=f"Unknown job {job_id}")
+        self.write_json(job)
+
+
+class JobEventsHandler(BaseHandler):
+    """Streams the job as an SSE "status" event on every change, ending with "done"."""
+
+    async def get(self, job_id):
+        version, job = self.jobs.snapshot(job_id)
+        if job is None:
+            raise tornado.web.HTTPError(404, reason=f"Unknown job {job_id}")
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("X-Accel-Buffering", "no")
+
+        sent_version = None
+        idle = 0.0
+        try:
+            while True:
+                if version != sent_version:
+                    event = "done" if job["status"] in ("succeeded", "failed") else "status"
+                    self.write(f"event: {event}\ndata: {json.dumps(job, default=str)}\n\n")
+                    await self.flush()
+                    sent_version, idle = version, 0.0
+                    if event == "done":
+                        break
+                elif idle >= SSE_HEARTBEAT_SECONDS:
+                    self.write(": keep-alive\n\n")
+                    await self.flush()
+                    idle = 0.0
+                await asyncio.sleep(SSE_POLL_SECONDS)
+                idle += SSE_POLL_SECONDS
+                version, job = self.jobs.snapshot(job_id)
+                if job is None:
+                    break
+        except StreamClosedError:
+            return
+        self.finish()
+
+
+class HealthHandler(BaseHandler):
+    def get(self):
+        self.write_json({"status": "ok", "sessions": len(self.sessions), "queued_jobs": self.jobs.queue_depth()})
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(render_metrics())
+
+
+def make_app(api_key=None, sessions=None, jobs=None):
+    """
+    Build the tornado application.
+
+    Args:
+        api_key (str, optional): OpenAI key for the agents; defaults to OPENAI_API_KEY
+        sessions (SessionManager, optional): Session registry
+        jobs (JobManager, optional): Background job runner
+
+    Returns:
+        tornado.web.Application: The API application
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OpenAI API key not found. Please check your .env file.")
+    sessions = sessions or SessionManager(api_key)
+    jobs = jobs or JobManager()
+    _job_managers.append(jobs)
+
+    session_path = r"/v1/sessions/([0-9a-f]+)"
+    return tornado.web.Application(
+        [
+            (r"/v1/sessions", SessionsHandler),
+            (session_path, SessionHandler),
+            (session_path + "/scenario", ScenarioHandler),
+            (session_path + "/answers", AnswersHandler),
+            (session_path + "/json", ClientJsonHandler),
+            (session_path + "/strategies", StrategiesHandler),
+            (session_path + "/comparison", ComparisonHandler),
+            (session_path + "/comparison/report", ComparisonReportHandler),
+            (r"/v1/jobs/([0-9a-f]+)", JobHandler),
+            (r"/v1/jobs/([0-9a-f]+)/events", JobEventsHandler),
+            (r"/healthz", HealthHandler),
+            (r"/metrics", MetricsHandler),
+        ],
+        sessions=sessions,
+        jobs=jobs,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless HTTP API for the tax pipeline")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    app = make_app()
+
+    async def serve():
+        server = tornado.httpserver.HTTPServer(app, max_body_size=API_MAX_UPLOAD_BYTES)
+        server.listen(args.port, args.host)
+        logger.info(f"API listening on http://{args.host}:{args.port}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        app.settings["jobs"].shutdown(wait=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+API sessions: one client conversation and its pipeline results.
+
+Each session owns its own ScenarioClarificationAgent (the agent keeps the
+conversation in instance state) and shares the stateless strategies agent.
+Stage methods run inside background jobs; a per-session lock keeps a
+session's stages in order while different sessions run in parallel.
+"""
+import os
+import io
+import time
+import uuid
+import logging
+import threading
+from contextlib import ExitStack
+
+from shared.cost_ledger import cost_scope
+from shared.metrics import touch_session
+from shared.rate_limiter import PRIORITY_BATCH, PRIORITY_INTERACTIVE, priority_scope
+from shared.scenario_model import ClientScenario, InvalidScenario
+from shared.storage import make_namespace
+from shared.tracing import session_trace
+
+logger = logging.getLogger(__name__)
+
+API_SESSION_TTL_SECONDS = int(os.getenv("API_SESSION_TTL_SECONDS", "86400"))
+# Highest question number recognised when splitting Agent 1's question list
+MAX_QUESTION_NUMBER = 30
+
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "batch": PRIORITY_BATCH}
+
+
+class SessionStateError(Exception):
+    """Raised when a stage is requested before the stages it depends on."""
+
+
+class NamedUpload(io.BytesIO):
+    """In-memory upload with the .name attribute the comparison code expects."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def parse_questions(response_text):
+    """Numbered questions from Agent 1's question list, as the app extracts them."""
+    lines = [line.strip() for line in response_text.split("\n")]
+    return [line for line in lines if line and any(line.startswith(str(i)) for i in range(1, MAX_QUESTION_NUMBER))]
+
+
+def parse_client_json(text):
+    """
+    Parse Agent 1's structured output, tolerating markdown code fences.
+
+    Raises:
+        InvalidScenario: If no JSON object can be recovered
+    """
+    return ClientScenario.parse(text).data
+
+
+class ApiSession:
+    """State of one API session and the pipeline stages that update it."""
+
+    def __init__(self, api_key, client_id=None, priority="interactive", session_id=None):
+        from agent1.main import ScenarioClarificationAgent
+
+        self.id = session_id or uuid.uuid4().hex
+        self.client_id = client_id
+        self.priority = PRIORITIES.get(priority, PRIORITY_INTERACTIVE)
+        self.agent = ScenarioClarificationAgent(openai_api_key=api_key)
+        self.scenario = None
+        self.questions = []
+        self.clarifications = []
+        self.status = "created"
+        self.client_json = None
+        self.strategies = None
+        self.comparison = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.lock = threading.Lock()
+
+    @property
+    def namespace(self):
+        return make_namespace(self.id, self.client_id)
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "client_id": self.client_id,
+            "status": self.status,
+            "scenario": self.scenario,
+            "questions": self.questions,
+            "clarifications": self.clarifications,
+            "has_client_json": self.client_json is not None,
+            "has_strategies": self.strategies is not None,
+            "has_comparison": self.comparison is not None,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def run(self, fn):
+        """
+        Run a stage with the session's trace, cost attribution and priority,
+        one stage at a time per session.
+        """
+        with ExitStack() as stack:
+            stack.enter_context(self.lock)
+            stack.enter_context(session_trace(self.id))
+            stack.enter_context(cost_scope(self.id, self.client_id))
+            stack.enter_context(priority_scope(self.priority))
+            touch_session(self.id)
+            try:
+                return fn()
+            finally:
+                self.updated_at = time.time()
+
+    def _apply_clarification(self, response):
+        if response["status"] == "complete":
+            try:
+                self.client_json = parse_client_json(response["response"])
+            except InvalidScenario:
+                return {"error": "Agent 1 returned structured data that is not valid JSON"}
+            self.status = "complete"
+            return {"status": "complete", "client_json": self.client_json}
+        if response["status"] == "needs_clarification":
+            self.clarifications.append(response["response"])
+            self.status = "needs_clarification"
+            return {"status": "needs_clarification", "question": response["response"]}
+        return {"error": response.get("response", "Clarification failed")}
+
+    # -- stages --------------------------------------------------------------
+
+    def submit_scenario(self, scenario):
+        """Start a fresh conversation and generate Agent 1's question list."""
+        self.agent.reset()
+        self.scenario = scenario
+        self.questions = []
+        self.clarifications = []
+        self.client_json = self.strategies = self.comparison = None
+
+        response = self.agent.clarify_and_structure(scenario)
+        if response["status"] == "needs_clarification":
+            self.questions = parse_questions(response["response"])
+            self.status = "questions"
+            return {"status": "questions", "questions": self.questions, "response": response["response"]}
+        return self._apply_clarification(response)
+
+    def submit_answers(self, answers=None, answer=None):
+        """
+        Answer the question list (answers, in question order) or the latest
+        follow-up question (answer).
+        """
+        if self.scenario is None:
+            raise SessionStateError("Submit a scenario first")
+        if answers is not None:
+            for index, text in enumerate(answers):
+                question = self.questions[index] if index < len(self.questions) else f"Question {index + 1}"
+                self.clarifications.extend([question, text])
+        elif answer is not None:
+            self.clarifications.append(answer)
+        else:
+            raise SessionStateError("Provide answers or answer")
+
+        response = self.agent.clarify_and_structure(self.scenario, self.clarifications)
+        return self._apply_clarification(response)
+
+    def run_strategies(self, strategies_agent):
+        if self.client_json is None:
+            raise SessionStateError("Structured JSON is not available yet")
+        result = strategies_agent.process_tax_scenario(self.client_json, session_id=self.id)
+        if not isinstance(result, dict):
+            return {"error": str(result)}
+        self.strategies = result
+        return {
+            "applicable_strategies": result["applicable_strategies"],
+            "tax_analysis": result["tax_analysis"],
+        }
+
+    def run_comparison(self, documents, client_data=None):
+        """
+        Compare uploaded prior-year documents with this session's baseline.
+
+        Args:
+            documents (list): (file name, bytes) pairs
+            client_data (dict, optional): Client name and tax year for the report
+        """
+        from agent2.utils.comparison_cache import cached_tax_comparison
+        from agent2.utils.tax_file_reader import read_tax_calculation_file
+
+        if self.strategies is None:
+            raise SessionStateError("Run strategies first; the comparison uses their baseline calculation")
+        baseline = read_tax_calculation_file(self.strategies["baseline_path"])
+        if "error" in baseline:
+            return baseline
+        uploads = [NamedUpload(name, data) for name, data in documents]
+        result = cached_tax_comparison(uploads, baseline, client_data, namespace=self.namespace)
+        if "error" not in result:
+            self.comparison = result
+        return result
+
+
+class SessionManager:
+    """In-memory registry of API sessions with idle expiry."""
+
+    def __init__(self, api_key, ttl_seconds=API_SESSION_TTL_SECONDS):
+        from agent3.main import Tax_Stratigies_Agent
+
+        self.api_key = api_key
+        self.ttl_seconds = ttl_seconds
+        self.strategies_agent = Tax_Stratigies_Agent(openai_api_key=api_key)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, client_id=None, priority="interactive"):
+        session = ApiSession(self.api_key, client_id=client_id, priority=priority)
+        with self._lock:
+            self._prune()
+            self._sessions[session.id] = session
+        logger.info(f"Created API session {session.id}")
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        for session_id in [key for key, session in self._sessions.items() if session.updated_at < cutoff]:
+            del self._sessions[session_id]
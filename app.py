@@ -2,10 +2,21 @@ import streamlit as st
 from agent1.main import ScenarioClarificationAgent
 import agent2.app
 from agent3.main import Tax_Stratigies_Agent
+from shared.storage import make_namespace
+from shared.cost_ledger import bind_scope
+from shared.metrics import ensure_metrics_server, touch_session
+from shared.tracing import bind_session
+from shared.job_queue import get_job_queue
+from shared.storage import get_storage
+from shared.worker_pool import warm_worker_pool
+from shared.session_store import SessionSync, get_session_store
+from shared.scenario_model import ClientScenario, InvalidScenario
 import os
+import re
 from dotenv import load_dotenv
-import json
 import io
+import uuid
+import time
 # Load environment variables
 load_dotenv()
 
@@ -17,6 +28,46 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Session state that is persisted so an interview survives restarts and replica changes
+PERSISTED_FIELDS = [
+    "conversation_history", "clarifications", "scenario_submitted", "user_scenario", "final_json",
+    "question_list", "current_stage", "all_questions", "switch_to_agent2", "agent2_json_payload",
+    "tax_strategies_processed", "tax_strategies_result", "tax_strategies_job_id", "agent1_state",
+]
+session_store = get_session_store()
+session_sync = SessionSync(session_store, PERSISTED_FIELDS) if session_store else None
+
+# Per-session ID used to namespace stored artifacts (baseline, reports). It is kept
+# in the URL (?sid=) so a reload, a restart or another replica resumes the session.
+if "session_id" not in st.session_state:
+    requested_id = st.query_params.get("sid", "")
+    if session_sync and re.fullmatch(r"[0-9a-f]{32}", requested_id) and session_sync.restore(st.session_state, requested_id):
+        st.session_state.session_id = requested_id
+    else:
+        st.session_state.session_id = uuid.uuid4().hex
+if st.query_params.get("sid") != st.session_state.session_id:
+    st.query_params["sid"] = st.session_state.session_id
+
+def session_value(field):
+    """Read a persisted field, loading it from the store if it was left lazy on restore."""
+    if session_sync:
+        return session_sync.value(st.session_state, st.session_state.session_id, field)
+    return st.session_state.get(field)
+
+def set_session_value(field, value):
+    """Set a persisted field, replacing the stored value even if it was never loaded."""
+    if session_sync:
+        session_sync.assign(st.session_state, field, value)
+    else:
+        st.session_state[field] = value
+
+# Restore leaves large fields in the store. Load the ones the page reads directly
+# before the defaults below, so a default never stands in for the stored value;
+# the strategy report stays lazy until a page reads it through session_value().
+for field in PERSISTED_FIELDS:
+    if field != "tax_strategies_result":
+        session_value(field)
+
 # Initialize session state variables
 if "conversation_history" not in st.session_state:
     st.session_state.conversation_history = []
@@ -47,20 +98,35 @@ if "tax_strategies_processed" not in st.session_state:
     st.session_state.tax_strategies_processed = False
 if "tax_strategies_result" not in st.session_state:
     st.session_state.tax_strategies_result = None
+# Background job running Agent 3's analysis for the current JSON
+if "tax_strategies_job_id" not in st.session_state:
+    st.session_state.tax_strategies_job_id = None
+# Every span and LLM cost recorded during this rerun is attributed to the session
+bind_session(st.session_state.session_id)
+bind_scope(st.session_state.session_id)
+touch_session(st.session_state.session_id)
+ensure_metrics_server()
+warm_worker_pool()
 
 # Define the callback function for file submission
 def handle_file_submit():
     """Sets the submit_clicked flag to trigger processing of file answers"""
     st.session_state.submit_clicked = True
 
-# Initialize the agents
-@st.cache_resource
+# Initialize the agents. Agent 1 keeps the interview's conversation state, so each
+# session gets its own, restored from the session store after a restart.
 def get_agent():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        st.error("OpenAI API key not found. Please check your .env file.")
-        st.stop()
-    return ScenarioClarificationAgent(openai_api_key=api_key)
+    if "agent1" not in st.session_state:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            st.error("OpenAI API key not found. Please check your .env file.")
+            st.stop()
+        session_agent = ScenarioClarificationAgent(openai_api_key=api_key)
+        agent1_state = session_value("agent1_state")
+        if agent1_state:
+            session_agent.restore_state(agent1_state)
+        st.session_state.agent1 = session_agent
+    return st.session_state.agent1
 
 @st.cache_resource
 def get_tax_strategies_agent():
@@ -73,6 +139,93 @@ def get_tax_strategies_agent():
 agent = get_agent()
 tax_strategies_agent = get_tax_strategies_agent()
 
+def persist_session():
+    """Queue the session fields that changed since the last run for the session store."""
+    if session_sync:
+        set_session_value("agent1_state", agent.export_state())
+        session_sync.sync(st.session_state, st.session_state.session_id)
+
+def current_scenario():
+    """
+    The structured scenario in final_json, parsed once per session instead of on every use.
+
+    Returns:
+        ClientScenario or None: None until Agent 1 has produced valid JSON
+    """
+    if not st.session_state.final_json:
+        return None
+    if st.session_state.get("client_scenario") is None:
+        try:
+            st.session_state.client_scenario = ClientScenario.parse(st.session_state.final_json)
+        except InvalidScenario:
+            return None
+    return st.session_state.client_scenario
+
+def scenario_export_json():
+    """Pretty-printed final_json for downloads, the preview and Agent 2, or the raw text if it isn't valid JSON."""
+    scenario = current_scenario()
+    return scenario.to_json(indent=2) if scenario else str(st.session_state.final_json)
+
+# Runs that end in st.rerun() skip the end of the script, so changes are also saved here
+persist_session()
+
+# How often the page checks on a running strategy analysis
+STRATEGIES_POLL_SECONDS = 2
+
+def run_tax_strategies_job(payload):
+    """Job handler: run Agent 3 and keep the baseline text so other sessions can reuse the result."""
+    result = tax_strategies_agent.process_tax_scenario(payload["client_json"], session_id=payload["session_id"])
+    if not isinstance(result, dict):
+        return {"error": str(result)}
+    try:
+        with open(result["baseline_path"], "r", encoding="utf-8") as f:
+            result["baseline_text"] = f.read()
+    except OSError:
+        result["baseline_text"] = None
+    return result
+
+# Strategy analysis runs on the persistent job queue instead of blocking reruns
+job_queue = get_job_queue()
+job_queue.register("strategies", run_tax_strategies_job)
+
+def adopt_tax_strategies_result(result):
+    """
+    Store a finished analysis in this session, copying the baseline calculation into
+    this session's namespace when the job was deduplicated against another session.
+    """
+    own_path = tax_strategies_agent.baseline_path(st.session_state.session_id)
+    baseline_text = result.pop("baseline_text", None)
+    if result.get("baseline_path") != own_path and baseline_text:
+        get_storage().write_text(own_path, baseline_text, namespace=make_namespace(st.session_state.session_id),
+                                 kind="baseline")
+        result["baseline_path"] = own_path
+    set_session_value("tax_strategies_result", result)
+    st.session_state.tax_strategies_processed = True
+    st.session_state.tax_strategies_job_id = None
+    st.session_state.conversation_history.append({
+        "role": "agent",
+        "message": "**Agent 3**: I've analyzed your tax scenario and identified optimal tax strategies."
+    })
+
+@st.fragment(run_every=STRATEGIES_POLL_SECONDS)
+def show_tax_strategies_progress():
+    """Poll the analysis job; a full rerun renders the result once it finishes."""
+    job = job_queue.get(st.session_state.tax_strategies_job_id)
+    if job is None:
+        st.session_state.tax_strategies_job_id = None
+        st.rerun()
+    elif job["status"] == "succeeded":
+        adopt_tax_strategies_result(job["result"])
+        st.rerun()
+    elif job["status"] == "failed":
+        st.error(f"❌ Error processing tax strategies: {job['error']}")
+        if st.button("🔄 Retry analysis", key="retry_tax_strategies"):
+            st.session_state.tax_strategies_job_id = None
+            st.rerun(scope="app")
+    else:
+        state = "Waiting for a worker" if job["status"] == "queued" else "Agent 3 is working"
+        st.info(f"🔍 Analyzing your tax strategies... ({state}, {time.time() - job['created_at']:.0f}s)")
+
 # Function to process text file with answers
 def process_answers_file(file):
     content = file.getvalue().decode("utf-8")
@@ -269,42 +422,28 @@ if st.session_state.current_stage == "json_generation":
     # Agent 3 analysis section below
     st.markdown('<div class="agent-header agent3">🎯 Tax Strategy Analysis</div>', unsafe_allow_html=True)
     
-    # Process tax strategies if not already done
+    # Queue the tax strategy analysis if not already done; the page polls the job
     if st.session_state.final_json and not st.session_state.tax_strategies_processed:
         try:
-            with st.spinner("🔍 Analyzing your tax strategies..."):
-                # Parse the JSON if it's a string
-                json_data = st.session_state.final_json
-                if isinstance(json_data, str):
-                    try:
-                        json_data = json.loads(json_data)
-                    except json.JSONDecodeError:
-                        # Try to clean the JSON string
-                        json_text = json_data.strip()
-                        if json_text.startswith("```json"):
-                            json_text = json_text.split("```json", 1)[1]
-                        if json_text.startswith("```"):
-                            json_text = json_text.split("```", 1)[1]
-                        if "```" in json_text:
-                            json_text = json_text.split("```")[0]
-                        json_text = json_text.strip()
-                        json_data = json.loads(json_text)
-
-                # Process the JSON data with Tax Strategies Agent
-                tax_strategies_result = tax_strategies_agent.process_tax_scenario(json_data)
-                st.session_state.tax_strategies_result = tax_strategies_result
-                st.session_state.tax_strategies_processed = True
-
-                # Add to conversation history
-                st.session_state.conversation_history.append({
-                    "role": "agent",
-                    "message": "**Agent 3**: I've analyzed your tax scenario and identified optimal tax strategies."
-                })
+            if st.session_state.tax_strategies_job_id is None:
+                scenario = current_scenario()
+                if scenario is None:
+                    raise InvalidScenario("The structured scenario is not valid JSON")
+
+                # The same scenario reuses a queued, running or finished analysis
+                job = job_queue.submit(
+                    "strategies",
+                    {"client_json": scenario.data, "session_id": st.session_state.session_id},
+                    dedup_key=scenario.digest,
+                    session_id=st.session_state.session_id,
+                )
+                st.session_state.tax_strategies_job_id = job["job_id"]
+            show_tax_strategies_progress()
         except Exception as e:
             st.error(f"❌ Error processing tax strategies: {str(e)}")
     
     # Display tax strategies analysis in a full-width layout
-    if st.session_state.tax_strategies_processed and st.session_state.tax_strategies_result:
+    if st.session_state.tax_strategies_processed and session_value("tax_strategies_result"):
         result = st.session_state.tax_strategies_result
         #print(result)
         
@@ -358,6 +497,8 @@ if st.session_state.current_stage == "json_generation":
                                 
                                 with col_a:
                                     st.markdown(f"**Relevance Score**: {strategy.get('relevance_score', 'N/A')}/10")
+                                    if strategy.get('score_source') == "index":
+                                        st.caption(f"Score reused from a similar scenario (similarity {strategy.get('similarity') or 0:.2f})")
                                     st.markdown("**Strategy Details**:")
                                     st.markdown(strategy.get('details', 'No details available'))
                                 
@@ -393,18 +534,9 @@ if st.session_state.current_stage == "json_generation":
             with col2:
                 # Download JSON button
                 if st.session_state.final_json:
-                    try:
-                        if isinstance(st.session_state.final_json, str):
-                            json_data = json.loads(st.session_state.final_json)
-                        else:
-                            json_data = st.session_state.final_json
-                        pretty_json = json.dumps(json_data, indent=2)
-                    except:
-                        pretty_json = str(st.session_state.final_json)
-                    
                     st.download_button(
                         label="📋 Download JSON",
-                        data=pretty_json,
+                        data=scenario_export_json(),
                         file_name="tax_scenario.json",
                         mime="application/json",
                         use_container_width=True
@@ -414,7 +546,7 @@ if st.session_state.current_stage == "json_generation":
                 # Proceed to Agent 2 button
                 if st.button("🔍 Analyze with Agent 2", key="to_agent2_from_agent3", use_container_width=True):
                     st.session_state.switch_to_agent2 = True
-                    st.session_state.agent2_json_payload = pretty_json if 'pretty_json' in locals() else st.session_state.final_json
+                    st.session_state.agent2_json_payload = scenario_export_json() if st.session_state.final_json else None
                     
                     if "agent2_user_scenario_override" in st.session_state:
                         del st.session_state["agent2_user_scenario_override"]
@@ -424,33 +556,15 @@ if st.session_state.current_stage == "json_generation":
             if st.session_state.final_json:
                 st.markdown("---")
                 st.markdown("### 📋 JSON Data Preview")
-                
-                try:
-                    if isinstance(st.session_state.final_json, str):
-                        json_data = json.loads(st.session_state.final_json)
-                        pretty_json = json.dumps(json_data, indent=2)
-                    else:
-                        pretty_json = json.dumps(st.session_state.final_json, indent=2)
-                except:
-                    pretty_json = str(st.session_state.final_json)
-                
-                st.code(pretty_json, language="json")
+                st.code(scenario_export_json(), language="json")
         
         # --- AUTO-LOAD AGENT 2 AFTER AGENT 3 COMPLETES ---
         # Set switch_to_agent2 and rerun after Agent 3 finishes
         if not st.session_state.get("switch_to_agent2", False):
             # Prepare JSON payload for Agent 2
             if st.session_state.final_json:
-                try:
-                    if isinstance(st.session_state.final_json, str):
-                        json_data = json.loads(st.session_state.final_json)
-                    else:
-                        json_data = st.session_state.final_json
-                    pretty_json = json.dumps(json_data, indent=2)
-                except:
-                    pretty_json = str(st.session_state.final_json)
                 st.session_state.switch_to_agent2 = True
-                st.session_state.agent2_json_payload = pretty_json
+                st.session_state.agent2_json_payload = scenario_export_json()
                 st.rerun()
     else:
         # Show loading state or instructions
@@ -652,6 +766,7 @@ else:
                     else:
                         # Agent 2 has enough information - move to Agent 3
                         st.session_state.final_json = response["response"]
+                        st.session_state.client_scenario = None
                         st.session_state.conversation_history.append({
                             "role": "agent",
                             "message": "Thank you for providing all the necessary information. Here's a structured representation of your tax scenario:"
@@ -743,6 +858,7 @@ if st.session_state.submit_clicked and st.session_state.file_answers:
             if response["status"] == "complete":
                 # Final JSON response - move to Agent 3
                 st.session_state.final_json = response["response"]
+                st.session_state.client_scenario = None
                 st.session_state.conversation_history.append({
                     "role": "agent",
                     "message": "**Agent 2**: All necessary information provided. Here's your structured tax scenario."
@@ -776,8 +892,16 @@ if st.session_state.get("switch_to_agent2", False):
     st.header("Agent 2: Baseline Tax Comparision")
     import agent2.app # Ensure agent2.app is imported
 
-    # Directly call Agent 2's main function without preparing or passing a JSON payload
-    agent2.app.main(set_page_config=False)
+    # Call Agent 2's main function with this session's baseline calculation
+    baseline_path = None
+    tax_strategies_result = session_value("tax_strategies_result")
+    if isinstance(tax_strategies_result, dict):
+        baseline_path = tax_strategies_result.get("baseline_path")
+    if baseline_path:
+        agent2.app.main(set_page_config=False, baseline_path=baseline_path,
+                        namespace=make_namespace(st.session_state.session_id))
+    else:
+        st.error("No baseline tax calculation for this session yet. Go back to Agent 1 and run the tax analysis first.")
 
     # Optionally, add a button to go back to Agent 1
     if st.button("Back to Agent 1", key="back_to_agent1"):
@@ -788,3 +912,5 @@ if st.session_state.get("switch_to_agent2", False):
         if "uploaded_scenario_auto" in st.session_state: # Clean up old state if any
             del st.session_state["uploaded_scenario_auto"]
         st.rerun()
+
+persist_session()
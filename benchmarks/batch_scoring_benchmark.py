@@ -0,0 +1,156 @@
+"""
+Batched vs single-client strategy scoring benchmark.
+
+Scores every corpus profile against the strategy catalog twice: once with
+one request per client (get_tax_strategies) and once packed several clients
+per request (get_tax_strategies_batch). Reports LLM calls and tokens for both
+and how closely the batched shortlists agree with the single-client ones:
+
+    python -m benchmarks.batch_scoring_benchmark --scenarios 24 --batch-size 8
+
+The scenario index is disabled so every client is actually scored. Exits
+non-zero when agreement falls outside --min-overlap / --max-score-diff.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import DEFAULT_CORPUS_SIZE, DEFAULT_SEED, generate_corpus
+from benchmarks.fake_llm_server import FakeLLMServer, load_profile
+from benchmarks.measure import LLMCallCollector
+from shared.cost_ledger import CostLedger, set_ledger
+
+logger = logging.getLogger(__name__)
+
+# Mean share of each single-client top 3 that the batched top 3 must keep
+DEFAULT_MIN_OVERLAP = 0.8
+# Mean absolute score difference allowed on strategies both runs selected
+DEFAULT_MAX_SCORE_DIFF = 1.0
+
+
+def _client_json(scenario):
+    profile = dict(scenario["profile"])
+    profile.pop("prior_return_style", None)
+    return profile
+
+
+def _agreement(single, batched):
+    """Mean top-k overlap and mean absolute score difference between two runs."""
+    overlaps, differences = [], []
+    for expected, actual in zip(single, batched):
+        expected_scores = {strategy["id"]: strategy["relevance_score"] for strategy in expected}
+        actual_scores = {strategy["id"]: strategy["relevance_score"] for strategy in actual}
+        if expected_scores:
+            overlaps.append(len(expected_scores.keys() & actual_scores.keys()) / len(expected_scores))
+        elif not actual_scores:
+            overlaps.append(1.0)
+        else:
+            overlaps.append(0.0)
+        differences.extend(abs(expected_scores[key] - actual_scores[key]) for key in expected_scores.keys() & actual_scores.keys())
+    return {
+        "top_overlap": round(sum(overlaps) / len(overlaps), 3) if overlaps else None,
+        "mean_score_diff": round(sum(differences) / len(differences), 3) if differences else 0.0,
+    }
+
+
+def _timed_run(collector, fn):
+    collector.totals.clear()
+    collector.latencies.clear()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    totals = collector.snapshot().get("strategies", {})
+    return result, {
+        "wall_time_s": round(elapsed, 3),
+        "llm_calls": totals.get("calls", 0),
+        "prompt_tokens": totals.get("prompt_tokens", 0),
+        "completion_tokens": totals.get("completion_tokens", 0),
+        "cached_tokens": totals.get("cached_tokens", 0),
+    }
+
+
+def run(args):
+    # Configure the process before the agent and index modules are imported
+    server = None
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+    else:
+        server = FakeLLMServer(port=0, profile=load_profile(args.profile), seed=args.seed).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-benchmark-key")
+    os.environ["SCENARIO_INDEX_ENABLED"] = "0"
+    # Benchmark calls never show up as spend in the real cost ledger
+    set_ledger(CostLedger(path=os.path.join(tempfile.mkdtemp(prefix="benchmark-state-"), "cost_ledger.sqlite3")))
+    os.environ["STORAGE_ROOT"] = tempfile.mkdtemp(prefix="benchmark-storage-")
+    os.environ["STRATEGY_BATCH_SIZE"] = str(args.batch_size)
+
+    from agent3.main import Tax_Stratigies_Agent
+
+    clients = [_client_json(scenario) for scenario in generate_corpus(args.scenarios, args.seed)]
+    collector = LLMCallCollector().install()
+    try:
+        agent = Tax_Stratigies_Agent(openai_api_key=os.environ["OPENAI_API_KEY"])
+        single, single_totals = _timed_run(collector, lambda: [agent.get_tax_strategies(client) for client in clients])
+        batched, batched_totals = _timed_run(collector, lambda: agent.get_tax_strategies_batch(clients))
+    finally:
+        collector.uninstall()
+        if server is not None:
+            server.stop()
+
+    return {
+        "clients": len(clients),
+        "batch_size": args.batch_size,
+        "llm": "external" if args.base_url else f"fake:{args.profile}",
+        "single": single_totals,
+        "batched": batched_totals,
+        "agreement": _agreement(single, batched),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare batched and single-client strategy scoring")
+    parser.add_argument("--scenarios", type=int, default=DEFAULT_CORPUS_SIZE, help="Number of synthetic clients")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Corpus and fake-server seed")
+    parser.add_argument("--batch-size", type=int, default=8, help="Most clients per batched request")
+    parser.add_argument("--profile", default="instant", help="Fake LLM latency profile name or JSON file")
+    parser.add_argument("--base-url", default=None, help="Use this OpenAI-compatible endpoint instead of the fake server")
+    parser.add_argument("--min-overlap", type=float, default=DEFAULT_MIN_OVERLAP, help="Lowest acceptable mean top-3 overlap")
+    parser.add_argument("--max-score-diff", type=float, default=DEFAULT_MAX_SCORE_DIFF, help="Highest acceptable mean score difference")
+    parser.add_argument("--output", default=None, help="Also write the JSON results here")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    for mode in ("single", "batched"):
+        values = results[mode]
+        print(
+            f"{mode:<8} calls={values['llm_calls']} prompt_tokens={values['prompt_tokens']} "
+            f"completion_tokens={values['completion_tokens']} wall={values['wall_time_s']}s"
+        )
+    agreement = results["agreement"]
+    print(f"top-3 overlap={agreement['top_overlap']} mean score diff={agreement['mean_score_diff']}")
+
+    if agreement["top_overlap"] is not None and agreement["top_overlap"] < args.min_overlap:
+        print(f"Batched shortlists disagree with single-client scoring (overlap < {args.min_overlap})")
+        return 1
+    if agreement["mean_score_diff"] > args.max_score_diff:
+        print(f"Batched scores drift from single-client scoring (diff > {args.max_score_diff})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Diff two benchmark result files (from pipeline_benchmark or load_test).
+
+    python -m benchmarks.compare_results old.json new.json --threshold 10
+
+Prints every numeric metric per stage with its change and exits with status 1
+if a latency, token, call or memory metric regressed by more than the
+threshold percentage.
+"""
+import sys
+import json
+import argparse
+
+# Metrics where a higher value is worse
+REGRESSION_KEYS = ("latency_ms", "llm_calls_per_session", "prompt_tokens", "completion_tokens", "peak_rss_mb", "errors")
+
+
+def _flatten(values, prefix=""):
+    flat = {}
+    for key, value in values.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old, new, threshold):
+    """
+    Compare the stage metrics of two result dicts.
+
+    Returns:
+        tuple: (rows, regressions) where rows are (metric, old, new, percent_change)
+    """
+    old_flat = _flatten(old.get("stages", {}))
+    new_flat = _flatten(new.get("stages", {}))
+    rows = []
+    regressions = []
+    for metric in sorted(set(old_flat) | set(new_flat)):
+        before, after = old_flat.get(metric), new_flat.get(metric)
+        change = None
+        if before not in (None, 0) and after is not None:
+            change = (after - before) / abs(before) * 100
+        rows.append((metric, before, after, change))
+        watched = any(f".{key}" in f".{metric}" for key in REGRESSION_KEYS) and not metric.endswith(".count")
+        appeared = before == 0 and after  # e.g. errors going from none to some
+        if watched and ((change is not None and change > threshold) or appeared):
+            regressions.append(metric)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    with open(args.old, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"old: {old.get('meta', {}).get('commit')}  new: {new.get('meta', {}).get('commit')}")
+    rows, regressions = compare(old, new, args.threshold)
+    for metric, before, after, change in rows:
+        marker = "  <-- regression" if metric in regressions else ""
+        change_text = "n/a" if change is None else f"{change:+.1f}%"
+        print(f"{metric:<45} {str(before):>12} {str(after):>12} {change_text:>9}{marker}")
+
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
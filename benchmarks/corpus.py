@@ -0,0 +1,151 @@
+"""
+Deterministic synthetic client scenarios for benchmarks and load tests.
+
+Scenarios vary filing status, state and income mix, and each carries the
+answers a client would give plus a prior-year return for the comparison
+stage. The same seed always yields the same corpus, so results from
+different commits are comparable.
+"""
+import json
+import random
+
+FILING_STATUSES = ["single", "married_filing_jointly", "married_filing_separately", "head_of_household"]
+STATES = ["CA", "NY", "TX", "FL", "WA", "IL", "MA", "CO", "GA", "NJ"]
+INCOME_MIXES = ["w2_only", "self_employed", "w2_plus_side_business", "investor", "landlord", "crypto_trader"]
+PRIOR_RETURN_STYLES = ["structured", "narrative"]
+
+DEFAULT_CORPUS_SIZE = 24
+DEFAULT_SEED = 20240415
+
+
+def _income_sources(mix, rng):
+    if mix == "w2_only":
+        return {"wages": rng.randrange(45000, 220000, 500)}
+    if mix == "self_employed":
+        return {"business_income": rng.randrange(60000, 320000, 500), "business_expenses": rng.randrange(8000, 70000, 100)}
+    if mix == "w2_plus_side_business":
+        return {
+            "wages": rng.randrange(50000, 180000, 500),
+            "business_income": rng.randrange(10000, 60000, 500),
+            "business_expenses": rng.randrange(2000, 15000, 100),
+        }
+    if mix == "investor":
+        return {
+            "wages": rng.randrange(80000, 250000, 500),
+            "dividends": rng.randrange(2000, 40000, 100),
+            "capital_gains": rng.randrange(5000, 120000, 500),
+        }
+    if mix == "landlord":
+        return {"wages": rng.randrange(60000, 160000, 500), "rental_income": rng.randrange(12000, 60000, 500)}
+    return {"wages": rng.randrange(50000, 150000, 500), "crypto_gains": rng.randrange(-20000, 80000, 500)}
+
+
+def _scenario_text(profile):
+    sources = ", ".join(f"{name.replace('_', ' ')} of ${amount:,}" for name, amount in profile["income"].items())
+    dependents = profile["dependents"]
+    return (
+        f"I live in {profile['state']} and file as {profile['filing_status'].replace('_', ' ')}. "
+        f"This year I had {sources}. "
+        f"I have {dependents} dependent{'s' if dependents != 1 else ''}"
+        f"{' and pay mortgage interest of $' + format(profile['mortgage_interest'], ',') if profile['mortgage_interest'] else ''}. "
+        "I'd like to know which tax strategies could lower my bill."
+    )
+
+
+def _total_income(profile):
+    return sum(amount for name, amount in profile["income"].items() if amount > 0 and not name.endswith("expenses"))
+
+
+def _answers(profile):
+    total_income = _total_income(profile)
+    return [
+        f"My filing status is {profile['filing_status'].replace('_', ' ')}.",
+        f"I live in {profile['state']}, United States.",
+        f"My total income was about ${total_income:,} from: "
+        + ", ".join(f"{name.replace('_', ' ')} ${amount:,}" for name, amount in profile["income"].items()) + ".",
+        f"I have {profile['dependents']} dependents and contributed ${profile['retirement_contributions']:,} to retirement accounts.",
+    ]
+
+
+def _prior_return(profile, rng):
+    """Prior-year return data in the shape parse_previous_tax_return produces."""
+    income = round(_total_income(profile) * rng.uniform(0.8, 1.05))
+    agi = round(income * rng.uniform(0.82, 0.95))
+    taxable = max(0, agi - 27700)
+    federal = round(taxable * rng.uniform(0.14, 0.24))
+    state = round(taxable * rng.uniform(0.0, 0.08))
+    total = federal + state
+    if profile["prior_return_style"] == "structured":
+        return {
+            "source_type": "json",
+            "file_name": f"{profile['tax_year'] - 1}_return.json",
+            "raw_data": {
+                "tax_year": profile["tax_year"] - 1,
+                "total_income": income,
+                "adjusted_gross_income": agi,
+                "taxable_income": taxable,
+                "federal_tax": federal,
+                "state_tax": state,
+                "total_tax": total,
+            },
+        }
+    # Prose that the local parser cannot read, so the AI fallback is exercised
+    return {
+        "source_type": "pdf",
+        "file_name": f"{profile['tax_year'] - 1}_return.pdf",
+        "text_content": (
+            f"For tax year {profile['tax_year'] - 1} the household earned roughly {income} dollars in all, "
+            f"which after adjustments came to {agi}. Federal liability was {federal} and the state took {state}."
+        ),
+    }
+
+
+def generate_corpus(size=DEFAULT_CORPUS_SIZE, seed=DEFAULT_SEED):
+    """
+    Build the synthetic scenario corpus.
+
+    Args:
+        size (int): Number of scenarios
+        seed (int): Random seed; the same seed always yields the same corpus
+
+    Returns:
+        list: Scenario dicts with id, profile, scenario, answers and prior_return
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(size):
+        # Cycle the categorical axes so every combination is covered evenly
+        profile = {
+            "filing_status": FILING_STATUSES[index % len(FILING_STATUSES)],
+            "state": STATES[(index * 3) % len(STATES)],
+            "income_mix": INCOME_MIXES[index % len(INCOME_MIXES)],
+            "prior_return_style": PRIOR_RETURN_STYLES[(index // 2) % len(PRIOR_RETURN_STYLES)],
+            "dependents": rng.randint(0, 3),
+            "mortgage_interest": rng.choice([0, rng.randrange(4000, 24000, 100)]),
+            "retirement_contributions": rng.randrange(0, 23000, 500),
+            "tax_year": 2024,
+        }
+        profile["income"] = _income_sources(profile["income_mix"], rng)
+        corpus.append({
+            "id": f"scenario-{index:03d}",
+            "profile": profile,
+            "scenario": _scenario_text(profile),
+            "answers": _answers(profile),
+            "prior_return": _prior_return(profile, rng),
+        })
+    return corpus
+
+
+def answers_file_text(questions, answers):
+    """Render an answers upload in the format of the app's downloadable answer template."""
+    lines = []
+    for index, question in enumerate(questions):
+        answer = answers[index] if index < len(answers) else "Not applicable."
+        lines.append(f"Question {index + 1}: {question}")
+        lines.append(answer)
+        lines.append("")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(json.dumps(generate_corpus(), indent=2))
@@ -0,0 +1,648 @@
+"""
+Offline stand-in for the OpenAI chat/completions API.
+
+Point the app (or a benchmark) at it with OPENAI_BASE_URL and any API key:
+
+    python -m benchmarks.fake_llm_server --port 8600 --profile realistic
+    OPENAI_BASE_URL=http://127.0.0.1:8600/v1 OPENAI_API_KEY=fake streamlit run app.py
+
+Responses are replayed from recordings keyed by prompt hash when one exists,
+otherwise generated from a canned template for the prompt family (question
+list, validation, structured JSON, strategy scores, baseline, analysis, HTML
+conversion, comparison). Latency, jitter, stalls, 5xx errors and 429s follow a
+configurable profile, and "stream": true is served as server-sent events.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from collections import Counter, OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+FAKE_LLM_HOST = os.getenv("FAKE_LLM_HOST", "127.0.0.1")
+FAKE_LLM_PORT = int(os.getenv("FAKE_LLM_PORT", "8600"))
+RECORDINGS_DIR = os.getenv("FAKE_LLM_RECORDINGS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings"))
+
+# Latency in milliseconds; per-family entries override "default".
+#   latency_ms: base latency, jitter_ms: uniform extra, ms_per_token: output speed,
+#   stall_rate/stall_ms: occasional stalled connections, error_rate: 500s,
+#   rate_limit_rate: 429s with Retry-After
+PROFILES = {
+    "instant": {
+        "default": {"latency_ms": 0, "jitter_ms": 0, "ms_per_token": 0},
+    },
+    "realistic": {
+        "default": {"latency_ms": 400, "jitter_ms": 300, "ms_per_token": 8},
+        "validation": {"latency_ms": 300, "jitter_ms": 200, "ms_per_token": 8},
+        "baseline": {"latency_ms": 600, "jitter_ms": 600, "ms_per_token": 12},
+        "analysis": {"latency_ms": 800, "jitter_ms": 800, "ms_per_token": 12},
+    },
+    "flaky": {
+        "default": {
+            "latency_ms": 400, "jitter_ms": 400, "ms_per_token": 8,
+            "stall_rate": 0.03, "stall_ms": 8000, "error_rate": 0.03, "rate_limit_rate": 0.05,
+        },
+    },
+}
+
+# Prompt families, checked in order against the concatenated messages
+PROMPT_FAMILIES = [
+    ("question_list", ("comprehensive list of specific questions", "numbered tax filing questions")),
+    ("validation", ("determine if we have enough information", "wrapping up a client consultation")),
+    ("structured_json", ("well-structured json object", "generate a valid json object", "generate only a valid json object")),
+    ("strategy_scores", ("tax strategy expert",)),
+    ("baseline", ("detailed baseline tax calculation",)),
+    ("analysis", ("tax strategy analysis",)),
+    ("html_conversion", ("html conversion expert",)),
+    ("comparison", ("analyzing two tax documents",)),
+]
+
+# Prompt caching is simulated like the provider's: prefixes of at least
+# 1024 tokens are cached in 128-token blocks
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+CHARS_PER_TOKEN = 4
+
+
+def prompt_hash(model, messages):
+    """Stable key for a request: model plus the exact message list."""
+    canonical = json.dumps({"model": model, "messages": messages}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def classify_prompt(text):
+    """Return the prompt family for a prompt, or "generic"."""
+    lowered = text.lower()
+    for family, markers in PROMPT_FAMILIES:
+        if any(marker in lowered for marker in markers):
+            return family
+    return "generic"
+
+
+def _count_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _income_from_prompt(text, rng):
+    """Pick a plausible income figure from the client data in a prompt."""
+    amounts = [
+        int(value.replace(",", ""))
+        for value in re.findall(r"(?<![\d.])(\d{2,3},\d{3}|\d{5,7})(?![\d.])", text)
+    ]
+    amounts = [amount for amount in amounts if 10000 <= amount <= 5000000]
+    return max(amounts) if amounts else rng.randrange(60000, 260000, 100)
+
+
+def _tax_figures(income):
+    expenses = round(income * 0.18)
+    agi = income - expenses
+    deduction = 27700
+    taxable = max(0, agi - deduction)
+    federal = round(taxable * 0.19)
+    state = round(taxable * 0.05)
+    fica = round(min(agi, 160200) * 0.153 * 0.9235)
+    total = federal + state + fica
+    return {
+        "income": income, "expenses": expenses, "agi": agi, "deduction": deduction,
+        "taxable": taxable, "federal": federal, "state": state, "fica": fica,
+        "total": total, "rate": round(total / income * 100, 2) if income else 0,
+    }
+
+
+def _template_question_list(prompt, rng):
+    questions = [
+        "What is your filing status (single, married filing jointly, etc.)?",
+        "Which state do you live in?",
+        "What was your total income for the year?",
+        "Do you receive a W-2 salary, 1099 income, or both?",
+        "Do you own a business or do any freelance work?",
+        "What were your business expenses, if any?",
+        "Do you have any dependents? If so, what are their ages?",
+        "Did you pay mortgage interest or property taxes?",
+        "Did you contribute to a retirement account such as a 401(k) or IRA?",
+        "Did you receive any dividends, interest or capital gains?",
+        "Do you own any rental property?",
+        "Did you buy or sell any cryptocurrency?",
+        "Did you make estimated tax payments during the year?",
+        "Did you have any large medical expenses?",
+        "Did you make charitable donations?",
+    ]
+    count = rng.randint(10, len(questions))
+    return "\n".join(f"{i}. {question}" for i, question in enumerate(questions[:count], 1))
+
+
+def _template_validation(prompt, rng):
+    return "COMPLETE: All necessary information gathered."
+
+
+def _template_structured_json(prompt, rng):
+    income = _income_from_prompt(prompt, rng)
+    data = {
+        "filing_status": rng.choice(["single", "married_filing_jointly", "head_of_household"]),
+        "state": rng.choice(["CA", "NY", "TX", "WA", "IL"]),
+        "income": {
+            "primary": rng.choice(["salary", "business"]),
+            "amount": income,
+            "sources": [{"type": "dividends", "amount": rng.randrange(500, 8000, 100)}],
+        },
+        "deductions": [{"type": "mortgage_interest", "amount": rng.randrange(4000, 20000, 100)}],
+        "dependents": rng.randint(0, 3),
+        "tax_dates": {"tax_year": 2023},
+    }
+    return json.dumps(data, indent=2)
+
+
+# Share of batched scores the fake model moves by one point, so batched and
+# single-client scoring agree closely but not exactly, as with a real model
+BATCH_SCORE_JITTER = 0.15
+
+
+def _client_facts(value):
+    """Client JSON without empty fields, so pretty and compact prompts hash alike."""
+    if isinstance(value, dict):
+        pruned = {key: _client_facts(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [item for item in (_client_facts(item) for item in value) if item not in (None, "", [], {})]
+    return value
+
+
+def _client_scores(client, strategy_ids):
+    """Scores that depend only on the client's facts and the strategy."""
+    facts = json.dumps(_client_facts(client), sort_keys=True, separators=(",", ":"))
+    return {
+        strategy_id: random.Random(int(hashlib.sha256(f"{facts}|{strategy_id}".encode("utf-8")).hexdigest()[:16], 16)).randint(2, 10)
+        for strategy_id in strategy_ids
+    }
+
+
+def _template_strategy_scores(prompt, rng):
+    match = re.search(r"Available Tax Strategies \(ID: title\):\s*(\{.*?\})", prompt, re.DOTALL)
+    if match:
+        try:
+            strategy_ids = list(json.loads(match.group(1)))
+        except ValueError:
+            strategy_ids = []
+        clients = re.findall(r"^(C\d+): (\{.*\})$", prompt, re.MULTILINE)
+        if strategy_ids and clients:
+            results = {}
+            for client_id, client in clients:
+                scores = _client_scores(json.loads(client), strategy_ids)
+                for strategy_id, score in scores.items():
+                    if rng.random() < BATCH_SCORE_JITTER:
+                        scores[strategy_id] = min(10, max(1, score + rng.choice((-1, 1))))
+                results[client_id] = scores
+            return json.dumps(results, indent=2)
+        client = re.search(r"Client Tax Information:\s*(\{.*\})", prompt, re.DOTALL)
+        if strategy_ids and client:
+            try:
+                return json.dumps(_client_scores(json.loads(client.group(1)), strategy_ids), indent=2)
+            except ValueError:
+                pass
+        if strategy_ids:
+            return json.dumps({strategy_id: rng.randint(2, 10) for strategy_id in strategy_ids}, indent=2)
+    # Older prompts listed titles only and were answered by title
+    match = re.search(r"Available Tax Strategies \(titles only\):\s*(\[.*?\])", prompt, re.DOTALL)
+    titles = []
+    if match:
+        try:
+            titles = json.loads(match.group(1))
+        except ValueError:
+            titles = []
+    titles = titles or re.findall(r"Strategy \d+: [^\"\n]+", prompt)
+    scores = {title: rng.randint(2, 10) for title in titles}
+    return json.dumps(scores, indent=2)
+
+
+def _template_baseline(prompt, rng):
+    f = _tax_figures(_income_from_prompt(prompt, rng))
+    return (
+        "### 1. Total Income Calculation from All Sources\n\n"
+        f"- Total Income: ${f['income']:,}\n\n"
+        "### 2. Business Expenses and Deductions\n\n"
+        f"- Business Expenses: ${f['expenses']:,}\n"
+        f"- Deductions: ${f['deduction']:,}\n\n"
+        "### 3. Adjusted Gross Income (AGI)\n\n"
+        f"- Adjusted Gross Income: ${f['agi']:,}\n"
+        f"- Taxable Income: ${f['taxable']:,}\n\n"
+        "### 4. Federal Income Tax Calculation with Tax Brackets\n\n"
+        f"- Federal Tax: ${f['federal']:,}\n\n"
+        "### 5. State Tax Calculation\n\n"
+        f"- State Tax: ${f['state']:,}\n\n"
+        "### 6. FICA Taxes\n\n"
+        f"- FICA Tax: ${f['fica']:,}\n\n"
+        "### 7. Total Tax Liability\n\n"
+        f"- Total Tax: ${f['total']:,}\n\n"
+        "### 8. Effective Tax Rate\n\n"
+        f"- Effective Tax Rate: {f['rate']}%\n"
+    )
+
+
+def _template_analysis(prompt, rng):
+    titles = re.findall(r'"title": "(Strategy \d+: [^"]+)"', prompt) or ["Strategy 1: New Side Business and Potential Deductions"]
+    f = _tax_figures(_income_from_prompt(prompt, rng))
+    sections = ["TAX STRATEGY ANALYSIS\n", "## Client Overview", f"- Total Annual Income: ${f['income']:,}\n"]
+    rows = []
+    for title in titles[:3]:
+        savings = rng.randrange(1000, 15000, 50)
+        rows.append((title, savings))
+        sections.append(
+            f"### {title}\n"
+            f"- **Relevance Score**: {rng.randint(5, 10)}/10\n"
+            f"- **Total Tax with Strategy**: ${f['total'] - savings:,}\n"
+            f"- **Estimated Tax Savings**: ${savings:,}\n"
+            "- **Implementation Steps**:\n  1. Review eligibility\n  2. Gather documentation\n  3. File the required forms\n"
+        )
+    sections.append("## Summary and Recommendations\n")
+    sections.append("| Strategy | Tax Savings |\n|----------|-------------|")
+    sections.extend(f"| {title} | ${savings:,} |" for title, savings in rows)
+    best = max(rows, key=lambda row: row[1])
+    sections.append(f"\n- **Recommended Strategy**: {best[0]}\n- **Expected Annual Savings**: ${best[1]:,}")
+    return "\n".join(sections)
+
+
+def _template_html_conversion(prompt, rng):
+    body = prompt.split("```")[1] if prompt.count("```") >= 2 else prompt[-2000:]
+    paragraphs = "".join(f"<p>{line}</p>" for line in body.splitlines() if line.strip())
+    return f"<div class=\"tax-calculation\"><h1>Baseline Tax Calculation</h1>{paragraphs}</div>"
+
+
+def _template_comparison(prompt, rng):
+    labels = ["Total Income", "Adjusted Gross Income", "Federal Tax", "State Tax", "Total Tax"]
+    metrics = []
+    for label in labels:
+        previous = rng.randrange(10000, 250000, 100)
+        current = round(previous * rng.uniform(0.85, 1.2))
+        metrics.append({"label": label, "document1": previous, "document2": current, "difference": current - previous})
+    data = {"year_labels": ["Previous Year", "Current Year"], "key_metrics": metrics}
+    return f"DETAILED COMPARISON: Values extracted from both documents.\n[JSON_START]\n{json.dumps(data, indent=2)}\n[JSON_END]"
+
+
+def _template_generic(prompt, rng):
+    return "Thought: I can answer without using any more tools.\nAnswer: OK"
+
+
+TEMPLATES = {
+    "question_list": _template_question_list,
+    "validation": _template_validation,
+    "structured_json": _template_structured_json,
+    "strategy_scores": _template_strategy_scores,
+    "baseline": _template_baseline,
+    "analysis": _template_analysis,
+    "html_conversion": _template_html_conversion,
+    "comparison": _template_comparison,
+    "generic": _template_generic,
+}
+
+
+class FakeLLM:
+    """
+    Response generation, recordings, latency profile and counters shared by
+    all request handler threads.
+    """
+
+    def __init__(self, profile="instant", recordings_dir=RECORDINGS_DIR, seed=None, upstream_url=None):
+        self.profile = PROFILES[profile] if isinstance(profile, str) else profile
+        self.recordings_dir = recordings_dir
+        # When set, prompts without a recording are fetched from the real API and recorded
+        self.upstream_url = upstream_url
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._prefix_cache = OrderedDict()
+
+    # -- recordings ----------------------------------------------------------
+
+    def _recording_path(self, key):
+        return os.path.join(self.recordings_dir, f"{key}.json")
+
+    def load_recording(self, key):
+        try:
+            with open(self._recording_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)["content"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save_recording(self, key, model, messages, content):
+        """Store a response so later requests with the same prompt replay it."""
+        os.makedirs(self.recordings_dir, exist_ok=True)
+        with open(self._recording_path(key), "w", encoding="utf-8") as f:
+            json.dump({"model": model, "messages": messages, "content": content}, f, indent=1)
+
+    def record_from_upstream(self, model, messages):
+        """Fetch a real response from upstream_url and save it as a recording."""
+        import httpx
+
+        response = httpx.post(
+            f"{self.upstream_url.rstrip('/')}/chat/completions",
+            headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"},
+            json={"model": model, "messages": messages},
+            timeout=300,
+        )
+        response.raise_for_status()
+        content = response.json()["choices"][0]["message"]["content"]
+        self.save_recording(prompt_hash(model, messages), model, messages, content)
+        self.count("recorded")
+        return content
+
+    # -- behaviour -----------------------------------------------------------
+
+    def settings(self, family):
+        settings = dict(self.profile.get("default", {}))
+        settings.update(self.profile.get(family, {}))
+        return settings
+
+    def respond(self, model, messages):
+        """Return (family, content) for a request."""
+        prompt = "\n".join(str(message.get("content") or "") for message in messages)
+        family = classify_prompt(prompt)
+        key = prompt_hash(model, messages)
+        content = self.load_recording(key)
+        if content is None and self.upstream_url:
+            content = self.record_from_upstream(model, messages)
+        with self._lock:
+            self.stats[f"family:{family}"] += 1
+            self.stats["replayed" if content is not None else "templated"] += 1
+        if content is None:
+            # Seeded by the prompt so identical prompts get identical answers
+            rng = random.Random(int(key[:16], 16))
+            content = TEMPLATES[family](prompt, rng)
+        return family, content
+
+    def cached_tokens(self, prompt):
+        """Simulated provider prompt caching: longest previously seen block-aligned prefix."""
+        block = CACHE_BLOCK_TOKENS * CHARS_PER_TOKEN
+        boundaries = range(CACHE_MIN_TOKENS * CHARS_PER_TOKEN, len(prompt) + 1, block)
+        cached = 0
+        with self._lock:
+            for boundary in boundaries:
+                digest = hashlib.sha1(prompt[:boundary].encode("utf-8")).hexdigest()
+                if digest in self._prefix_cache:
+                    cached = boundary // CHARS_PER_TOKEN
+                    self._prefix_cache.move_to_end(digest)
+                else:
+                    self._prefix_cache[digest] = True
+            while len(self._prefix_cache) > 50000:
+                self._prefix_cache.popitem(last=False)
+        return cached
+
+    def fault(self, family):
+        """Return "error", "rate_limit", "stall" or None for this request."""
+        settings = self.settings(family)
+        with self._lock:
+            roll = self.random.random()
+        for fault in ("rate_limit", "error", "stall"):
+            rate = settings.get(f"{fault}_rate", 0)
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def delay(self, family, completion_tokens):
+        """Seconds to wait before the first byte, and per streamed token."""
+        settings = self.settings(family)
+        with self._lock:
+            jitter = self.random.uniform(0, settings.get("jitter_ms", 0))
+        first_byte = (settings.get("latency_ms", 0) + jitter) / 1000.0
+        per_token = settings.get("ms_per_token", 0) / 1000.0
+        return first_byte, per_token
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+class FakeLLMRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeLLM/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    @property
+    def fake(self):
+        return self.server.fake_llm
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.endswith("/models"):
+            models = ["gpt-4o-mini", "gpt-4"]
+            self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "fake"} for m in models]})
+        elif path == "/stats":
+            with self.fake._lock:
+                self._send_json(200, dict(self.fake.stats))
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        if path.endswith("/chat/completions"):
+            messages = request.get("messages") or []
+        elif path.endswith("/completions"):
+            messages = [{"role": "user", "content": request.get("prompt") or ""}]
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        model = request.get("model") or "gpt-4o-mini"
+        family, content = self.fake.respond(model, messages)
+        fault = self.fake.fault(family)
+        self.fake.count("requests")
+
+        if fault == "rate_limit":
+            self.fake.count("rate_limited")
+            self._send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "rate_limit_error"}},
+                            headers={"Retry-After": "1"})
+            return
+        if fault == "error":
+            self.fake.count("errors")
+            self._send_json(500, {"error": {"message": "Internal server error (fake)", "type": "server_error"}})
+            return
+
+        prompt = "\n".join(str(message.get("content") or "") for message in messages)
+        usage = {
+            "prompt_tokens": _count_tokens(prompt),
+            "completion_tokens": _count_tokens(content),
+            "prompt_tokens_details": {"cached_tokens": self.fake.cached_tokens(prompt)},
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        first_byte, per_token = self.fake.delay(family, usage["completion_tokens"])
+        if fault == "stall":
+            self.fake.count("stalled")
+            first_byte += self.fake.settings(family).get("stall_ms", 0) / 1000.0
+
+        chat = path.endswith("/chat/completions")
+        response_id = f"{'chatcmpl' if chat else 'cmpl'}-fake{hashlib.sha1(os.urandom(8)).hexdigest()[:20]}"
+        try:
+            if request.get("stream"):
+                self._stream(response_id, model, content, usage, first_byte, per_token, chat, request)
+            else:
+                time.sleep(first_byte + per_token * usage["completion_tokens"])
+                self._send_json(200, self._completion(response_id, model, content, usage, chat))
+        except (BrokenPipeError, ConnectionResetError):
+            # Client gave up (deadline or hedge loser); nothing left to do
+            self.fake.count("client_disconnects")
+
+    def _completion(self, response_id, model, content, usage, chat):
+        if chat:
+            choice = {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop", "logprobs": None}
+        else:
+            choice = {"index": 0, "text": content, "finish_reason": "stop", "logprobs": None}
+        return {
+            "id": response_id,
+            "object": "chat.completion" if chat else "text_completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [choice],
+            "usage": usage,
+        }
+
+    def _stream(self, response_id, model, content, usage, first_byte, per_token, chat, request):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(first_byte)
+
+        def send(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            base = {"id": response_id, "created": int(time.time()), "model": model}
+            if chat:
+                base.update(object="chat.completion.chunk",
+                            choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}])
+            else:
+                base.update(object="text_completion",
+                            choices=[{"index": 0, "text": delta.get("content", ""), "finish_reason": finish_reason, "logprobs": None}])
+            return base
+
+        if chat:
+            send(json.dumps(chunk({"role": "assistant", "content": ""})))
+        # Roughly one token per chunk
+        pieces = re.findall(r"\S*\s*", content)
+        for piece in pieces:
+            if not piece:
+                continue
+            send(json.dumps(chunk({"content": piece})))
+            if per_token:
+                time.sleep(per_token * max(1, len(piece) // CHARS_PER_TOKEN))
+        send(json.dumps(chunk({}, finish_reason="stop")))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            final = chunk({})
+            final["choices"] = []
+            final["usage"] = usage
+            send(json.dumps(final))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeLLMServer:
+    """
+    Fake OpenAI server running in a daemon thread.
+
+    Usage:
+        with FakeLLMServer(profile="realistic") as server:
+            os.environ["OPENAI_BASE_URL"] = server.base_url
+    """
+
+    def __init__(self, host=FAKE_LLM_HOST, port=FAKE_LLM_PORT, profile="instant", recordings_dir=RECORDINGS_DIR,
+                 seed=None, upstream_url=None):
+        self.fake_llm = FakeLLM(profile=profile, recordings_dir=recordings_dir, seed=seed, upstream_url=upstream_url)
+        self.httpd = ThreadingHTTPServer((host, port), FakeLLMRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake_llm = self.fake_llm
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def stats(self):
+        with self.fake_llm._lock:
+            return dict(self.fake_llm.stats)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-llm-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Fake LLM server listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def load_profile(value):
+    """Resolve a profile name or a path to a JSON profile file."""
+    if value in PROFILES:
+        return PROFILES[value]
+    with open(value, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server for offline benchmarks and load tests")
+    parser.add_argument("--host", default=FAKE_LLM_HOST)
+    parser.add_argument("--port", type=int, default=FAKE_LLM_PORT)
+    parser.add_argument("--profile", default="instant", help=f"One of {', '.join(PROFILES)} or a JSON profile file")
+    parser.add_argument("--recordings", default=RECORDINGS_DIR, help="Directory of recorded responses")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency and fault injection")
+    parser.add_argument("--record-upstream", default=None, metavar="URL",
+                        help="Record missing prompts from a real API (e.g. https://api.openai.com/v1) using OPENAI_API_KEY")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    server = FakeLLMServer(args.host, args.port, load_profile(args.profile), args.recordings, args.seed,
+                          upstream_url=args.record_upstream)
+    print(f"Fake LLM server on {server.base_url} (profile: {args.profile})")
+    print(f"Use: OPENAI_BASE_URL={server.base_url} OPENAI_API_KEY=fake")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
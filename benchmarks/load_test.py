@@ -0,0 +1,463 @@
+"""
+Concurrent-user load test for the Streamlit app.
+
+Each virtual user is a separate process that runs full journeys against
+app.py through Streamlit's AppTest, one fresh AppTest (and so one fresh
+session) per journey. AppTest instances in one process share Streamlit's
+runtime state and interfere with each other, so users are not run as threads.
+The users do share the fake LLM server, the job queue, the session store and
+the storage root, the state that replicas of a `streamlit run` deployment
+share:
+
+    load        first script run of a new session
+    scenario    enter a scenario and click "Generate Questions"
+    answers     submit an answers file; the app then chains validation,
+                structured JSON, Agent 3 and the Agent 2 baseline view
+    comparison  compare a prior-year document with the session's baseline
+
+AppTest cannot drive st.file_uploader, so the answers step sets the same
+session state the upload tab sets (file_answers + submit_clicked), and the
+comparison step calls the functions Agent 2's upload handler calls with an
+in-memory upload. Everything else goes through the real script.
+
+Failures where the app errored or never reached the expected state count
+against the step's error rate. Failures of the harness itself (a missing
+widget, a crashed user process) are reported separately as harness errors
+and do not count as app latency samples.
+
+By default the fake LLM server runs in the parent process, so the test is offline:
+
+    python -m benchmarks.load_test --users 8 --ramp 30 --duration 300 --profile realistic
+"""
+import io
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import datetime
+import tempfile
+import threading
+import multiprocessing
+from collections import defaultdict
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import DEFAULT_SEED, answers_file_text, generate_corpus
+from benchmarks.fake_llm_server import FakeLLMServer, load_profile
+from benchmarks.measure import LLMCallCollector, current_rss_bytes, git_revision, latency_summary
+
+logger = logging.getLogger(__name__)
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+JOURNEY_STEPS = ["load", "scenario", "answers", "comparison"]
+RESULT_SCHEMA_VERSION = 1
+# Pause between reruns while the app is still chaining stages after a step, such
+# as the background strategies job that the page only picks up when it reruns
+SETTLE_POLL_SECONDS = 0.5
+
+
+class JourneyError(Exception):
+    """The app errored, or a journey step did not reach the state it should have."""
+
+
+def _is_app_error(error):
+    # AppTest raises RuntimeError when a script run exceeds its timeout; that is app latency
+    return isinstance(error, JourneyError) or (isinstance(error, RuntimeError) and "timed out" in str(error))
+
+
+def _parse_answers_file(text):
+    # Same rules as app.process_answers_file: question/comment lines and blank
+    # lines separate answers
+    answers, current = [], []
+    for line in text.split("\n"):
+        line = line.strip()
+        if line.startswith(("Q", "Question", "#")) or not line:
+            if current:
+                answers.append("\n".join(current))
+                current = []
+        else:
+            current.append(line)
+    if current:
+        answers.append("\n".join(current))
+    return answers
+
+
+class _Upload(io.BytesIO):
+    """Minimal stand-in for Streamlit's UploadedFile."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def _prior_return_upload(scenario):
+    """The scenario's prior-year return as the file a user would upload (JSON or PDF)."""
+    prior = scenario["prior_return"]
+    if prior["source_type"] == "json":
+        return _Upload(json.dumps(prior["raw_data"]).encode("utf-8"), prior["file_name"])
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=11)
+    pdf.multi_cell(0, 6, prior["text_content"])
+    return _Upload(pdf.output(dest="S").encode("latin-1"), prior["file_name"])
+
+
+class VirtualUser:
+    """Runs journeys for one simulated browser session at a time, reporting events to a queue."""
+
+    def __init__(self, user_id, corpus, events, timeout):
+        self.user_id = user_id
+        self.corpus = corpus
+        self.events = events
+        self.timeout = timeout
+        self.journeys = 0
+        self.session_ids = set()
+
+    def _step(self, name, fn):
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            kind = "app" if _is_app_error(e) else "harness"
+            self.events.put(("step", name, time.perf_counter() - started, f"{type(e).__name__}: {e}", kind))
+            raise
+        self.events.put(("step", name, time.perf_counter() - started, None, None))
+        return result
+
+    def _settle(self, at, done):
+        deadline = time.perf_counter() + self.timeout
+        while not done(at) and not at.exception and time.perf_counter() < deadline:
+            time.sleep(SETTLE_POLL_SECONDS)
+            at.run(timeout=self.timeout)
+        if at.exception:
+            raise JourneyError(str(at.exception[0].value))
+        if not done(at):
+            raise JourneyError(f"App did not reach the expected state within {self.timeout:.0f}s")
+
+    def run_journey(self):
+        from streamlit.testing.v1 import AppTest
+
+        scenario = self.corpus[(self.user_id + self.journeys * 7) % len(self.corpus)]
+        self.journeys += 1
+        at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+
+        def load():
+            at.run()
+            if at.exception:
+                raise JourneyError(str(at.exception[0].value))
+            # Every journey must start a new session, not resume an earlier one
+            session_id = at.session_state["session_id"]
+            if session_id in self.session_ids or at.session_state["current_stage"] != "question_generation":
+                raise RuntimeError(f"Journey did not start from a fresh session ({session_id})")
+            self.session_ids.add(session_id)
+
+        def submit_scenario():
+            at.text_area(key="scenario_input").input(scenario["scenario"])
+            at.button(key="submit_scenario").click().run()
+            self._settle(at, lambda app: app.session_state["current_stage"] == "validation")
+
+        def submit_answers():
+            questions = [q.split(".", 1)[-1].strip() for q in at.session_state["all_questions"]]
+            at.session_state["file_answers"] = _parse_answers_file(answers_file_text(questions, scenario["answers"]))
+            at.session_state["submit_clicked"] = True
+            at.run()
+            self._settle(at, lambda app: "baseline_tax_calculation" in app.session_state)
+
+        def compare():
+            from agent2.utils.comparison_cache import cached_parse_previous_tax_returns, cached_tax_comparison
+            from shared.storage import make_namespace
+
+            parsed = cached_parse_previous_tax_returns([upload])
+            if "error" in parsed[0]:
+                raise JourneyError(parsed[0]["error"])
+            upload.seek(0)
+            result = cached_tax_comparison(
+                [upload],
+                current_year_data=at.session_state["baseline_tax_calculation"],
+                client_data={"name": "Tax Client", "tax_year": datetime.datetime.now().year},
+                namespace=make_namespace(at.session_state["session_id"]),
+            )
+            if "error" in result:
+                raise JourneyError(result["error"])
+
+        # Built up front so PDF generation isn't counted in the comparison step
+        upload = _prior_return_upload(scenario)
+        started = time.perf_counter()
+        try:
+            self._step("load", load)
+            self._step("scenario", submit_scenario)
+            self._step("answers", submit_answers)
+            self._step("comparison", compare)
+        except Exception as e:
+            logger.warning(f"User {self.user_id} journey failed: {type(e).__name__}: {str(e)}")
+            self.events.put(("journey", time.perf_counter() - started, "app" if _is_app_error(e) else "harness"))
+            return False
+        self.events.put(("journey", time.perf_counter() - started, None))
+        return True
+
+
+def _user_process(user_id, corpus, events, options):
+    """Entry point of a virtual user's process: run journeys until the deadline, then report LLM totals."""
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    collector = LLMCallCollector().install()
+    user = VirtualUser(user_id, corpus, events, options["step_timeout"])
+    events.put(("started", user_id, os.getpid()))
+    try:
+        while time.time() < options["stop_at"]:
+            user.run_journey()
+            if options["iterations"] and user.journeys >= options["iterations"]:
+                break
+            if options["think_time"]:
+                time.sleep(options["think_time"])
+    finally:
+        collector.uninstall()
+        events.put(("llm", collector.export()))
+        events.put(("finished", user_id, os.getpid()))
+
+
+class Recorder:
+    """Collects the events user processes send: step timings, errors, LLM totals and memory samples."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_messages = defaultdict(lambda: defaultdict(int))
+        self.harness_errors = defaultdict(lambda: defaultdict(int))
+        self.journey_latencies = []
+        self.journeys_ok = 0
+        self.journeys_failed = 0
+        self.journeys_harness_failed = 0
+        self.memory = []
+        self.user_pids = set()
+        self.llm = LLMCallCollector()
+        self._lock = threading.Lock()
+
+    def handle(self, event):
+        kind = event[0]
+        with self._lock:
+            if kind == "step":
+                _, step, seconds, error, error_kind = event
+                if error_kind == "harness":
+                    self.harness_errors[step][error[:200]] += 1
+                    return
+                self.latencies[step].append(seconds)
+                if error:
+                    self.errors[step] += 1
+                    self.error_messages[step][error[:200]] += 1
+            elif kind == "journey":
+                _, seconds, failure = event
+                if failure is None:
+                    self.journeys_ok += 1
+                    self.journey_latencies.append(seconds)
+                elif failure == "harness":
+                    self.journeys_harness_failed += 1
+                else:
+                    self.journeys_failed += 1
+            elif kind == "started":
+                self.user_pids.add(event[2])
+            elif kind == "finished":
+                self.user_pids.discard(event[2])
+        if kind == "llm":
+            self.llm.merge(event[1])
+
+    def harness_error(self, where, message):
+        with self._lock:
+            self.harness_errors[where][message[:200]] += 1
+
+    def sample_memory(self, started):
+        with self._lock:
+            pids = list(self.user_pids)
+        # The harness process (fake server, recorder) plus every live user process
+        rss = (current_rss_bytes() or 0) + sum(current_rss_bytes(pid) or 0 for pid in pids)
+        with self._lock:
+            self.memory.append({
+                "t": round(time.perf_counter() - started, 1),
+                "rss_mb": round(rss / (1024 * 1024), 1),
+                "active_users": len(pids),
+                "journeys_done": self.journeys_ok + self.journeys_failed + self.journeys_harness_failed,
+            })
+
+
+def run(args):
+    server = None
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+    else:
+        server = FakeLLMServer(port=0, profile=load_profile(args.profile), seed=args.seed).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-load-test-key")
+    if not args.keep_artifacts:
+        os.environ["STORAGE_ROOT"] = tempfile.mkdtemp(prefix="load-test-storage-")
+        os.environ.setdefault("COMPARISON_CACHE_DIR", tempfile.mkdtemp(prefix="load-test-cache-"))
+    # Fresh persistent state, so a run never replays jobs, sessions or shortlists
+    # finished by an earlier run instead of exercising the app, and load-test calls
+    # never show up as spend in the real cost ledger (user processes are spawned,
+    # so they read these settings when they import the app)
+    state_dir = tempfile.mkdtemp(prefix="load-test-state-")
+    os.environ["COST_LEDGER_PATH"] = os.path.join(state_dir, "cost_ledger.sqlite3")
+    os.environ["JOB_QUEUE_PATH"] = os.path.join(state_dir, "job_queue.sqlite3")
+    os.environ["SESSION_STORE_URL"] = "sqlite:///" + os.path.join(state_dir, "sessions.sqlite3")
+    os.environ["SCENARIO_INDEX_PATH"] = os.path.join(state_dir, "scenario_index.sqlite3")
+
+    # Every user process would otherwise try to bind the same metrics port
+    os.environ.setdefault("METRICS_ENABLED", "0")
+
+    corpus = generate_corpus(max(args.users * 2, 8), args.seed)
+    recorder = Recorder()
+    # Spawned (not forked) so each user starts with a clean interpreter and Streamlit runtime
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    options = {
+        "stop_at": time.time() + args.ramp + args.duration,
+        "iterations": args.iterations,
+        "think_time": args.think_time,
+        "step_timeout": args.step_timeout,
+    }
+    stop_event = threading.Event()
+
+    def drain_events():
+        while not stop_event.is_set() or not events.empty():
+            try:
+                recorder.handle(events.get(timeout=0.2))
+            except queue.Empty:
+                continue
+
+    started = time.perf_counter()
+
+    def sample_memory():
+        while not stop_event.wait(args.memory_interval):
+            recorder.sample_memory(started)
+
+    threads = [
+        threading.Thread(target=drain_events, name="load-test-events", daemon=True),
+        threading.Thread(target=sample_memory, name="memory-sampler", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    users = []
+    try:
+        for user_id in range(args.users):
+            process = context.Process(target=_user_process, args=(user_id, corpus, events, options),
+                                      name=f"virtual-user-{user_id}", daemon=True)
+            process.start()
+            users.append(process)
+            # Spread user starts evenly over the ramp period
+            if args.ramp and user_id < args.users - 1:
+                time.sleep(args.ramp / max(1, args.users - 1))
+        for process in users:
+            # A journey in progress at the deadline may run for a few more steps
+            process.join(timeout=max(0, options["stop_at"] - time.time()) + 4 * args.step_timeout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in users:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+                recorder.harness_error("process", f"{process.name} did not finish and was terminated")
+            elif process.exitcode:
+                recorder.harness_error("process", f"{process.name} exited with code {process.exitcode}")
+        recorder.sample_memory(started)
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - started
+        server_stats = server.stats if server is not None else None
+        if server is not None:
+            server.stop()
+
+    llm = recorder.llm.snapshot()
+    stages = {}
+    for step in JOURNEY_STEPS:
+        samples = recorder.latencies.get(step, [])
+        stages[step] = {
+            "latency_ms": latency_summary(samples),
+            "errors": recorder.errors.get(step, 0),
+            "error_rate": round(recorder.errors.get(step, 0) / len(samples), 4) if samples else 0,
+            "error_messages": dict(recorder.error_messages.get(step, {})),
+        }
+    completed = recorder.journeys_ok + recorder.journeys_failed
+    harness_errors = {where: dict(messages) for where, messages in recorder.harness_errors.items()}
+    memory = [sample["rss_mb"] for sample in recorder.memory]
+    return {
+        "schema_version": RESULT_SCHEMA_VERSION,
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "llm": "external" if args.base_url else f"fake:{args.profile}",
+            "users": args.users,
+            "ramp_s": args.ramp,
+            "duration_s": args.duration,
+            "seed": args.seed,
+        },
+        "wall_time_s": round(wall_time, 3),
+        "journeys": {
+            "completed": recorder.journeys_ok,
+            "failed": recorder.journeys_failed,
+            "error_rate": round(recorder.journeys_failed / completed, 4) if completed else 0,
+            "per_minute": round(recorder.journeys_ok / wall_time * 60, 2) if wall_time else 0,
+            "latency_ms": latency_summary(recorder.journey_latencies),
+        },
+        "stages": stages,
+        # Failures of the load-test harness itself, kept out of the app's error rates
+        "harness": {
+            "failed_journeys": recorder.journeys_harness_failed,
+            "errors": harness_errors,
+        },
+        "llm": llm,
+        "memory": {
+            "peak_rss_mb": max(memory) if memory else None,
+            "final_rss_mb": memory[-1] if memory else None,
+            "timeline": recorder.memory,
+        },
+        "fake_llm": server_stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test app.py with concurrent simulated user journeys")
+    parser.add_argument("--users", type=int, default=4, help="Concurrent virtual users")
+    parser.add_argument("--ramp", type=float, default=10.0, help="Seconds over which users are started")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to keep running after the ramp")
+    parser.add_argument("--iterations", type=int, default=0, help="Journeys per user (0 = until the duration ends)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Pause between a user's journeys")
+    parser.add_argument("--step-timeout", type=float, default=300.0, help="Seconds allowed per script run")
+    parser.add_argument("--memory-interval", type=float, default=1.0, help="Seconds between RSS samples")
+    parser.add_argument("--profile", default="realistic", help="Fake LLM latency profile name or JSON file")
+    parser.add_argument("--base-url", default=None, help="Use this OpenAI-compatible endpoint instead of the fake server")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--keep-artifacts", action="store_true", help="Use the configured storage and cache directories")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    journeys = results["journeys"]
+    print(f"journeys: {journeys['completed']} ok, {journeys['failed']} failed, {journeys['per_minute']}/min")
+    if results["harness"]["failed_journeys"] or results["harness"]["errors"]:
+        print(f"harness errors (not counted above): {results['harness']['failed_journeys']} journeys, "
+              f"{json.dumps(results['harness']['errors'])}")
+    for step, values in results["stages"].items():
+        latency = values["latency_ms"]
+        print(f"{step:<11} p50={latency.get('p50')}ms p95={latency.get('p95')}ms p99={latency.get('p99')}ms "
+              f"error_rate={values['error_rate']}")
+    print(f"peak RSS {results['memory']['peak_rss_mb']}MB; results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
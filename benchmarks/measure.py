@@ -0,0 +1,183 @@
+"""Measurement helpers shared by the benchmark and load-test harnesses."""
+import os
+import sys
+import math
+import time
+import threading
+import subprocess
+from collections import defaultdict
+
+from shared import llm_gateway
+
+# Which pipeline stage each gateway call site belongs to
+STAGE_CALL_SITES = {
+    "question_generation": "clarification",
+    "question_generation_backup": "clarification",
+    "validation": "clarification",
+    "json_generation": "clarification",
+    "json_generation_retry": "clarification",
+    "strategy_scoring": "strategies",
+    "strategy_scoring_batch": "strategies",
+    "baseline": "strategies",
+    "analysis": "strategies",
+    "html_conversion": "read_baseline",
+    "comparison": "comparison",
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(fraction * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean/max in milliseconds for a list of durations in seconds."""
+    if not seconds:
+        return {"count": 0}
+    millis = [value * 1000 for value in seconds]
+    return {
+        "count": len(millis),
+        "p50": round(percentile(millis, 0.50), 2),
+        "p95": round(percentile(millis, 0.95), 2),
+        "p99": round(percentile(millis, 0.99), 2),
+        "mean": round(sum(millis) / len(millis), 2),
+        "max": round(max(millis), 2),
+    }
+
+
+def current_rss_bytes(pid=None):
+    """Resident set size of a process (this one by default), or None if unknown."""
+    pid = pid or os.getpid()
+    try:
+        import psutil
+
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if pid == os.getpid():
+        import resource
+
+        # ru_maxrss is a lifetime peak (KiB on Linux, bytes on macOS); best effort only
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+class RSSSampler:
+    """Samples RSS in a background thread and keeps the peak since the last reset."""
+
+    def __init__(self, interval=0.01, pid=None):
+        self.interval = interval
+        self.pid = pid
+        self.peak = 0
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss_bytes(self.pid)
+            if rss is None:
+                continue
+            with self._lock:
+                self.peak = max(self.peak, rss)
+                self.samples.append((time.time(), rss))
+
+    def reset(self):
+        """Start a new peak window and return the RSS at its start."""
+        rss = current_rss_bytes(self.pid) or 0
+        with self._lock:
+            self.peak = rss
+        return rss
+
+    def read_peak(self):
+        rss = current_rss_bytes(self.pid) or 0
+        with self._lock:
+            self.peak = max(self.peak, rss)
+            return self.peak
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+class LLMCallCollector:
+    """Gateway observer that totals calls, tokens and successful call latency per pipeline stage."""
+
+    def __init__(self):
+        self.totals = defaultdict(lambda: defaultdict(int))
+        self.latencies = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        stage = STAGE_CALL_SITES.get(record.get("call_site"), record.get("call_site", "unknown"))
+        with self._lock:
+            totals = self.totals[stage]
+            # Discarded hedge copies are extra requests, not extra calls, but their tokens are billed
+            totals["calls"] += 0 if record.get("outcome") == "discarded" else 1
+            totals[f"outcome_{record.get('outcome')}"] += 1
+            totals["attempts"] += record.get("attempts") or 0
+            if record.get("outcome") == "ok" and record.get("latency") is not None:
+                self.latencies[stage].append(record["latency"])
+            totals["hedged"] += 1 if record.get("hedged") and record.get("outcome") == "ok" else 0
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                totals[key] += record.get(key) or 0
+
+    def install(self):
+        llm_gateway.add_observer(self)
+        return self
+
+    def uninstall(self):
+        llm_gateway.remove_observer(self)
+
+    def export(self):
+        """Raw totals and latencies, for sending to another process."""
+        with self._lock:
+            return {
+                "totals": {stage: dict(values) for stage, values in self.totals.items()},
+                "latencies": {stage: list(values) for stage, values in self.latencies.items()},
+            }
+
+    def merge(self, exported):
+        """Add totals and latencies exported by a collector in another process."""
+        with self._lock:
+            for stage, values in exported["totals"].items():
+                for key, value in values.items():
+                    self.totals[stage][key] += value
+            for stage, values in exported["latencies"].items():
+                self.latencies[stage].extend(values)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {**values, "latency_ms": latency_summary(self.latencies[stage])}
+                for stage, values in self.totals.items()
+            }
+
+
+def git_revision():
+    """Current commit hash and dirty flag, for labelling result files."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                    capture_output=True, text=True, timeout=30).stdout.strip())
+        return {"commit": commit or None, "dirty": dirty}
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "dirty": None}
@@ -0,0 +1,265 @@
+"""
+End-to-end pipeline benchmark.
+
+Runs every scenario of the synthetic corpus through the four pipeline stages:
+
+    clarification   ScenarioClarificationAgent.clarify_and_structure (questions,
+                    answers, validation, structured JSON)
+    strategies      Tax_Stratigies_Agent.process_tax_scenario
+    read_baseline   read_tax_calculation_file on the session's baseline
+    comparison      generate_tax_comparison against the scenario's prior return
+
+and writes latency percentiles, LLM calls and tokens per session and peak RSS
+per stage as JSON. By default it starts the fake LLM server in-process, so no
+API key is needed:
+
+    python -m benchmarks.pipeline_benchmark --scenarios 24 --profile realistic --output results.json
+    python -m benchmarks.compare_results baseline.json results.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import datetime
+import tempfile
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import DEFAULT_CORPUS_SIZE, DEFAULT_SEED, generate_corpus
+from benchmarks.fake_llm_server import FakeLLMServer, load_profile
+from benchmarks.measure import LLMCallCollector, RSSSampler, git_revision, latency_summary
+from shared.cost_ledger import CostLedger, set_ledger
+from shared.prompts import check_prompts
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["clarification", "strategies", "read_baseline", "comparison"]
+RESULT_SCHEMA_VERSION = 1
+# Rounds of follow-up answers before a session is counted as stuck in clarification
+MAX_CLARIFICATION_ROUNDS = 4
+
+
+def _is_error(result):
+    if isinstance(result, dict):
+        return "error" in result
+    return not isinstance(result, list)
+
+
+def _questions(response_text):
+    lines = [line.strip() for line in response_text.split("\n")]
+    return [line for line in lines if line and any(line.startswith(str(i)) for i in range(1, 30))]
+
+
+def run_clarification(api_key, scenario):
+    """Drive Agent 1 the way the app does: questions, then answers until complete."""
+    from agent1.main import ScenarioClarificationAgent
+
+    agent = ScenarioClarificationAgent(openai_api_key=api_key)
+    response = agent.clarify_and_structure(scenario["scenario"])
+    questions = _questions(response["response"])
+
+    clarifications = []
+    for question, answer in zip(questions, scenario["answers"]):
+        clarifications.extend([question, answer])
+
+    for _ in range(MAX_CLARIFICATION_ROUNDS):
+        response = agent.clarify_and_structure(scenario["scenario"], clarifications)
+        if response["status"] == "complete":
+            return {"client_json": response["response"]}
+        clarifications.extend([response["response"], "Not applicable."])
+    return {"error": "Clarification did not complete"}
+
+
+class PipelineBenchmark:
+    """Runs scenarios stage by stage, timing each stage and sampling RSS."""
+
+    def __init__(self, api_key, collector, sampler):
+        from agent3.main import Tax_Stratigies_Agent
+
+        self.api_key = api_key
+        self.collector = collector
+        self.sampler = sampler
+        self.strategies_agent = Tax_Stratigies_Agent(openai_api_key=api_key)
+        self.latencies = {stage: [] for stage in STAGES}
+        self.errors = {stage: 0 for stage in STAGES}
+        self.peak_rss = {stage: 0 for stage in STAGES}
+        self.rss_growth = {stage: 0 for stage in STAGES}
+
+    def _timed(self, stage, fn, record=True):
+        start_rss = self.sampler.reset()
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            logger.error(f"Stage {stage} raised: {str(e)}")
+            result = {"error": str(e)}
+        elapsed = time.perf_counter() - started
+        peak = self.sampler.read_peak()
+        if record:
+            self.latencies[stage].append(elapsed)
+            self.peak_rss[stage] = max(self.peak_rss[stage], peak)
+            self.rss_growth[stage] = max(self.rss_growth[stage], peak - start_rss)
+            if _is_error(result):
+                self.errors[stage] += 1
+        return result
+
+    def run_session(self, scenario, run_id, record=True):
+        from agent2.utils.tax_file_reader import read_tax_calculation_file
+        from agent2.utils.tax_comparison import generate_tax_comparison
+        from shared.storage import make_namespace
+
+        session_id = f"{run_id}-{scenario['id']}"
+        clarified = self._timed("clarification", lambda: run_clarification(self.api_key, scenario), record)
+        if "error" in clarified:
+            return
+
+        strategies = self._timed(
+            "strategies",
+            lambda: self.strategies_agent.process_tax_scenario(clarified["client_json"], session_id=session_id),
+            record,
+        )
+        if _is_error(strategies):
+            return
+
+        baseline = self._timed("read_baseline", lambda: read_tax_calculation_file(strategies["baseline_path"]), record)
+        if _is_error(baseline):
+            return
+
+        client_data = {"name": scenario["id"], "tax_year": scenario["profile"]["tax_year"]}
+        self._timed(
+            "comparison",
+            lambda: generate_tax_comparison(scenario["prior_return"], baseline, client_data,
+                                            namespace=make_namespace(session_id)),
+            record,
+        )
+
+    def results(self, sessions):
+        llm = self.collector.snapshot()
+        stages = {}
+        for stage in STAGES:
+            totals = llm.get(stage, {})
+            prompt_tokens = totals.get("prompt_tokens", 0)
+            stages[stage] = {
+                "latency_ms": latency_summary(self.latencies[stage]),
+                "errors": self.errors[stage],
+                "llm_calls_per_session": round(totals.get("calls", 0) / sessions, 3) if sessions else 0,
+                "llm_attempts": totals.get("attempts", 0),
+                "llm_hedged": totals.get("hedged", 0),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": totals.get("completion_tokens", 0),
+                "cached_tokens": totals.get("cached_tokens", 0),
+                "cached_ratio": round(totals.get("cached_tokens", 0) / prompt_tokens, 3) if prompt_tokens else 0.0,
+                "peak_rss_mb": round(self.peak_rss[stage] / (1024 * 1024), 1),
+                "rss_growth_mb": round(self.rss_growth[stage] / (1024 * 1024), 1),
+            }
+        return stages
+
+
+def run(args):
+    # Configure the process before the agent and storage modules are imported
+    server = None
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+    else:
+        server = FakeLLMServer(port=0, profile=load_profile(args.profile), seed=args.seed).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-benchmark-key")
+    if not args.keep_artifacts:
+        os.environ["STORAGE_ROOT"] = tempfile.mkdtemp(prefix="benchmark-storage-")
+    # A fresh near-duplicate index per run: reusing an earlier run's shortlists and
+    # question lists would make identical runs report different call counts. Fake
+    # calls go to a throwaway cost ledger so they never mix with real spend.
+    state_dir = tempfile.mkdtemp(prefix="benchmark-state-")
+    os.environ["SCENARIO_INDEX_PATH"] = os.path.join(state_dir, "scenario_index.sqlite3")
+    set_ledger(CostLedger(path=os.path.join(state_dir, "cost_ledger.sqlite3")))
+
+    if args.metrics_port:
+        from shared.metrics import ensure_metrics_server
+
+        ensure_metrics_server(port=args.metrics_port)
+
+    collector = LLMCallCollector()
+    sampler = RSSSampler().start()
+    corpus = generate_corpus(args.scenarios, args.seed)
+    run_id = datetime.datetime.now().strftime("bench%Y%m%d%H%M%S")
+
+    try:
+        benchmark = PipelineBenchmark(os.environ["OPENAI_API_KEY"], collector, sampler)
+        # Warm-up sessions load modules and fill connection pools without being measured
+        for scenario in corpus[:args.warmup]:
+            benchmark.run_session(scenario, f"{run_id}-warmup", record=False)
+
+        collector.install()
+        started = time.perf_counter()
+        for index, scenario in enumerate(corpus, 1):
+            benchmark.run_session(scenario, run_id)
+            logger.info(f"Completed {index}/{len(corpus)} sessions")
+        wall_time = time.perf_counter() - started
+    finally:
+        collector.uninstall()
+        sampler.stop()
+        if server is not None:
+            server.stop()
+
+    return {
+        "schema_version": RESULT_SCHEMA_VERSION,
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "llm": "external" if args.base_url else f"fake:{args.profile}",
+            "scenarios": len(corpus),
+            "seed": args.seed,
+            "warmup": args.warmup,
+        },
+        "wall_time_s": round(wall_time, 3),
+        "sessions_per_minute": round(len(corpus) / wall_time * 60, 2) if wall_time else None,
+        "stages": benchmark.results(len(corpus)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tax pipeline stages on a synthetic scenario corpus")
+    parser.add_argument("--scenarios", type=int, default=DEFAULT_CORPUS_SIZE, help="Number of synthetic scenarios")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Corpus and fake-server seed")
+    parser.add_argument("--profile", default="instant", help="Fake LLM latency profile name or JSON file")
+    parser.add_argument("--base-url", default=None, help="Use this OpenAI-compatible endpoint instead of the fake server")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured warm-up sessions")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port while running")
+    parser.add_argument("--keep-artifacts", action="store_true", help="Write reports to STORAGE_ROOT instead of a temp dir")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+
+    # Cached-token ratios only mean something if every prompt's static prefix is
+    # byte-identical across clients; a template that breaks that fails the run
+    problems = check_prompts()
+    for problem in problems:
+        print(f"Prompt prefix check failed: {problem}")
+    if problems:
+        return 1
+
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    for stage, values in results["stages"].items():
+        latency = values["latency_ms"]
+        print(
+            f"{stage:<14} p50={latency.get('p50')}ms p95={latency.get('p95')}ms p99={latency.get('p99')}ms "
+            f"calls/session={values['llm_calls_per_session']} errors={values['errors']} peak_rss={values['peak_rss_mb']}MB"
+        )
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
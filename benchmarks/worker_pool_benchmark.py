@@ -0,0 +1,197 @@
+"""
+Throughput of CPU-bound stages on the worker pool versus inline threads.
+
+Simulated sessions submit document work from threads, the way concurrent
+Streamlit sessions do. The "inline" row runs the same work on those threads
+under the GIL; the other rows run it on shared.worker_pool.WorkerPool with
+1, 2, 4 ... processes, so the speedup column shows how throughput scales
+with cores.
+
+Tasks:
+    metrics   regex metric extraction (comparison_engine.extract_metrics) on large text documents
+    pdf       FPDF multi-year report rendering followed by PyPDF2 text extraction (needs fpdf and PyPDF2)
+
+    python -m benchmarks.worker_pool_benchmark --task metrics --tasks 64 --doc-kb 256
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import platform
+from concurrent.futures import ThreadPoolExecutor
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import DEFAULT_SEED, generate_corpus
+from benchmarks.measure import git_revision, latency_summary
+from shared.worker_pool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+RESULT_SCHEMA_VERSION = 1
+TASKS = ["metrics", "pdf"]
+
+# Filler prose between labelled lines; the parsers scan it but match nothing
+FILLER = (
+    "The taxpayer reported wages, interest and a small amount of business activity during the year. "
+    "Supporting schedules were attached and reviewed for consistency with prior filings.\n"
+)
+
+
+def _document_text(prior_return, size_kb):
+    """A text document of about size_kb with the prior return's figures spread through it."""
+    raw = prior_return.get("raw_data") or {}
+    income = raw.get("total_income", 85000)
+    lines = [
+        f"Total Income: ${income:,}",
+        f"Adjusted Gross Income: ${raw.get('adjusted_gross_income', round(income * 0.9)):,}",
+        f"Taxable Income: ${raw.get('taxable_income', round(income * 0.7)):,}",
+        f"Federal Tax: ${raw.get('federal_tax', round(income * 0.12)):,}",
+        f"State Tax: ${raw.get('state_tax', round(income * 0.04)):,}",
+        "Effective Tax Rate: 14.2%",
+    ]
+    block = "\n".join(lines) + "\n" + FILLER * 8
+    return block * max(1, (size_kb * 1024) // len(block))
+
+
+def metrics_task(text):
+    from agent2.utils.comparison_engine import extract_metrics
+
+    return extract_metrics({"source_type": "text", "text_content": text})
+
+
+def pdf_task(comparison_data):
+    from agent2.utils.document_processing import extract_document, render_multi_year_report
+
+    pdf_bytes, _ = render_multi_year_report(comparison_data, {"name": "Benchmark Client"})
+    result = extract_document("report.pdf", pdf_bytes)
+    return {"bytes": len(pdf_bytes), "pages": result.get("page_count")}
+
+
+def _pdf_input(corpus, rows):
+    """A multi-year comparison matrix with the given number of metric rows."""
+    years = [str(2019 + index) for index in range(5)] + ["Baseline"]
+    metrics = []
+    for index in range(rows):
+        base = 40000 + (index * 1733) % 90000
+        values = [base + year * 1250 for year in range(len(years))]
+        metrics.append({
+            "label": f"Metric {index + 1} ({corpus[index % len(corpus)]['profile']['state']})",
+            "values": values,
+            "difference": values[-1] - values[0],
+            "percent_change": (values[-1] - values[0]) / values[0] * 100,
+            "trend": "up",
+        })
+    return {"year_labels": years, "key_metrics": metrics}
+
+
+def _inputs(args):
+    corpus = generate_corpus(max(args.tasks, 1), args.seed)
+    if args.task == "metrics":
+        return metrics_task, [_document_text(item["prior_return"], args.doc_kb) for item in corpus[:args.tasks]]
+    return pdf_task, [_pdf_input(corpus, args.pdf_rows)] * args.tasks
+
+
+def _drive(run, fn, inputs, clients):
+    """Run every input through run(fn, item) from `clients` threads; returns (wall seconds, latencies)."""
+    latencies = []
+
+    def one(item):
+        started = time.perf_counter()
+        run(fn, item)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(one, inputs))
+    return time.perf_counter() - started, latencies
+
+
+def _worker_counts(max_workers):
+    counts, count = [], 1
+    while count < max_workers:
+        counts.append(count)
+        count *= 2
+    return counts + [max_workers]
+
+
+def run(args):
+    fn, inputs = _inputs(args)
+    # Fail early, in-process, if the task's libraries are missing
+    fn(inputs[0])
+
+    rows = []
+    wall, latencies = _drive(lambda task, item: task(item), fn, inputs, args.clients)
+    rows.append({"mode": "inline", "workers": 0, "wall_time_s": wall, "latency_ms": latency_summary(latencies)})
+
+    for workers in _worker_counts(args.max_workers):
+        pool = WorkerPool(processes=workers, max_pending=max(workers * 4, args.clients))
+        try:
+            pool.warm()
+            wall, latencies = _drive(pool.run, fn, inputs, args.clients)
+        finally:
+            pool.shutdown()
+        rows.append({"mode": "process", "workers": workers, "wall_time_s": wall, "latency_ms": latency_summary(latencies)})
+        logger.info(f"{workers} worker(s): {len(inputs) / wall:.2f} tasks/s")
+
+    single = next(row for row in rows if row["workers"] == 1)
+    for row in rows:
+        row["tasks_per_second"] = round(len(inputs) / row["wall_time_s"], 3)
+        row["speedup_vs_one_worker"] = round(single["wall_time_s"] / row["wall_time_s"], 2)
+        row["wall_time_s"] = round(row["wall_time_s"], 3)
+
+    return {
+        "schema_version": RESULT_SCHEMA_VERSION,
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "task": args.task,
+            "tasks": len(inputs),
+            "clients": args.clients,
+            "doc_kb": args.doc_kb if args.task == "metrics" else None,
+            "pdf_rows": args.pdf_rows if args.task == "pdf" else None,
+        },
+        "results": rows,
+    }
+
+
+def main(argv=None):
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Measure CPU-bound stage throughput on the worker pool")
+    parser.add_argument("--task", choices=TASKS, default="metrics", help="Workload to run")
+    parser.add_argument("--tasks", type=int, default=64, help="Number of tasks per configuration")
+    parser.add_argument("--clients", type=int, default=cpu_count * 2, help="Concurrent submitting threads (sessions)")
+    parser.add_argument("--max-workers", type=int, default=cpu_count, help="Largest pool size to measure")
+    parser.add_argument("--doc-kb", type=int, default=256, help="Size of each metrics document in KB")
+    parser.add_argument("--pdf-rows", type=int, default=200, help="Metric rows per rendered PDF")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Corpus seed")
+    parser.add_argument("--output", default="worker_pool_results.json", help="Where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    for row in results["results"]:
+        label = "inline" if row["mode"] == "inline" else f"{row['workers']} proc"
+        print(
+            f"{label:<8} {row['tasks_per_second']:>8.2f} tasks/s  speedup={row['speedup_vs_one_worker']:.2f}x  "
+            f"p50={row['latency_ms'].get('p50')}ms p95={row['latency_ms'].get('p95')}ms"
+        )
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+"""
+Token and cost ledger for LLM calls.
+
+Every request that goes through shared.llm_gateway is written to a local
+SQLite database with its model, tokens, latency and computed cost, attributed
+to the session, client and pipeline stage that made it. Budgets per session
+and per client are checked before each call and either refuse the call or
+downgrade it to a cheaper model.
+
+    python -m shared.cost_ledger report --by prompt_family --top 10
+    python -m shared.cost_ledger report --by stage --session <session_id>
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+COST_LEDGER_ENABLED = os.getenv("COST_LEDGER_ENABLED", "1").lower() not in ("0", "false", "no")
+COST_LEDGER_PATH = os.getenv("COST_LEDGER_PATH", os.path.join("cache", "cost_ledger.sqlite3"))
+
+# USD per million tokens: input, cached input, output. Models are matched by
+# longest prefix, so dated snapshots (gpt-4o-mini-2024-07-18) share a price.
+DEFAULT_PRICING = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4-turbo": {"input": 10.00, "cached_input": 10.00, "output": 30.00},
+    "gpt-4": {"input": 30.00, "cached_input": 30.00, "output": 60.00},
+    "gpt-3.5-turbo": {"input": 0.50, "cached_input": 0.50, "output": 1.50},
+}
+LLM_PRICING = {**DEFAULT_PRICING, **json.loads(os.getenv("LLM_PRICING", "{}"))}
+
+# Budgets in USD; unset means unlimited
+LLM_BUDGET_SESSION_USD = float(os.getenv("LLM_BUDGET_SESSION_USD", "0")) or None
+LLM_BUDGET_CLIENT_USD = float(os.getenv("LLM_BUDGET_CLIENT_USD", "0")) or None
+# "stop" refuses calls over budget; "downgrade" switches to LLM_DOWNGRADE_MODELS
+# and only stops when there is nothing cheaper left
+LLM_BUDGET_ACTION = os.getenv("LLM_BUDGET_ACTION", "downgrade").lower()
+LLM_DOWNGRADE_MODELS = {
+    "gpt-4": "gpt-4o-mini",
+    "gpt-4-turbo": "gpt-4o-mini",
+    "gpt-4o": "gpt-4o-mini",
+    **json.loads(os.getenv("LLM_DOWNGRADE_MODELS", "{}")),
+}
+
+# Call sites grouped into the prompt that produced them, for reporting
+PROMPT_FAMILIES = {
+    "question_generation": "question_generation",
+    "question_generation_backup": "question_generation",
+    "validation": "validation",
+    "json_generation": "json_generation",
+    "json_generation_retry": "json_generation",
+    "strategy_scoring": "strategy_scoring",
+    "strategy_scoring_batch": "strategy_scoring",
+    "baseline": "baseline",
+    "analysis": "strategy_analysis",
+    "html_conversion": "html_conversion",
+    "comparison": "comparison",
+}
+
+REPORT_GROUPS = ("prompt_family", "stage", "model", "session_id", "client_id")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    session_id TEXT,
+    client_id TEXT,
+    stage TEXT NOT NULL,
+    prompt_family TEXT NOT NULL,
+    model TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    hedged INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL,
+    cost_usd REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS llm_calls_session ON llm_calls (session_id);
+CREATE INDEX IF NOT EXISTS llm_calls_client ON llm_calls (client_id);
+CREATE INDEX IF NOT EXISTS llm_calls_created ON llm_calls (created_at);
+"""
+
+_scope = contextvars.ContextVar("cost_scope", default=(None, None))
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised before an LLM call when the session or client budget is spent."""
+
+
+def bind_scope(session_id=None, client_id=None):
+    """
+    Attribute LLM calls made by the current thread to a session and client.
+
+    Streamlit runs each rerun in its own thread, so app.py calls this at the
+    top of every run.
+    """
+    _scope.set((session_id, client_id))
+
+
+@contextmanager
+def cost_scope(session_id=None, client_id=None):
+    """Attribute LLM calls made inside the block to a session and client."""
+    token = _scope.set((session_id, client_id))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope():
+    """The (session_id, client_id) calls are currently attributed to."""
+    return _scope.get()
+
+
+def prompt_family(call_site):
+    return PROMPT_FAMILIES.get(call_site, call_site)
+
+
+def model_pricing(model):
+    """Pricing entry for the longest matching model prefix, or None."""
+    matches = [name for name in LLM_PRICING if model == name or model.startswith(name + "-")]
+    if not matches:
+        return None
+    return LLM_PRICING[max(matches, key=len)]
+
+
+def compute_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """
+    Cost of one request in USD.
+
+    Args:
+        model (str): Model name
+        prompt_tokens (int): Prompt tokens, including cached ones
+        completion_tokens (int): Completion tokens
+        cached_tokens (int): Prompt tokens served from the provider's prefix cache
+
+    Returns:
+        float: Cost in USD (0 for models without pricing)
+    """
+    pricing = model_pricing(model)
+    if pricing is None:
+        return 0.0
+    cached_tokens = min(cached_tokens or 0, prompt_tokens or 0)
+    uncached = (prompt_tokens or 0) - cached_tokens
+    return (
+        uncached * pricing["input"]
+        + cached_tokens * pricing.get("cached_input", pricing["input"])
+        + (completion_tokens or 0) * pricing["output"]
+    ) / 1_000_000
+
+
+class CostLedger:
+    """SQLite-backed record of every LLM call, with per-session and per-client budgets."""
+
+    def __init__(self, path=COST_LEDGER_PATH, session_budget=LLM_BUDGET_SESSION_USD,
+                 client_budget=LLM_BUDGET_CLIENT_USD, budget_action=LLM_BUDGET_ACTION):
+        self.path = path
+        self.session_budget = session_budget
+        self.client_budget = client_budget
+        self.budget_action = budget_action
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        # Running spend per session/client, loaded from the database on first use
+        self._spend = {}
+        self._warned_models = set()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # -- recording -----------------------------------------------------------
+
+    def record(self, record):
+        """
+        Gateway observer: write one LLM request to the ledger.
+
+        Args:
+            record (dict): Record emitted by shared.llm_gateway
+        """
+        session_id, client_id = current_scope()
+        model = record.get("model") or "unknown"
+        prompt_tokens = record.get("prompt_tokens") or 0
+        completion_tokens = record.get("completion_tokens") or 0
+        cached_tokens = record.get("cached_tokens") or 0
+        if model_pricing(model) is None and model not in self._warned_models:
+            self._warned_models.add(model)
+            logger.warning(f"No pricing for model {model}; its calls are recorded at $0")
+        cost = compute_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        latency = record.get("latency")
+        call_site = record.get("call_site", "unknown")
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO llm_calls (created_at, session_id, client_id, stage, prompt_family, model, outcome, "
+                "attempts, hedged, prompt_tokens, completion_tokens, cached_tokens, latency_ms, cost_usd) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(), session_id, client_id, call_site, prompt_family(call_site), model,
+                    record.get("outcome", "ok"), record.get("attempts", 1), int(bool(record.get("hedged"))),
+                    prompt_tokens, completion_tokens, cached_tokens,
+                    round(latency * 1000, 3) if latency is not None else None, cost,
+                ),
+            )
+            for key in (("session_id", session_id), ("client_id", client_id)):
+                if key in self._spend:
+                    self._spend[key] += cost
+
+    # -- budgets -------------------------------------------------------------
+
+    def spent(self, column, value):
+        """Total USD spent by a session_id or client_id."""
+        key = (column, value)
+        with self._lock:
+            if key not in self._spend:
+                row = self._conn.execute(
+                    f"SELECT COALESCE(SUM(cost_usd), 0) FROM llm_calls WHERE {column} = ?", (value,)
+                ).fetchone()
+                self._spend[key] = row[0]
+            return self._spend[key]
+
+    def over_budget(self):
+        """
+        Check the current scope against its budgets.
+
+        Returns:
+            str: Description of the exceeded budget, or None
+        """
+        session_id, client_id = current_scope()
+        if session_id and self.session_budget is not None:
+            spent = self.spent("session_id", session_id)
+            if spent >= self.session_budget:
+                return f"session {session_id} spent ${spent:.4f} of ${self.session_budget:.4f}"
+        if client_id and self.client_budget is not None:
+            spent = self.spent("client_id", client_id)
+            if spent >= self.client_budget:
+                return f"client {client_id} spent ${spent:.4f} of ${self.client_budget:.4f}"
+        return None
+
+    def enforce_budget(self, call_site, model):
+        """
+        Decide which model a call may use under the current budgets.
+
+        Args:
+            call_site (str): Pipeline stage making the call
+            model (str): Requested model
+
+        Returns:
+            str: The requested model, or a cheaper one when over budget
+
+        Raises:
+            BudgetExceeded: If over budget and the call cannot be downgraded
+        """
+        exceeded = self.over_budget()
+        if exceeded is None:
+            return model
+        cheaper = LLM_DOWNGRADE_MODELS.get(model) if self.budget_action == "downgrade" else None
+        if cheaper:
+            logger.warning(f"Budget exceeded ({exceeded}); downgrading {call_site} from {model} to {cheaper}")
+            return cheaper
+        raise BudgetExceeded(f"LLM budget exceeded ({exceeded}); refusing {call_site} call to {model}")
+
+    # -- reporting -----------------------------------------------------------
+
+    def summary(self, group_by="prompt_family", session_id=None, client_id=None, since=None, limit=None):
+        """
+        Aggregate calls, tokens, latency and cost, and the share of prompt
+        tokens that were served from the provider's prefix cache.
+
+        Args:
+            group_by (str): One of REPORT_GROUPS
+            session_id (str, optional): Only this session
+            client_id (str, optional): Only this client
+            since (float, optional): Only calls after this Unix timestamp
+            limit (int, optional): Top N groups by cost
+
+        Returns:
+            list: One dict per group, most expensive first
+        """
+        if group_by not in REPORT_GROUPS:
+            raise ValueError(f"group_by must be one of {', '.join(REPORT_GROUPS)}")
+        conditions, params = [], []
+        for column, value in (("session_id", session_id), ("client_id", client_id)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = (
+            f"SELECT {group_by} AS name, COUNT(*) AS calls, SUM(outcome = 'error') AS errors, "
+            "SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens, "
+            "SUM(cached_tokens) AS cached_tokens, AVG(latency_ms) AS mean_latency_ms, SUM(cost_usd) AS cost_usd "
+            f"FROM llm_calls {where} GROUP BY {group_by} ORDER BY cost_usd DESC"
+        )
+        if limit:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = [dict(row) for row in self._conn.execute(query, params).fetchall()]
+        for row in rows:
+            # Share of prompt tokens served from the provider's prefix cache
+            row["cached_ratio"] = (row["cached_tokens"] or 0) / row["prompt_tokens"] if row["prompt_tokens"] else 0.0
+        return rows
+
+    def total(self, session_id=None, client_id=None, since=None):
+        """Total USD spent, optionally for one session or client."""
+        return sum(row["cost_usd"] or 0 for row in self.summary("model", session_id, client_id, since))
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """
+    Return the process-wide ledger.
+
+    Returns:
+        CostLedger: The shared ledger, or None if COST_LEDGER_ENABLED is off
+    """
+    global _ledger
+    if not COST_LEDGER_ENABLED:
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = CostLedger()
+        return _ledger
+
+
+def set_ledger(ledger):
+    """Replace the process-wide ledger (e.g. a throwaway one in benchmarks), closing the old one."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is not None and _ledger is not ledger:
+            _ledger.close()
+        _ledger = ledger
+
+
+def enforce_budget(call_site, model):
+    """Module-level shortcut for CostLedger.enforce_budget on the shared ledger."""
+    ledger = get_ledger()
+    if ledger is None:
+        return model
+    return ledger.enforce_budget(call_site, model)
+
+
+def record_call(record):
+    """Gateway observer that writes to the shared ledger."""
+    ledger = get_ledger()
+    if ledger is not None:
+        ledger.record(record)
+
+
+def _print_report(rows, group_by):
+    total = sum(row["cost_usd"] or 0 for row in rows) or 1
+    print(f"{group_by:<28} {'calls':>7} {'errors':>7} {'prompt':>11} {'completion':>11} {'cached':>10} "
+          f"{'cached %':>9} {'mean ms':>9} {'cost $':>10} {'share':>7}")
+    for row in rows:
+        print(
+            f"{str(row['name']):<28} {row['calls']:>7} {row['errors'] or 0:>7} {row['prompt_tokens'] or 0:>11} "
+            f"{row['completion_tokens'] or 0:>11} {row['cached_tokens'] or 0:>10} "
+            f"{row['cached_ratio'] * 100:>8.1f}% {row['mean_latency_ms'] or 0:>9.0f} "
+            f"{row['cost_usd'] or 0:>10.4f} {(row['cost_usd'] or 0) / total * 100:>6.1f}%"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LLM token and cost ledger")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="Show the top cost drivers")
+    report.add_argument("--by", default="prompt_family", choices=REPORT_GROUPS, help="Grouping")
+    report.add_argument("--top", type=int, default=10, help="Number of groups to show")
+    report.add_argument("--session", default=None, help="Only this session ID")
+    report.add_argument("--client", default=None, help="Only this client ID")
+    report.add_argument("--days", type=float, default=None, help="Only calls from the last N days")
+    report.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    report.add_argument("--db", default=COST_LEDGER_PATH, help="Ledger database path")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"No ledger at {args.db}")
+        return 1
+    ledger = CostLedger(args.db)
+    since = time.time() - args.days * 86400 if args.days else None
+    rows = ledger.summary(args.by, args.session, args.client, since, args.top)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        _print_report(rows, args.by)
+        print(f"Total: ${ledger.total(args.session, args.client, since):.4f}")
+    ledger.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
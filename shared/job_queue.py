@@ -0,0 +1,363 @@
+"""
+Persistent background job queue.
+
+Jobs are rows in a local SQLite table and run on a thread pool, so a slow
+stage (Agent 3's strategy analysis) is accepted immediately and the caller
+polls for the result instead of blocking. Jobs are deduplicated by
+(kind, dedup_key): submitting the same scenario again returns the existing
+job. Queued jobs, and running jobs whose process stopped heartbeating, are
+picked up again when a handler for their kind is registered after a restart.
+
+    queue = get_job_queue()
+    queue.register("strategies", run_strategies)
+    job = queue.submit("strategies", {"client_json": data}, dedup_key=scenario_hash(data))
+    queue.get(job["job_id"])["status"]
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from shared.cost_ledger import cost_scope
+from shared.rate_limiter import PRIORITY_INTERACTIVE, priority_scope
+from shared.scenario_model import ClientScenario, canonical_json
+from shared.tracing import session_trace
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join("cache", "job_queue.sqlite3"))
+JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", "4"))
+# Finished jobs are kept this long so reruns and restarts can reuse their results
+JOB_QUEUE_TTL_SECONDS = int(os.getenv("JOB_QUEUE_TTL_HOURS", "168")) * 3600
+# A running job whose owner has not heartbeated for this long is treated as interrupted
+JOB_QUEUE_STALE_SECONDS = int(os.getenv("JOB_QUEUE_STALE_SECONDS", "120"))
+JOB_QUEUE_HEARTBEAT_SECONDS = 30
+# Jobs interrupted this many times are failed instead of retried again
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "3"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    dedup_key TEXT,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    session_id TEXT,
+    client_id TEXT,
+    priority INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs (kind, dedup_key);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, kind);
+"""
+
+
+def scenario_hash(data):
+    """
+    Stable hash of a scenario, independent of key order and whitespace.
+
+    Args:
+        data (ClientScenario, dict or str): Client JSON as a scenario, dict or JSON string
+
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    if isinstance(data, ClientScenario):
+        return data.digest
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            return hashlib.sha256(data.strip().encode("utf-8")).hexdigest()
+    return hashlib.sha256(canonical_json(data).encode("utf-8")).hexdigest()
+
+
+def _row_to_dict(row):
+    return {
+        "job_id": row["id"],
+        "kind": row["kind"],
+        "dedup_key": row["dedup_key"],
+        "status": row["status"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "session_id": row["session_id"],
+        "client_id": row["client_id"],
+        "attempts": row["attempts"],
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+    }
+
+
+class JobQueue:
+    """SQLite-backed job table with a thread pool that runs registered handlers."""
+
+    def __init__(self, path=JOB_QUEUE_PATH, workers=JOB_QUEUE_WORKERS, ttl_seconds=JOB_QUEUE_TTL_SECONDS,
+                 stale_seconds=JOB_QUEUE_STALE_SECONDS, max_attempts=JOB_QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        # Identifies this process's running jobs so others can tell when they are abandoned
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-queue")
+        self._handlers = {}
+        self._stop_event = threading.Event()
+        self._heartbeat_thread = None
+
+    # -- handlers ------------------------------------------------------------
+
+    def register(self, kind, handler):
+        """
+        Register the function that runs jobs of a kind.
+
+        The first registration of a kind also resumes its jobs left queued or
+        interrupted by a previous process. Registering again (e.g. on every
+        Streamlit rerun) only replaces the handler.
+
+        Args:
+            kind (str): Job type, e.g. "strategies"
+            handler (callable): Called with the job payload dict; its return value
+                must be JSON-serialisable. A dict with an "error" key marks the job
+                as failed.
+        """
+        with self._lock:
+            first = kind not in self._handlers
+            self._handlers[kind] = handler
+        if first:
+            self._start_heartbeat()
+            self._resume(kind)
+
+    def _requeue_stale(self, kind, now):
+        """Requeue running jobs whose owner stopped heartbeating; fail those retried too often."""
+        cutoff = now - self.stale_seconds
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+            "WHERE kind = ? AND status = ? AND heartbeat_at < ? AND attempts >= ?",
+            (JOB_FAILED, "Job was interrupted too many times", now, kind, JOB_RUNNING, cutoff, self.max_attempts),
+        )
+        job_ids = [row["id"] for row in self._conn.execute(
+            "SELECT id FROM jobs WHERE kind = ? AND status = ? AND heartbeat_at < ?", (kind, JOB_RUNNING, cutoff)
+        )]
+        for job_id in job_ids:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL WHERE id = ? AND status = ?", (JOB_QUEUED, job_id, JOB_RUNNING)
+            )
+        return job_ids
+
+    def _resume(self, kind):
+        with self._lock:
+            self._requeue_stale(kind, time.time())
+            job_ids = [row["id"] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND status = ? ORDER BY priority, created_at",
+                (kind, JOB_QUEUED),
+            )]
+        if job_ids:
+            logger.info(f"Resuming {len(job_ids)} queued {kind} job(s)")
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+
+    # -- submitting and polling ----------------------------------------------
+
+    def submit(self, kind, payload, dedup_key=None, session_id=None, client_id=None, priority=PRIORITY_INTERACTIVE):
+        """
+        Queue a job, or return the existing job with the same dedup key.
+
+        A failed job with the same key is queued again; queued, running and
+        succeeded jobs are returned as they are.
+
+        Args:
+            kind (str): Job type with a registered handler
+            payload (dict): JSON-serialisable arguments for the handler
+            dedup_key (str, optional): Key that identifies equivalent jobs, e.g. a scenario hash
+            session_id (str, optional): Session the job's spans and LLM costs are attributed to
+            client_id (str, optional): Client the job's LLM costs are attributed to
+            priority (int): Rate-limiter priority for the job's LLM calls
+
+        Returns:
+            dict: The job
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind {kind}")
+        payload_text = json.dumps(payload, default=str)
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            row = None
+            if dedup_key is not None:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE kind = ? AND dedup_key = ?", (kind, dedup_key)
+                ).fetchone()
+            if row is not None and row["status"] != JOB_FAILED:
+                return _row_to_dict(row)
+            if row is not None:
+                job_id = row["id"]
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, payload = ?, result = NULL, error = NULL, session_id = ?, "
+                    "client_id = ?, priority = ?, attempts = 0, owner = NULL, created_at = ?, started_at = NULL, "
+                    "finished_at = NULL, heartbeat_at = NULL WHERE id = ?",
+                    (JOB_QUEUED, payload_text, session_id, client_id, priority, now, job_id),
+                )
+            else:
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO jobs (id, kind, dedup_key, status, payload, session_id, client_id, priority, "
+                    "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, dedup_key, JOB_QUEUED, payload_text, session_id, client_id, priority, now),
+                )
+        self._executor.submit(self._run, job_id)
+        logger.info(f"Queued {kind} job {job_id}")
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """
+        Returns:
+            dict: The job, or None if it does not exist
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_dict(row) if row else None
+
+    def find(self, kind, dedup_key):
+        """The job with a dedup key, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND dedup_key = ?", (kind, dedup_key)
+            ).fetchone()
+        return _row_to_dict(row) if row else None
+
+    def queue_depth(self, kind=None):
+        query, params = "SELECT COUNT(*) FROM jobs WHERE status = ?", [JOB_QUEUED]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    # -- running -------------------------------------------------------------
+
+    def _claim(self, job_id):
+        now = time.time()
+        with self._lock:
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ? "
+                "WHERE id = ? AND status = ?",
+                (JOB_RUNNING, self.owner, now, now, job_id, JOB_QUEUED),
+            ).rowcount
+            if not claimed:
+                return None
+            return self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND owner = ?",
+                (status, json.dumps(result, default=str) if result is not None else None, error,
+                 time.time(), job_id, self.owner),
+            )
+
+    def _run(self, job_id):
+        # Another worker or process may already have claimed the job
+        row = self._claim(job_id)
+        if row is None:
+            return
+        handler = self._handlers[row["kind"]]
+        try:
+            with ExitStack() as stack:
+                stack.enter_context(session_trace(row["session_id"]))
+                stack.enter_context(cost_scope(row["session_id"], row["client_id"]))
+                stack.enter_context(priority_scope(row["priority"]))
+                result = handler(json.loads(row["payload"]))
+        except Exception as e:
+            logger.error(f"Job {job_id} ({row['kind']}) failed: {str(e)}")
+            self._finish(job_id, JOB_FAILED, error=str(e))
+            return
+        if isinstance(result, dict) and "error" in result:
+            self._finish(job_id, JOB_FAILED, result=result, error=str(result["error"]))
+        else:
+            self._finish(job_id, JOB_SUCCEEDED, result=result)
+        logger.info(f"Finished {row['kind']} job {job_id}")
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat_thread is not None:
+                return
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="job-queue-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    def _heartbeat(self):
+        while not self._stop_event.wait(JOB_QUEUE_HEARTBEAT_SECONDS):
+            requeued = []
+            try:
+                with self._lock:
+                    now = time.time()
+                    self._conn.execute(
+                        "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+                        (now, self.owner, JOB_RUNNING),
+                    )
+                    # Pick up jobs abandoned by a process that stopped after this one started
+                    for kind in list(self._handlers):
+                        requeued.extend((kind, job_id) for job_id in self._requeue_stale(kind, now))
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue heartbeat failed: {str(e)}")
+            for kind, job_id in requeued:
+                logger.info(f"Requeued interrupted {kind} job {job_id}")
+                self._executor.submit(self._run, job_id)
+
+    def _prune(self, now):
+        self._conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (*FINISHED_STATES, now - self.ttl_seconds),
+        )
+
+    def shutdown(self, wait=True):
+        self._stop_event.set()
+        self._executor.shutdown(wait=wait)
+        with self._lock:
+            self._conn.close()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Return the process-wide job queue.
+
+    Returns:
+        JobQueue: The shared queue
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
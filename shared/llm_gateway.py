@@ -0,0 +1,448 @@
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+import importlib.util
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from shared.rate_limiter import (
+    DEFAULT_COMPLETION_TOKENS,
+    current_priority,
+    estimate_tokens,
+    get_rate_limiter,
+    is_rate_limit_error,
+    retry_after_seconds,
+)
+from shared.cost_ledger import enforce_budget, record_call
+from shared.metrics import observe_llm_call
+from shared.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+load_dotenv()
+tracer = get_tracer(__name__)
+
+# Connection pool shared by every LLM call in the process
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+# "auto" enables HTTP/2 when the h2 package is installed
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "auto").lower()
+
+# Retries of transient failures (429, 5xx, timeouts, dropped connections)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+# Overall budget for one logical call, including retries and queueing
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE_SECONDS", "180"))
+
+# Hedging: stages listed here get a duplicate request once the first one has
+# run longer than the stage's observed p95 latency
+LLM_HEDGE_CALL_SITES = {
+    site.strip() for site in os.getenv("LLM_HEDGE_CALL_SITES", "strategy_scoring,baseline,analysis").split(",") if site.strip()
+}
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Used until a stage has LLM_HEDGE_MIN_SAMPLES latencies recorded
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", "30"))
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    "APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError",
+    "TimeoutException", "ConnectError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError",
+    "ReadError", "WriteError", "PoolTimeout",
+}
+
+_lock = threading.Lock()
+_http_client = None
+_openai_clients = {}
+_llms = {}
+_observers = []
+_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONNECTIONS * 2, thread_name_prefix="llm-call")
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when a call (including retries) does not finish within its deadline."""
+
+
+def _http2_enabled():
+    if LLM_HTTP2 in ("1", "true", "yes"):
+        return True
+    if LLM_HTTP2 == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return False
+
+
+def _api_key(api_key=None):
+    return api_key or os.getenv("OPENAI_API_KEY")
+
+
+def _base_url():
+    # Lets the whole process point at a proxy or a local stand-in server
+    return os.getenv("OPENAI_BASE_URL") or None
+
+
+def _usage(response):
+    """Token usage reported by the provider for an openai or llama_index response."""
+    raw = getattr(response, "raw", response)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return {}
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "total_tokens": usage.get("total_tokens"),
+        "cached_tokens": details.get("cached_tokens") if isinstance(details, dict) else None,
+    }
+
+
+def finish_reason(response):
+    """
+    Why the provider stopped generating ("stop", "length", ...) for an openai
+    or llama_index response, or None if it isn't reported.
+    """
+    raw = getattr(response, "raw", response)
+    choices = raw.get("choices") if isinstance(raw, dict) else getattr(raw, "choices", None)
+    if not choices:
+        return None
+    choice = choices[0]
+    return choice.get("finish_reason") if isinstance(choice, dict) else getattr(choice, "finish_reason", None)
+
+
+def add_observer(callback):
+    """
+    Register a callable that receives a record dict for every LLM request.
+
+    Records carry call_site, model, priority, outcome ("ok", "error", or
+    "discarded" for the losing copy of a hedge), latency, token usage,
+    attempts and hedged. Observers must be fast and must not raise.
+    """
+    with _lock:
+        if callback not in _observers:
+            _observers.append(callback)
+
+
+def remove_observer(callback):
+    with _lock:
+        if callback in _observers:
+            _observers.remove(callback)
+
+
+def _emit(record):
+    with _lock:
+        observers = list(_observers)
+    for callback in observers:
+        try:
+            callback(record)
+        except Exception as e:
+            logger.error(f"LLM observer failed: {str(e)}")
+
+
+class LatencyTracker:
+    """Recent successful latencies per call site, used to pick the hedge delay."""
+
+    def __init__(self, window=200):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, call_site, latency):
+        with self._lock:
+            self._samples[call_site].append(latency)
+
+    def percentile(self, call_site, fraction):
+        with self._lock:
+            samples = sorted(self._samples[call_site])
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def hedge_delay(self, call_site):
+        delay = self.percentile(call_site, LLM_HEDGE_PERCENTILE)
+        return LLM_HEDGE_DEFAULT_DELAY if delay is None else delay
+
+
+latency_tracker = LatencyTracker()
+
+
+def is_retryable(error):
+    """True for transient provider or network failures worth retrying."""
+    if isinstance(error, LLMDeadlineExceeded):
+        return False
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES or isinstance(error, (TimeoutError, ConnectionError))
+
+
+def backoff_delay(attempt, error=None):
+    """Exponential backoff with full jitter, honouring Retry-After on 429s."""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** (attempt - 1))))
+    if error is not None and is_rate_limit_error(error):
+        delay = max(delay, retry_after_seconds(error) or 0)
+    return delay
+
+
+def get_http_client():
+    """
+    Return the process-wide keep-alive httpx client used for all LLM traffic.
+
+    Returns:
+        httpx.Client: Shared client with pooled connections
+    """
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            import httpx
+
+            http2 = _http2_enabled()
+            _http_client = httpx.Client(
+                http2=http2,
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+            )
+            logger.info(f"Created shared LLM connection pool (max_connections={LLM_MAX_CONNECTIONS}, http2={http2})")
+        return _http_client
+
+
+def get_openai_client(api_key=None):
+    """
+    Return a shared openai.OpenAI client backed by the pooled HTTP client.
+
+    Args:
+        api_key (str, optional): Defaults to OPENAI_API_KEY
+
+    Returns:
+        openai.OpenAI: Client instance, or None if no API key is configured
+    """
+    api_key = _api_key(api_key)
+    if not api_key:
+        return None
+
+    http_client = get_http_client()
+    with _lock:
+        client = _openai_clients.get(api_key)
+        if client is None:
+            from openai import OpenAI
+
+            # Retries happen in the gateway so they are not multiplied
+            client = OpenAI(api_key=api_key, base_url=_base_url(), http_client=http_client, max_retries=0)
+            _openai_clients[api_key] = client
+        return client
+
+
+def get_llm(model=DEFAULT_MODEL, api_key=None, **kwargs):
+    """
+    Return a shared llama_index OpenAI LLM for a model, backed by the pooled HTTP client.
+
+    Args:
+        model (str): Model name
+        api_key (str, optional): Defaults to OPENAI_API_KEY
+        **kwargs: Extra llama_index OpenAI arguments (e.g. temperature)
+
+    Returns:
+        llama_index.llms.openai.OpenAI: LLM instance
+    """
+    api_key = _api_key(api_key)
+    key = (model, api_key, tuple(sorted(kwargs.items())))
+
+    http_client = get_http_client()
+    with _lock:
+        llm = _llms.get(key)
+        if llm is None:
+            from llama_index.llms.openai import OpenAI
+
+            kwargs.setdefault("max_retries", 0)
+            kwargs.setdefault("timeout", LLM_TIMEOUT)
+            llm = OpenAI(model=model, api_key=api_key, api_base=_base_url(), http_client=http_client, **kwargs)
+            _llms[key] = llm
+        return llm
+
+
+def _attempt(request, model, estimated, priority, deadline_at):
+    """Run one request inside a rate limiter slot. Returns (response, usage, latency)."""
+    remaining = deadline_at - time.monotonic()
+    if remaining <= 0:
+        raise LLMDeadlineExceeded("LLM deadline passed before the request started")
+    with get_rate_limiter().slot(model, estimated, priority, timeout=remaining) as outcome:
+        started = time.monotonic()
+        response = request(max(1.0, deadline_at - started))
+        usage = _usage(response)
+        outcome["tokens"] = usage.get("total_tokens")
+        return response, usage, time.monotonic() - started
+
+
+def _discard(future, record):
+    """Account for a hedge loser or abandoned request once it finishes."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, usage, latency = future.result()
+    _emit({**record, **usage, "outcome": "discarded", "latency": latency})
+
+
+def _race(request, record, estimated, priority, deadline_at, hedge):
+    """
+    Run a request, firing one duplicate if it outlives the hedge delay, and
+    return the first successful result. The slower copy is cancelled if it
+    has not started yet; otherwise its tokens are reported as discarded when
+    it completes, since the provider bills them either way.
+    """
+    hedge_at = time.monotonic() + latency_tracker.hedge_delay(record["call_site"]) if hedge else None
+    # Attempts and discard callbacks run on other threads; give each a copy of
+    # the caller's context so session and client scopes follow them
+    context = contextvars.copy_context()
+
+    def submit():
+        return _executor.submit(context.copy().run, _attempt, request, record["model"], estimated, priority, deadline_at)
+
+    pending = {submit()}
+    last_error = None
+    try:
+        while pending:
+            now = time.monotonic()
+            if now >= deadline_at:
+                raise LLMDeadlineExceeded(f"LLM call for {record['call_site']} exceeded its deadline")
+            timeout = deadline_at - now
+            if hedge_at is not None:
+                timeout = min(timeout, max(0.0, hedge_at - now))
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                last_error = future.exception()
+
+            if hedge_at is not None and pending and time.monotonic() >= hedge_at:
+                logger.info(f"Hedging slow LLM call for {record['call_site']}")
+                record["hedged"] = True
+                pending.add(submit())
+                hedge_at = None
+        raise last_error
+    finally:
+        for future in pending:
+            if not future.cancel():
+                future.add_done_callback(lambda f: context.copy().run(_discard, f, record))
+
+
+def _call(request, model, call_site, estimated, priority, deadline, hedge):
+    """Retry loop around _race with jittered backoff, bounded by the deadline."""
+    priority = current_priority() if priority is None else priority
+    deadline_at = time.monotonic() + (deadline or LLM_DEADLINE)
+    hedge = call_site in LLM_HEDGE_CALL_SITES if hedge is None else hedge
+    record = {"call_site": call_site, "model": model, "priority": priority, "hedged": False, "attempts": 0}
+    started = time.monotonic()
+
+    with tracer.start_as_current_span(f"llm.{call_site}", {"llm.call_site": call_site, "llm.model": model}) as span:
+        while True:
+            record["attempts"] += 1
+            try:
+                response, usage, latency = _race(request, record, estimated, priority, deadline_at, hedge)
+            except Exception as e:
+                remaining = deadline_at - time.monotonic()
+                delay = backoff_delay(record["attempts"], e)
+                if not is_retryable(e) or record["attempts"] > LLM_MAX_RETRIES or delay >= remaining:
+                    span.set_attributes({"llm.attempts": record["attempts"], "llm.hedged": record["hedged"]})
+                    _emit({**record, "outcome": "error", "error": type(e).__name__, "latency": time.monotonic() - started})
+                    raise
+                logger.warning(f"LLM call for {call_site} failed ({type(e).__name__}); retrying in {delay:.1f}s")
+                span.add_event("retry", {"error": type(e).__name__, "delay_s": round(delay, 3)})
+                time.sleep(delay)
+                continue
+
+            latency_tracker.record(call_site, latency)
+            span.set_attributes({
+                "llm.attempts": record["attempts"],
+                "llm.hedged": record["hedged"],
+                "llm.prompt_tokens": usage.get("prompt_tokens"),
+                "llm.completion_tokens": usage.get("completion_tokens"),
+                "llm.cached_tokens": usage.get("cached_tokens"),
+                "outcome": "ok",
+            })
+            _emit({**record, **usage, "outcome": "ok", "latency": time.monotonic() - started})
+            return response
+
+
+def complete(llm, prompt, call_site="unknown", priority=None, deadline=None, hedge=None):
+    """
+    Run a llama_index completion through the gateway, with retries, a
+    deadline and optional hedging.
+
+    Args:
+        llm: LLM from get_llm
+        prompt (str): Prompt text
+        call_site (str): Pipeline stage making the call, used for limits and reporting
+        priority (int, optional): Scheduling priority; defaults to the current priority_scope
+        deadline (float, optional): Seconds allowed including retries; defaults to LLM_DEADLINE_SECONDS
+        hedge (bool, optional): Force hedging on or off; defaults to LLM_HEDGE_CALL_SITES
+
+    Returns:
+        CompletionResponse: The llama_index response
+
+    Raises:
+        BudgetExceeded: If the session or client budget is spent and the call cannot be downgraded
+        LLMDeadlineExceeded: If no attempt succeeds before the deadline
+    """
+    model = enforce_budget(call_site, llm.model)
+    if model != llm.model:
+        llm = get_llm(model, api_key=llm.api_key)
+    estimated = estimate_tokens(prompt) + DEFAULT_COMPLETION_TOKENS
+    # llama_index applies its own client timeout per request; the deadline bounds the wait
+    return _call(lambda timeout: llm.complete(prompt), llm.model, call_site, estimated, priority, deadline, hedge)
+
+
+def chat_completion(messages, model="gpt-4", call_site="unknown", api_key=None, priority=None,
+                    deadline=None, hedge=None, **kwargs):
+    """
+    Run an OpenAI chat completion through the gateway, with retries, a
+    deadline and optional hedging.
+
+    Args:
+        messages (list): Chat messages
+        model (str): Model name
+        call_site (str): Pipeline stage making the call, used for limits and reporting
+        api_key (str, optional): Defaults to OPENAI_API_KEY
+        priority (int, optional): Scheduling priority; defaults to the current priority_scope
+        deadline (float, optional): Seconds allowed including retries; defaults to LLM_DEADLINE_SECONDS
+        hedge (bool, optional): Force hedging on or off; defaults to LLM_HEDGE_CALL_SITES
+        **kwargs: Extra chat.completions.create arguments (e.g. temperature)
+
+    Returns:
+        ChatCompletion: The OpenAI response
+
+    Raises:
+        ValueError: If no API key is configured
+        BudgetExceeded: If the session or client budget is spent and the call cannot be downgraded
+        LLMDeadlineExceeded: If no attempt succeeds before the deadline
+    """
+    client = get_openai_client(api_key)
+    if client is None:
+        raise ValueError("OpenAI API key not found. Please check your .env file.")
+    model = enforce_budget(call_site, model)
+    prompt_tokens = sum(estimate_tokens(message.get("content")) for message in messages)
+    estimated = prompt_tokens + kwargs.get("max_tokens", DEFAULT_COMPLETION_TOKENS)
+
+    def request(timeout):
+        # Each attempt gets at most the time left before the deadline
+        return client.with_options(timeout=min(timeout, LLM_TIMEOUT)).chat.completions.create(
+            model=model, messages=messages, **kwargs
+        )
+
+    return _call(request, model, call_site, estimated, priority, deadline, hedge)
+
+
+# Every call is written to the cost ledger (a no-op when COST_LEDGER_ENABLED is off)
+add_observer(record_call)
+add_observer(observe_llm_call)
@@ -0,0 +1,423 @@
+"""
+Prometheus-style metrics for the app and batch runs.
+
+Counters, gauges and histograms are kept in process and served in the
+Prometheus text exposition format from a small HTTP endpoint that runs next to
+Streamlit (or the benchmark runner):
+
+    curl http://127.0.0.1:9464/metrics
+
+LLM latency, tokens, retries and outcomes come from the gateway observer;
+429s, queue depth and concurrency are read from the rate limiter at scrape
+time; the agents report fallbacks, cache lookups, extraction and report times.
+"""
+import os
+import time
+import bisect
+import functools
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from shared.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+# A session counts as active if it reran within this window
+METRICS_SESSION_IDLE_SECONDS = int(os.getenv("METRICS_SESSION_IDLE_SECONDS", "1800"))
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            return [("_total", key, None, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down. With a callback the values are computed at
+    scrape time: callback() returns a list of (labels dict, value).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self.callback is not None:
+            try:
+                return [("", self._key(labels), None, value) for labels, value in self.callback()]
+            except Exception as e:
+                logger.error(f"Metric callback for {self.name} failed: {str(e)}")
+                return []
+        with self._lock:
+            return [("", key, None, value) for key, value in sorted(self._values.items())]
+
+
+class CallbackCounter(Gauge):
+    """Counter whose cumulative values are read from another component at scrape time."""
+
+    kind = "counter"
+
+    def _samples(self):
+        return [("_total", key, extra, value) for _, key, extra, value in super()._samples()]
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            entry["buckets"][bisect.bisect_left(self.buckets, value)] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def time(self, **labels):
+        """Context manager that observes the elapsed seconds of its block."""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), entry["buckets"]):
+                    cumulative += count
+                    samples.append(("_bucket", key, [("le", _format_value(float(bound)))], cumulative))
+                samples.append(("_sum", key, None, round(entry["sum"], 6)))
+                samples.append(("_count", key, None, entry["count"]))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def timed(histogram, **labels):
+    """
+    Decorator that observes a function's duration in a histogram.
+
+    Label values may be callables; they receive the function's arguments,
+    e.g. format=lambda file_obj: file_obj.name.rsplit(".", 1)[-1].
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                values = {}
+                for name, value in labels.items():
+                    try:
+                        values[name] = value(*args, **kwargs) if callable(value) else value
+                    except Exception:
+                        values[name] = "unknown"
+                histogram.observe(time.perf_counter() - started, **values)
+        return wrapper
+    return decorator
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# -- active sessions -----------------------------------------------------------
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def touch_session(session_id):
+    """Mark a session as active (called on every Streamlit rerun or API request)."""
+    with _sessions_lock:
+        _sessions[session_id] = time.monotonic()
+
+
+def active_session_count():
+    cutoff = time.monotonic() - METRICS_SESSION_IDLE_SECONDS
+    with _sessions_lock:
+        for session_id in [key for key, seen in _sessions.items() if seen < cutoff]:
+            del _sessions[session_id]
+        return len(_sessions)
+
+
+def _rate_limiter_values(field):
+    from shared.rate_limiter import get_rate_limiter
+
+    return [({"model": entry["model"]}, entry[field]) for entry in get_rate_limiter().snapshot()]
+
+
+# -- metric definitions --------------------------------------------------------
+
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "llm_request_duration_seconds", "LLM request latency including retries, by model and call site",
+    ("model", "call_site", "outcome"),
+))
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "llm_requests", "LLM requests by model, call site and outcome", ("model", "call_site", "outcome"),
+))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "llm_retries", "LLM request attempts beyond the first", ("model", "call_site"),
+))
+LLM_HEDGES = REGISTRY.register(Counter(
+    "llm_hedged_requests", "LLM requests that fired a hedge copy", ("model", "call_site"),
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens", "LLM tokens by model, call site and kind (prompt, completion, cached)",
+    ("model", "call_site", "kind"),
+))
+LLM_RATE_LIMITED = REGISTRY.register(CallbackCounter(
+    "llm_rate_limited", "429 responses from the provider", ("model",),
+    callback=lambda: _rate_limiter_values("rate_limited"),
+))
+LLM_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "llm_queue_depth", "LLM requests waiting for a rate limiter slot", ("model",),
+    callback=lambda: _rate_limiter_values("queue_depth"),
+))
+LLM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "llm_in_flight", "LLM requests currently in flight", ("model",),
+    callback=lambda: _rate_limiter_values("in_flight"),
+))
+LLM_CONCURRENCY = REGISTRY.register(Gauge(
+    "llm_concurrency_window", "Current AIMD concurrency window", ("model",),
+    callback=lambda: _rate_limiter_values("concurrency"),
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "cache_lookups", "Cache lookups by cache and result (hit, miss)", ("cache", "result"),
+))
+FALLBACKS = REGISTRY.register(Counter(
+    "fallback_activations", "Degraded output served by a fallback path", ("stage", "fallback"),
+))
+ACTIVE_SESSIONS = REGISTRY.register(Gauge(
+    "active_sessions", "Sessions seen within METRICS_SESSION_IDLE_SECONDS",
+    callback=lambda: [({}, active_session_count())],
+))
+DOCUMENT_EXTRACTION_SECONDS = REGISTRY.register(Histogram(
+    "document_extraction_duration_seconds", "Time to extract data from an uploaded tax document", ("format",),
+    buckets=STAGE_BUCKETS,
+))
+REPORT_GENERATION_SECONDS = REGISTRY.register(Histogram(
+    "report_generation_duration_seconds", "Time to build a comparison PDF report", ("kind",),
+    buckets=STAGE_BUCKETS,
+))
+WORKER_POOL_TASKS = REGISTRY.register(Counter(
+    "worker_pool_tasks", "CPU-bound tasks run on the worker pool by task and outcome", ("task", "outcome"),
+))
+
+
+def record_fallback(stage, fallback):
+    """
+    Count a fallback activation and log it, so degraded output is visible.
+
+    Args:
+        stage (str): Pipeline stage, e.g. "question_generation"
+        fallback (str): Fallback name, e.g. "basic_questions"
+    """
+    logger.warning(f"Fallback {fallback} used in {stage}")
+    FALLBACKS.inc(stage=stage, fallback=fallback)
+    current_span().set_attribute("fallback", fallback)
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def observe_llm_call(record):
+    """Gateway observer that updates the LLM metrics."""
+    model, call_site, outcome = record.get("model", "unknown"), record.get("call_site", "unknown"), record.get("outcome")
+    LLM_REQUESTS.inc(model=model, call_site=call_site, outcome=outcome)
+    for kind in ("prompt", "completion", "cached"):
+        tokens = record.get(f"{kind}_tokens")
+        if tokens:
+            LLM_TOKENS.inc(tokens, model=model, call_site=call_site, kind=kind)
+    # Hedge losers are billed but not part of the caller's latency or retries
+    if outcome == "discarded":
+        return
+    if record.get("latency") is not None:
+        LLM_REQUEST_SECONDS.observe(record["latency"], model=model, call_site=call_site, outcome=outcome)
+    if record.get("attempts", 1) > 1:
+        LLM_RETRIES.inc(record["attempts"] - 1, model=model, call_site=call_site)
+    if record.get("hedged"):
+        LLM_HEDGES.inc(model=model, call_site=call_site)
+    if record.get("cached_tokens") is not None:
+        record_cache_lookup("llm_prompt_prefix", record["cached_tokens"] > 0)
+
+
+def render_metrics():
+    """The registry in Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Metrics server: {format % args}")
+
+
+_server = None
+# Set after a failed bind, so reruns don't retry (and log) it every time
+_server_failed = False
+_server_lock = threading.Lock()
+
+
+def ensure_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Start the /metrics endpoint in a daemon thread if it isn't running yet.
+
+    Returns:
+        bool: True if the endpoint is available
+    """
+    global _server, _server_failed
+    if not METRICS_ENABLED:
+        return False
+    with _server_lock:
+        if _server is not None:
+            return True
+        if _server_failed:
+            return False
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        except OSError as e:
+            _server_failed = True
+            logger.error(f"Could not start metrics server on {host}:{port}: {str(e)}")
+            return False
+        _server.daemon_threads = True
+        thread = threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True)
+        thread.start()
+        logger.info(f"Metrics server listening on {host}:{_server.server_address[1]}")
+        return True
+
+
+def shutdown_metrics_server():
+    """Stop the /metrics endpoint (mainly for tests and benchmarks)."""
+    global _server, _server_failed
+    with _server_lock:
+        _server_failed = False
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
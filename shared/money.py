@@ -0,0 +1,282 @@
+"""
+Exact money and percentage parsing.
+
+Extracted amounts used to go through float(text.replace(",", "")), and report
+differences and formatting were float arithmetic, which shows up as penny
+differences when thousands of values are reconciled. This module parses
+"$1,234.56", "(1,234)", "-$1,234", "$1.2k", "3.5M" and "12.5%" into exact
+Decimals, rounds half-up at the cent, and formats without going through
+binary floats.
+
+    parse_money("(1,234.50)")            # Decimal("-1234.50")
+    money_difference(1000.10, 1234.35)   # 234.25 (new minus old, exact to the cent)
+    format_money(2.675)                  # "$2.68" (f"{2.675:,.2f}" gives "$2.67")
+
+parse_amounts() parses a whole column at once into an int64 NumPy array of
+fixed-point units (cents by default) plus validity and percent masks.
+"""
+import re
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+CENT_PLACES = 2
+
+# Powers of ten for the scale suffixes ("1.2k", "3.5M", "2bn")
+SUFFIX_EXPONENTS = {"k": 3, "m": 6, "mm": 6, "b": 9, "bn": 9}
+
+# An amount inside free text, for use in larger extraction patterns. The
+# suffix must not run into a word ("$85,000 Married" is not 85 billion).
+AMOUNT_PATTERN = (
+    r"\(?[-−]?\$?\s*[-−]?\d[\d,]*(?:\.\d+)?"
+    r"(?:[ \t]*(?:[kK]|[mM]{1,2}|[bB][nN]?)(?![A-Za-z]))?\)?"
+)
+
+_AMOUNT_RE = re.compile(
+    r"^\s*(?P<open>\()?\s*(?P<sign>[-+−])?\s*(?:\$|USD\s*)?\s*(?P<sign2>[-−])?\s*"
+    r"(?P<int>\d[\d,]*|)(?:\.(?P<frac>\d+))?\s*"
+    r"(?P<suffix>[kK]|[mM]{1,2}|[bB][nN]?)?\s*(?P<percent>%)?\s*(?:USD)?\s*(?P<close>\))?\s*$"
+)
+
+_INT64_MAX = np.iinfo(np.int64).max
+_MAX_MANTISSA_DIGITS = 18
+_POW10 = np.array([10 ** n for n in range(_MAX_MANTISSA_DIGITS + 1)], dtype=np.int64)
+
+
+def _components(value):
+    """
+    Split a value into (negative, digits, exponent, is_percent).
+
+    digits is the unsigned integer mantissa as a string, so the value is
+    (-1 if negative) * int(digits) * 10**exponent. Returns None for anything
+    that isn't an amount.
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, int):
+        return value < 0, str(abs(value)), 0, False
+    if isinstance(value, (float, Decimal)):
+        # repr() of a float is the shortest decimal that round-trips, so 0.1 stays 0.1
+        number = Decimal(repr(value)) if isinstance(value, float) else value
+        if not number.is_finite():
+            return None
+        sign, digits, exponent = number.as_tuple()
+        return bool(sign), "".join(map(str, digits)) or "0", exponent, False
+    if not isinstance(value, str):
+        return None
+
+    match = _AMOUNT_RE.match(value)
+    if not match or bool(match.group("open")) != bool(match.group("close")):
+        return None
+    whole, frac = match.group("int").replace(",", ""), match.group("frac") or ""
+    if not whole and not frac:
+        return None
+    if match.group("sign") and match.group("sign2"):
+        return None
+    negative = bool(match.group("open")) or (match.group("sign") or match.group("sign2") or "") in ("-", "−")
+    exponent = SUFFIX_EXPONENTS.get((match.group("suffix") or "").lower(), 0) - len(frac)
+    return negative, (whole + frac).lstrip("0") or "0", exponent, bool(match.group("percent"))
+
+
+def parse_amount(value):
+    """
+    Parse a money amount or percentage.
+
+    Args:
+        value: int, float, Decimal or text such as "$1,234.56", "(1,234)", "$1.2k" or "12.5%"
+
+    Returns:
+        tuple or None: (Decimal value, True if it was written as a percentage), or None
+    """
+    parts = _components(value)
+    if parts is None:
+        return None
+    negative, digits, exponent, is_percent = parts
+    number = Decimal((int(negative), tuple(int(d) for d in digits), exponent))
+    return number, is_percent
+
+
+def parse_money(value):
+    """
+    Parse a money amount exactly.
+
+    Args:
+        value: int, float, Decimal or text such as "$1,234.56" or "(1,234)"
+
+    Returns:
+        Decimal or None: The amount, or None for percentages and unparseable values
+    """
+    parsed = parse_amount(value)
+    if parsed is None or parsed[1]:
+        return None
+    return parsed[0]
+
+
+def parse_percent(value):
+    """
+    Parse a percentage; "12.5%", "12.5" and 12.5 all give Decimal("12.5").
+
+    Returns:
+        Decimal or None: The percentage, or None if it can't be parsed
+    """
+    parsed = parse_amount(value)
+    return parsed[0] if parsed is not None else None
+
+
+def to_decimal(value):
+    """Exact Decimal for a number or amount text; raises ValueError if it isn't one."""
+    parsed = parse_amount(value)
+    if parsed is None:
+        raise ValueError(f"Not an amount: {value!r}")
+    return parsed[0]
+
+
+def quantize(value, places=CENT_PLACES):
+    """Round half-up to the given number of decimal places."""
+    return to_decimal(value).quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+
+
+def to_cents(value):
+    """
+    Amount as integer cents, rounded half-up.
+
+    Returns:
+        int: Cents
+    """
+    return int(quantize(value).scaleb(CENT_PLACES))
+
+
+def from_cents(cents):
+    """Integer cents back to an exact Decimal amount."""
+    return Decimal(int(cents)).scaleb(-CENT_PLACES)
+
+
+def round_half_up(value, places=CENT_PLACES):
+    """
+    Round for JSON output: the nearest float to the half-up rounded Decimal.
+
+    Returns:
+        float: Rounded value
+    """
+    return float(quantize(value, places))
+
+
+def money_difference(old, new, places=CENT_PLACES):
+    """
+    new - old computed on exact decimals.
+
+    Returns:
+        float: The difference rounded half-up to `places`
+    """
+    return round_half_up(to_decimal(new) - to_decimal(old), places)
+
+
+def percent_change(old, new, places=CENT_PLACES):
+    """
+    Change from old to new as a percentage of |old|.
+
+    Returns:
+        float or None: The change, or None when old is zero
+    """
+    old, new = to_decimal(old), to_decimal(new)
+    if old == 0:
+        return None
+    return round_half_up((new - old) / abs(old) * 100, places)
+
+
+def format_money(value, signed=False):
+    """
+    Format an amount as "$1,234.56", or "-$1,234.56" when negative.
+
+    Args:
+        value: Number, Decimal or amount text
+        signed (bool): Prefix positive amounts with "+"
+
+    Returns:
+        str: The formatted amount
+    """
+    amount = quantize(value)
+    sign = "-" if amount < 0 else ("+" if signed and amount > 0 else "")
+    return f"{sign}${abs(amount):,.2f}"
+
+
+def format_percent(value, signed=False):
+    """Format a percentage value (23.75 -> "23.75%") with half-up rounding."""
+    rate = quantize(value)
+    sign = "-" if rate < 0 else ("+" if signed and rate > 0 else "")
+    return f"{sign}{abs(rate):.2f}%"
+
+
+def parse_amounts(values, places=CENT_PLACES):
+    """
+    Parse a column of amounts into fixed-point integers in one pass.
+
+    Each value is split into sign, mantissa and exponent once; scaling and
+    half-up rounding to `places` are then done on whole int64 arrays.
+
+    Args:
+        values (iterable): Strings, numbers or None
+        places (int): Decimal places kept; 2 gives cents
+
+    Returns:
+        tuple: (units, valid, percent) NumPy arrays. units is int64 value * 10**places
+        (0 where invalid); valid is False for unparseable entries and ones that
+        overflow int64; percent marks entries written with "%".
+    """
+    parts = [_components(value) for value in values]
+    count = len(parts)
+    mantissa = np.zeros(count, dtype=np.int64)
+    exponent = np.zeros(count, dtype=np.int64)
+    negative = np.zeros(count, dtype=bool)
+    percent = np.zeros(count, dtype=bool)
+    valid = np.zeros(count, dtype=bool)
+    for index, part in enumerate(parts):
+        if part is None or len(part[1]) > _MAX_MANTISSA_DIGITS:
+            continue
+        negative[index], digits, exponent[index], percent[index] = part
+        mantissa[index] = int(digits)
+        valid[index] = True
+
+    shift = exponent + places
+    units = np.zeros(count, dtype=np.int64)
+
+    # Scale up: mantissa * 10**shift, where it fits in int64
+    up = valid & (shift >= 0)
+    up_shift = np.clip(shift, 0, _MAX_MANTISSA_DIGITS)
+    fits = up & (shift <= _MAX_MANTISSA_DIGITS) & (mantissa <= _INT64_MAX // _POW10[up_shift])
+    valid &= ~(up & ~fits)
+    units[fits] = mantissa[fits] * _POW10[up_shift[fits]]
+
+    # Scale down: divide by 10**-shift, rounding half away from zero
+    down = valid & (shift < 0)
+    down_shift = np.clip(-shift, 0, _MAX_MANTISSA_DIGITS)
+    divisor = _POW10[down_shift[down]]
+    quotient, remainder = np.divmod(mantissa[down], divisor)
+    # Beyond 18 places every representable mantissa rounds to zero
+    quotient[(-shift[down]) > _MAX_MANTISSA_DIGITS] = 0
+    remainder[(-shift[down]) > _MAX_MANTISSA_DIGITS] = 0
+    units[down] = quotient + (2 * remainder >= divisor)
+
+    units[negative] *= -1
+    return units, valid, percent
+
+
+def units_to_decimals(units, valid, places=CENT_PLACES):
+    """
+    Exact Decimals for the output of parse_amounts.
+
+    Returns:
+        list: Decimal per entry, None where invalid
+    """
+    return [Decimal(int(unit)).scaleb(-places) if ok else None for unit, ok in zip(units.tolist(), valid.tolist())]
+
+
+def units_to_floats(units, valid, places=CENT_PLACES):
+    """
+    Floats for the output of parse_amounts, for JSON results.
+
+    Returns:
+        list: float per entry, None where invalid
+    """
+    scale = 10 ** places
+    return [unit / scale if ok else None for unit, ok in zip(units.tolist(), valid.tolist())]
@@ -0,0 +1,336 @@
+"""
+Opt-in profiling of pipeline stages.
+
+Set PROFILING_MODE to "cprofile" (deterministic, higher overhead) or
+"sampling" (stack samples of the stage's thread every
+PROFILING_SAMPLE_INTERVAL_MS) and every stage run through
+shared.tracing.traced is profiled. With PROFILING_THRESHOLD_MS only stages
+slower than the threshold are written. Dumps go to
+PROFILING_DIR/<session_id>/ as .prof (cProfile) or .collapsed (sampling) files.
+
+    python -m shared.profiling list profiles/
+    python -m shared.profiling collapse profiles/ --stage pdf_build -o pdf_build.collapsed
+    flamegraph.pl pdf_build.collapsed > pdf_build.svg
+
+Collapsed stacks are weighted in microseconds, so cProfile and sampling dumps
+can be merged into one flamegraph.
+"""
+import os
+import sys
+import time
+import uuid
+import pstats
+import cProfile
+import logging
+import argparse
+import datetime
+import functools
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# "off" (default), "cprofile" or "sampling"
+PROFILING_MODE = os.getenv("PROFILING_MODE", "off").lower()
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+# Only write dumps for stages slower than this; 0 writes every profiled stage
+PROFILING_THRESHOLD_MS = float(os.getenv("PROFILING_THRESHOLD_MS", "0"))
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "5"))
+# Comma-separated stage names to profile; empty profiles every stage
+PROFILING_STAGES = {stage.strip() for stage in os.getenv("PROFILING_STAGES", "").split(",") if stage.strip()}
+
+NO_SESSION = "no-session"
+# Paths in cProfile call graphs contributing less than this are dropped when collapsing
+MIN_COLLAPSED_MICROSECONDS = 50
+
+# Only the outermost profiled stage in a context runs a profiler; nested
+# stages are part of its dump
+_active = contextvars.ContextVar("profiling_active", default=False)
+
+
+def _safe_name(value):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(value))[:64] or "_"
+
+
+def _frame_label(filename, lineno, name):
+    if filename == "~":
+        # Built-ins are reported as ("~", 0, "<built-in method ...>")
+        return name.replace(";", ":")
+    return f"{name} ({os.path.basename(filename)}:{lineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """Samples one thread's stack on a background thread and counts collapsed stacks."""
+
+    def __init__(self, thread_id=None, interval_ms=PROFILING_SAMPLE_INTERVAL_MS):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_frame_label(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def collapsed(self):
+        """Collapsed stacks weighted in microseconds."""
+        weight = int(self.interval * 1_000_000)
+        return Counter({stack: count * weight for stack, count in self.samples.items()})
+
+
+def pstats_to_collapsed(stats, min_microseconds=MIN_COLLAPSED_MICROSECONDS):
+    """
+    Approximate collapsed stacks from a cProfile call graph.
+
+    cProfile keeps caller -> callee edges rather than full stacks, so each
+    function's time is split across its callers in proportion to the
+    cumulative time of each edge.
+
+    Args:
+        stats (dict): pstats.Stats(...).stats
+        min_microseconds (int): Drop paths contributing less than this
+
+    Returns:
+        Counter: Collapsed stack -> microseconds
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+
+    collapsed = Counter()
+
+    def walk(func, path, seen, share):
+        _, _, self_time, cumulative, _ = stats[func]
+        path = path + [_frame_label(*func)]
+        self_us = int(self_time * share * 1_000_000)
+        if self_us >= min_microseconds:
+            collapsed[";".join(path)] += self_us
+        for callee, edge_cumulative in callees[func].items():
+            callee_cumulative = stats[callee][3] if callee in stats else 0
+            if callee in seen or callee_cumulative <= 0:
+                continue
+            callee_share = min(1.0, edge_cumulative * share / callee_cumulative)
+            if callee_cumulative * callee_share * 1_000_000 < min_microseconds:
+                continue
+            walk(callee, path, seen | {callee}, callee_share)
+
+    roots = [func for func, values in stats.items() if not values[4]]
+    for root in roots:
+        walk(root, [], {root}, 1.0)
+    return collapsed
+
+
+class StageProfile:
+    """One running profile; stop() writes the dump if the stage was slow enough."""
+
+    def __init__(self, stage, session_id=None, mode=PROFILING_MODE, threshold_ms=PROFILING_THRESHOLD_MS,
+                 directory=PROFILING_DIR):
+        self.stage = stage
+        self.session_id = session_id
+        self.mode = mode
+        self.threshold_ms = threshold_ms
+        self.directory = directory
+        self.path = None
+        self._profiler = None
+        self._started = None
+
+    def start(self):
+        if self.mode == "cprofile":
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # Python 3.12+ allows one cProfile per process; skip overlapping stages
+                logger.debug(f"Not profiling {self.stage}: {str(e)}")
+                return self
+            self._profiler = profiler
+        elif self.mode == "sampling":
+            self._profiler = SamplingProfiler().start()
+        self._started = time.perf_counter()
+        return self
+
+    def stop(self):
+        """
+        Stop profiling and write the dump.
+
+        Returns:
+            str: Path of the dump, or None if nothing was written
+        """
+        if self._profiler is None:
+            return None
+        elapsed_ms = (time.perf_counter() - self._started) * 1000
+        if isinstance(self._profiler, cProfile.Profile):
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+        if elapsed_ms < self.threshold_ms:
+            return None
+
+        session_dir = os.path.join(self.directory, _safe_name(self.session_id or NO_SESSION))
+        os.makedirs(session_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+        base = f"{timestamp}-{_safe_name(self.stage)}-{int(elapsed_ms)}ms-{uuid.uuid4().hex[:6]}"
+        try:
+            if isinstance(self._profiler, cProfile.Profile):
+                self.path = os.path.join(session_dir, base + ".prof")
+                self._profiler.dump_stats(self.path)
+            else:
+                self.path = os.path.join(session_dir, base + ".collapsed")
+                _write_collapsed(self.path, self._profiler.collapsed())
+        except OSError as e:
+            logger.error(f"Could not write profile for {self.stage}: {str(e)}")
+            return None
+        logger.info(f"Profiled {self.stage} ({elapsed_ms:.0f} ms): {self.path}")
+        return self.path
+
+
+def _write_collapsed(path, collapsed):
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, weight in sorted(collapsed.items()):
+            f.write(f"{stack} {weight}\n")
+
+
+def _stage_enabled(stage):
+    return PROFILING_MODE in ("cprofile", "sampling") and (not PROFILING_STAGES or stage in PROFILING_STAGES)
+
+
+@contextmanager
+def profile_stage(stage, session_id=None):
+    """
+    Profile the block when PROFILING_MODE is on and no outer stage is already profiling.
+
+    Args:
+        stage (str): Stage name used in the dump file name
+        session_id (str, optional): Session the dump is filed under
+    """
+    if not _stage_enabled(stage) or _active.get():
+        yield
+        return
+    token = _active.set(True)
+    profile = StageProfile(stage, session_id).start()
+    try:
+        yield
+    finally:
+        _active.reset(token)
+        profile.stop()
+
+
+def profiled(stage):
+    """Decorator form of profile_stage."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile_stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# -- CLI -------------------------------------------------------------------------
+
+def find_dumps(directory, session_id=None, stage=None):
+    """
+    List profile dumps under a directory.
+
+    Returns:
+        list: dicts with path, session_id, stage, duration_ms and kind
+    """
+    dumps = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if ext not in (".prof", ".collapsed"):
+                continue
+            parts = stem.split("-")
+            if len(parts) < 4:
+                continue
+            dump = {
+                "path": os.path.join(root, name),
+                "session_id": os.path.basename(root),
+                "stage": "-".join(parts[1:-2]),
+                "duration_ms": int(parts[-2][:-2]) if parts[-2].endswith("ms") and parts[-2][:-2].isdigit() else None,
+                "kind": ext[1:],
+            }
+            if session_id and dump["session_id"] != _safe_name(session_id):
+                continue
+            if stage and dump["stage"] != _safe_name(stage):
+                continue
+            dumps.append(dump)
+    return dumps
+
+
+def load_collapsed(dump):
+    """Collapsed stacks (microseconds) for one dump from find_dumps."""
+    if dump["kind"] == "prof":
+        return pstats_to_collapsed(pstats.Stats(dump["path"]).stats)
+    collapsed = Counter()
+    with open(dump["path"], "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, weight = line.rstrip("\n").rpartition(" ")
+            if stack and weight.isdigit():
+                collapsed[stack] += int(weight)
+    return collapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and aggregate pipeline profile dumps")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (("list", "List dumps"), ("collapse", "Merge dumps into collapsed stacks")):
+        sub = subparsers.add_parser(command, help=help_text)
+        sub.add_argument("directory", nargs="?", default=PROFILING_DIR)
+        sub.add_argument("--session", default=None, help="Only this session ID")
+        sub.add_argument("--stage", default=None, help="Only this stage")
+        if command == "collapse":
+            sub.add_argument("-o", "--output", default=None, help="Output file (default stdout)")
+            sub.add_argument("--prefix-stage", action="store_true", help="Prefix stacks with the stage name")
+    args = parser.parse_args(argv)
+
+    dumps = find_dumps(args.directory, args.session, args.stage)
+    if not dumps:
+        print(f"No profile dumps in {args.directory}", file=sys.stderr)
+        return 1
+
+    if args.command == "list":
+        for dump in dumps:
+            print(f"{dump['session_id']:<34} {dump['stage']:<26} {str(dump['duration_ms']):>8} ms  {dump['path']}")
+        return 0
+
+    merged = Counter()
+    for dump in dumps:
+        for stack, weight in load_collapsed(dump).items():
+            merged[f"{dump['stage']};{stack}" if args.prefix_stage else stack] += weight
+    lines = [f"{stack} {weight}" for stack, weight in sorted(merged.items())]
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        print(f"Wrote {len(lines)} stacks from {len(dumps)} dumps to {args.output}")
+    else:
+        print("\n".join(lines))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,572 @@
+"""
+Prompt templates with a static prefix and a dynamic suffix.
+
+Providers cache prompt prefixes automatically (OpenAI from 1024 tokens, in
+128-token blocks) and bill cached input tokens at a discount with a lower
+time to first token. A prefix only hits if it is byte-identical, so client
+data near the top of a prompt made every call a miss. Each template here puts
+the instructions, catalog and output format first and the per-client data
+last:
+
+    STRATEGY_SCORING.render(catalog=catalog.listing(), client_json=scenario.to_json(indent=2))
+
+Fields in `static` may only be bound to values that are the same for many
+calls (the strategy catalog); the bound prefix is built once and reused.
+Templates carry a version; bump it whenever the text changes, since prompt
+IDs ("strategy_scoring@v3") are used in cache keys and on trace spans.
+
+To check that every static prefix is byte-identical across clients:
+
+    python -m shared.prompts check
+"""
+import os
+import sys
+import json
+import string
+import argparse
+import threading
+from collections import OrderedDict
+
+from shared.rate_limiter import estimate_tokens
+from shared.tracing import current_span
+
+# Provider minimum for prefix caching; shorter prefixes are never cached
+CACHE_MIN_TOKENS = 1024
+# Bound prefixes kept per template (one per strategy catalog in use)
+PREFIX_CACHE_SIZE = 8
+
+PROMPTS = {}
+
+
+def _fields(text):
+    return tuple(dict.fromkeys(name for _, name, _, _ in string.Formatter().parse(text) if name))
+
+
+class PromptTemplate:
+    """A prompt split into a static prefix and a dynamic suffix."""
+
+    def __init__(self, name, version, static, dynamic="", system=None, samples=()):
+        """
+        Args:
+            name (str): Prompt name, usually the call site
+            version (str): Bumped whenever the text changes
+            static (str): Format string for the prefix; its fields must be call-independent
+            dynamic (str): Format string for the per-call suffix
+            system (str, optional): Static system message for chat call sites
+            samples (tuple): Two or more value dicts used by `check`
+        """
+        self.name = name
+        self.version = version
+        self.static = static
+        self.dynamic = dynamic
+        self.system = system
+        self.samples = samples
+        self.static_fields = _fields(static)
+        self.dynamic_fields = _fields(dynamic)
+        self._prefixes = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def prompt_id(self):
+        return f"{self.name}@v{self.version}"
+
+    def prefix(self, **values):
+        """
+        The static prefix, built once per distinct set of static values.
+
+        Raises:
+            KeyError: If a static field has no value
+        """
+        key = tuple(values[name] for name in self.static_fields)
+        with self._lock:
+            prefix = self._prefixes.get(key)
+            if prefix is not None:
+                self._prefixes.move_to_end(key)
+                return prefix
+        prefix = self.static.format(**{name: values[name] for name in self.static_fields})
+        with self._lock:
+            self._prefixes[key] = prefix
+            while len(self._prefixes) > PREFIX_CACHE_SIZE:
+                self._prefixes.popitem(last=False)
+        return prefix
+
+    def render(self, **values):
+        """
+        Build the prompt text.
+
+        Args:
+            **values: Values for the static and dynamic fields
+
+        Returns:
+            str: Static prefix followed by the dynamic suffix
+        """
+        current_span().set_attribute("prompt.id", self.prompt_id)
+        suffix = self.dynamic.format(**{name: values[name] for name in self.dynamic_fields})
+        return self.prefix(**values) + suffix
+
+    def messages(self, **values):
+        """Chat messages: the static system message, then the rendered prompt."""
+        messages = [{"role": "system", "content": self.system}] if self.system else []
+        return messages + [{"role": "user", "content": self.render(**values)}]
+
+
+def register(template):
+    if template.name in PROMPTS:
+        raise ValueError(f"Prompt {template.name} is already registered")
+    PROMPTS[template.name] = template
+    return template
+
+
+def get_prompt(name):
+    """Registered template by name; raises KeyError for unknown names."""
+    return PROMPTS[name]
+
+
+_SAMPLE_CATALOG = json.dumps({
+    "S1": "Strategy 1: New Side Business and Potential Deductions",
+    "S2": "Strategy 2: Converting a Primary Residence to a Rental Property",
+}, indent=2)
+_SAMPLE_CLIENTS = (
+    json.dumps({"filing_status": "single", "state": "CA", "income": {"primary": "salary", "amount": 85000}}, indent=2),
+    json.dumps({"filing_status": "married_filing_jointly", "state": "TX", "dependents": 2,
+                "income": {"primary": "business", "amount": 240000}}, indent=2),
+)
+
+
+CPA_SYSTEM = register(PromptTemplate(
+    "cpa_system", "1",
+    "You are a CPA assistant with three distinct roles working in a strict sequence:\n"
+    "ROLE 1: Question Generator - Creates a list of important questions needed for tax filing\n"
+    "ROLE 2: Response Validator - Reviews answers to the questions from Role 1 and determines if more information is needed\n"
+    "ROLE 3: JSON Generator - Creates structured JSON representation when all information is gathered\n\n"
+    "Always follow this exact sequence and maintain context between roles. Each role builds upon the work of the previous role.",
+    samples=({}, {}),
+))
+
+QUESTION_LIST = register(PromptTemplate(
+    "question_generation", "1",
+    "You are a professional tax preparer with extensive experience. Your task is to generate a comprehensive list of specific questions which you can ask your client. Include only the questions which a layman could answer. No tax knowledge should be required to answer these questions. "
+    "Questions should be about personal information relevant to tax filing but shouldn't ask questions about how to file."
+    "Based on these questions you should be able to accurately file a tax return based on the client's scenario. Think through all aspects of tax filing:\n\n"
+    "You can ask as many questions as required to extract the artifacts required as questioning is the only source to extract information from client. \n"
+    "Don't ask any questions which would require tax knowledge. All such information would be extracted from artifacts.\n"
+    "The questions would be asked by a tax consultant to his client. The questions asked should be relevant to tax filing artifacts only. Shouldn't confuse the client or require him to use his tax knowledge. \n"
+    "You can ask questions like all these and all the other necessary ones. The tax filing is being done in US, so do consider this."
+    "- Region to determine applicable tax laws (federal, state, local)\n"
+    "- Annual Income amount. \n"
+    "- Income sources (W-2, 1099, self-employment, investments, rental properties, etc.)\n"
+    "- Deductions (medical expenses, mortgage interest, etc.)\n"
+    "- Credits (child tax credit, education credits, energy credits, etc.)\n"
+    "- Dependents and household information\n"
+    "- Tax payments already made (withholding, estimated payments, etc.)\n"
+    "- Special situations (foreign income, cryptocurrency, retirement distributions, etc.)\n\n"
+    "Format as a clear numbered list of questions that would be essential for tax filing. "
+    "Each question should be specific and directly related to tax filing requirements.\n"
+    "Do NOT provide answers or explanations - ONLY the numbered list of questions.\n\n",
+    "Client Scenario:\n{conversation}\n\n",
+    samples=(
+        {"conversation": "Single W-2 employee in California earning $85,000."},
+        {"conversation": "Married couple in Texas with a side business and two children."},
+    ),
+))
+
+QUESTION_LIST_BACKUP = register(PromptTemplate(
+    "question_generation_backup", "1",
+    "Generate exactly 15 numbered tax filing questions based on this scenario. "
+    "Format each question starting with a number followed by a period. For example:\n"
+    "1. What is your filing status?\n"
+    "2. What was your total income?\n",
+    "Scenario: {conversation}",
+    samples=({"conversation": "Single filer in CA."}, {"conversation": "Joint filers in TX."}),
+))
+
+VALIDATION = register(PromptTemplate(
+    "validation", "2",
+    "You are a tax expert. Your job is to determine if we have ENOUGH information to create a basic tax filing. "
+    "We don't need perfect or complete information - just the minimum essential details.\n\n"
+    "IMPORTANT: You should err on the side of completion rather than asking too many questions. "
+    "Only ask for additional information if absolutely critical tax details are missing. The most critical things that need to be asked are: 1) Country 2) Region 3) Annual Income 4) Filing Status \n\n"
+    "You must do ONE of the following:\n"
+    "1. If a CRITICAL piece of information is still missing (like filing status or basic income), "
+    "ask ONE specific follow-up question.\n\n"
+    "2. In MOST cases, you should respond with: 'COMPLETE: All necessary information gathered.'\n\n",
+    # The question list and original scenario stay the same for a whole
+    # session and the conversation only grows, so later turns share a longer prefix
+    "{question_context}\n\n"
+    "Original Scenario: {original_scenario}\n\n"
+    "Conversation History:\n{conversation}\n\n"
+    "So far, {answered_questions} questions have been answered.\n\n"
+    "Your assessment (strongly prefer 'COMPLETE: All necessary information gathered.' unless critical information is missing):",
+    samples=(
+        {"question_context": "1. What is your filing status?", "original_scenario": "Single filer in CA.",
+         "conversation": "Q: Filing status?\nA: single", "answered_questions": 1},
+        {"question_context": "", "original_scenario": "Joint filers in TX.",
+         "conversation": "Q: Income?\nA: 240000", "answered_questions": 3},
+    ),
+))
+
+VALIDATION_WRAP_UP = register(PromptTemplate(
+    "validation_wrap_up", "2",
+    "You are a tax expert wrapping up a client consultation. You've already gathered several pieces of information. "
+    "At this point, you should have enough to proceed with a basic tax filing.\n\n"
+    "Unless a fundamental piece of tax information is missing (like filing status or whether they had any income), "
+    "you should respond EXACTLY with: 'COMPLETE: All necessary information gathered.'\n\n",
+    "Current information:\n{conversation}\n\n"
+    "Your assessment:",
+    samples=({"conversation": "Q: Filing status?\nA: single"}, {"conversation": "Q: Income?\nA: 240000"}),
+))
+
+JSON_GENERATION = register(PromptTemplate(
+    "json_generation", "2",
+    "You are a tax expert. Your job is to generate a well-structured JSON object that represents "
+    "the client's tax scenario based on the conversation history.\n\n"
+    "IMPORTANT: You MUST generate valid JSON even if information is incomplete. "
+    "The JSON must only contain the JSON object itself - no surrounding quotes, explanations, or markdown code blocks.\n"
+    "Use null values, empty arrays, or default values like 'unknown' for missing information.\n\n"
+    "Example structure (follow this format):\n"
+    "{{\n"
+    "  \"filing_status\": \"single\",\n"
+    "  \"income\": {{\n"
+    "    \"primary\": \"salary\",\n"
+    "    \"amount\": 75000,\n"
+    "    \"sources\": []\n"
+    "  }},\n"
+    "  \"deductions\": [],\n"
+    "  \"tax_dates\": {{}}\n"
+    "}}\n\n",
+    "{context}"
+    "Original Scenario: {original_scenario}\n\n"
+    "Complete Conversation History:\n{conversation}\n\n"
+    "Structured JSON output (do not include any text before or after the JSON):",
+    samples=(
+        {"context": "", "original_scenario": "Single filer in CA.", "conversation": "Q: Income?\nA: 85000"},
+        {"context": "Important tax questions identified:\n1. Filing status?\n\n",
+         "original_scenario": "Joint filers in TX.", "conversation": "Q: Income?\nA: 240000"},
+    ),
+))
+
+STRATEGY_SCORING = register(PromptTemplate(
+    "strategy_scoring", "3",
+    """You are a tax strategy expert. Based on the client's tax information, identify the most relevant tax strategies.
+
+Available Tax Strategies (ID: title):
+{catalog}
+
+For each strategy, evaluate its relevance to this client's situation on a scale of 1-10.
+Return your answer as a JSON object with strategy IDs as keys and relevance scores as values.
+Example:
+{{
+    "S1": 8,
+    "S2": 3
+}}
+
+Include only strategies with a relevance score of 5 or higher.
+
+""",
+    """Client Tax Information:
+{client_json}
+""",
+    samples=tuple({"catalog": _SAMPLE_CATALOG, "client_json": client} for client in _SAMPLE_CLIENTS),
+))
+
+STRATEGY_SCORING_BATCH = register(PromptTemplate(
+    "strategy_scoring_batch", "1",
+    """You are a tax strategy expert. For each client listed at the end, identify the most relevant tax strategies.
+
+Available Tax Strategies (ID: title):
+{catalog}
+
+For each client, evaluate each strategy's relevance to that client's situation on a scale of 1-10.
+Score every client on its own facts; do not compare clients with each other.
+Return your answer as a JSON object with client IDs as keys. Each value is an object with strategy IDs
+as keys and relevance scores as values.
+Example:
+{{
+    "C1": {{"S1": 8, "S2": 6}},
+    "C2": {{}}
+}}
+
+Include only strategies with a relevance score of 5 or higher, but include every client ID,
+with an empty object if no strategy scores 5 or higher.
+
+""",
+    """Clients (one per line, client ID then compact JSON):
+{clients}
+""",
+    samples=tuple(
+        {"catalog": _SAMPLE_CATALOG, "clients": "\n".join(f"C{n}: {json.dumps(json.loads(client))}" for n in range(1, 3))}
+        for client in _SAMPLE_CLIENTS
+    ),
+))
+
+BASELINE = register(PromptTemplate(
+    "baseline", "2",
+    """You are a professional tax advisor. Calculate the detailed baseline tax calculation for the client below.
+
+Provide a comprehensive breakdown including:
+1. Total income calculation from all sources
+2. Business expenses and deductions
+3. Adjusted Gross Income (AGI)
+4. Federal income tax calculation with tax brackets
+5. State tax calculation (if applicable)
+6. FICA taxes (Social Security and Medicare)
+7. Total tax liability
+8. Effective tax rate
+
+Show all calculations step by step with formulas and specific dollar amounts.
+Format this as a detailed calculation showing all steps and formulas used.
+
+""",
+    """Client Tax Information:
+{client_json}
+""",
+    samples=tuple({"client_json": client} for client in _SAMPLE_CLIENTS),
+))
+
+STRATEGY_ANALYSIS = register(PromptTemplate(
+    "analysis", "2",
+    """You are a professional tax advisor with extensive knowledge of tax calculations and optimization strategies.
+Based on the client's financial information and the selected tax strategies given at the end, provide a tax strategy analysis.
+
+Your task is to:
+1. For each strategy, calculate the tax impact and savings compared to baseline
+2. Provide detailed implementation steps
+3. Include common pitfalls to avoid for each strategy
+4. Make realistic assumptions about tax brackets, deductions, and credits
+
+Use these guidelines for calculations:
+- For US taxes, consider federal income tax, state tax (if applicable), and FICA taxes
+- Apply appropriate tax brackets based on filing status and income level
+- Consider standard vs itemized deductions
+- Factor in applicable tax credits
+- For business income, consider self-employment tax implications
+
+IMPORTANT: Format your response as human-readable text that could be directly shared with a client.
+Include clear headings, specific dollar amounts, and step-by-step explanations for each strategy.
+DO NOT respond with JSON - respond with well-formatted text only.
+DO NOT include the baseline tax calculation section in your response.
+
+Structure your response like this:
+
+TAX STRATEGY ANALYSIS
+
+## Client Overview
+- Filing Status: [Extract from client data]
+- Total Annual Income: $[Calculate total income]
+- Primary Income Sources: [List main sources]
+- Dependents: [Number and ages if applicable]
+
+### Strategy 1: [Strategy Title]
+- **Relevance Score**: [Score]/10
+- **How it applies**: [Detailed explanation based on client situation]
+- **Tax Calculation with Strategy**:
+  - Federal Income Tax: $[Adjusted amount]
+  - State Tax: $[Adjusted amount]
+  - FICA Taxes: $[Adjusted amount]
+  - Total Tax with Strategy: $[New total]
+- **Estimated Tax Savings**: $[Baseline - Strategy total]
+- **Implementation Steps**:
+  1. [Specific actionable step]
+  2. [Specific actionable step]
+  3. [Additional steps as needed]
+- **Required Documentation**: [List any forms or documents needed]
+- **Timing Considerations**: [When to implement]
+- **Common Pitfalls to Avoid**:
+  [Include the specific pitfalls from the strategy data provided below]
+
+### Strategy 2: [Strategy Title]
+[Same format as Strategy 1, including the Common Pitfalls section]
+
+### Strategy 3: [Strategy Title]
+[Same format as Strategy 1, including the Common Pitfalls section]
+
+## Summary and Recommendations
+
+### Strategy Comparison
+| Strategy | Tax Savings | Implementation Difficulty | Timeline |
+|----------|-------------|---------------------------|----------|
+| [Strategy 1] | $[Amount] | [Easy/Medium/Hard] | [Timeline] |
+| [Strategy 2] | $[Amount] | [Easy/Medium/Hard] | [Timeline] |
+| [Strategy 3] | $[Amount] | [Easy/Medium/Hard] | [Timeline] |
+
+### Best Strategy Recommendation
+- **Recommended Strategy**: [Name of strategy with best savings/effort ratio]
+- **Expected Annual Savings**: $[Amount]
+- **Why this strategy**: [Explanation of why it's best for this client]
+
+### Combined Strategy Potential
+- **If multiple strategies can be combined**: $[Total potential savings]
+- **Overall Recommendation**: [Strategic advice for the client]
+
+### Next Steps
+1. [Immediate action item]
+2. [Follow-up action item]
+3. [Long-term planning item]
+
+**Note**: These calculations are estimates based on current tax laws and the information provided.
+
+""",
+    # The selected strategies come from the shared catalog and are often the
+    # same for many clients, so they go ahead of the client's own data
+    """Selected Tax Strategies (Top {strategy_count} most relevant):
+{strategies_json}
+
+Client Tax Information:
+{client_json}
+
+Base line tax calculation (For Reference Only):
+{baseline}
+""",
+    samples=tuple(
+        {"client_json": client, "baseline": f"Total Tax: ${tax:,}", "strategy_count": 1,
+         "strategies_json": json.dumps([{"title": "Strategy 1: New Side Business and Potential Deductions"}], indent=2)}
+        for client, tax in zip(_SAMPLE_CLIENTS, (14250, 52310))
+    ),
+))
+
+HTML_CONVERSION = register(PromptTemplate(
+    "html_conversion", "2",
+    """Convert the tax calculation text at the end to a well-formatted HTML representation.
+Do not change ANY of the content - keep all numbers, calculations, and text exactly the same.
+
+Improve the presentation using these HTML elements and CSS classes:
+- Use <section> tags to group related content
+- Use <h1>, <h2>, <h3> for section titles
+- Use <p> for text blocks
+- Wrap tables in <div class="table-responsive">
+- Use <table>, <tr>, <th>, <td> for tabular data
+- Use <span class="number"> for important numeric values
+- Wrap calculation blocks in <div class="calculation">...</div>
+- Place summary information in <div class="summary">...</div>
+
+Apply modern formatting while maintaining the exact mathematical values and explanations.
+
+Return ONLY valid HTML that can be directly embedded in a web page. Don't include any explanations before or after.
+
+Here's the tax calculation text:
+
+""",
+    """```
+{text}
+```
+""",
+    system="You are an HTML conversion expert who preserves the exact content of tax documents while improving their presentation with HTML.",
+    samples=({"text": "Total Tax: $14,250"}, {"text": "Total Tax: $52,310\nEffective Tax Rate: 21.8%"}),
+))
+
+COMPARISON = register(PromptTemplate(
+    "comparison", "2",
+    """You are a tax expert analyzing two tax documents. Your task is to identify and compare ONLY numeric values
+between the two documents at the end. Focus exclusively on extracting numeric tax metrics, amounts, and rates.
+
+Please provide ONLY a detailed comparison of the numeric values found in both documents:
+
+1. DETAILED COMPARISON: Identify and compare ANY relevant tax metrics found in the documents.
+   - Extract numerical values from both documents where possible
+   - Calculate differences
+   - Do not include any analysis or recommendations
+   - Strictly focus on numeric tax-related values only
+
+Generate structured JSON data for the comparison with this format:
+{{
+  "year_labels": ["Previous Year", "Current Year"],
+  "key_metrics": [
+    {{
+      "label": "[Tax Metric Name]",
+      "document1": [numeric value],
+      "document2": [numeric value],
+      "difference": [numeric difference]
+    }}
+    // Include all relevant numeric metrics you can identify from the documents
+  ]
+}}
+
+Include the JSON between markers [JSON_START] and [JSON_END] to make extraction easier.
+
+""",
+    """# DOCUMENT 1 (Previous Year):
+```
+{document1}
+```
+
+# DOCUMENT 2 (Current Year):
+```
+{document2}
+```
+""",
+    system="You are a tax expert who analyzes and compares tax documents, extracting and comparing only numeric metrics based on the actual content of the documents.",
+    samples=(
+        {"document1": "Total Tax: $13,900", "document2": "Total Tax: $14,250"},
+        {"document1": "{\"total_tax\": 50120}", "document2": "Total Tax: $52,310"},
+    ),
+))
+
+
+def check_template(template):
+    """
+    Render a template with each of its samples and check the prefix.
+
+    Returns:
+        list: Problems found; empty if the static prefix is byte-identical
+        across samples and no dynamic value leaks into it
+    """
+    if len(template.samples) < 2:
+        return [f"{template.prompt_id}: needs at least two samples"]
+    problems = []
+    rendered = [template.messages(**sample) for sample in template.samples]
+    prefixes = [template.prefix(**sample) for sample in template.samples]
+    if len(set(prefixes)) > 1:
+        problems.append(f"{template.prompt_id}: static prefix differs between samples")
+    if template.system and len({messages[0]["content"] for messages in rendered}) > 1:
+        problems.append(f"{template.prompt_id}: system message differs between samples")
+    # What the provider sees: the full rendered prompts of different clients must
+    # agree byte for byte up to the end of the static prefix
+    prompts = [template.render(**sample) for sample in template.samples]
+    if len(os.path.commonprefix(prompts)) < len(min(prefixes, key=len)):
+        problems.append(f"{template.prompt_id}: rendered prompts diverge before the end of the static prefix")
+    for sample, messages, prefix in zip(template.samples, rendered, prefixes):
+        if not messages[-1]["content"].startswith(prefix):
+            problems.append(f"{template.prompt_id}: rendered prompt does not start with the static prefix")
+        for name in template.dynamic_fields:
+            # Short values such as counts can occur in the instructions by chance
+            value = str(sample[name])
+            if len(value) >= 16 and value in prefix:
+                problems.append(f"{template.prompt_id}: dynamic field {name} appears in the static prefix")
+    return problems
+
+
+def check_prompts():
+    """
+    Run check_template over every registered prompt.
+
+    Returns:
+        list: Problems found across all prompts; empty if every static prefix is cacheable
+    """
+    return [problem for template in PROMPTS.values() for problem in check_template(template)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prompt templates")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List prompt IDs and static prefix sizes")
+    subparsers.add_parser("check", help="Check that static prefixes are byte-identical across calls")
+    args = parser.parse_args(argv)
+
+    problems = []
+    for template in PROMPTS.values():
+        sample = template.samples[0] if template.samples else {}
+        system_tokens = estimate_tokens(template.system) if template.system else 0
+        prefix_tokens = system_tokens + estimate_tokens(template.prefix(**sample))
+        note = "" if prefix_tokens >= CACHE_MIN_TOKENS else "  (below the provider caching minimum on its own)"
+        print(f"{template.prompt_id:<34} static prefix ~{prefix_tokens:>5} tokens{note}")
+        if args.command == "check":
+            problems.extend(check_template(template))
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if args.command == "check" and not problems:
+        print(f"OK: {len(PROMPTS)} prompts have byte-identical static prefixes")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
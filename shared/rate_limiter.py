@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import heapq
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Lower number = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Per-model quotas (requests and tokens per minute). LLM_RATE_LIMITS takes a
+# JSON object with the same shape to match the account's actual tier.
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+    "gpt-4": {"rpm": 500, "tpm": 10000},
+    "default": {"rpm": 500, "tpm": 30000},
+}
+
+# AIMD concurrency window per model
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", "4"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+# Factor applied to the window when a request times out
+LLM_TIMEOUT_BACKOFF = float(os.getenv("LLM_TIMEOUT_BACKOFF", "0.9"))
+# Pause applied to a model after a 429 that did not carry Retry-After
+LLM_RATE_LIMIT_PAUSE = float(os.getenv("LLM_RATE_LIMIT_PAUSE_SECONDS", "2"))
+# Completion size assumed when reserving tokens before a call
+DEFAULT_COMPLETION_TOKENS = int(os.getenv("LLM_ESTIMATED_COMPLETION_TOKENS", "600"))
+
+_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+def _load_rate_limits():
+    limits = {model: dict(values) for model, values in DEFAULT_RATE_LIMITS.items()}
+    raw = os.getenv("LLM_RATE_LIMITS")
+    if raw:
+        try:
+            for model, values in json.loads(raw).items():
+                limits.setdefault(model, {}).update(values)
+        except (ValueError, AttributeError) as e:
+            logger.error(f"Ignoring invalid LLM_RATE_LIMITS: {str(e)}")
+    return limits
+
+
+@contextmanager
+def priority_scope(priority):
+    """
+    Run LLM calls made inside the block at the given priority.
+
+    Streamlit sessions use the PRIORITY_INTERACTIVE default; batch jobs wrap
+    their work in priority_scope(PRIORITY_BATCH) so they queue behind users.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def estimate_tokens(text):
+    """Rough token count for quota reservation (about four characters per token)."""
+    return max(1, len(text or "") // 4)
+
+
+def is_rate_limit_error(error):
+    """True if an openai/httpx/llama_index exception is a provider 429."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_timeout_error(error):
+    """True if an openai/httpx/llama_index exception is a request timeout."""
+    return isinstance(error, TimeoutError) or type(error).__name__ in ("APITimeoutError", "TimeoutException", "ReadTimeout")
+
+
+def retry_after_seconds(error):
+    """Retry-After hint from a 429 response, if the provider sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to capacity units and refills continuously
+    at capacity per minute. Callers may take more than is available, which
+    drives the level negative and delays later callers until it recovers.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken (0 if it can be taken now)."""
+        self._refill(now)
+        # A single request larger than the bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def adjust(self, delta, now):
+        """Charge (positive) or refund (negative) the difference from an estimate."""
+        self._refill(now)
+        self.level = min(self.capacity, self.level - delta)
+
+
+class ModelScheduler:
+    """
+    Admission control for one model: request and token buckets, a priority
+    queue for callers that cannot start yet, and an AIMD concurrency window.
+
+    The window grows by one slot per window's worth of successes, shrinks
+    slightly when a request times out and is halved on a 429, so throughput
+    settles just under the provider's limit instead of repeatedly tripping it.
+    Latency alone never shrinks it: a long analysis call is normal, not a
+    sign of overload.
+    """
+
+    def __init__(self, model, rpm, tpm, initial_concurrency=LLM_INITIAL_CONCURRENCY,
+                 max_concurrency=LLM_MAX_CONCURRENCY, timeout_backoff=LLM_TIMEOUT_BACKOFF):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = float(min(max(1, initial_concurrency), self.max_concurrency))
+        self.timeout_backoff = timeout_backoff
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.stats = {"admitted": 0, "rate_limited": 0, "queued_peak": 0}
+
+    @property
+    def queue_depth(self):
+        with self._condition:
+            return len(self._waiters)
+
+    def _ready_in(self, estimated_tokens, now):
+        if self.in_flight >= int(self.concurrency):
+            return None  # wait for a release
+        return max(
+            self.paused_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(estimated_tokens, now),
+            0.0,
+        )
+
+    def acquire(self, estimated_tokens, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """
+        Block until this caller may start a request.
+
+        Args:
+            estimated_tokens (int): Prompt plus expected completion tokens
+            priority (int): Lower values are admitted first
+            timeout (float, optional): Give up after this many seconds
+
+        Returns:
+            bool: True if admitted, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, entry)
+            self.stats["queued_peak"] = max(self.stats["queued_peak"], len(self._waiters))
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiters[0] == entry:
+                        wait = self._ready_in(estimated_tokens, now)
+                        if wait == 0.0:
+                            heapq.heappop(self._waiters)
+                            self.requests.take(1, now)
+                            self.tokens.take(estimated_tokens, now)
+                            self.in_flight += 1
+                            self.stats["admitted"] += 1
+                            # Let the next waiter re-check against the new state
+                            self._condition.notify_all()
+                            return True
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self._waiters.remove(entry)
+                            heapq.heapify(self._waiters)
+                            self._condition.notify_all()
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._condition.wait(wait)
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._condition.notify_all()
+                raise
+
+    def release(self, estimated_tokens, actual_tokens=None, latency=None, rate_limited=False, retry_after=None,
+                timed_out=False):
+        """
+        Return a slot and feed the outcome back into the buckets and window.
+
+        Args:
+            estimated_tokens (int): The amount reserved in acquire()
+            actual_tokens (int, optional): Tokens reported by the provider
+            latency (float, optional): Seconds the request took; set only for successes
+            rate_limited (bool): Whether the provider answered 429
+            retry_after (float, optional): Provider's Retry-After hint
+            timed_out (bool): Whether the request timed out
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight = max(0, self.in_flight - 1)
+            if actual_tokens is not None:
+                self.tokens.adjust(actual_tokens - estimated_tokens, now)
+
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+                self.paused_until = max(self.paused_until, now + (retry_after or LLM_RATE_LIMIT_PAUSE))
+                # One decrease per burst of 429s from requests that were already in flight
+                if now - self._last_decrease > (retry_after or LLM_RATE_LIMIT_PAUSE):
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self._last_decrease = now
+                    logger.warning(f"{self.model} rate limited; concurrency window now {int(self.concurrency)}")
+            elif timed_out:
+                self.concurrency = max(1.0, self.concurrency * self.timeout_backoff)
+            elif latency is not None:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1.0 / self.concurrency)
+
+            self._condition.notify_all()
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                "model": self.model,
+                "concurrency": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "queue_depth": len(self._waiters),
+                **self.stats,
+            }
+
+
+class RateLimiter:
+    """Registry of ModelSchedulers keyed by model name."""
+
+    def __init__(self, limits=None):
+        self.limits = limits or _load_rate_limits()
+        self._schedulers = {}
+        self._lock = threading.Lock()
+
+    def scheduler(self, model):
+        with self._lock:
+            scheduler = self._schedulers.get(model)
+            if scheduler is None:
+                quota = self.limits.get(model) or self.limits["default"]
+                scheduler = ModelScheduler(model, quota["rpm"], quota["tpm"])
+                self._schedulers[model] = scheduler
+            return scheduler
+
+    @contextmanager
+    def slot(self, model, estimated_tokens, priority=None, timeout=None):
+        """
+        Hold an admission slot for one request.
+
+        Yields a dict the caller fills in with "tokens" (actual usage) and, on
+        failure, the exception under "error"; both are fed back on exit.
+
+        Raises:
+            TimeoutError: If no slot frees up within timeout seconds
+        """
+        scheduler = self.scheduler(model)
+        priority = current_priority() if priority is None else priority
+        if not scheduler.acquire(estimated_tokens, priority, timeout=timeout):
+            raise TimeoutError(f"Timed out waiting for a {model} rate limit slot")
+        outcome = {"tokens": None, "error": None}
+        started = time.monotonic()
+        try:
+            yield outcome
+        except BaseException as e:
+            outcome["error"] = e
+            raise
+        finally:
+            error = outcome["error"]
+            rate_limited = error is not None and is_rate_limit_error(error)
+            scheduler.release(
+                estimated_tokens,
+                actual_tokens=outcome["tokens"],
+                # Failed calls say nothing useful about healthy latency
+                latency=time.monotonic() - started if error is None else None,
+                rate_limited=rate_limited,
+                retry_after=retry_after_seconds(error) if rate_limited else None,
+                timed_out=error is not None and is_timeout_error(error),
+            )
+
+    def snapshot(self):
+        with self._lock:
+            schedulers = list(self._schedulers.values())
+        return [scheduler.snapshot() for scheduler in schedulers]
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide RateLimiter."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
@@ -0,0 +1,380 @@
+"""
+Near-duplicate scenario index.
+
+Many scenarios are small edits of earlier ones: a family resubmits with
+updated figures, or staff re-run the same template. Exact-match caches miss
+these. This index keeps MinHash signatures in a SQLite table with
+locality-sensitive-hashing buckets, so earlier results can be found for
+scenarios above a similarity threshold:
+
+    index = get_scenario_index()
+    match = index.find_similar_text("questions", scenario_text, version="1")
+    if match is None:
+        questions = generate_questions(scenario_text)
+        index.add_text("questions", scenario_text, questions, version="1")
+
+Text is compared on word 3-shingles with numbers folded to one token, so
+changed amounts don't lower the similarity. Structured client JSON is compared
+on path=value features with amounts bucketed by magnitude; a match also
+reports which fields differ and whether every difference is a numeric tweak
+within SCENARIO_NUMERIC_TOLERANCE, so callers can reuse results that don't
+depend on the exact figures and recompute the rest.
+
+`version` separates entries produced by different prompts or catalogs; bump
+it whenever the cached result would change.
+"""
+import os
+import re
+import json
+import math
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+from shared.metrics import record_cache_lookup
+from shared.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+SCENARIO_INDEX_ENABLED = os.getenv("SCENARIO_INDEX_ENABLED", "1").lower() not in ("0", "false", "no")
+SCENARIO_INDEX_PATH = os.getenv("SCENARIO_INDEX_PATH", os.path.join("cache", "scenario_index.sqlite3"))
+# Estimated Jaccard similarity a scenario needs to reuse an earlier result
+SCENARIO_TEXT_THRESHOLD = float(os.getenv("SCENARIO_TEXT_THRESHOLD", "0.85"))
+SCENARIO_JSON_THRESHOLD = float(os.getenv("SCENARIO_JSON_THRESHOLD", "0.8"))
+# Relative change below which a differing amount counts as a tweak, not a new situation
+SCENARIO_NUMERIC_TOLERANCE = float(os.getenv("SCENARIO_NUMERIC_TOLERANCE", "0.25"))
+SCENARIO_INDEX_TTL_SECONDS = int(os.getenv("SCENARIO_INDEX_TTL_DAYS", "30")) * 24 * 3600
+
+# 32 bands of 4 rows: pairs above ~0.6 similarity almost always share a bucket
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32
+SHINGLE_SIZE = 3
+# Candidates compared exactly per lookup, most recent first
+MAX_CANDIDATES = 50
+PRUNE_INTERVAL_SECONDS = 3600
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes; fixed seed so
+# signatures stay comparable across processes and restarts
+_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(20240611)
+_A = _rng.integers(1, 2 ** 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenario_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    version TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    fields TEXT,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scenario_buckets (
+    kind TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scenario_buckets ON scenario_buckets (kind, bucket);
+CREATE INDEX IF NOT EXISTS idx_scenario_entries_created ON scenario_entries (created_at);
+"""
+
+_WORD_PATTERN = re.compile(r"[a-z]+|\d[\d,.]*")
+
+
+def normalize_text(text):
+    """Lower-case words with every number folded to "#"."""
+    return ["#" if token[0].isdigit() else token for token in _WORD_PATTERN.findall(str(text).lower())]
+
+
+def _shingles(tokens):
+    if len(tokens) < SHINGLE_SIZE:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def minhash(features):
+    """
+    MinHash signature of a set of string features.
+
+    Returns:
+        numpy.ndarray: MINHASH_PERMUTATIONS uint64 values
+    """
+    if not features:
+        return np.full(MINHASH_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint64, count=len(features))
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def similarity(signature1, signature2):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return float(np.mean(signature1 == signature2))
+
+
+def _band_buckets(signature):
+    """One LSH bucket per band, as signed 64-bit integers SQLite can store."""
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    return [
+        int.from_bytes(
+            hashlib.blake2b(bytes([band]) + signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest(),
+            "big", signed=True,
+        )
+        for band in range(LSH_BANDS)
+    ]
+
+
+def flatten_fields(data, prefix=""):
+    """
+    Flatten nested JSON to path -> list of leaf values.
+
+    List items share their list's path ("dependents.ages[]": [8, 5]), so
+    reordering dicts doesn't change the result.
+
+    Returns:
+        dict: Path to the list of scalar values found there
+    """
+    fields = {}
+
+    def visit(node, path):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                visit(value, f"{path}.{key}" if path else str(key))
+        elif isinstance(node, list):
+            for item in node:
+                visit(item, f"{path}[]")
+        else:
+            fields.setdefault(path, []).append(node)
+
+    visit(data, prefix)
+    return fields
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _feature_value(value):
+    if _is_number(value):
+        # Same bucket for amounts within about a factor of two
+        if value == 0:
+            return "#0"
+        return f"#{'-' if value < 0 else ''}{round(math.log2(abs(value)))}"
+    return str(value).strip().lower()
+
+
+def scenario_features(fields):
+    """path=value features of flattened JSON for MinHash."""
+    return {f"{path}={_feature_value(value)}" for path, values in fields.items() for value in values}
+
+
+def diff_fields(old, new, tolerance=SCENARIO_NUMERIC_TOLERANCE):
+    """
+    Compare two flattened scenarios.
+
+    Args:
+        old (dict): flatten_fields output of the indexed scenario
+        new (dict): flatten_fields output of the incoming scenario
+        tolerance (float): Largest relative change that counts as a tweak
+
+    Returns:
+        tuple: (sorted list of paths that differ, True if every difference is a
+        numeric change within tolerance)
+    """
+    changed, tweaks_only = [], True
+    for path in sorted(set(old) | set(new)):
+        a, b = old.get(path), new.get(path)
+        if a == b:
+            continue
+        changed.append(path)
+        if a is None or b is None or len(a) != len(b):
+            tweaks_only = False
+            continue
+        for x, y in zip(a, b):
+            if x == y:
+                continue
+            if not (_is_number(x) and _is_number(y)) or abs(x - y) > tolerance * max(abs(x), abs(y)):
+                tweaks_only = False
+    return changed, tweaks_only
+
+
+class ScenarioIndex:
+    """MinHash LSH index of scenario texts and structured scenarios with their cached results."""
+
+    def __init__(self, path=SCENARIO_INDEX_PATH, text_threshold=SCENARIO_TEXT_THRESHOLD,
+                 json_threshold=SCENARIO_JSON_THRESHOLD, ttl_seconds=SCENARIO_INDEX_TTL_SECONDS):
+        self.path = path
+        self.text_threshold = text_threshold
+        self.json_threshold = json_threshold
+        self.ttl_seconds = ttl_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        self._last_prune = 0
+
+    # -- storage -------------------------------------------------------------
+
+    def _add(self, kind, signature, payload, version, fields=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                entry_id = self._conn.execute(
+                    "INSERT INTO scenario_entries (kind, version, signature, fields, payload, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (kind, version, signature.tobytes(), json.dumps(fields) if fields is not None else None,
+                     json.dumps(payload), now),
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT INTO scenario_buckets (kind, bucket, entry_id) VALUES (?, ?, ?)",
+                    [(kind, bucket, entry_id) for bucket in set(_band_buckets(signature))],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if now - self._last_prune > PRUNE_INTERVAL_SECONDS:
+                self._prune(now)
+        return entry_id
+
+    def _best_match(self, kind, signature, version, threshold):
+        """Most similar entry at or above threshold among the LSH candidates, or None."""
+        buckets = _band_buckets(signature)
+        placeholders = ",".join("?" * len(buckets))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, signature, fields, payload FROM scenario_entries WHERE kind = ? AND version = ? AND id IN ("
+                f"SELECT entry_id FROM scenario_buckets WHERE kind = ? AND bucket IN ({placeholders})"
+                ") ORDER BY id DESC LIMIT ?",
+                (kind, version, kind, *buckets, MAX_CANDIDATES),
+            ).fetchall()
+        best = None
+        for entry_id, blob, fields, payload in rows:
+            score = similarity(signature, np.frombuffer(blob, dtype=np.uint64))
+            if score >= threshold and (best is None or score > best[0]):
+                best = (score, entry_id, fields, payload)
+        return best
+
+    def _prune(self, now):
+        cutoff = now - self.ttl_seconds
+        self._conn.execute(
+            "DELETE FROM scenario_buckets WHERE entry_id IN (SELECT id FROM scenario_entries WHERE created_at < ?)",
+            (cutoff,),
+        )
+        self._conn.execute("DELETE FROM scenario_entries WHERE created_at < ?", (cutoff,))
+        self._last_prune = now
+
+    # -- scenario text -------------------------------------------------------
+
+    def add_text(self, kind, text, payload, version=""):
+        """
+        Index a scenario text with the result computed for it.
+
+        Args:
+            kind (str): Result type, e.g. "questions"
+            text (str): Scenario text
+            payload: JSON-serialisable result
+            version (str): Prompt or catalog version the result depends on
+
+        Returns:
+            int: Entry ID
+        """
+        return self._add(kind, minhash(_shingles(normalize_text(text))), payload, version)
+
+    def find_similar_text(self, kind, text, version=""):
+        """
+        Find the result of the most similar earlier scenario text.
+
+        Returns:
+            dict or None: {"entry_id", "similarity", "payload"} for the best match at or
+            above the text threshold, otherwise None
+        """
+        match = self._best_match(kind, minhash(_shingles(normalize_text(text))), version, self.text_threshold)
+        record_cache_lookup(f"scenario_{kind}", match is not None)
+        if match is None:
+            return None
+        score, entry_id, _, payload = match
+        current_span().set_attributes({"scenario_index.entry": entry_id, "scenario_index.similarity": score})
+        return {"entry_id": entry_id, "similarity": score, "payload": json.loads(payload)}
+
+    # -- structured scenarios ------------------------------------------------
+
+    def add_scenario(self, kind, data, payload, version=""):
+        """
+        Index a structured scenario (client JSON) with the result computed for it.
+
+        Args:
+            kind (str): Result type, e.g. "strategies"
+            data (dict): Client JSON
+            payload: JSON-serialisable result
+            version (str): Prompt or catalog version the result depends on
+
+        Returns:
+            int: Entry ID
+        """
+        fields = flatten_fields(data)
+        return self._add(kind, minhash(scenario_features(fields)), payload, version, fields=fields)
+
+    def find_similar_scenario(self, kind, data, version=""):
+        """
+        Find the result of the most similar earlier structured scenario.
+
+        Returns:
+            dict or None: {"entry_id", "similarity", "payload", "changed_fields",
+            "tweaks_only"} for the best match at or above the JSON threshold. tweaks_only
+            is True when every changed field is a number within SCENARIO_NUMERIC_TOLERANCE.
+        """
+        fields = flatten_fields(data)
+        match = self._best_match(kind, minhash(scenario_features(fields)), version, self.json_threshold)
+        if match is None:
+            record_cache_lookup(f"scenario_{kind}", False)
+            return None
+        score, entry_id, stored_fields, payload = match
+        changed, tweaks_only = diff_fields(json.loads(stored_fields), fields)
+        record_cache_lookup(f"scenario_{kind}", tweaks_only)
+        current_span().set_attributes({
+            "scenario_index.entry": entry_id,
+            "scenario_index.similarity": score,
+            "scenario_index.changed_fields": len(changed),
+            "scenario_index.tweaks_only": tweaks_only,
+        })
+        return {
+            "entry_id": entry_id,
+            "similarity": score,
+            "payload": json.loads(payload),
+            "changed_fields": changed,
+            "tweaks_only": tweaks_only,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_scenario_index():
+    """
+    Return the process-wide scenario index.
+
+    Returns:
+        ScenarioIndex or None: The shared index, or None when SCENARIO_INDEX_ENABLED is off
+    """
+    global _index
+    if not SCENARIO_INDEX_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = ScenarioIndex()
+        return _index
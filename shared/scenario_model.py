@@ -0,0 +1,180 @@
+"""
+Canonical client scenario model.
+
+Agent 1 produces the client's tax scenario as free-form JSON text, often
+wrapped in markdown code fences. ClientScenario parses and validates it once;
+the same object is then passed to Agent 3, the job queue and the export tabs
+instead of each re-parsing the text.
+
+    scenario = ClientScenario.parse(response["response"])
+    scenario.data            # parsed dict, treat as read-only
+    scenario.canonical       # sorted-key compact JSON, stable across key order and whitespace
+    scenario.digest          # SHA-256 of canonical, used for dedup and cache keys
+    scenario.to_json(indent=2)
+    scenario.summary()       # one-line JSON without empty fields, for batched prompts
+"""
+import re
+import json
+import hashlib
+from dataclasses import dataclass, field
+
+# First "{" to last "}" in text that has prose around the JSON object
+JSON_OBJECT_PATTERN = re.compile(r"\{[\s\S]*\}")
+
+
+class InvalidScenario(ValueError):
+    """The scenario text is not a JSON object."""
+
+
+def strip_code_fences(text):
+    """
+    Remove a surrounding ```json ... ``` (or plain ```) markdown block.
+
+    Args:
+        text (str): LLM response text
+
+    Returns:
+        str: The text inside the block, stripped
+    """
+    cleaned = text.strip()
+    if cleaned.startswith("```json"):
+        cleaned = cleaned.split("```json", 1)[1]
+    elif cleaned.startswith("```"):
+        cleaned = cleaned.split("```", 1)[1]
+    if "```" in cleaned:
+        cleaned = cleaned.split("```")[0]
+    return cleaned.strip()
+
+
+def canonical_json(data):
+    """Compact JSON with sorted keys, identical for equal data."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _prune(value):
+    """Drop None, empty strings and empty containers, recursively."""
+    if isinstance(value, dict):
+        pruned = {key: _prune(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [item for item in (_prune(item) for item in value) if item not in (None, "", [], {})]
+    return value
+
+
+def _load_object(text):
+    text = strip_code_fences(text)
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        match = JSON_OBJECT_PATTERN.search(text)
+        if not match:
+            raise InvalidScenario("No JSON object found in scenario text")
+        try:
+            data = json.loads(match.group(0))
+        except json.JSONDecodeError as e:
+            raise InvalidScenario(f"Scenario is not valid JSON: {str(e)}")
+    # The model sometimes returns the object as a quoted JSON string
+    if isinstance(data, str):
+        return _load_object(data)
+    return data
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class ClientScenario:
+    """A parsed, validated client scenario. Equality and hashing follow the canonical form."""
+
+    data: dict
+    canonical: str
+    digest: str
+    _pretty: str = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a scenario from already-parsed client data.
+
+        Args:
+            data (dict): Client tax information
+
+        Returns:
+            ClientScenario: The scenario
+
+        Raises:
+            InvalidScenario: If data is not a dict
+        """
+        if not isinstance(data, dict):
+            raise InvalidScenario(f"Expected a JSON object but got {type(data).__name__}")
+        canonical = canonical_json(data)
+        return cls(data, canonical, hashlib.sha256(canonical.encode("utf-8")).hexdigest())
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Parse client JSON from any of the forms the pipeline passes around.
+
+        Args:
+            value (ClientScenario, dict or str): Existing scenario, parsed dict, or JSON
+                text (code fences, surrounding prose and quoted JSON are tolerated)
+
+        Returns:
+            ClientScenario: value itself if it is already a scenario, otherwise a new one
+
+        Raises:
+            InvalidScenario: If no JSON object can be recovered
+        """
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, (str, bytes)):
+            if isinstance(value, bytes):
+                value = value.decode("utf-8")
+            value = _load_object(value)
+        return cls.from_dict(value)
+
+    def to_json(self, indent=None):
+        """
+        Serialise the scenario.
+
+        Args:
+            indent (int, optional): None returns the canonical form; 2 returns the
+                original key order pretty-printed, as used in prompts and exports
+
+        Returns:
+            str: JSON text
+        """
+        if indent is None:
+            return self.canonical
+        if indent == 2:
+            # Every prompt that includes the scenario uses this form
+            if self._pretty is None:
+                object.__setattr__(self, "_pretty", json.dumps(self.data, indent=2))
+            return self._pretty
+        return json.dumps(self.data, indent=indent)
+
+    def summary(self):
+        """
+        Compact JSON without empty fields, for packing many clients into one prompt.
+
+        Returns:
+            str: One-line JSON in the original key order
+        """
+        return json.dumps(_prune(self.data), separators=(",", ":"), default=str)
+
+    @property
+    def filing_status(self):
+        return self.data.get("filing_status")
+
+    @property
+    def state(self):
+        """State of residence; Agent 1 writes it as a name or as {"name": ...}."""
+        state = self.data.get("state")
+        if isinstance(state, dict):
+            return state.get("name")
+        return state
+
+    def __eq__(self, other):
+        if not isinstance(other, ClientScenario):
+            return NotImplemented
+        return self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
@@ -0,0 +1,557 @@
+"""
+Persistent session state.
+
+A client's interview (scenario, answers, structured JSON, Agent 3 results)
+is saved outside the Streamlit process, so a restart or a request landing on
+another replica picks the session up where it left off. The store
+is field-based:
+
+- values are compact JSON, zlib-compressed above COMPRESS_MIN_BYTES
+- writes are buffered and flushed in one transaction every
+  SESSION_STORE_FLUSH_MS (write-behind); reads see buffered writes
+- fields larger than SESSION_STORE_LAZY_KB are not loaded when a session is
+  restored, only when first read
+
+SESSION_STORE_URL selects the backend: "sqlite:///cache/sessions.sqlite3"
+(default), "memory://" or "none". Other backends (e.g. a shared database for
+several replicas) implement SessionBackend and are added with
+register_backend(scheme, factory).
+
+    python -m shared.session_store check
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import atexit
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "sqlite:///" + os.path.join("cache", "sessions.sqlite3"))
+SESSION_STORE_FLUSH_MS = int(os.getenv("SESSION_STORE_FLUSH_MS", "250"))
+SESSION_STORE_LAZY_BYTES = int(os.getenv("SESSION_STORE_LAZY_KB", "16")) * 1024
+SESSION_STORE_TTL_SECONDS = int(os.getenv("SESSION_STORE_TTL_HOURS", "72")) * 3600
+# Values at least this large (as JSON) are zlib-compressed
+COMPRESS_MIN_BYTES = 1024
+
+_RAW = b"j"
+_COMPRESSED = b"z"
+
+# Key in the caller's state mapping where SessionSync keeps its bookkeeping
+SYNC_STATE_KEY = "_session_store_sync"
+
+
+def _encode(value):
+    data = json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return _COMPRESSED + zlib.compress(data, 6), len(data)
+    return _RAW + data, len(data)
+
+
+def encode_value(value):
+    """
+    Serialise a value to compact JSON bytes, compressed when large.
+
+    Returns:
+        bytes: One marker byte followed by the (compressed) JSON
+    """
+    return _encode(value)[0]
+
+
+def decode_value(blob):
+    """Inverse of encode_value."""
+    marker, data = blob[:1], blob[1:]
+    if marker == _COMPRESSED:
+        data = zlib.decompress(data)
+    return json.loads(data.decode("utf-8"))
+
+
+class SessionBackend:
+    """
+    Storage for encoded session fields.
+
+    Rows are (session_id, field, blob, lazy, updated_at); a None blob deletes
+    the field. Implementations must apply write_many atomically.
+    """
+
+    def write_many(self, rows):
+        raise NotImplementedError
+
+    def read(self, session_id, include_lazy=False):
+        """
+        Returns:
+            tuple: ({field: blob} for the loaded fields, [names of lazy fields not loaded])
+        """
+        raise NotImplementedError
+
+    def read_field(self, session_id, field):
+        """Returns the field's blob, or None."""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def prune(self, max_age_seconds):
+        """Delete sessions not written for max_age_seconds; returns the number removed."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(SessionBackend):
+    """In-process backend for single-process runs and tests."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def write_many(self, rows):
+        with self._lock:
+            for session_id, field, blob, lazy, updated_at in rows:
+                fields = self._sessions.setdefault(session_id, {})
+                if blob is None:
+                    fields.pop(field, None)
+                else:
+                    fields[field] = (blob, lazy, updated_at)
+
+    def read(self, session_id, include_lazy=False):
+        with self._lock:
+            fields = dict(self._sessions.get(session_id, {}))
+        loaded = {field: blob for field, (blob, lazy, _) in fields.items() if include_lazy or not lazy}
+        return loaded, [field for field, (_, lazy, _) in fields.items() if lazy and field not in loaded]
+
+    def read_field(self, session_id, field):
+        with self._lock:
+            entry = self._sessions.get(session_id, {}).get(field)
+        return entry[0] if entry else None
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def prune(self, max_age_seconds):
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            stale = [
+                session_id for session_id, fields in self._sessions.items()
+                if fields and max(updated_at for _, _, updated_at in fields.values()) < cutoff
+            ]
+            for session_id in stale:
+                del self._sessions[session_id]
+        return len(stale)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_fields (
+    session_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value BLOB NOT NULL,
+    lazy INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (session_id, field)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_session_fields_updated ON session_fields (updated_at);
+"""
+
+
+class SQLiteBackend(SessionBackend):
+    """SQLite backend (WAL mode); shareable by processes on the same host or volume."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SQLITE_SCHEMA)
+
+    def write_many(self, rows):
+        upserts = [row for row in rows if row[2] is not None]
+        deletes = [(row[0], row[1]) for row in rows if row[2] is None]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO session_fields (session_id, field, value, lazy, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (session_id, field) DO UPDATE SET value = excluded.value, lazy = excluded.lazy, "
+                    "updated_at = excluded.updated_at",
+                    [(session_id, field, blob, int(lazy), updated_at) for session_id, field, blob, lazy, updated_at in upserts],
+                )
+                self._conn.executemany("DELETE FROM session_fields WHERE session_id = ? AND field = ?", deletes)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def read(self, session_id, include_lazy=False):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT field, lazy, CASE WHEN lazy = 0 OR ? THEN value END FROM session_fields WHERE session_id = ?",
+                (int(include_lazy), session_id),
+            ).fetchall()
+        loaded = {field: blob for field, _, blob in rows if blob is not None}
+        return loaded, [field for field, lazy, blob in rows if lazy and blob is None]
+
+    def read_field(self, session_id, field):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM session_fields WHERE session_id = ? AND field = ?", (session_id, field)
+            ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_fields WHERE session_id = ?", (session_id,))
+
+    def prune(self, max_age_seconds):
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM session_fields WHERE session_id IN "
+                "(SELECT session_id FROM session_fields GROUP BY session_id HAVING MAX(updated_at) < ?)",
+                (cutoff,),
+            ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SessionStore:
+    """Write-behind session store over a SessionBackend."""
+
+    def __init__(self, backend, flush_interval=SESSION_STORE_FLUSH_MS / 1000, lazy_bytes=SESSION_STORE_LAZY_BYTES,
+                 ttl_seconds=SESSION_STORE_TTL_SECONDS):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.lazy_bytes = lazy_bytes
+        self.ttl_seconds = ttl_seconds
+        # (session_id, field) -> (blob or None, lazy, updated_at); later saves replace earlier ones
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_prune = 0.0
+
+    # -- writing -------------------------------------------------------------
+
+    def save(self, session_id, fields):
+        """
+        Queue field values for the next flush.
+
+        Args:
+            session_id (str): Session ID
+            fields (dict): Field name -> JSON-serialisable value; None deletes the field
+        """
+        now = time.time()
+        encoded = {}
+        for field, value in fields.items():
+            if value is None:
+                encoded[(session_id, field)] = (None, False, now)
+            else:
+                # Laziness follows the decoded size, which is what restoring costs
+                blob, size = _encode(value)
+                encoded[(session_id, field)] = (blob, size >= self.lazy_bytes, now)
+        with self._lock:
+            self._pending.update(encoded)
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+            self._wake.set()
+
+    def flush(self):
+        """Write every queued field to the backend in one batch."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            rows = [(session_id, field, blob, lazy, updated_at)
+                    for (session_id, field), (blob, lazy, updated_at) in pending.items()]
+            try:
+                self.backend.write_many(rows)
+            except Exception as e:
+                logger.error(f"Session store flush of {len(rows)} fields failed: {str(e)}")
+                # Put the batch back unless newer values arrived meanwhile
+                with self._lock:
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+                return 0
+            return len(rows)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="session-store-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait()
+            # Coalesce the writes of one burst (one Streamlit rerun) into one transaction
+            self._stop_event.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if self.ttl_seconds and time.time() - self._last_prune > 3600:
+                self._last_prune = time.time()
+                try:
+                    removed = self.backend.prune(self.ttl_seconds)
+                    if removed:
+                        logger.info(f"Pruned {removed} expired session field(s)")
+                except Exception as e:
+                    logger.warning(f"Session store prune failed: {str(e)}")
+
+    # -- reading -------------------------------------------------------------
+
+    def _pending_for(self, session_id):
+        with self._lock:
+            return {field: entry for (sid, field), entry in self._pending.items() if sid == session_id}
+
+    def load(self, session_id, include_lazy=False):
+        """
+        Load a session's fields.
+
+        Args:
+            session_id (str): Session ID
+            include_lazy (bool): Also load fields above the lazy size threshold
+
+        Returns:
+            tuple: ({field: value}, [names of lazy fields left unloaded])
+        """
+        blobs, lazy = self.backend.read(session_id, include_lazy=include_lazy)
+        lazy = set(lazy)
+        for field, (blob, is_lazy, _) in self._pending_for(session_id).items():
+            if blob is None:
+                blobs.pop(field, None)
+                lazy.discard(field)
+            elif is_lazy and not include_lazy:
+                blobs.pop(field, None)
+                lazy.add(field)
+            else:
+                blobs[field] = blob
+                lazy.discard(field)
+        return {field: decode_value(blob) for field, blob in blobs.items()}, sorted(lazy)
+
+    def load_field(self, session_id, field, default=None):
+        """Load one field (lazy or not), or default if it is not stored."""
+        entry = self._pending_for(session_id).get(field)
+        blob = entry[0] if entry else self.backend.read_field(session_id, field)
+        if entry and blob is None:
+            return default
+        return decode_value(blob) if blob is not None else default
+
+    def delete(self, session_id):
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == session_id]:
+                del self._pending[key]
+        self.backend.delete(session_id)
+
+    def close(self):
+        self._stop_event.set()
+        self._wake.set()
+        self.flush()
+
+
+class SessionSync:
+    """
+    Mirrors selected keys of a session-state mapping (e.g. st.session_state)
+    into a SessionStore, writing only the fields that changed.
+    """
+
+    def __init__(self, store, fields):
+        self.store = store
+        self.fields = list(fields)
+
+    def _meta(self, state):
+        if SYNC_STATE_KEY not in state:
+            state[SYNC_STATE_KEY] = {"digests": {}, "lazy": set()}
+        return state[SYNC_STATE_KEY]
+
+    @staticmethod
+    def _digest(value):
+        data = json.dumps(value, separators=(",", ":"), sort_keys=True, default=str).encode("utf-8")
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def restore(self, state, session_id):
+        """
+        Load a stored session into state; large fields stay lazy.
+
+        Returns:
+            bool: True if the session had stored fields
+        """
+        values, lazy = self.store.load(session_id)
+        meta = self._meta(state)
+        for field, value in values.items():
+            if field in self.fields:
+                state[field] = value
+                meta["digests"][field] = self._digest(value)
+        meta["lazy"] = {field for field in lazy if field in self.fields}
+        return bool(values or lazy)
+
+    def value(self, state, session_id, field, default=None):
+        """Read a field from state, loading it from the store first if it is still lazy."""
+        meta = self._meta(state)
+        if field in meta["lazy"]:
+            value = self.store.load_field(session_id, field, default)
+            state[field] = value
+            meta["lazy"].discard(field)
+            meta["digests"][field] = self._digest(value)
+        return state[field] if field in state else default
+
+    def assign(self, state, field, value):
+        """Set a field, replacing its stored value even if that was never loaded."""
+        self._meta(state)["lazy"].discard(field)
+        state[field] = value
+
+    def sync(self, state, session_id):
+        """
+        Queue every tracked field whose value changed since the last sync.
+
+        Fields restore() left lazy are skipped until value() loads them or
+        assign() replaces them; whatever the caller put in state meanwhile is
+        a placeholder default, not the session's value.
+
+        Returns:
+            int: Number of fields queued
+        """
+        meta = self._meta(state)
+        changed = {}
+        for field in self.fields:
+            if field not in state or field in meta["lazy"]:
+                continue
+            value = state[field]
+            digest = self._digest(value)
+            if meta["digests"].get(field) != digest:
+                changed[field] = value
+                meta["digests"][field] = digest
+        if changed:
+            self.store.save(session_id, changed)
+        return len(changed)
+
+
+def _sqlite_backend(location):
+    return SQLiteBackend(location or os.path.join("cache", "sessions.sqlite3"))
+
+
+_BACKENDS = {
+    "sqlite": _sqlite_backend,
+    "memory": lambda location: MemoryBackend(),
+}
+
+
+def register_backend(scheme, factory):
+    """
+    Make a backend available to SESSION_STORE_URL.
+
+    Args:
+        scheme (str): URL scheme, e.g. "redis"
+        factory (callable): Called with the part of the URL after "<scheme>://";
+            returns a SessionBackend
+    """
+    _BACKENDS[scheme] = factory
+
+
+def open_session_store(url=SESSION_STORE_URL):
+    """
+    Build a store from a URL such as "sqlite:///cache/sessions.sqlite3".
+
+    Returns:
+        SessionStore: The store, or None for "none"
+    """
+    if not url or url == "none":
+        return None
+    scheme, _, location = url.partition("://")
+    if scheme not in _BACKENDS:
+        raise ValueError(f"Unknown session store backend {scheme!r}; expected one of {sorted(_BACKENDS)}")
+    # sqlite:///relative/path and sqlite:////absolute/path, as in SQLAlchemy URLs
+    if location.startswith("/"):
+        location = location[1:]
+    return SessionStore(_BACKENDS[scheme](location))
+
+
+_store = None
+_store_opened = False
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """
+    Return the process-wide session store.
+
+    Returns:
+        SessionStore: The shared store, or None if SESSION_STORE_URL is "none"
+    """
+    global _store, _store_opened
+    with _store_lock:
+        if not _store_opened:
+            _store = open_session_store()
+            _store_opened = True
+        return _store
+
+
+def check_restore():
+    """
+    Restore a session whose large fields stay lazy, apply empty defaults the
+    way app.py does, sync, and check that the stored values survived.
+
+    Returns:
+        list: Problems found; empty if defaults never overwrite unloaded fields
+    """
+    stored = {"conversation_history": [{"role": "user", "content": "x" * 64}] * 4, "current_stage": "analysis"}
+    store = SessionStore(MemoryBackend(), flush_interval=0, lazy_bytes=128, ttl_seconds=0)
+    sync = SessionSync(store, list(stored) + ["tax_strategies_result"])
+    store.save("check", {**stored, "tax_strategies_result": {"report": "y" * 256}})
+
+    state = {}
+    sync.restore(state, "check")
+    state.setdefault("conversation_history", [])
+    state.setdefault("current_stage", "question_generation")
+    state.setdefault("tax_strategies_result", None)
+    sync.sync(state, "check")
+
+    problems = []
+    values, _ = store.load("check", include_lazy=True)
+    for field, value in stored.items():
+        if values.get(field) != value:
+            problems.append(f"{field}: default overwrote the stored value on sync")
+    if sync.value(state, "check", "tax_strategies_result") != {"report": "y" * 256}:
+        problems.append("tax_strategies_result: value() did not load the stored value over the default")
+    sync.assign(state, "tax_strategies_result", {"report": "z"})
+    sync.sync(state, "check")
+    if store.load_field("check", "tax_strategies_result") != {"report": "z"}:
+        problems.append("tax_strategies_result: assign() of a new value was not saved")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Session store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("check", help="Check that restoring a session and applying defaults keeps stored fields")
+    parser.parse_args(argv)
+
+    problems = check_restore()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if not problems:
+        print("OK: restored sessions keep their stored fields")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
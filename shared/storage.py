@@ -0,0 +1,329 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import datetime
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Root for generated artifacts (comparison reports, per-session baselines)
+STORAGE_ROOT = Path(os.getenv("STORAGE_ROOT", "reports"))
+STORAGE_MAX_AGE_SECONDS = int(os.getenv("STORAGE_MAX_AGE_HOURS", "72")) * 3600
+STORAGE_MAX_BYTES = int(os.getenv("STORAGE_MAX_MB", "500")) * 1024 * 1024
+# How often the background thread enforces the quotas; 0 disables it
+STORAGE_EVICTION_INTERVAL = int(os.getenv("STORAGE_EVICTION_INTERVAL_SECONDS", "600"))
+
+SHARED_NAMESPACE = "shared"
+BASELINE_FILE_NAME = "base_tax_calculation.txt"
+INDEX_FILE_NAME = "index.sqlite3"
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    relative_path TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_namespace ON artifacts (namespace, kind);
+"""
+
+
+def _safe_segment(value):
+    """Reduce an identifier to characters that are safe in a path segment."""
+    return re.sub(r"[^A-Za-z0-9_\-]", "_", str(value))[:64] or "_"
+
+
+def make_namespace(session_id=None, client_id=None):
+    """
+    Build the storage namespace for a client and/or session.
+
+    Args:
+        session_id (str, optional): Streamlit or API session ID
+        client_id (str, optional): Stable client identifier
+
+    Returns:
+        str: Relative namespace such as "client-42/session-ab12", or "shared"
+    """
+    parts = []
+    if client_id:
+        parts.append(f"client-{_safe_segment(client_id)}")
+    if session_id:
+        parts.append(f"session-{_safe_segment(session_id)}")
+    return "/".join(parts) or SHARED_NAMESPACE
+
+
+class StorageManager:
+    """
+    Namespaced artifact storage with atomic writes, an artifact index and
+    age/size quotas.
+
+    Every file is written to a temporary name in its destination directory and
+    renamed into place, so readers never see partial files and concurrent
+    sessions never share a path. The index is a SQLite database in the root,
+    so processes sharing STORAGE_ROOT (the app, the API, replicas) see each
+    other's entries and each write touches one row.
+    """
+
+    def __init__(self, root=STORAGE_ROOT, max_age_seconds=STORAGE_MAX_AGE_SECONDS, max_bytes=STORAGE_MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._index_path = self.root / INDEX_FILE_NAME
+        self._conn = sqlite3.connect(str(self._index_path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_INDEX_SCHEMA)
+        self._stop_event = threading.Event()
+        self._eviction_thread = None
+
+    # -- index ---------------------------------------------------------------
+
+    @staticmethod
+    def _entry(row):
+        return {
+            "path": row["path"],
+            "namespace": row["namespace"],
+            "kind": row["kind"],
+            "size": row["size"],
+            "created_at": row["created_at"],
+            "metadata": json.loads(row["metadata"]),
+        }
+
+    def _relative(self, path):
+        return Path(path).resolve().relative_to(self.root.resolve()).as_posix()
+
+    def register(self, path, namespace=SHARED_NAMESPACE, kind="artifact", metadata=None):
+        """
+        Record a stored file in the artifact index.
+
+        Args:
+            path (str or Path): File inside the storage root
+            namespace (str): Namespace the file belongs to
+            kind (str): Artifact kind, e.g. "comparison_report" or "baseline"
+            metadata (dict, optional): Extra JSON-serializable details
+
+        Returns:
+            dict: The index entry
+        """
+        entry = {
+            "path": str(path),
+            "namespace": namespace,
+            "kind": kind,
+            "size": os.path.getsize(path),
+            "created_at": time.time(),
+            "metadata": metadata or {},
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._relative(path), entry["path"], namespace, kind, entry["size"], entry["created_at"],
+                 json.dumps(entry["metadata"])),
+            )
+        return entry
+
+    def list_artifacts(self, namespace=None, kind=None):
+        """
+        List indexed artifacts, newest first.
+
+        Args:
+            namespace (str, optional): Only artifacts in this namespace
+            kind (str, optional): Only artifacts of this kind
+
+        Returns:
+            list: Index entries
+        """
+        query, params = "SELECT * FROM artifacts WHERE 1 = 1", []
+        if namespace is not None:
+            query += " AND namespace = ?"
+            params.append(namespace)
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created_at DESC", params).fetchall()
+        return [self._entry(row) for row in rows]
+
+    # -- paths and writes ----------------------------------------------------
+
+    def namespace_dir(self, namespace=SHARED_NAMESPACE):
+        """Directory for a namespace, created on demand."""
+        directory = self.root / namespace
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def artifact_path(self, namespace, prefix, suffix):
+        """
+        Return a collision-free path for a new artifact in a namespace.
+
+        Args:
+            namespace (str): Namespace from make_namespace
+            prefix (str): Human-readable file name prefix
+            suffix (str): File extension including the dot
+
+        Returns:
+            Path: Destination path (not yet created)
+        """
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        return self.namespace_dir(namespace) / f"{_safe_segment(prefix)}_{timestamp}_{uuid.uuid4().hex[:8]}{suffix}"
+
+    @contextmanager
+    def atomic_path(self, final_path):
+        """
+        Yield a temporary path next to final_path and rename it into place on success.
+
+        Use this for libraries that write to a path themselves (e.g. FPDF.output).
+        """
+        final_path = Path(final_path)
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=final_path.parent, prefix=".tmp-", suffix=final_path.suffix)
+        os.close(fd)
+        try:
+            yield temp_path
+            os.replace(temp_path, final_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def write_bytes(self, path, data, namespace=SHARED_NAMESPACE, kind="artifact", metadata=None):
+        """Atomically write bytes to path and index the result. Returns the path."""
+        with self.atomic_path(path) as temp_path:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+        self.register(path, namespace=namespace, kind=kind, metadata=metadata)
+        return Path(path)
+
+    def write_text(self, path, text, namespace=SHARED_NAMESPACE, kind="artifact", metadata=None):
+        """Atomically write UTF-8 text to path and index the result. Returns the path."""
+        return self.write_bytes(path, text.encode("utf-8"), namespace=namespace, kind=kind, metadata=metadata)
+
+    def baseline_path(self, namespace):
+        """Path of the baseline tax calculation for a namespace."""
+        return self.namespace_dir(namespace) / BASELINE_FILE_NAME
+
+    def delete(self, path):
+        """Remove a stored file and its index entry."""
+        with self._lock:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM artifacts WHERE relative_path = ?", (self._relative(path),))
+
+    # -- quotas --------------------------------------------------------------
+
+    def _stored_files(self):
+        """(relative path, size, mtime) of every artifact file under the root, indexed or not."""
+        files = []
+        for path in self.root.rglob("*"):
+            if path.parent == self.root and path.name.startswith(INDEX_FILE_NAME):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.is_file():
+                files.append((path.relative_to(self.root).as_posix(), stat.st_size, stat.st_mtime))
+        return files
+
+    def evict(self):
+        """
+        Enforce the quotas: drop index entries whose files are gone, delete
+        artifacts older than max_age_seconds, then delete the oldest artifacts
+        until the total size fits max_bytes.
+
+        The storage root is scanned rather than the index alone, so files
+        another process wrote but never indexed (or a leftover temporary file)
+        are aged out by modification time.
+
+        Returns:
+            int: Number of files removed
+        """
+        removed = 0
+        now = time.time()
+        with self._lock:
+            created = {
+                row["relative_path"]: row["created_at"]
+                for row in self._conn.execute("SELECT relative_path, created_at FROM artifacts")
+            }
+            files = self._stored_files()
+            missing = created.keys() - {relative_path for relative_path, _, _ in files}
+            self._conn.executemany("DELETE FROM artifacts WHERE relative_path = ?", [(path,) for path in missing])
+
+            kept = []
+            for relative_path, size, modified in files:
+                created_at = created.get(relative_path, modified)
+                if now - created_at > self.max_age_seconds:
+                    self._remove(relative_path)
+                    removed += 1
+                else:
+                    kept.append((created_at, relative_path, size))
+
+            total = sum(size for _, _, size in kept)
+            for _, relative_path, size in sorted(kept):
+                if total <= self.max_bytes:
+                    break
+                self._remove(relative_path)
+                total -= size
+                removed += 1
+
+        # Remove session directories that have been empty for a while (recent
+        # ones may be about to receive a write)
+        for directory in sorted(self.root.glob("**/"), key=lambda p: len(p.parts), reverse=True):
+            try:
+                if directory != self.root and not any(directory.iterdir()) and now - directory.stat().st_mtime > 60:
+                    directory.rmdir()
+            except OSError:
+                continue
+
+        if removed:
+            logger.info(f"Storage eviction removed {removed} artifacts")
+        return removed
+
+    def _remove(self, relative_path):
+        """Delete a file and its index entry. Caller holds the lock."""
+        (self.root / relative_path).unlink(missing_ok=True)
+        self._conn.execute("DELETE FROM artifacts WHERE relative_path = ?", (relative_path,))
+
+    def start_background_eviction(self, interval_seconds=STORAGE_EVICTION_INTERVAL):
+        """Run evict() periodically in a daemon thread (idempotent)."""
+        if interval_seconds <= 0 or self._eviction_thread is not None:
+            return
+
+        def run():
+            while not self._stop_event.wait(interval_seconds):
+                try:
+                    self.evict()
+                except Exception as e:
+                    logger.error(f"Storage eviction failed: {str(e)}")
+
+        self._eviction_thread = threading.Thread(target=run, name="storage-eviction", daemon=True)
+        self._eviction_thread.start()
+
+    def stop_background_eviction(self):
+        self._stop_event.set()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide StorageManager, starting background eviction on first use."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = StorageManager()
+            _storage.start_background_eviction()
+        return _storage
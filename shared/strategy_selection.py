@@ -0,0 +1,423 @@
+"""
+Strategy catalog and relevance-score selection for Agent 3.
+
+The catalog in agent3/tax_strategies.md is parsed once into records with
+stable IDs ("S1" for "Strategy 1: ..."). The scoring prompt lists the
+strategies by ID and the model answers {"S4": 8, ...}. Titles echoed back
+instead of IDs, with small differences in wording, still resolve, so a
+strategy is no longer dropped silently because its title didn't match exactly.
+
+    catalog = StrategyCatalog.from_markdown(content)
+    scores = parse_scores(response.text, catalog)      # {"S4": 8, "S1": 6}
+    top = select_top(scores, catalog)                  # [ScoredStrategy, ...], best first
+    [strategy.to_dict() for strategy in top]
+
+Many clients can be scored in one request: the catalog is sent once, followed
+by one compact summary per client ("C1: {...}"). pack_batches() sizes the
+batches to the prompt and output budgets, and parse_batch_scores() reads back
+one score map per client, salvaging complete clients from truncated output.
+"""
+import os
+import re
+import json
+import heapq
+import logging
+from dataclasses import dataclass
+
+from shared.rate_limiter import estimate_tokens
+from shared.scenario_model import JSON_OBJECT_PATTERN, strip_code_fences
+
+logger = logging.getLogger(__name__)
+
+MAX_STRATEGIES = 3
+MIN_RELEVANCE_SCORE = 5
+MAX_RELEVANCE_SCORE = 10
+
+# Batched scoring: clients per request, and the prompt and output token
+# budgets a batch must fit in (the model's context and max output, with margin)
+STRATEGY_BATCH_SIZE = int(os.getenv("STRATEGY_BATCH_SIZE", "8"))
+STRATEGY_BATCH_MAX_PROMPT_TOKENS = int(os.getenv("STRATEGY_BATCH_MAX_PROMPT_TOKENS", "32000"))
+STRATEGY_BATCH_MAX_OUTPUT_TOKENS = int(os.getenv("STRATEGY_BATCH_MAX_OUTPUT_TOKENS", "4096"))
+# Worst-case output per client: every strategy scored ("S12": 7,) plus the client key
+SCORE_TOKENS_PER_STRATEGY = 6
+CLIENT_OVERHEAD_TOKENS = 8
+
+# A strategy runs from its "### Strategy N:" heading to the next level-3
+# heading; "#### Common Pitfalls" inside it is not a boundary
+_STRATEGY_PATTERN = re.compile(r"^### (Strategy (\d+): .+?)\n(.*?)(?=^### |\Z)", re.MULTILINE | re.DOTALL)
+_PITFALLS_HEADING = "#### Common Pitfalls"
+_JSON_ARRAY_PATTERN = re.compile(r"\[[\s\S]*\]")
+_NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+_STRATEGY_NUMBER_PATTERN = re.compile(r"^\s*(?:strategy\s*|s)(\d+)\b", re.IGNORECASE)
+_CLIENT_ID_PATTERN = re.compile(r"^\s*(?:client\s*)?c?(\d+)\s*$", re.IGNORECASE)
+# A complete "C3": {...} block, for output cut off mid-way
+_CLIENT_BLOCK_PATTERN = re.compile(r'"?\b(C\d+)"?\s*:\s*(\{[^{}]*\})')
+
+
+def _normalize_title(title):
+    title = re.sub(r"^\s*strategy\s*\d+\s*:\s*", "", str(title), flags=re.IGNORECASE)
+    return " ".join(re.findall(r"[a-z0-9]+", title.lower()))
+
+
+def _word_overlap(a, b):
+    # Plurals are folded so "deductions" matches "deduction"
+    words_a, words_b = {word.rstrip("s") for word in a.split()}, {word.rstrip("s") for word in b.split()}
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+@dataclass(frozen=True, slots=True)
+class CatalogStrategy:
+    """One entry of the strategy catalog."""
+
+    strategy_id: str
+    title: str
+    details: str
+    pitfalls: str
+
+
+@dataclass(frozen=True, slots=True)
+class ScoredStrategy:
+    """A selected strategy with its score and where the score came from."""
+
+    strategy: CatalogStrategy
+    relevance_score: float
+    # "llm" when scored for this client, "index" when reused from a similar scenario
+    source: str = "llm"
+    similarity: float = None
+
+    @property
+    def strategy_id(self):
+        return self.strategy.strategy_id
+
+    @property
+    def title(self):
+        return self.strategy.title
+
+    def to_dict(self):
+        """The dict form used in results, the job queue and the analysis prompt."""
+        return {
+            "id": self.strategy.strategy_id,
+            "title": self.strategy.title,
+            "relevance_score": self.relevance_score,
+            "details": self.strategy.details,
+            "pitfalls": self.strategy.pitfalls,
+            "score_source": self.source,
+            "similarity": self.similarity,
+        }
+
+
+class StrategyCatalog:
+    """Catalog strategies in file order, looked up by ID or title."""
+
+    def __init__(self, strategies):
+        self.strategies = tuple(strategies)
+        self.by_id = {strategy.strategy_id: strategy for strategy in self.strategies}
+        self.positions = {strategy.strategy_id: index for index, strategy in enumerate(self.strategies)}
+        self._by_title = {strategy.title.lower(): strategy for strategy in self.strategies}
+        self._by_normalized_title = {_normalize_title(strategy.title): strategy for strategy in self.strategies}
+        self._listing = None
+
+    @classmethod
+    def from_markdown(cls, content):
+        """
+        Parse the "### Strategy N: Title" sections of the catalog file.
+
+        Args:
+            content (str): Markdown catalog
+
+        Returns:
+            StrategyCatalog: The catalog; empty if no strategy headings are found
+        """
+        strategies = []
+        for title, number, body in _STRATEGY_PATTERN.findall(content):
+            title = title.strip()
+            if _PITFALLS_HEADING in body:
+                details, pitfalls = body.split(_PITFALLS_HEADING, 1)
+                details, pitfalls = details.strip(), _PITFALLS_HEADING + "\n" + pitfalls.strip()
+            else:
+                details, pitfalls = body.strip(), ""
+            strategies.append(CatalogStrategy(f"S{number}", title, details, pitfalls))
+        return cls(strategies)
+
+    def __len__(self):
+        return len(self.strategies)
+
+    def __iter__(self):
+        return iter(self.strategies)
+
+    def get(self, strategy_id):
+        return self.by_id.get(strategy_id)
+
+    def resolve(self, key):
+        """
+        Find a strategy by ID ("S4"), exact title, "Strategy 4" or title wording.
+
+        Returns:
+            CatalogStrategy or None: The strategy, or None if the key matches nothing
+        """
+        key = str(key).strip()
+        strategy = self.by_id.get(key.upper()) or self._by_title.get(key.lower())
+        if strategy is not None:
+            return strategy
+        normalized = _normalize_title(key)
+        strategy = self._by_normalized_title.get(normalized)
+        if strategy is not None:
+            return strategy
+        match = _STRATEGY_NUMBER_PATTERN.match(key)
+        if match:
+            strategy = self.by_id.get(f"S{match.group(1)}")
+            # "Strategy 4: <reworded title>" is strategy 4, but "Strategy 4: <another
+            # strategy's title>" is not
+            if strategy is not None and (":" not in key or _word_overlap(normalized, _normalize_title(strategy.title)) >= 0.5):
+                return strategy
+        return None
+
+    def listing(self):
+        """JSON {id: title} for prompts; built once, so prompt prefixes stay identical."""
+        if self._listing is None:
+            self._listing = json.dumps({strategy.strategy_id: strategy.title for strategy in self.strategies}, indent=2)
+        return self._listing
+
+
+def _as_score(value):
+    """A numeric score from 8, 8.5, "8", "8/10" or {"score": 8}; None otherwise."""
+    if isinstance(value, dict):
+        value = value.get("score", value.get("relevance_score"))
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        score = value
+    else:
+        match = _NUMBER_PATTERN.search(str(value))
+        if not match:
+            return None
+        score = float(match.group(0))
+    score = min(max(score, 0), MAX_RELEVANCE_SCORE)
+    return int(score) if float(score).is_integer() else float(score)
+
+
+def _entries(data):
+    """(key, value) pairs from a score map or a list of {"id"/"title", "score"} items."""
+    if isinstance(data, dict) and len(data) == 1 and isinstance(next(iter(data.values())), (dict, list)):
+        key = next(iter(data))
+        # {"scores": {...}} wrappers, but not {"S4": {"score": 8}}
+        if str(key).lower() in ("scores", "strategies", "relevance_scores", "results"):
+            data = data[key]
+    if isinstance(data, dict):
+        return list(data.items())
+    if isinstance(data, list):
+        entries = []
+        for item in data:
+            if isinstance(item, dict):
+                key = item.get("id", item.get("strategy_id", item.get("title", item.get("strategy"))))
+                entries.append((key, item))
+        return entries
+    return []
+
+
+def score_map(data, catalog):
+    """
+    Resolve parsed model output to catalog scores.
+
+    Args:
+        data (dict or list): {id or title: score} or [{"id": ..., "score": ...}]
+        catalog (StrategyCatalog): Catalog the keys refer to
+
+    Returns:
+        dict: {strategy_id: score}; unknown keys are logged and skipped
+    """
+    scores, unknown = {}, []
+    for key, value in _entries(data):
+        strategy = catalog.resolve(key) if key is not None else None
+        score = _as_score(value)
+        if strategy is None or score is None:
+            unknown.append(str(key))
+            continue
+        scores[strategy.strategy_id] = max(score, scores.get(strategy.strategy_id, score))
+    if unknown:
+        logger.warning(f"Ignored {len(unknown)} unrecognised strategy scores: {', '.join(unknown[:5])}")
+    return scores
+
+
+def load_json(text):
+    """
+    Parse JSON from a model response, tolerating code fences and surrounding prose.
+
+    Raises:
+        ValueError: If no JSON object or array can be recovered
+    """
+    cleaned = strip_code_fences(text)
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        pass
+    for pattern in (JSON_OBJECT_PATTERN, _JSON_ARRAY_PATTERN):
+        match = pattern.search(cleaned)
+        if match:
+            try:
+                return json.loads(match.group(0))
+            except json.JSONDecodeError:
+                continue
+    raise ValueError("No JSON found in the strategy scoring response")
+
+
+def parse_scores(text, catalog):
+    """
+    Parse a scoring response into catalog scores.
+
+    Args:
+        text (str): Model response
+        catalog (StrategyCatalog): Catalog the response refers to
+
+    Returns:
+        dict: {strategy_id: score}
+
+    Raises:
+        ValueError: If the response contains no JSON
+    """
+    return score_map(load_json(text), catalog)
+
+
+def select_top(scores, catalog, k=MAX_STRATEGIES, min_score=MIN_RELEVANCE_SCORE, source="llm", similarity=None):
+    """
+    Pick the k highest-scoring strategies at or above min_score.
+
+    Ties go to the strategy listed first in the catalog.
+
+    Args:
+        scores (dict): {strategy_id: score}
+        catalog (StrategyCatalog): Catalog the IDs refer to
+        k (int): Number of strategies to keep
+        min_score (float): Lowest relevance score kept
+        source (str): Score provenance recorded on each result
+        similarity (float, optional): Similarity of the scenario the scores were reused from
+
+    Returns:
+        list: ScoredStrategy records, best first
+    """
+    candidates = (
+        (score, -catalog.positions[strategy_id], strategy_id)
+        for strategy_id, score in scores.items()
+        if strategy_id in catalog.by_id and score >= min_score
+    )
+    return [
+        ScoredStrategy(catalog.by_id[strategy_id], score, source, similarity)
+        for score, _, strategy_id in heapq.nlargest(k, candidates)
+    ]
+
+
+def client_label(position):
+    """Batch-local client ID for the client at a 0-based position."""
+    return f"C{position + 1}"
+
+
+def client_output_tokens(catalog):
+    """Worst-case output tokens for one client's scores."""
+    return len(catalog) * SCORE_TOKENS_PER_STRATEGY + CLIENT_OVERHEAD_TOKENS
+
+
+def pack_batches(summaries, catalog, prefix_tokens, max_clients=None, max_prompt_tokens=None, max_output_tokens=None):
+    """
+    Split client summaries into batches that fit one request each.
+
+    A batch closes when it has max_clients clients, when the next summary
+    would push the prompt past max_prompt_tokens, or when the worst-case
+    output would pass max_output_tokens. A client too large on its own still
+    gets a batch of one.
+
+    Args:
+        summaries (list): Compact client summaries, in order
+        catalog (StrategyCatalog): Catalog being scored
+        prefix_tokens (int): Tokens of the prompt before the client lines
+        max_clients (int, optional): Defaults to STRATEGY_BATCH_SIZE
+        max_prompt_tokens (int, optional): Defaults to STRATEGY_BATCH_MAX_PROMPT_TOKENS
+        max_output_tokens (int, optional): Defaults to STRATEGY_BATCH_MAX_OUTPUT_TOKENS
+
+    Returns:
+        list: Lists of positions into summaries
+    """
+    max_clients = max(1, max_clients or STRATEGY_BATCH_SIZE)
+    max_prompt_tokens = max_prompt_tokens or STRATEGY_BATCH_MAX_PROMPT_TOKENS
+    max_output_tokens = max_output_tokens or STRATEGY_BATCH_MAX_OUTPUT_TOKENS
+    per_client_output = client_output_tokens(catalog)
+
+    batches, current, prompt_tokens = [], [], prefix_tokens
+    for position, summary in enumerate(summaries):
+        # "C12: " and the newline
+        line_tokens = estimate_tokens(summary) + 4
+        full = current and (
+            len(current) >= max_clients
+            or prompt_tokens + line_tokens > max_prompt_tokens
+            or (len(current) + 1) * per_client_output > max_output_tokens
+        )
+        if full:
+            batches.append(current)
+            current, prompt_tokens = [], prefix_tokens
+        current.append(position)
+        prompt_tokens += line_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _client_key(key, client_ids):
+    if key in client_ids:
+        return key
+    match = _CLIENT_ID_PATTERN.match(str(key))
+    if match and f"C{int(match.group(1))}" in client_ids:
+        return f"C{int(match.group(1))}"
+    return None
+
+
+def parse_batch_scores(text, catalog, client_ids):
+    """
+    Parse a batched scoring response into one score map per client.
+
+    Accepts {"C1": {...}, ...}, {"clients": {...}} and [{"client": "C1", "scores": {...}}].
+    When the JSON doesn't parse (usually output cut off at the token limit),
+    every complete "C1": {...} block is still used.
+
+    Args:
+        text (str): Model response
+        catalog (StrategyCatalog): Catalog the response refers to
+        client_ids (list): Client IDs sent in the request
+
+    Returns:
+        dict: {client_id: {strategy_id: score}} for the clients found; missing
+        clients are left out so the caller can retry them
+    """
+    client_ids = set(client_ids)
+    try:
+        data = load_json(text)
+    except ValueError:
+        data = None
+
+    entries = []
+    if isinstance(data, dict):
+        if len(data) == 1 and str(next(iter(data))).lower() in ("clients", "results", "scores"):
+            data = next(iter(data.values()))
+    if isinstance(data, dict):
+        entries = list(data.items())
+    elif isinstance(data, list):
+        for item in data:
+            if isinstance(item, dict):
+                key = item.get("client", item.get("client_id", item.get("id")))
+                entries.append((key, item.get("scores", item.get("strategies", {}))))
+    else:
+        entries = [(key, block) for key, block in _CLIENT_BLOCK_PATTERN.findall(text)]
+
+    results = {}
+    for key, value in entries:
+        client_id = _client_key(key, client_ids)
+        if client_id is None:
+            continue
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError:
+                continue
+        results[client_id] = score_map(value, catalog)
+    return results
+
@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from shared.profiling import profile_stage
+
+logger = logging.getLogger(__name__)
+
+# "none" (default, no-op), "console", "json" or "otel" (requires opentelemetry-api/sdk)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", os.path.join("traces", "spans.jsonl"))
+
+STATUS_UNSET = "UNSET"
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_session = contextvars.ContextVar("trace_session", default=None)
+
+
+def trace_id_for_session(session_id):
+    """Stable 128-bit trace ID (32 hex chars) for a session, so every rerun joins the same trace."""
+    return hashlib.sha256(str(session_id).encode("utf-8")).hexdigest()[:32]
+
+
+def _new_span_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    """
+    A timed operation. Mirrors the subset of opentelemetry.trace.Span the
+    pipeline uses: set_attribute(s), add_event, record_exception, set_status,
+    end and is_recording.
+    """
+
+    def __init__(self, name, trace_id, parent_span_id=None, attributes=None, exporter=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_span_id()
+        self.parent_span_id = parent_span_id
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = STATUS_UNSET
+        self.status_description = None
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self._exporter = exporter
+
+    def is_recording(self):
+        return self.end_time is None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name, attributes=None):
+        self.events.append({"name": name, "time": time.time_ns(), "attributes": dict(attributes or {})})
+
+    def record_exception(self, exception):
+        self.add_event("exception", {"exception.type": type(exception).__name__, "exception.message": str(exception)})
+
+    def set_status(self, status, description=None):
+        self.status = status
+        self.status_description = description
+
+    def end(self):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time_ns()
+        if self._exporter is not None:
+            try:
+                self._exporter.export(self)
+            except Exception as e:
+                logger.error(f"Span export failed: {str(e)}")
+
+    @property
+    def duration_ms(self):
+        end = self.end_time or time.time_ns()
+        return (end - self.start_time) / 1e6
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "status_description": self.status_description,
+            "attributes": self.attributes,
+            "events": self.events,
+        }
+
+
+class _NoOpSpan:
+    """Returned when tracing is disabled; every method does nothing."""
+
+    trace_id = None
+    span_id = None
+
+    def is_recording(self):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+    def set_status(self, status, description=None):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoOpSpan()
+
+
+class ConsoleExporter:
+    """Prints one line per finished span to stderr, indented by nesting depth."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self._depths = {}
+        self._lock = threading.Lock()
+
+    def start(self, span):
+        with self._lock:
+            self._depths[span.span_id] = self._depths.get(span.parent_span_id, -1) + 1
+
+    def export(self, span):
+        with self._lock:
+            depth = self._depths.pop(span.span_id, 0)
+            attributes = " ".join(f"{key}={value}" for key, value in sorted(span.attributes.items()))
+            self.stream.write(
+                f"[trace {span.trace_id[:8]}] {'  ' * depth}{span.name} {span.duration_ms:.1f}ms "
+                f"{span.status} {attributes}\n"
+            )
+            self.stream.flush()
+
+
+class JSONExporter:
+    """Appends finished spans as JSON lines to a file."""
+
+    def __init__(self, path=TRACING_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def start(self, span):
+        pass
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class Tracer:
+    """
+    Creates spans that nest through a context variable, like an OpenTelemetry
+    tracer. Spans are no-ops while no exporter is configured.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def start_span(self, name, attributes=None):
+        exporter = _get_exporter()
+        if exporter is None:
+            return NOOP_SPAN
+        parent = _current_span.get()
+        session_id = _session.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id = trace_id_for_session(session_id) if session_id else uuid.uuid4().hex
+            parent_id = None
+        span = Span(name, trace_id, parent_id, attributes, exporter)
+        if session_id:
+            span.set_attribute("session.id", session_id)
+        exporter.start(span)
+        return span
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        span = self.start_span(name, attributes)
+        if span is NOOP_SPAN:
+            yield span
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            span.set_status(STATUS_ERROR, str(e))
+            span.set_attribute("outcome", "error")
+            raise
+        finally:
+            _current_span.reset(token)
+            if span.status == STATUS_UNSET:
+                span.set_status(STATUS_OK)
+            span.end()
+
+
+class _OTelTracer:
+    """Adapter that adds session attributes to spans from a real OpenTelemetry tracer."""
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        with self._tracer.start_as_current_span(name, attributes=attributes) as span:
+            session_id = _session.get()
+            if session_id:
+                span.set_attribute("session.id", session_id)
+            yield span
+
+    def start_span(self, name, attributes=None):
+        return self._tracer.start_span(name, attributes=attributes)
+
+
+_tracers = {}
+_exporter = None
+_exporter_configured = False
+_lock = threading.Lock()
+
+
+def _get_exporter():
+    global _exporter, _exporter_configured
+    if not _exporter_configured:
+        with _lock:
+            if not _exporter_configured:
+                if TRACING_EXPORTER == "console":
+                    _exporter = ConsoleExporter()
+                elif TRACING_EXPORTER == "json":
+                    _exporter = JSONExporter(TRACING_FILE)
+                _exporter_configured = True
+    return _exporter
+
+
+def get_tracer(name):
+    """
+    Return a tracer for a module, configured by TRACING_EXPORTER.
+
+    Args:
+        name (str): Instrumentation scope, usually __name__
+
+    Returns:
+        Tracer: A local tracer, or an OpenTelemetry adapter when TRACING_EXPORTER=otel
+    """
+    with _lock:
+        tracer = _tracers.get(name)
+        if tracer is None:
+            tracer = Tracer(name)
+            if TRACING_EXPORTER == "otel":
+                try:
+                    from opentelemetry import trace
+
+                    tracer = _OTelTracer(trace.get_tracer(name))
+                except ImportError:
+                    logger.warning("TRACING_EXPORTER=otel but opentelemetry is not installed; tracing disabled")
+            _tracers[name] = tracer
+        return tracer
+
+
+def set_exporter(exporter):
+    """Replace the local exporter (e.g. in benchmarks); None disables tracing."""
+    global _exporter, _exporter_configured
+    with _lock:
+        _exporter = exporter
+        _exporter_configured = True
+
+
+def bind_session(session_id):
+    """
+    Attach the current thread's spans to a session's trace.
+
+    Streamlit runs each script rerun in its own thread, so app.py calls this
+    at the top of every run instead of wrapping the whole script in a block.
+    """
+    _session.set(session_id)
+
+
+@contextmanager
+def session_trace(session_id):
+    """Run the block with spans attached to a session's trace."""
+    token = _session.set(session_id)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def current_span():
+    """The innermost active span, or a no-op span."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def propagate(fn):
+    """
+    Wrap fn so calls made from worker threads (ThreadPoolExecutor.map) keep
+    the caller's session and parent span.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def traced(name, tracer_name=None):
+    """
+    Decorator that runs a pipeline stage in a span (and under the profiler
+    when PROFILING_MODE is on).
+
+    A dict result containing "error" marks the span's outcome as "error";
+    anything else is "ok".
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = get_tracer(tracer_name or fn.__module__)
+            with profile_stage(name, _session.get()), tracer.start_as_current_span(name) as span:
+                result = fn(*args, **kwargs)
+                if isinstance(result, dict) and "error" in result:
+                    span.set_attribute("outcome", "error")
+                    span.set_status(STATUS_ERROR, str(result["error"])[:200])
+                else:
+                    span.set_attribute("outcome", "ok")
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,346 @@
+"""
+Process pool for CPU-bound stages.
+
+PDF text extraction, FPDF report rendering and the regex metric parsers hold
+the GIL, so on the Streamlit thread one large upload slows every other
+session's reruns. With WORKER_POOL_MODE=process those functions run in a pool
+of warm worker processes (PyPDF2, fpdf and the parsers imported up front);
+the default "inline" mode calls them directly as before.
+
+    result = run_cpu_bound(extract_document, file_name, data)
+
+Tasks must be module-level functions with picklable arguments and results.
+Each task has a timeout and a result size limit, and at most
+WORKER_POOL_MAX_PENDING tasks are queued or running at once.
+"""
+import os
+import time
+import pickle
+import signal
+import logging
+import importlib
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from shared.metrics import Gauge, REGISTRY, WORKER_POOL_TASKS
+from shared.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+# "inline" runs tasks in the calling thread; "process" runs them in the pool
+WORKER_POOL_MODE = os.getenv("WORKER_POOL_MODE", "inline").lower()
+WORKER_POOL_PROCESSES = int(os.getenv("WORKER_POOL_PROCESSES", "0")) or os.cpu_count() or 1
+# Tasks queued or running at once; further submissions wait up to WORKER_POOL_SUBMIT_TIMEOUT_SECONDS
+WORKER_POOL_MAX_PENDING = int(os.getenv("WORKER_POOL_MAX_PENDING", "0")) or WORKER_POOL_PROCESSES * 4
+WORKER_POOL_SUBMIT_TIMEOUT_SECONDS = float(os.getenv("WORKER_POOL_SUBMIT_TIMEOUT_SECONDS", "30"))
+WORKER_POOL_TASK_TIMEOUT_SECONDS = float(os.getenv("WORKER_POOL_TASK_TIMEOUT_SECONDS", "120"))
+WORKER_POOL_MAX_RESULT_BYTES = int(os.getenv("WORKER_POOL_MAX_RESULT_MB", "32")) * 1024 * 1024
+# "spawn" is safe next to Streamlit's threads; "forkserver" starts workers faster on Linux
+WORKER_POOL_START_METHOD = os.getenv("WORKER_POOL_START_METHOD", "spawn")
+# Modules imported when a worker starts so the first task doesn't pay for them
+WORKER_POOL_PRELOAD = [
+    name.strip() for name in os.getenv(
+        "WORKER_POOL_PRELOAD",
+        "PyPDF2,fpdf,docx,agent2.utils.document_processing,agent2.utils.comparison_engine",
+    ).split(",") if name.strip()
+]
+WARM_PING_SECONDS = 0.05
+# Extra time the parent waits past the task timeout before restarting the pool
+TIMEOUT_GRACE_SECONDS = 5
+
+# Set in each worker by _warm_worker; tasks report their ID on it when they start
+_started_queue = None
+
+
+class WorkerPoolError(RuntimeError):
+    """A task could not be run or completed on the worker pool."""
+
+
+class WorkerPoolBusy(WorkerPoolError):
+    """The pool's queue stayed full for WORKER_POOL_SUBMIT_TIMEOUT_SECONDS."""
+
+
+class WorkerTimeout(WorkerPoolError):
+    """A task ran longer than its timeout."""
+
+
+class ResultTooLarge(WorkerPoolError):
+    """A task's pickled result exceeded the size limit."""
+
+
+def _task_name(fn):
+    return f"{fn.__module__}.{fn.__qualname__}"
+
+
+def _warm_worker(modules, started_queue=None):
+    """Worker initializer: import the heavy modules once per process."""
+    global _started_queue
+    _started_queue = started_queue
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning(f"Worker could not preload {name}: {str(e)}")
+
+
+def _ping(delay):
+    # Holding each worker briefly makes the pings spread across all of them
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _raise_timeout(signum, frame):
+    raise WorkerTimeout("Task exceeded its time limit")
+
+
+def _call_in_worker(fn, args, kwargs, timeout, max_result_bytes, task_id=None):
+    """
+    Run fn in a worker process under a SIGALRM timeout and return its pickled
+    result, refusing results over max_result_bytes. Reports task_id to the
+    parent first, so its deadline doesn't include time spent queued.
+    """
+    if _started_queue is not None and task_id is not None:
+        _started_queue.put(task_id)
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    if max_result_bytes and len(data) > max_result_bytes:
+        raise ResultTooLarge(f"Result of {len(data)} bytes exceeds the {max_result_bytes} byte limit")
+    return data
+
+
+class WorkerPool:
+    """ProcessPoolExecutor with warm workers, a bounded queue, timeouts and result limits."""
+
+    def __init__(self, processes=WORKER_POOL_PROCESSES, max_pending=WORKER_POOL_MAX_PENDING,
+                 task_timeout=WORKER_POOL_TASK_TIMEOUT_SECONDS, max_result_bytes=WORKER_POOL_MAX_RESULT_BYTES,
+                 preload=WORKER_POOL_PRELOAD, start_method=WORKER_POOL_START_METHOD):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.task_timeout = task_timeout
+        self.max_result_bytes = max_result_bytes
+        self.preload = list(preload)
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._started_queue = None
+        self._task_ids = itertools.count()
+        # task ID -> Event set once a worker has picked the task up
+        self._started = {}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                # One queue per executor, so a worker killed mid-put can't wedge its replacement
+                self._started_queue = context.SimpleQueue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=context,
+                    initializer=_warm_worker,
+                    initargs=(self.preload, self._started_queue),
+                )
+                threading.Thread(
+                    target=self._watch_starts, args=(self._started_queue,), name="worker-pool-starts", daemon=True,
+                ).start()
+            return self._executor
+
+    def _watch_starts(self, started_queue):
+        """Mark tasks as running as workers report them; exits on None."""
+        while True:
+            task_id = started_queue.get()
+            if task_id is None:
+                return
+            with self._lock:
+                event = self._started.get(task_id)
+            if event is not None:
+                event.set()
+
+    def _stop_watching(self, started_queue):
+        if started_queue is not None:
+            started_queue.put(None)
+
+    def _reset(self, executor):
+        """Replace a broken or stuck executor, terminating its workers."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            started_queue, self._started_queue = self._started_queue, None
+        self._stop_watching(started_queue)
+        # ProcessPoolExecutor has no public way to stop a running task
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning("Worker pool restarted")
+
+    def warm(self):
+        """
+        Start every worker now instead of on first use.
+
+        Returns:
+            int: Number of distinct worker processes that answered
+        """
+        executor = self._get_executor()
+        futures = [executor.submit(_ping, WARM_PING_SECONDS) for _ in range(self.processes)]
+        return len({future.result() for future in futures})
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def run(self, fn, *args, task_timeout=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) in a worker process and wait for the result.
+
+        Args:
+            fn (callable): Module-level function
+            task_timeout (float, optional): Seconds the task may run; defaults to the pool's
+                task_timeout. Named so it can't capture a `timeout` argument meant for fn.
+
+        Returns:
+            The function's return value
+
+        Raises:
+            WorkerPoolBusy: If no queue slot frees up within WORKER_POOL_SUBMIT_TIMEOUT_SECONDS
+            WorkerTimeout: If the task runs past its timeout
+            ResultTooLarge: If the result exceeds the size limit
+            WorkerPoolError: If the worker process died
+        """
+        task = _task_name(fn)
+        timeout = self.task_timeout if task_timeout is None else task_timeout
+        if not self._slots.acquire(timeout=WORKER_POOL_SUBMIT_TIMEOUT_SECONDS):
+            WORKER_POOL_TASKS.inc(task=task, outcome="busy")
+            raise WorkerPoolBusy(f"Worker pool queue is full ({self.max_pending} tasks)")
+        with self._lock:
+            self._pending += 1
+            task_id = next(self._task_ids)
+            started = self._started[task_id] = threading.Event()
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_call_in_worker, fn, args, kwargs, timeout, self.max_result_bytes, task_id)
+        except Exception:
+            self._release()
+            with self._lock:
+                self._started.pop(task_id, None)
+            raise
+        future.add_done_callback(self._release)
+        # Also wakes the wait below if the task fails or is cancelled before it starts
+        future.add_done_callback(lambda _future: started.set())
+
+        outcome = "error"
+        try:
+            if timeout:
+                # Time spent queued behind other tasks doesn't count towards the limit
+                started.wait()
+            data = future.result(timeout=timeout + TIMEOUT_GRACE_SECONDS if timeout else None)
+            outcome = "ok"
+            return pickle.loads(data)
+        except FutureTimeoutError:
+            # The worker ignored SIGALRM (e.g. stuck in C code); only a restart frees it
+            outcome = "timeout"
+            self._reset(executor)
+            raise WorkerTimeout(f"{task} did not finish within {timeout:.0f}s")
+        except WorkerTimeout:
+            outcome = "timeout"
+            raise
+        except ResultTooLarge:
+            outcome = "too_large"
+            raise
+        except BrokenProcessPool as e:
+            self._reset(executor)
+            raise WorkerPoolError(f"Worker process for {task} died: {str(e)}")
+        finally:
+            with self._lock:
+                self._started.pop(task_id, None)
+            WORKER_POOL_TASKS.inc(task=task, outcome=outcome)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            started_queue, self._started_queue = self._started_queue, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+        self._stop_watching(started_queue)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_warming = False
+
+REGISTRY.register(Gauge(
+    "worker_pool_pending_tasks", "Tasks queued or running on the worker pool",
+    callback=lambda: [({}, _pool.pending() if _pool is not None else 0)],
+))
+
+
+def get_worker_pool():
+    """
+    Return the process-wide worker pool.
+
+    Returns:
+        WorkerPool: The shared pool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+        return _pool
+
+
+def warm_worker_pool():
+    """
+    Start the pool's workers in the background when WORKER_POOL_MODE is
+    "process", so the first upload doesn't wait for them. Safe to call on
+    every Streamlit rerun.
+    """
+    global _warming
+    if WORKER_POOL_MODE != "process":
+        return
+    with _pool_lock:
+        if _warming:
+            return
+        _warming = True
+    threading.Thread(target=lambda: get_worker_pool().warm(), name="worker-pool-warm", daemon=True).start()
+
+
+def run_cpu_bound(fn, *args, task_timeout=None, **kwargs):
+    """
+    Run a CPU-bound function on the worker pool when WORKER_POOL_MODE is
+    "process", otherwise call it directly.
+
+    Args:
+        fn (callable): Module-level function with picklable arguments and result
+        task_timeout (float, optional): Seconds the task may run in the pool
+
+    Returns:
+        The function's return value
+    """
+    if WORKER_POOL_MODE != "process":
+        return fn(*args, **kwargs)
+    started = time.perf_counter()
+    result = get_worker_pool().run(fn, *args, task_timeout=task_timeout, **kwargs)
+    current_span().set_attributes({
+        "worker_pool.task": _task_name(fn),
+        "worker_pool.duration_ms": round((time.perf_counter() - started) * 1000, 3),
+    })
+    return result